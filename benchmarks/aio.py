@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Backend benchmark. Loopback throughput of the gevent Sender/Receiver against the asyncio ones (pygftlib.aio)
+
+- each backend runs in a process of its own, so that neither pays for the other's imports and event loop
+- with --uvloop the asyncio backend runs on uvloop, when it is installed
+- best of --repeat transfers
+
+    python benchmarks/aio.py [--size BYTES] [--blksize BYTES] [--windowsize N] [--repeat N] [--uvloop]
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from common import argument_parser
+
+import logging
+logging.disable(logging.INFO)
+
+
+def run_gevent(path, port, block_size, window_size):
+    import gevent
+    from pygftlib.protocol import Sender, Receiver
+    receiver = Receiver()
+    server = gevent.spawn(receiver.start, '127.0.0.1', port)
+    gevent.sleep(0.1)
+    sender = Sender(path, block_size=block_size, window_size=window_size)
+    started = time.monotonic()
+    gevent.spawn(sender.upload, '127.0.0.1', port).join()
+    elapsed = time.monotonic() - started
+    receiver.stop()
+    server.kill()
+    return elapsed if sender.transfer_complete else None
+
+
+def run_asyncio(path, port, block_size, window_size):
+    import asyncio
+    from pygftlib import aio
+
+    async def main():
+        transport, _ = await aio.serve('127.0.0.1', port)
+        try:
+            started = time.monotonic()
+            await aio.send_file(path, '127.0.0.1', port, block_size=block_size, window_size=window_size)
+            return time.monotonic() - started
+        finally:
+            transport.close()
+    try:
+        return asyncio.run(main())
+    except aio.ProtocolException:
+        return None
+
+
+def child(args):
+    """Runs in the process of one backend: prints the seconds each transfer took"""
+    if args.backend == 'uvloop':
+        import uvloop
+        uvloop.install()
+    run = run_gevent if args.backend == 'gevent' else run_asyncio
+    for _ in range(args.repeat):
+        print(run(args.path, args.port, args.blksize, args.windowsize))
+        for name in os.listdir('.'):
+            if name != os.path.basename(args.path):
+                os.remove(name)
+
+
+def measure(backend, path, args):
+    command = [sys.executable, os.path.abspath(__file__), '--backend', backend, '--path', path,
+               '--size', str(args.size), '--blksize', str(args.blksize), '--windowsize', str(args.windowsize),
+               '--repeat', str(args.repeat), '--port', str(args.port)]
+    output = subprocess.check_output(command, cwd=os.path.dirname(path)).decode()
+    times = [float(line) for line in output.split() if line != 'None']
+    return min(times) if times else None
+
+
+def main():
+    parser = argument_parser(__doc__)
+    parser.add_argument('--size', help='bytes to send', default=32 * 1024 * 1024, type=int)
+    parser.add_argument('--blksize', help='DATA payload size', default=1400, type=int)
+    parser.add_argument('--windowsize', help='send window (blocks)', default=64, type=int)
+    parser.add_argument('--repeat', help='runs per backend. The best one counts', default=3, type=int)
+    parser.add_argument('--port', help='Receiver port', default=12490, type=int)
+    parser.add_argument('--uvloop', help='measure asyncio on uvloop as well', action='store_true')
+    parser.add_argument('--backend', help=argparse.SUPPRESS)
+    parser.add_argument('--path', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.backend:
+        return child(args)
+
+    backends = ['gevent', 'asyncio']
+    if args.uvloop:
+        try:
+            import uvloop  # noqa: F401
+            backends.append('uvloop')
+        except ImportError:
+            print('uvloop is not installed')
+    root = tempfile.mkdtemp()
+    try:
+        path = os.path.join(root, 'payload.bin')
+        with open(path, 'wb') as f:
+            f.write(os.urandom(args.size))
+        print('{} bytes, blksize {}, windowsize {}'.format(args.size, args.blksize, args.windowsize))
+        print('{:>8} {:>10} {:>10}'.format('backend', 'time (s)', 'MB/s'))
+        for backend in backends:
+            elapsed = measure(backend, path, args)
+            print('{:>8} {:>10} {:>10}'.format(
+                backend, '{:.2f}'.format(elapsed) if elapsed else 'failed',
+                '{:.1f}'.format(args.size / elapsed / 1e6) if elapsed else '-'))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Packet codec microbenchmark. Packets per second for encoding and decoding each packet type with
+
+- codec: the struct based fast path used by the protocol
+- codec (buffer): encode_*_into / decode_data_into a preallocated buffer (where available)
+- factory: the PacketFactory compatibility wrapper
+- packets: the packet classes of packets.py
+
+    python benchmarks/codec.py [--number N] [--blksize BYTES]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from pygftlib import codec
+from pygftlib.packet_factory import PacketFactory
+from pygftlib.packets import INITRQPacket, DATAPacket, ACKPacket, ERRPacket, OACKPacket, SACKPacket
+from common import argument_parser
+
+
+def cases(blksize):
+    payload = os.urandom(blksize)
+    buffer = memoryview(bytearray(blksize + 16))  # slice assignment to a memoryview is cheaper than to a bytearray
+    options = {'windowsize': 64, 'blksize': blksize, 'tsize': 10 ** 9}
+    packets = {
+        'INITRQ': codec.encode_initrq('some-file.bin', options),
+        'DATA': codec.encode_data(1234, payload),
+        'ACK': codec.encode_ack(1234),
+        'ERR': codec.encode_err(3, b'Disk full or allocation exceeded.'),
+        'OACK': codec.encode_oack(options),
+        'SACK': codec.encode_sack(1234, [1236, 1240, 1250]),
+    }
+    # (packet type, implementation) -> (encode, decode). None where there is nothing to measure
+    return {
+        ('INITRQ', 'codec'): (lambda: codec.encode_initrq('some-file.bin', options),
+                              lambda: codec.decode_initrq(packets['INITRQ'])),
+        ('INITRQ', 'factory'): (lambda: PacketFactory.to_bytes('initrq', file_name='some-file.bin', options=options),
+                                lambda: (PacketFactory.from_bytes(packets['INITRQ']),
+                                         PacketFactory.options(packets['INITRQ']))),
+        ('INITRQ', 'packets'): (lambda: INITRQPacket().build_packet(file_name='some-file.bin', options=options),
+                                lambda: INITRQPacket().parse_packet(packets['INITRQ'])),
+        ('DATA', 'codec'): (lambda: codec.encode_data(1234, payload), lambda: codec.decode_data(packets['DATA'])),
+        ('DATA', 'codec (buffer)'): (lambda: codec.encode_data_into(buffer, 1234, payload),
+                                     lambda: codec.decode_data_into(packets['DATA'], buffer)),
+        ('DATA', 'factory'): (lambda: PacketFactory.to_bytes('data', block_no=1234, data=payload),
+                              lambda: PacketFactory.from_bytes(packets['DATA'])),
+        ('DATA', 'packets'): (lambda: DATAPacket().build_packet(block_no=1234, data=payload),
+                              lambda: DATAPacket().parse_packet(packets['DATA'])),
+        ('ACK', 'codec'): (lambda: codec.encode_ack(1234), lambda: codec.decode_ack(packets['ACK'])),
+        ('ACK', 'codec (buffer)'): (lambda: codec.encode_ack_into(buffer, 1234), None),
+        ('ACK', 'factory'): (lambda: PacketFactory.to_bytes('ack', block_no=1234),
+                             lambda: PacketFactory.from_bytes(packets['ACK'])),
+        ('ACK', 'packets'): (lambda: ACKPacket().build_packet(block_no=1234),
+                             lambda: ACKPacket().parse_packet(packets['ACK'])),
+        ('ERR', 'codec'): (lambda: codec.encode_err(3, b'Disk full or allocation exceeded.'),
+                           lambda: codec.decode_err(packets['ERR'])),
+        ('ERR', 'factory'): (None, lambda: PacketFactory.from_bytes(packets['ERR'])),
+        ('ERR', 'packets'): (lambda: ERRPacket().build_packet(err_code=3),
+                             lambda: ERRPacket().parse_packet(packets['ERR'])),
+        ('OACK', 'codec'): (lambda: codec.encode_oack(options), lambda: codec.decode_oack(packets['OACK'])),
+        ('OACK', 'factory'): (lambda: PacketFactory.to_bytes('oack', options=options),
+                              lambda: PacketFactory.from_bytes(packets['OACK'])),
+        ('OACK', 'packets'): (lambda: OACKPacket().build_packet(options=options),
+                              lambda: OACKPacket().parse_packet(packets['OACK'])),
+        ('SACK', 'codec'): (lambda: codec.encode_sack(1234, [1236, 1240, 1250]),
+                            lambda: codec.decode_sack(packets['SACK'])),
+        ('SACK', 'factory'): (lambda: PacketFactory.to_bytes('sack', block_no=1234, selective=[1236, 1240, 1250]),
+                              lambda: PacketFactory.from_bytes(packets['SACK'])),
+        ('SACK', 'packets'): (lambda: SACKPacket().build_packet(block_no=1234, selective=[1236, 1240, 1250]),
+                              lambda: SACKPacket().parse_packet(packets['SACK'])),
+    }
+
+
+def rate(func, number):
+    """Packets per second. Best of 3"""
+    if func is None:
+        return None
+    return number / min(timeit.repeat(func, number=number, repeat=3))
+
+
+def main():
+    parser = argument_parser(__doc__)
+    parser.add_argument('--number', help='packets per measurement', default=100000, type=int)
+    parser.add_argument('--blksize', help='DATA payload size', default=508, type=int)
+    args = parser.parse_args()
+
+    print('{:<8} {:<16} {:>14} {:>14}'.format('packet', 'implementation', 'encode pkt/s', 'decode pkt/s'))
+    for (packet_type, implementation), (encode, decode) in cases(args.blksize).items():
+        results = ['{:>14,.0f}'.format(r) if r else '{:>14}'.format('-')
+                   for r in (rate(encode, args.number), rate(decode, args.number))]
+        print('{:<8} {:<16} {} {}'.format(packet_type, implementation, *results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,9 @@
+"""
+What the benchmark scripts share. They import it as a sibling module: each runs as  python benchmarks/NAME.py
+"""
+import argparse
+
+
+def argument_parser(doc):
+    """The ArgumentParser of a benchmark script. --help describes it with the first paragraph of its docstring"""
+    return argparse.ArgumentParser(description=doc.strip().split('\n\n')[0])
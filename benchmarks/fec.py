@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+FEC benchmark. Completion time of a transfer through a lossy link, with and without forward error correction
+
+- the link is a UDP proxy between Sender and Receiver (pygftlib.impairment) that drops each datagram (both ways)
+  with the given probability -- seeded, so that runs are repeatable -- and delays it by half the round trip time
+- every loss rate is measured with FEC off and on, best of --repeat runs
+
+    python benchmarks/fec.py [--size BYTES] [--losses 1,2,5,10] [--rtt SECONDS] [--blksize BYTES] [--seed N]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import gevent
+
+from pygftlib.impairment import ImpairmentProxy, Profile
+from pygftlib.protocol import Sender, Receiver
+from common import argument_parser
+
+import logging
+logging.disable(logging.INFO)
+
+
+def transfer(path, port, loss, rtt, fec, block_size, seed):
+    """:return: seconds to send the file (None if it did not get through), datagrams dropped"""
+    receiver = Receiver()
+    server = gevent.spawn(receiver.start, '127.0.0.1', port)
+    gevent.sleep(0.1)
+    link = ImpairmentProxy(('127.0.0.1', port), Profile(loss=loss, delay=rtt / 2), seed=seed)
+    sender = Sender(path, block_size=block_size, fec=fec)
+    started = time.monotonic()
+    gevent.spawn(sender.upload, *link.address).join(timeout=300)
+    elapsed = time.monotonic() - started
+    link.close()
+    receiver.stop()
+    server.kill()
+    return (elapsed if sender.transfer_complete else None), sum(way['dropped'] for way in link.stats().values())
+
+
+def main():
+    parser = argument_parser(__doc__)
+    parser.add_argument('--size', help='bytes to send', default=4 * 1024 * 1024, type=int)
+    parser.add_argument('--losses', help='loss rates to measure (percent, comma separated)', default='1,2,5,10')
+    parser.add_argument('--rtt', help='round trip time of the link (seconds)', default=0.02, type=float)
+    parser.add_argument('--blksize', help='DATA payload size', default=1400, type=int)
+    parser.add_argument('--repeat', help='runs per measurement. The best one counts', default=3, type=int)
+    parser.add_argument('--seed', help='seed of the loss pattern', default=1, type=int)
+    parser.add_argument('--port', help='Receiver port', default=12480, type=int)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    os.chdir(root)  # received files land here
+    try:
+        path = os.path.join(root, 'payload.bin')
+        with open(path, 'wb') as f:
+            f.write(os.urandom(args.size))
+        print('{} bytes, blksize {}, rtt {:.0f} ms'.format(args.size, args.blksize, args.rtt * 1000))
+        print('{:>6} {:>12} {:>12} {:>8}'.format('loss', 'fec off (s)', 'fec on (s)', 'speedup'))
+        for loss in (float(value) / 100 for value in args.losses.split(',')):
+            results = []
+            for fec in (False, True):
+                times = [transfer(path, args.port, loss, args.rtt, fec, args.blksize, args.seed + run)[0]
+                         for run in range(args.repeat)]
+                times = [t for t in times if t is not None]
+                results.append(min(times) if times else None)
+                for name in os.listdir(root):
+                    if name != 'payload.bin':
+                        os.remove(os.path.join(root, name))
+            off, on = results
+            print('{:>5.0%} {:>12} {:>12} {:>8}'.format(
+                loss, '{:.2f}'.format(off) if off else 'failed', '{:.2f}'.format(on) if on else 'failed',
+                '{:.2f}x'.format(off / on) if off and on else '-'))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Multicast benchmark. Bytes the Sender puts on the wire to get one file to --receivers Receivers on the loopback: a
+unicast transfer per Receiver against a single multicast transfer to all of them
+
+- every Receiver misses --loss of the DATA sent to it (seeded, independently of the others), so that the
+  multicast Sender has NAKs to answer
+- reported: time, bytes sent by the Sender(s), repairs/retransmits and NAKs
+
+    python benchmarks/multicast.py [--size BYTES] [--blksize BYTES] [--receivers N] [--loss P] [--rate BYTES/S]
+"""
+import filecmp
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import gevent  # noqa: E402
+from pygftlib import codec  # noqa: E402
+from pygftlib.protocol import Sender, Receiver, MulticastSender  # noqa: E402
+from common import argument_parser  # noqa: E402
+
+
+def drop(handler, loss, seed):
+    """handler, missing a share of the DATA packets it is handed"""
+    rng = random.Random(seed)
+
+    def handle(data, address):
+        if codec.op_code(data) == codec.DATA and rng.random() < loss:
+            return
+        return handler(data, address)
+    return handle
+
+
+def start_receivers(args, group=None):
+    receivers = []
+    for i in range(args.receivers):
+        receiver = Receiver(batched=False, group=group)
+        if group is None:
+            receiver.handle = drop(receiver.handle, args.loss, i)
+        else:
+            receiver.handle_group = drop(receiver.handle_group, args.loss, i)
+        receivers.append((receiver, gevent.spawn(receiver.start, '127.0.0.1', args.port + 1 + i)))
+    gevent.sleep(0.2)
+    return receivers
+
+
+def finish(receivers, path):
+    """Stop the Receivers. :return: True if each of them has a copy of path"""
+    for receiver, worker in receivers:
+        receiver.stop()
+        worker.kill()
+    copies = [name for name in os.listdir('.') if name != os.path.basename(path)]
+    correct = len(copies) == len(receivers) and all(filecmp.cmp(name, path, shallow=False) for name in copies)
+    for name in copies:
+        os.remove(name)
+    return correct
+
+
+def unicast(path, args):
+    receivers = start_receivers(args)
+    senders = [Sender(path, block_size=args.blksize, max_rate=args.rate) for _ in receivers]
+    started = time.monotonic()
+    gevent.joinall([gevent.spawn(sender.upload, '127.0.0.1', args.port + 1 + i) for i, sender in enumerate(senders)])
+    elapsed = time.monotonic() - started
+    stats = [sender.stats() for sender in senders]
+    correct = finish(receivers, path) and all(sender.transfer_complete for sender in senders)
+    return correct, elapsed, sum(s['bytes_sent'] for s in stats), sum(s['retransmits'] for s in stats), 0
+
+
+def multicast(path, args):
+    group = ('239.255.41.9', args.port)
+    receivers = start_receivers(args, group)
+    sender = MulticastSender(path, block_size=args.blksize, max_rate=args.rate, receivers=args.receivers,
+                             interface='127.0.0.1')
+    started = time.monotonic()
+    gevent.spawn(sender.upload, group).join()
+    elapsed = time.monotonic() - started
+    stats = sender.stats()
+    correct = finish(receivers, path) and sender.transfer_complete
+    return correct, elapsed, stats['bytes_sent'], stats['retransmits'], stats['naks']
+
+
+def main():
+    parser = argument_parser(__doc__)
+    parser.add_argument('--size', help='bytes to send', default=8 * 1024 * 1024, type=int)
+    parser.add_argument('--blksize', help='DATA payload size', default=1400, type=int)
+    parser.add_argument('--receivers', help='number of Receivers', default=8, type=int)
+    parser.add_argument('--loss', help='share of DATA each Receiver misses', default=0.01, type=float)
+    parser.add_argument('--rate', help='sending rate of each Sender (bytes per second)', default=50e6, type=float)
+    parser.add_argument('--port', help='multicast port. Receivers listen on the ones after it', default=12600,
+                        type=int)
+    args = parser.parse_args()
+
+    import logging
+    logging.disable(logging.INFO)
+    root = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    os.chdir(root)  # the Receivers write here
+    try:
+        path = os.path.join(root, 'payload.bin')
+        with open(path, 'wb') as f:
+            f.write(os.urandom(args.size))
+        print('{} bytes to {} Receivers, blksize {}, {:.1%} loss each, {:.0f} bytes/s'.format(
+            args.size, args.receivers, args.blksize, args.loss, args.rate))
+        print('{:>10} {:>10} {:>14} {:>12} {:>12} {:>8}'.format('', 'time (s)', 'bytes sent', 'x file size',
+                                                              'repairs', 'NAKs'))
+        for name, run in (('unicast', unicast), ('multicast', multicast)):
+            correct, elapsed, sent, repairs, naks = run(path, args)
+            if not correct:
+                print('{:>10} {:>10}'.format(name, 'failed'))
+                continue
+            print('{:>10} {:>10.2f} {:>14} {:>12.2f} {:>12} {:>8}'.format(name, elapsed, sent, sent / args.size,
+                                                                        repairs, naks))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Sender CPU benchmark. CPU time the gevent Sender spends per DATA block, for one or more source trees
+
+- the Receiver and the Sender run in processes of their own, so that only the Sender's CPU time is counted
+- --tree may be given more than once, to compare Senders: e.g. the working tree against the commit before it,
+  checked out with  git worktree add /tmp/before HEAD~1  . The Receiver always comes from this tree
+- best of --repeat transfers, per tree
+
+    python benchmarks/sender_cpu.py [--size BYTES] [--blksize BYTES] [--windowsize N] [--repeat N] [--tree DIR]...
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from common import argument_parser
+
+here = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+
+def receive(port):
+    """Runs in the Receiver's process, till it is killed"""
+    sys.path.insert(0, here)
+    from pygftlib.protocol import Receiver
+    Receiver().start('127.0.0.1', port)
+
+
+def send(path, port, block_size, window_size):
+    """Runs in a Sender's process (sys.path starts with its tree): prints CPU seconds and wall seconds"""
+    import gevent
+    from pygftlib.protocol import Sender
+    sender = Sender(path, block_size=block_size, window_size=window_size)
+    cpu, wall = time.process_time(), time.monotonic()
+    gevent.spawn(sender.upload, '127.0.0.1', port).join()
+    if sender.transfer_complete:
+        print(time.process_time() - cpu, time.monotonic() - wall)
+    else:
+        print(None, None)
+
+
+def child(args):
+    import logging
+    logging.disable(logging.INFO)
+    if args.role == 'receive':
+        return receive(args.port)
+    sys.path.insert(0, args.tree[0])
+    send(args.path, args.port, args.blksize, args.windowsize)
+
+
+def measure(tree, path, args):
+    """:return: best (CPU seconds, wall seconds) of the Sender from tree"""
+    command = [sys.executable, os.path.abspath(__file__), '--path', path, '--port', str(args.port),
+               '--blksize', str(args.blksize), '--windowsize', str(args.windowsize)]
+    best = None
+    for _ in range(args.repeat):
+        receiver = subprocess.Popen(command + ['--role', 'receive'], cwd=os.path.dirname(path))
+        try:
+            time.sleep(1)  # till it is listening
+            sender = command + ['--role', 'send', '--tree', os.path.abspath(tree)]
+            output = subprocess.check_output(sender).decode().split()
+        finally:
+            receiver.kill()
+            receiver.wait()
+        for name in os.listdir(os.path.dirname(path)):
+            if name != os.path.basename(path):
+                os.remove(os.path.join(os.path.dirname(path), name))
+        if output[0] != 'None':
+            cpu, wall = float(output[0]), float(output[1])
+            best = min(best or (cpu, wall), (cpu, wall))
+    return best
+
+
+def main():
+    parser = argument_parser(__doc__)
+    parser.add_argument('--size', help='bytes to send', default=32 * 1024 * 1024, type=int)
+    parser.add_argument('--blksize', help='DATA payload size', default=1400, type=int)
+    parser.add_argument('--windowsize', help='send window (blocks)', default=64, type=int)
+    parser.add_argument('--repeat', help='runs per tree. The best one counts', default=3, type=int)
+    parser.add_argument('--port', help='Receiver port', default=12495, type=int)
+    parser.add_argument('--tree', help='source tree of the Sender to measure. May be repeated', action='append')
+    parser.add_argument('--role', help=argparse.SUPPRESS)
+    parser.add_argument('--path', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.role:
+        return child(args)
+
+    trees = args.tree or [here]
+    blocks = args.size // args.blksize + 1
+    root = tempfile.mkdtemp()
+    try:
+        path = os.path.join(root, 'payload.bin')
+        with open(path, 'wb') as f:
+            f.write(os.urandom(args.size))
+        print('{} bytes ({} blocks), blksize {}, windowsize {}'.format(args.size, blocks, args.blksize,
+                                                                       args.windowsize))
+        print('{:>40} {:>10} {:>10} {:>14}'.format('tree', 'time (s)', 'CPU (s)', 'CPU/block (us)'))
+        for tree in trees:
+            best = measure(tree, path, args)
+            name = os.path.abspath(tree)[-40:]
+            if best is None:
+                print('{:>40} {:>10}'.format(name, 'failed'))
+            else:
+                cpu, wall = best
+                print('{:>40} {:>10.2f} {:>10.2f} {:>14.1f}'.format(name, wall, cpu, cpu / blocks * 1e6))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
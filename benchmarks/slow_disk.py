@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Slow disk benchmark. Transfers on the loopback while every disk call takes --delay longer, with disk I/O on the event
+loop and in threads
+
+- receive: --senders concurrent uploads to one Receiver, which writes with disk_threads 0 (on the event loop) and
+  --disk-threads. Every write and fsync sleeps first -- the thread waits, as it would for a slow disk
+- send: one upload from a Sender that reads with read_ahead 0 and --read-ahead (zero_copy off). Every read sleeps
+- reported: wall time and the mean round trip time the Senders measured. A stalled event loop shows in both
+
+The delay is per call, as a disk's latency is per request. The Sender's reader asks for half its read-ahead in one
+read, so it pays the delay once per batch of blocks; read_ahead 0 reads a block at a time, on the event loop. On the
+loopback of a single-core VM (4 MiB files, blksize 1400), time and mean RTT were:
+
+    delay    receive, disk_threads 0 / 4      send, read_ahead 0 / 64
+    2 ms     0.64 s, 3.8 ms / 0.62 s, 3.9 ms  7.4 s, 40 ms / 0.17 s, 0.7 ms
+    10 ms    0.82 s, 5.1 ms / 0.59 s, 3.7 ms  31.9 s, 167 ms / 0.68 s, 0.6 ms
+
+Read-ahead hides the disk from the Sender. Writing behind helps the Receiver less: its writes are coalesced into few
+calls on the event loop as well, so only a slower disk (longer --delay) sets the two apart.
+
+    python benchmarks/slow_disk.py [--size BYTES] [--blksize BYTES] [--senders N] [--delay SECONDS]
+                                   [--disk-threads N] [--read-ahead N]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import gevent  # noqa: E402
+from pygftlib.file_io import FileReader  # noqa: E402
+from pygftlib.protocol import Sender, Receiver  # noqa: E402
+from common import argument_parser  # noqa: E402
+
+
+def slow(function, delay):
+    """function, taking delay seconds longer"""
+    def call(*args):
+        time.sleep(delay)
+        return function(*args)
+    return call
+
+
+class SlowFile(object):
+    """A file whose reads take delay seconds longer"""
+
+    def __init__(self, f, delay):
+        self._f = f
+        self.read = slow(f.read, delay)
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+
+def transfer(paths, port, args, disk_threads, read_ahead):
+    """:return: wall seconds and mean RTT (ms) of uploading paths at once, or None if one of them failed"""
+    receiver = Receiver(disk_threads=disk_threads)
+    worker = gevent.spawn(receiver.start, '127.0.0.1', port)
+    gevent.sleep(0.1)
+    senders = [Sender(path, block_size=args.blksize, zero_copy=False, read_ahead=read_ahead) for path in paths]
+    started = time.monotonic()
+    gevent.joinall([gevent.spawn(sender.upload, '127.0.0.1', port) for sender in senders])
+    elapsed = time.monotonic() - started
+    receiver.stop()
+    worker.kill()
+    for name in os.listdir('.'):
+        if not name.startswith('payload-'):
+            os.remove(name)
+    if not all(sender.transfer_complete for sender in senders):
+        return None
+    rtt = [sender.stats() for sender in senders]
+    count = sum(stats['rtt_seconds_count'] for stats in rtt)
+    return elapsed, sum(stats['rtt_seconds_sum'] for stats in rtt) / max(count, 1) * 1000
+
+
+def report(name, result):
+    if result is None:
+        print('{:>28} {:>10}'.format(name, 'failed'))
+    else:
+        print('{:>28} {:>10.2f} {:>14.2f}'.format(name, *result))
+
+
+def main():
+    parser = argument_parser(__doc__)
+    parser.add_argument('--size', help='bytes per file', default=4 * 1024 * 1024, type=int)
+    parser.add_argument('--blksize', help='DATA payload size', default=1400, type=int)
+    parser.add_argument('--senders', help='concurrent uploads, for the Receiver', default=4, type=int)
+    parser.add_argument('--delay', help='seconds added to every disk call', default=0.002, type=float)
+    parser.add_argument('--disk-threads', help='Receiver disk threads to compare with 0', default=4, type=int)
+    parser.add_argument('--read-ahead', help='Sender read-ahead (blocks) to compare with 0', default=64, type=int)
+    parser.add_argument('--port', help='first Receiver port', default=12496, type=int)
+    args = parser.parse_args()
+
+    import logging
+    logging.disable(logging.INFO)
+    root = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    os.chdir(root)  # the Receiver writes here
+    try:
+        paths = []
+        for i in range(args.senders):
+            paths.append(os.path.join(root, 'payload-{}.bin'.format(i)))
+            with open(paths[-1], 'wb') as f:
+                f.write(os.urandom(args.size))
+        print('{} x {} bytes, blksize {}, {:.1f} ms per disk call'.format(args.senders, args.size, args.blksize,
+                                                                         args.delay * 1000))
+        print('{:>28} {:>10} {:>14}'.format('', 'time (s)', 'mean RTT (ms)'))
+        port = args.port
+        with mock.patch('os.pwritev', slow(os.pwritev, args.delay)), \
+                mock.patch('os.pwrite', slow(os.pwrite, args.delay)), \
+                mock.patch('os.fsync', slow(os.fsync, args.delay)):
+            for threads in (0, args.disk_threads):
+                report('receive, disk_threads {}'.format(threads), transfer(paths, port, args, threads, 0))
+                port += 1
+        open_file = FileReader._open_file
+        with mock.patch.object(FileReader, '_open_file', lambda self: SlowFile(open_file(self), args.delay)):
+            for blocks in (0, args.read_ahead):
+                report('send, read_ahead {}'.format(blocks), transfer(paths[:1], port, args, 0, blocks))
+                port += 1
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark suite. Goodput, completion time and retransmit overhead of transfers through an impaired link,
+for a matrix of file sizes and link profiles (pygftlib.impairment.PROFILES)
+
+- every transfer goes Sender -> ImpairmentProxy -> Receiver on the loopback. The impairments are seeded: run n of a
+  measurement uses seed --seed + n, whatever else is measured
+- best of --repeat runs (by completion time) per size and profile. Every run is kept in the results
+- --output writes the results as JSON. --baseline compares goodput with an earlier --output and exits with status 1
+  if any measurement fell short of it by more than --tolerance
+
+    python benchmarks/suite.py [--sizes 64K,1M,8M] [--profiles clean,lossy,...] [--repeat N] [--output FILE]
+                               [--baseline FILE] [--tolerance 0.2]
+"""
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import gevent
+
+from pygftlib.helpers import parse_size
+from pygftlib.impairment import ImpairmentProxy, PROFILES
+from pygftlib.protocol import Sender, Receiver
+from common import argument_parser
+
+import logging
+logging.disable(logging.INFO)
+
+
+def transfer(path, port, profile, seed, args):
+    """:return: dict of what one transfer measured"""
+    receiver = Receiver()
+    server = gevent.spawn(receiver.start, '127.0.0.1', port)
+    gevent.sleep(0.1)
+    link = ImpairmentProxy(('127.0.0.1', port), profile, seed=seed)
+    sender = Sender(path, block_size=args.blksize, window_size=args.windowsize)
+    started = time.monotonic()
+    gevent.spawn(sender.upload, *link.address).join(timeout=args.timeout)
+    elapsed = time.monotonic() - started
+    link.close()
+    receiver.stop()
+    server.kill()
+    size = os.path.getsize(path)
+    stats = sender.stats()
+    return {
+        'seed': seed,
+        'complete': sender.transfer_complete,
+        'seconds': round(elapsed, 4),
+        'goodput_mbps': round(size * 8 / elapsed / 1e6, 3) if sender.transfer_complete else None,
+        'packets_sent': stats['packets_sent'],
+        'retransmits': stats['retransmits'],
+        # bytes on the wire for every byte of the file, less one. Headers, handshake and retransmissions
+        'overhead': round(stats['bytes_sent'] / size - 1, 4) if size else None,
+        'link': link.stats(),
+    }
+
+
+def measure(size, name, root, args):
+    path = os.path.join(root, 'payload.bin')
+    with open(path, 'wb') as f:
+        f.write(os.urandom(size))
+    runs = []
+    for run in range(args.repeat):
+        runs.append(transfer(path, args.port, PROFILES[name], args.seed + run, args))
+        for entry in os.listdir(root):
+            if entry != 'payload.bin':
+                os.remove(os.path.join(root, entry))
+    complete = [run for run in runs if run['complete']]
+    best = min(complete, key=lambda run: run['seconds']) if complete else None
+    return {'size': size, 'profile': name, 'best': best, 'runs': runs}
+
+
+def regressions(results, baseline, tolerance):
+    """:return: (size, profile, goodput, baseline goodput) of every measurement that fell short of the baseline"""
+    before = {(entry['size'], entry['profile']): entry['best'] for entry in baseline['results']}
+    short = []
+    for entry in results:
+        previous = before.get((entry['size'], entry['profile']))
+        if not previous:
+            continue
+        goodput = entry['best']['goodput_mbps'] if entry['best'] else 0
+        if goodput < previous['goodput_mbps'] * (1 - tolerance):
+            short.append((entry['size'], entry['profile'], goodput, previous['goodput_mbps']))
+    return short
+
+
+def main():
+    parser = argument_parser(__doc__)
+    parser.add_argument('--sizes', help='file sizes to send (comma separated, e.g. 64K,1M)', default='64K,1M,8M')
+    parser.add_argument('--profiles', help='link profiles (comma separated). One of ' + ', '.join(sorted(PROFILES)),
+                        default=','.join(sorted(PROFILES)))
+    parser.add_argument('--blksize', help='DATA payload size', default=1400, type=int)
+    parser.add_argument('--windowsize', help='send window (blocks)', default=64, type=int)
+    parser.add_argument('--repeat', help='runs per measurement. The best one counts', default=3, type=int)
+    parser.add_argument('--seed', help='seed of the impairments of the first run', default=1, type=int)
+    parser.add_argument('--timeout', help='seconds a transfer may take before it counts as failed', default=120,
+                        type=float)
+    parser.add_argument('--port', help='Receiver port', default=12500, type=int)
+    parser.add_argument('--output', help='write the results to this file (JSON)')
+    parser.add_argument('--baseline', help='results (JSON) of an earlier run to compare goodput with')
+    parser.add_argument('--tolerance', help='fraction of the baseline goodput that may be lost', default=0.2,
+                        type=float)
+    args = parser.parse_args()
+    sizes = [parse_size(size) for size in args.sizes.split(',')]
+    profiles = args.profiles.split(',')
+    unknown = [name for name in profiles if name not in PROFILES]
+    if unknown:
+        parser.error('unknown profiles {}'.format(', '.join(unknown)))
+
+    root = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    os.chdir(root)  # received files land here
+    results = []
+    try:
+        print('{:>10} {:>10} {:>10} {:>12} {:>12} {:>10}'.format(
+            'size', 'profile', 'time (s)', 'goodput', 'retransmits', 'overhead'))
+        for size in sizes:
+            for name in profiles:
+                entry = measure(size, name, root, args)
+                results.append(entry)
+                best = entry['best']
+                if best is None:
+                    print('{:>10} {:>10} {:>10}'.format(size, name, 'failed'))
+                else:
+                    print('{:>10} {:>10} {:>10.2f} {:>7.1f} Mb/s {:>12} {:>9.1%}'.format(
+                        size, name, best['seconds'], best['goodput_mbps'], best['retransmits'], best['overhead']))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(root)
+
+    document = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {'blksize': args.blksize, 'windowsize': args.windowsize, 'repeat': args.repeat,
+                       'seed': args.seed, 'profiles': {name: PROFILES[name]._asdict() for name in profiles}},
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            short = regressions(results, json.load(f), args.tolerance)
+        for size, name, goodput, before in short:
+            print('Regression: {} bytes over {}: {:.1f} Mb/s, was {:.1f} Mb/s'.format(size, name, goodput, before))
+        if short:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -31,3 +31,25 @@ DATA_SIZE = MAX_PACKET_SIZE - 4  # payload size of DATA packet. 4 bytes for pack
 CONN_TIMEOUT = 40  # remove all clients if they are inactive for over 30 seconds(say)
 MAX_NO_RESPONSE_TIME = 20  # Disconnect the client if no ACK response is received from the server withing 5 seconds(say)
 NO_RESPONSE_TIME = 1  # Resend the last data packet if no ACK is received within this time --- for client
+EXPIRY_INTERVAL = 1  # how often (seconds) the Receiver looks for sessions that have expired
+
+WINDOW_SIZE = 32  # number of unacknowledged DATA packets the Sender keeps in flight (if the Receiver agrees)
+MAX_WINDOW_SIZE = 4096  # largest windowsize a Receiver would accept
+MAX_DATAGRAM_SIZE = 65535  # receive buffer size. Large enough for any packet (OACK, SACK etc)
+MIN_BLOCK_SIZE = 8  # smallest/largest DATA payload (blksize) that may be negotiated. Same bounds as rfc2348
+MAX_BLOCK_SIZE = 65464
+SOCKET_BUFFER_SIZE = 4 * 1024 * 1024  # SO_RCVBUF/SO_SNDBUF to ask for. Room for a window of large blocks
+MIN_RTO = 0.05  # bounds on the retransmission timeout computed from the measured round trip time (seconds)
+MAX_RTO = 60
+MAX_STRIPES = 64  # most stripes (sessions) a striped transfer may be split into
+STREAMS = 4  # stripes the Sender splits a file into, when asked to stripe it
+READ_AHEAD = 64  # blocks of the file the Sender reads ahead of the window
+DISK_THREADS = 4  # threads the Receiver does its file system calls in. Shared by all sessions
+WRITE_BEHIND = 16 * 1024 * 1024  # bytes of a file that may wait to be written before the Receiver waits for them
+MAX_SESSIONS = 1024  # sessions a Receiver runs at a time. Further clients are turned down with an ERR
+MAX_CLIENT_SESSIONS = 128  # of them, sessions of a single host
+SCHEDULER_QUEUE = 512  # DATA packets of a session that may wait for their turn (see pygftlib.scheduler)
+SEND_QUEUE_SIZE = 1024  # packets the Sender queues up for its transmitter. Whoever queues more waits
+MULTICAST_TTL = 1  # hops multicast DATA may travel. 1 -- the local network
+MULTICAST_RATE = 10 * 1000 * 1000  # bytes per second a multicast Sender sends at, unless told otherwise
+MAX_NAK_BLOCKS = 64  # most missing blocks a single NAK lists
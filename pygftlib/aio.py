@@ -0,0 +1,450 @@
+"""
+asyncio transport. The protocol of protocol.py -- same packets, options, windows and congestion control -- on an
+asyncio event loop, without gevent. Only standard loop APIs are used, so it runs on uvloop as well.
+
+- ReceiverProtocol is an asyncio.DatagramProtocol that receives files. serve() binds one to an address.
+- send_file() sends a file and returns once the Receiver has all of it.
+
+Both talk to the gevent Sender/Receiver as well as to each other. The protocol itself is that of pygftlib.core; this
+module does the I/O around it: sockets, timers, pacing and files. So it implements the windowed transfer of a single
+file (options windowsize, blksize, seqwidth, tsize, fec). The options that need more machinery (striping, batch,
+resume, delta, compress) are turned down by ReceiverProtocol and never asked for by send_file().
+
+Files are read and written in the default executor of the loop, off the loop itself -- as pygftlib.disk_io does for
+gevent -- so that one slow disk does not hold up every session and timer. The Receiver writes behind (_FileJobs, the
+disk of its FileWriters): the calls on the file of a session are queued and carried out in order, and its ACKs wait
+once more than write_behind bytes are queued. The Sender reads up to read_ahead blocks ahead of the window.
+
+    async def main():
+        transport, receiver = await serve('127.0.0.1', 12345)
+        await send_file('data.bin', '127.0.0.1', 12345)
+"""
+import asyncio
+import collections
+import functools
+import os
+import time
+
+from pygftlib import *
+from pygftlib import codec
+from pygftlib import core
+from pygftlib import scheduler as scheduling
+from pygftlib.congestion import TokenBucket
+from pygftlib.exceptions import MalformedPacketException, ProtocolException
+from pygftlib.file_io import FileReader, FileWriter, read_blocks
+
+import logging
+logger = logging.getLogger(__name__)
+
+SUPPORTED_OPTIONS = core.SUPPORTED_OPTIONS
+
+
+def _carry_out(jobs, error):
+    """
+    Runs in the executor: the jobs in order. Once one fails (or if error is given) the rest are not carried out, bar
+    those that are to be anyway.
+    :return: (value, exception) per job, and the first exception
+    """
+    results = []
+    for _, function, args, _, anyway in jobs:
+        if error is not None and not anyway:
+            results.append((None, error))
+            continue
+        try:
+            results.append((function(*args), None))
+        except Exception as err:
+            results.append((None, err))
+            error = error or err
+    return results, error
+
+
+class _FileJobs(object):
+    """
+    The calls on the file of one session, carried out in order in the default executor of the loop. Those queued
+    meanwhile are handed over together. Once one fails, the rest fail with it -- bar the last word (abort).
+    The disk of the session's FileWriter: it hands its writes to submit(), as to a disk_io.WriteBehind
+    """
+
+    def __init__(self, limit=WRITE_BEHIND, on_error=None):
+        self.limit = limit
+        self.on_error = on_error  # called with the exception of a write that failed. Calls have their futures
+        self.pending = 0  # bytes of writes queued and not written yet
+        self.error = None
+        self._jobs = collections.deque()  # (size, function, args, future for call() -- None for submit(), anyway)
+        self._running = False
+        self._on_room = None  # called once pending is down to limit
+
+    def submit(self, size, function, *args):
+        """
+        Queue function(*args), a write of size bytes
+        :raises: whatever an earlier write raised
+        """
+        if self.error is not None:
+            raise self.error
+        self._jobs.append((size, function, args, None, False))
+        self.pending += size
+        self._start()
+
+    def call(self, function, *args):
+        """:return: future of function(*args), carried out once everything queued before it is done"""
+        future = asyncio.get_running_loop().create_future()
+        self._jobs.append((0, function, args, future, False))
+        self._start()
+        return future
+
+    def finish(self, function, *args):
+        """Queue function(*args), the last call on the file. Carried out even if an earlier one failed"""
+        self._jobs.append((0, function, args, None, True))
+        self._start()
+
+    def when_room(self, callback):
+        """callback() once no more than limit bytes are waiting to be written"""
+        self._on_room = callback
+
+    def _start(self):
+        if not self._running:
+            self._running = True
+            asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while self._jobs:
+            jobs = list(self._jobs)
+            self._jobs.clear()
+            results, error = await loop.run_in_executor(None, _carry_out, jobs, self.error)
+            for (size, _, _, future, anyway), (value, err) in zip(jobs, results):
+                self.pending -= size
+                if future is not None and not future.cancelled():
+                    if err is not None:
+                        future.set_exception(err)
+                    else:
+                        future.set_result(value)
+                elif err is not None and anyway:
+                    logger.error('Unable to give up on a file: {}'.format(err))
+            if error is not None and self.error is None:
+                self.error = error
+                if self.on_error is not None:
+                    self.on_error(error)
+            if self.pending <= self.limit and self._on_room is not None:
+                callback, self._on_room = self._on_room, None
+                callback()
+        self._running = False
+
+
+class ReceiverProtocol(asyncio.DatagramProtocol):
+    """
+    Receives files from any number of clients, one session per (host, port). Each file is written to the current
+    directory under a unique name (see FileWriter). Sessions expire off a timer on the loop, as in the gevent Receiver.
+    New sessions are turned down once max_sessions are in progress, or max_client_sessions of a host.
+    """
+
+    def __init__(self, window_size=MAX_WINDOW_SIZE, block_size=MAX_BLOCK_SIZE, fsync=None, max_sessions=MAX_SESSIONS,
+                 max_client_sessions=MAX_CLIENT_SESSIONS, write_behind=WRITE_BEHIND):
+        self.core = core.ReceiverCore(window_size, block_size,
+                                      scheduler=scheduling.Scheduler(max_sessions, max_client_sessions))
+        self.fsync = fsync  # durability of received files. None, 'end' or every so many bytes -- see FileWriter
+        self.write_behind = write_behind  # bytes of a file that may wait to be written before its ACKs wait
+        self.transport = None
+        self._files = {}  # session -> _FileJobs, from Open till the file is closed or given up on
+        self._early = {}  # session -> [(block_no, data)] that came in while its file was being opened
+        self._expiry = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self._expiry = asyncio.get_running_loop().call_later(EXPIRY_INTERVAL, self._expire_sessions)
+
+    def connection_lost(self, exc):
+        if self._expiry is not None:
+            self._expiry.cancel()
+        self._carry_out(self.core.close())
+
+    def stats(self):
+        """Counters since the Receiver was created. The same as the gevent Receiver's"""
+        return self.core.stats()
+
+    def datagram_received(self, data, address):
+        self._carry_out(self.core.datagram_received(data, address, time.monotonic()))
+
+    def error_received(self, exc):
+        logger.info('Socket error: {}'.format(exc))
+
+    def _carry_out(self, actions):
+        """Do what the core asks for. The file calls are queued to the executor (see _FileJobs)"""
+        for action in actions:
+            if isinstance(action, core.Send):
+                self._send(action.packet, action.address)
+                continue
+            session = action.session
+            if isinstance(action, core.Acknowledge):
+                self._acknowledge(session)
+            elif isinstance(action, core.Write):
+                if session not in self._files:
+                    continue
+                if session.file_obj is None:
+                    self._early.setdefault(session, []).append((action.block_no, action.data))
+                    continue
+                # coalesced in memory. The writes are queued to the session's _FileJobs
+                try:
+                    session.file_obj.write_block(action.block_no, action.data)
+                except (MalformedPacketException, OSError) as err:
+                    self._failed(session, err)
+            elif isinstance(action, core.Open):
+                jobs = self._files[session] = _FileJobs(self.write_behind, functools.partial(self._failed, session))
+                jobs.call(self._open, session, jobs).add_done_callback(functools.partial(self._opened, session))
+            elif isinstance(action, core.Close):
+                self._files[session].call(self._close, session).add_done_callback(
+                    functools.partial(self._closed, session))
+            elif isinstance(action, core.Abort):
+                self._early.pop(session, None)
+                jobs = self._files.pop(session, None)
+                if jobs is not None:
+                    # an incomplete file is left behind under its temporary name
+                    jobs.finish(self._abort, session)
+
+    def _acknowledge(self, session):
+        jobs = self._files.get(session)
+        if jobs is not None and jobs.pending > jobs.limit:
+            # writing behind too far. The client waits, and slows down to the disk
+            jobs.when_room(functools.partial(self._acknowledge, session))
+            return
+        packet = self.core.ack(session)
+        if packet is not None:
+            self._send(packet, session.address)
+
+    def _opened(self, session, future):
+        if not future.cancelled() and future.exception() is not None:
+            self._failed(session, future.exception())
+        elif not future.cancelled() and session in self._files:
+            try:
+                for block_no, data in self._early.pop(session, ()):
+                    session.file_obj.write_block(block_no, data)
+            except (MalformedPacketException, OSError) as err:
+                self._failed(session, err)
+                return
+            self._carry_out(self.core.opened(session))
+
+    def _closed(self, session, future):
+        if not future.cancelled() and future.exception() is not None:
+            self._failed(session, future.exception())
+        elif not future.cancelled() and self._files.pop(session, None) is not None:
+            logger.info('Wrote {} to disk'.format(session.file_obj.name))
+            self._carry_out(self.core.closed(session))
+
+    def _failed(self, session, err):
+        """The file of session raised err. The session is dropped, and its client sent an ERR instead of the ACK"""
+        if session not in self._files:
+            return  # dropped already
+        if isinstance(err, MalformedPacketException):
+            logger.warning('Client {} sent a file that cannot be decoded: {}'.format(session.address, err))
+            code, message = codec.ERR_ILLEGAL_OPERATION, str(err)
+        elif isinstance(err, OSError):
+            logger.error('Unable to write {} for client {}: {}'.format(session.file_name, session.address, err))
+            code, message = codec.ERR_ALLOCATION_EXCEEDED, err.strerror or str(err)
+        else:
+            logger.error('Unable to write {} for client {}'.format(session.file_name, session.address), exc_info=err)
+            code, message = codec.ERR_UNDEFINED, 'Unable to write the file'
+        self._carry_out(self.core.failed(session, code, message))
+
+    # the file calls. They run in the executor, one session's in order
+
+    def _open(self, session, jobs):
+        session.file_obj = FileWriter(session.file_name, session.block_size, size=session.options.get('tsize'),
+                                      fsync=self.fsync, disk=jobs)
+
+    @staticmethod
+    def _close(session):
+        # every write queued before is done. The rest of the work is done here and now, in the executor
+        session.file_obj.disk = None
+        session.file_obj.close()
+
+    @staticmethod
+    def _abort(session):
+        if session.file_obj is not None:
+            session.file_obj.disk = None
+            session.file_obj.abort()
+
+    def _send(self, packet, address):
+        self.transport.sendto(packet, address)
+        self.core.metrics.sent(len(packet))
+
+    def _expire_sessions(self):
+        self._carry_out(self.core.expire(time.monotonic()))
+        self._expiry = asyncio.get_running_loop().call_later(EXPIRY_INTERVAL, self._expire_sessions)
+
+
+async def serve(host, port, **receiver_kwargs):
+    """
+    Receive files on (host, port) till the transport is closed.
+    :param receiver_kwargs: see ReceiverProtocol
+    :return: transport, ReceiverProtocol
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.create_datagram_endpoint(lambda: ReceiverProtocol(**receiver_kwargs), local_addr=(host, port))
+
+
+class SenderProtocol(asyncio.DatagramProtocol):
+    """
+    Sends one file, driven by the packets the Receiver sends back and by a retransmission timer on the loop. The
+    window, RTT estimation and congestion control are those of the gevent Sender (see core.SenderCore). The file is
+    read up to read_ahead blocks ahead of the window, in the executor.
+    done is a future: the number of bytes sent once the file is through, or ProtocolException.
+    """
+
+    def __init__(self, file_name, window_size=WINDOW_SIZE, block_size=DATA_SIZE, seq_width=None, congestion='reno',
+                 max_rate=None, fec=False, read_ahead=READ_AHEAD):
+        self.file_obj = FileReader(file_name)
+        self.file_name = file_name
+        self.core = core.SenderCore(file_name, os.path.getsize(file_name), window_size=window_size,
+                                    block_size=block_size, seq_width=seq_width, congestion=congestion, fec=fec,
+                                    max_no_response_time=MAX_NO_RESPONSE_TIME)
+        self.max_rate = max_rate
+        self.pacer = TokenBucket(max_rate)
+        self.transport = None
+        self.done = None
+        self._queue = collections.deque()  # packets waiting for the pacer (or for the socket buffer to drain)
+        self._paused = False
+        self._pacing = None  # timer handle, while the pacer holds packets back
+        self._timer = None  # retransmission timer
+        self._deadline = None  # the core's deadline _timer was set for
+        self.read_ahead = max(1, read_ahead)
+        self._chunks = collections.deque()  # blocks of the file, read ahead by _reader
+        self._reader = None  # task reading ahead, once the Receiver has accepted
+        self._room = asyncio.Event()  # set by _fill_window once half the blocks read ahead are gone
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.done = asyncio.get_running_loop().create_future()
+        self._sendto(self.core.connect(time.monotonic()))
+        self._arm()
+
+    def connection_lost(self, exc):
+        self._cancel_timers()
+        if not self.done.done():
+            self.done.set_exception(ProtocolException('Connection lost: {}'.format(exc)))
+
+    def stats(self):
+        """Counters and histograms of the transfer. The same as the gevent Sender's"""
+        return self.core.stats()
+
+    def error_received(self, exc):
+        # e.g. ICMP port unreachable -- nobody listening (yet). Packets are sent again on a timeout
+        logger.info('Socket error: {}'.format(exc))
+
+    def pause_writing(self):
+        self._paused = True
+
+    def resume_writing(self):
+        self._paused = False
+        self._transmit()
+
+    def datagram_received(self, data, address):
+        if self.done.done():
+            return
+        now = time.monotonic()
+        for packet in self.core.datagram_received(data, now):
+            self._send(packet)
+        if self._reader is None and self.core.accepted is not None and not self.core.done:
+            # block_size is settled. From here on the file is read ahead
+            self._reader = asyncio.get_running_loop().create_task(self._read_ahead())
+        self.pacer.rate = self.core.pacing_rate(self.max_rate)
+        self._fill_window(now)
+        self._update()
+
+    def _fill_window(self, now):
+        """Create and send new DATA packets while the window has room for them -- of the blocks read so far"""
+        while self._chunks and self.core.can_send():
+            for packet in self.core.push(self._chunks.popleft(), now):
+                self._send(packet)
+        if self.read_ahead - len(self._chunks) >= (self.read_ahead + 1) // 2:
+            self._room.set()
+
+    async def _read_ahead(self):
+        """The reader. Once half the blocks read ahead are gone, reads as many in the executor, and sends them"""
+        loop = asyncio.get_running_loop()
+        while True:
+            while self.read_ahead - len(self._chunks) < (self.read_ahead + 1) // 2:
+                self._room.clear()
+                await self._room.wait()
+            try:
+                chunks = await loop.run_in_executor(None, read_blocks, self.file_obj, self.core.block_size,
+                                                    self.read_ahead - len(self._chunks))
+            except OSError as err:
+                self.core.fail('Unable to read {}: {}'.format(self.file_name, err))
+                self._update()
+                return
+            self._chunks.extend(chunks)
+            self._fill_window(time.monotonic())
+            self._update()
+            if len(chunks[-1]) != self.core.block_size:
+                return
+
+    def _update(self):
+        """Settle the future once the core is done. Else follow its retransmission timer"""
+        if self.done.done():
+            return
+        if self.core.error is not None:
+            self._cancel_timers()
+            self.done.set_exception(ProtocolException(self.core.error))
+        elif self.core.complete:
+            self._cancel_timers()
+            self.done.set_result(self.core.file_size)
+        elif self.core.deadline != self._deadline:
+            self._arm()
+
+    def _send(self, packet):
+        self._queue.append(packet)
+        self._transmit()
+
+    def _transmit(self):
+        """Send what the pacer allows. The rest waits for a timer"""
+        while self._queue and not self._paused and self._pacing is None:
+            packet = self._queue.popleft()
+            self._sendto(packet)
+            delay = self.pacer.reserve(len(packet))
+            if delay:
+                self._pacing = asyncio.get_running_loop().call_later(delay, self._paced)
+
+    def _paced(self):
+        self._pacing = None
+        self._transmit()
+        self._update()  # the last packet may be all a Receiver speaking the original protocol is waiting for
+
+    def _sendto(self, packet):
+        self.transport.sendto(packet)
+        self.core.sent(packet)
+
+    def _arm(self):
+        """(Re)start the retransmission timer, for the core's deadline"""
+        if self._timer is not None:
+            self._timer.cancel()
+        self._deadline = self.core.deadline
+        self._timer = asyncio.get_running_loop().call_later(max(0, self._deadline - time.monotonic()),
+                                                            self._on_timeout)
+
+    def _on_timeout(self):
+        self._timer = None
+        for packet in self.core.timeout(time.monotonic()):
+            self._sendto(packet)
+        self._update()
+
+    def _cancel_timers(self):
+        for handle in (self._timer, self._pacing, self._reader):
+            if handle is not None:
+                handle.cancel()
+        self._timer = self._pacing = None
+
+
+async def send_file(file_name, host, port, **sender_kwargs):
+    """
+    Send a file to a Receiver (gevent or asyncio) listening on (host, port).
+    :param sender_kwargs: window_size, block_size, seq_width, congestion, max_rate, fec -- as for the gevent Sender
+    :return: bytes sent
+    :raises ProtocolException: the Receiver stopped answering
+    """
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(lambda: SenderProtocol(file_name, **sender_kwargs),
+                                                              remote_addr=(host, port))
+    try:
+        return await protocol.done
+    finally:
+        transport.close()
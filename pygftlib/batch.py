@@ -0,0 +1,193 @@
+"""
+Batch transfers: a directory tree (or a list of files) sent in a single session.
+
+The Sender sends one stream of bytes -- a manifest followed by the contents of every file, back to back -- so small
+files share DATA blocks and the whole batch costs a single INITRQ handshake. The INITRQ asks for option batch=1; a
+Receiver that does not accept it would store the stream as a plain file, so the Sender gives up instead.
+
+Stream layout (all integers big endian):
+
+    magic b'PGB1' | manifest length (4 bytes) | manifest | contents of every file, in manifest order
+
+The manifest is one entry per file or directory:
+
+    size (8 bytes) | mode (4 bytes, as in st_mode) | name length (2 bytes) | name (utf-8, relative, '/' separated)
+
+The Receiver writes the stream to a .part file like any other (BatchWriter), and once it is complete unpacks it into
+a directory with the same relative layout. Names that would land outside that directory are refused.
+"""
+import os
+import stat
+import struct
+import shutil
+
+from pygftlib.file_io import StagedWriter, copy_range
+from pygftlib.exceptions import MalformedPacketException
+
+import logging
+logger = logging.getLogger(__name__)
+
+MAGIC = b'PGB1'
+_HEADER = struct.Struct('!4sI')
+_ENTRY = struct.Struct('!QIH')
+
+
+def scan(paths):
+    """
+    List what to send.
+    :param paths: a directory (everything under it is sent) or a list of files
+    :return: list of (name in the manifest, path on disk, os.stat_result). Directories included, so that empty ones
+             survive the trip. Anything that is neither a file nor a directory (fifos, sockets ..) is left out
+    """
+    if isinstance(paths, str):
+        root = paths
+        entries = []
+        for directory, dirs, files in os.walk(root):
+            dirs.sort()
+            for name in dirs + sorted(files):
+                path = os.path.join(directory, name)
+                st = os.stat(path)
+                if stat.S_ISREG(st.st_mode) or stat.S_ISDIR(st.st_mode):
+                    entries.append((os.path.relpath(path, root).replace(os.sep, '/'), path, st))
+        return entries
+    # a list of files. They all end up next to each other
+    entries, seen = [], set()
+    for path in paths:
+        name = os.path.basename(os.path.normpath(path))
+        if name in seen:
+            raise ValueError('More than one file named {} in the batch'.format(name))
+        seen.add(name)
+        entries.append((name, path, os.stat(path)))
+    return entries
+
+
+def pack_manifest(entries):
+    """:return: the header and manifest of the stream for scan()'s entries"""
+    manifest = b''.join(_ENTRY.pack(size(st), st.st_mode, len(name.encode('utf-8'))) + name.encode('utf-8')
+                        for name, _, st in entries)
+    return _HEADER.pack(MAGIC, len(manifest)) + manifest
+
+
+def unpack_manifest(data):
+    """:return: list of (name, size, mode) from the manifest (without the header)"""
+    entries, offset = [], 0
+    while offset < len(data):
+        if offset + _ENTRY.size > len(data):
+            raise MalformedPacketException('Truncated batch manifest')
+        file_size, mode, length = _ENTRY.unpack_from(data, offset)
+        offset += _ENTRY.size
+        entries.append((bytes(data[offset:offset + length]).decode('utf-8'), file_size, mode))
+        offset += length
+    return entries
+
+
+def size(st):
+    """Bytes an entry takes in the stream"""
+    return st.st_size if stat.S_ISREG(st.st_mode) else 0
+
+
+def safe_path(root, name):
+    """Where an entry is unpacked. Refuses absolute names and names reaching outside of root"""
+    parts = name.split('/')
+    if not name or name.startswith('/') or any(part in ('', '.', '..') for part in parts) or '\\' in name:
+        raise MalformedPacketException('Refusing to unpack {!r}'.format(name))
+    return os.path.join(root, *parts)
+
+
+class BatchReader(object):
+    """
+    Reads the stream of a batch chunk by chunk -- the FileReader interface the Sender expects. Files are opened one at
+    a time, as the stream gets to them.
+    """
+
+    def __init__(self, entries):
+        self.entries = [(path, size(st)) for _, path, st in entries if stat.S_ISREG(st.st_mode)]
+        self._pending = bytearray(pack_manifest(entries))  # read but not handed out yet. From _position on
+        self._position = 0
+        self.size = len(self._pending) + sum(file_size for _, file_size in self.entries)
+        self._next = 0  # index of the next file to open
+        self.finished = False
+        self.mapped = False
+
+    def skip(self, count):
+        """Move past count bytes of the stream without reading them (e.g. what a Receiver already has)"""
+        header = min(count, len(self._pending) - self._position)
+        self._position += header
+        count -= header
+        while count > 0 and self._next < len(self.entries):
+            path, file_size = self.entries[self._next]
+            self._next += 1
+            if count < file_size:
+                del self._pending[:self._position]
+                self._position = 0
+                self._read_file(path, file_size, start=count)
+            count -= file_size
+
+    def read_chunk(self, size):
+        if self.finished:
+            return b''
+        while len(self._pending) - self._position < size and self._next < len(self.entries):
+            # drop what was handed out already. Only when there is more to add -- not for every chunk of a large
+            # manifest
+            del self._pending[:self._position]
+            self._position = 0
+            self._read_file(*self.entries[self._next])
+            self._next += 1
+        data = bytes(self._pending[self._position:self._position + size])
+        self._position += len(data)
+        if len(data) < size:
+            self.finished = True
+        return data
+
+    def _read_file(self, path, file_size, start=0):
+        with open(path, 'rb') as f:
+            f.seek(start)
+            data = f.read(file_size - start)
+        if len(data) < file_size - start:
+            # the file shrank since the manifest was made. Its size is what the Receiver expects
+            logger.warning('{} changed while being sent. Padding it to {} bytes'.format(path, file_size))
+            data += bytes(file_size - start - len(data))
+        self._pending += data
+
+
+class BatchWriter(StagedWriter):
+    """
+    Receives the stream of a batch into a .part file like any other, but publishes it by unpacking it into a
+    directory instead of renaming it. The directory is assembled under its .part name and renamed once whole.
+    """
+    STAGING_SUFFIX = '.d'
+
+    def _discard(self, path):
+        shutil.rmtree(path, ignore_errors=True)
+
+    def _build(self, root):
+        magic, length = _HEADER.unpack(os.pread(self._fd, _HEADER.size, 0))
+        if magic != MAGIC:
+            raise MalformedPacketException('Not a batch stream')
+        manifest = os.pread(self._fd, length, _HEADER.size)
+        if len(manifest) != length:
+            raise MalformedPacketException('Truncated batch manifest')
+        os.mkdir(root)
+        offset = _HEADER.size + length
+        directories = []
+        entries = unpack_manifest(manifest)
+        for name, file_size, mode in entries:
+            path = safe_path(root, name)
+            if stat.S_ISDIR(mode):
+                os.makedirs(path, exist_ok=True)
+                directories.append((path, mode))
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o600)
+            try:
+                copy_range(self._fd, offset, fd, 0, file_size)
+                if hasattr(os, 'fchmod'):
+                    os.fchmod(fd, stat.S_IMODE(mode))
+                if self.fsync is not None:
+                    os.fsync(fd)
+            finally:
+                os.close(fd)
+            offset += file_size
+        for path, mode in reversed(directories):
+            os.chmod(path, stat.S_IMODE(mode) | stat.S_IWUSR | stat.S_IXUSR)  # keep them writable for the owner
+        logger.info('Unpacked {} files and directories of batch {}'.format(len(entries), self.name))
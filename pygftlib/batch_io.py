@@ -0,0 +1,127 @@
+"""
+Batched datagram I/O. Linux only; everywhere else (or on kernels that lack the socket options) callers fall back to
+one send/recvfrom per datagram.
+
+- Receive: drain every datagram that is waiting on the socket in one wakeup, into a single preallocated buffer with
+  recvmsg_into. With UDP_GRO the kernel may hand over several datagrams from the same peer coalesced in one read,
+  along with the size of the segments to split it up into.
+- Send: UDP_SEGMENT (GSO). A run of equally sized datagrams is passed to the kernel in a single sendmsg and split
+  into separate datagrams further down the stack. Only the last datagram in a run may be shorter.
+"""
+
+import errno
+import socket
+import struct
+import sys
+
+from pygftlib import MAX_DATAGRAM_SIZE
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Not exported by the socket module. Values are from <linux/udp.h>
+SOL_UDP = getattr(socket, 'SOL_UDP', 17)
+UDP_SEGMENT = getattr(socket, 'UDP_SEGMENT', 103)
+UDP_GRO = getattr(socket, 'UDP_GRO', 104)
+
+BATCH_SIZE = 64  # at most this many reads per wakeup
+MAX_SEGMENTS = 64  # UDP_MAX_SEGMENTS of older kernels. Newer ones allow 128
+MAX_GSO_SIZE = MAX_DATAGRAM_SIZE - 20 - 8  # a GSO send is a single (large) IPv4 datagram to begin with
+
+_GRO_SIZE = struct.Struct('=i')
+_SEGMENT_SIZE = struct.Struct('=H')
+
+
+def _linux(sock):
+    return sys.platform.startswith('linux') and sock.family in (socket.AF_INET, socket.AF_INET6)
+
+
+def supports_batched_recv(sock):
+    """True if datagrams can be read into a preallocated buffer"""
+    return hasattr(sock, 'recvmsg_into')
+
+
+def enable_gro(sock):
+    """
+    Ask the kernel to coalesce datagrams (UDP_GRO)
+    :return: True if it agreed
+    """
+    if not _linux(sock):
+        return False
+    try:
+        sock.setsockopt(SOL_UDP, UDP_GRO, 1)
+        return True
+    except OSError:
+        logger.debug('UDP_GRO is not available', exc_info=True)
+        return False
+
+
+def supports_gso(sock):
+    """True if UDP_SEGMENT can be used to send runs of datagrams"""
+    if not _linux(sock) or not hasattr(sock, 'sendmsg'):
+        return False
+    try:
+        sock.getsockopt(SOL_UDP, UDP_SEGMENT)
+        return True
+    except OSError:
+        logger.debug('UDP_SEGMENT is not available', exc_info=True)
+        return False
+
+
+def packet_size(packet):
+    """Size of a packet -- bytes or a (header, payload) pair"""
+    if isinstance(packet, bytes):
+        return len(packet)
+    return sum(len(part) for part in packet)
+
+
+class DatagramReader(object):
+    """Reads datagrams off a non-blocking socket into one buffer that is allocated once"""
+
+    def __init__(self, sock, gro=True):
+        self.sock = sock
+        self.gro = gro and enable_gro(sock)
+        self._buffer = bytearray(MAX_DATAGRAM_SIZE)
+        self._view = memoryview(self._buffer)
+        self._ancillary_size = socket.CMSG_SPACE(_GRO_SIZE.size) if self.gro else 0
+
+    def read(self, limit=BATCH_SIZE):
+        """
+        Read everything that is waiting on the socket. Never blocks.
+        :param limit: at most this many reads
+        :return: list of (data, address). data is a copy -- the buffer is reused by the next read
+        """
+        datagrams = []
+        for _ in range(limit):
+            try:
+                size, ancillary, _, address = self.sock.recvmsg_into([self._buffer], self._ancillary_size)
+            except socket.error as err:
+                if err.args[0] in (errno.EWOULDBLOCK, errno.EAGAIN):
+                    break
+                raise
+            segment = size
+            for level, kind, value in ancillary:
+                if level == SOL_UDP and kind == UDP_GRO:
+                    segment = _GRO_SIZE.unpack(value[:_GRO_SIZE.size])[0]
+            if segment <= 0:
+                datagrams.append((bytes(self._view[:size]), address))
+                continue
+            for offset in range(0, size, segment):
+                datagrams.append((bytes(self._view[offset:min(offset + segment, size)]), address))
+        return datagrams
+
+
+def send_segments(sock, packets):
+    """
+    Send a run of datagrams with a single sendmsg (UDP_SEGMENT). All of them but the last must be the same size.
+    :param packets: list of bytes or (header, payload) pairs
+    """
+    buffers = []
+    for packet in packets:
+        if isinstance(packet, bytes):
+            buffers.append(packet)
+        else:
+            buffers.extend(packet)
+    if len(packets) == 1:
+        return sock.sendmsg(buffers)
+    return sock.sendmsg(buffers, [(SOL_UDP, UDP_SEGMENT, _SEGMENT_SIZE.pack(packet_size(packets[0])))])
@@ -0,0 +1,233 @@
+"""
+Fast packet codec. The per packet work of the protocol, without the packet objects of packets.py:
+
+- the op_code is read with a precompiled struct and dispatched on as an integer
+- headers are packed/unpacked with precompiled struct.Struct objects, one per seqwidth
+- encode_*_into/decode_data_into work on caller supplied buffers, so a hot loop can reuse a single buffer
+- nothing is logged
+
+PacketFactory (and the packet classes) remain the friendlier API and are built on top of this.
+"""
+import struct
+
+from pygftlib import DATA_SIZE, MAX_PACKET_SIZE, MIN_PACKET_SIZE, MAX_WINDOW_SIZE, MAX_NAK_BLOCKS
+from pygftlib.helpers import str_to_bytes, pack_options, unpack_options, pack_bitmap, unpack_bitmap
+
+INITRQ, DATA, ACK, ERR, OACK, SACK, SIGRQ, SIG, PARITY, NAK = 1, 2, 3, 4, 5, 6, 7, 8, 9, 10
+
+# error codes of ERR. As in rfc1350
+ERR_UNDEFINED, ERR_FILE_NOT_FOUND, ERR_ACCESS_VIOLATION, ERR_ALLOCATION_EXCEEDED, ERR_ILLEGAL_OPERATION, \
+    ERR_UNKNOWN_TRANSFER, ERR_FILE_EXISTS = range(7)
+
+NAMES = {INITRQ: 'INITRQ', DATA: 'DATA', ACK: 'ACK', ERR: 'ERR', OACK: 'OACK', SACK: 'SACK', SIGRQ: 'SIGRQ', SIG: 'SIG',
+         PARITY: 'PARITY', NAK: 'NAK'}
+OP_CODES = {name: op_code for op_code, name in NAMES.items()}
+OP_CODES.update({name.lower(): op_code for op_code, name in NAMES.items()})
+
+_OP_CODE = struct.Struct('>H')
+_ERR_HEADER = struct.Struct('>HH')
+# op_code + Block # for each seqwidth
+HEADERS = {2: struct.Struct('>HH'), 4: struct.Struct('>HI'), 8: struct.Struct('>HQ')}
+# op_code + offset of SIGRQ and SIG (delta transfers, see pygftlib.delta)
+_OFFSET_HEADER = struct.Struct('>HQ')
+# op_code + first Block # of the group + number of blocks + XOR of their lengths. PARITY (see pygftlib.fec)
+PARITY_HEADERS = {width: struct.Struct(header.format + 'BH') for width, header in HEADERS.items()}
+# op_code + multicast session id, followed by the missing Block #s. NAK (see pygftlib.multicast)
+_NAK_HEADER = struct.Struct('>HI')
+_BLOCK_NUMBERS = {2: 'H', 4: 'I', 8: 'Q'}
+
+
+def op_code(data):
+    """op_code of a packet. 0 if it is too short to have one"""
+    return _OP_CODE.unpack_from(data)[0] if len(data) >= 2 else 0
+
+
+# -- encoding --
+
+def encode_initrq(file_name, options=None):
+    return _OP_CODE.pack(INITRQ) + str_to_bytes(file_name) + b'\x00' + pack_options(options or {})
+
+
+def encode_data(block_no, payload, seq_width=2):
+    return HEADERS[seq_width].pack(DATA, block_no) + payload
+
+
+def encode_ack(block_no, seq_width=2):
+    return HEADERS[seq_width].pack(ACK, block_no)
+
+
+def encode_err(err_code, err_msg=b''):
+    return _ERR_HEADER.pack(ERR, err_code) + str_to_bytes(err_msg) + b'\x00'
+
+
+def encode_oack(options):
+    return _OP_CODE.pack(OACK) + pack_options(options)
+
+
+def encode_sack(block_no, selective=(), seq_width=2):
+    return HEADERS[seq_width].pack(SACK, block_no) + pack_bitmap(block_no, selective)
+
+
+def encode_sigrq(offset):
+    return _OFFSET_HEADER.pack(SIGRQ, offset)
+
+
+def encode_sig(offset, payload):
+    return _OFFSET_HEADER.pack(SIG, offset) + payload
+
+
+def encode_parity(first, count, length, payload, seq_width=2):
+    return PARITY_HEADERS[seq_width].pack(PARITY, first, count, length) + payload
+
+
+def encode_nak(session, blocks, seq_width=2):
+    return _NAK_HEADER.pack(NAK, session) + struct.pack('>{}{}'.format(len(blocks), _BLOCK_NUMBERS[seq_width]), *blocks)
+
+
+def encode_data_into(buffer, block_no, payload, seq_width=2, offset=0):
+    """
+    Write a DATA packet into buffer (bytearray, memoryview, mmap, ...) at offset
+    :return: size of the packet
+    """
+    header = HEADERS[seq_width]
+    header.pack_into(buffer, offset, DATA, block_no)
+    end = offset + header.size + len(payload)
+    buffer[offset + header.size:end] = payload
+    return end - offset
+
+
+def encode_ack_into(buffer, block_no, seq_width=2, offset=0):
+    """Write an ACK packet into buffer at offset. :return: size of the packet"""
+    HEADERS[seq_width].pack_into(buffer, offset, ACK, block_no)
+    return HEADERS[seq_width].size
+
+
+# -- decoding. All of these assume the op_code has been checked already --
+
+def decode_initrq(data):
+    """:return: file_name, options"""
+    file_name, _, options = bytes(data[2:]).partition(b'\x00')
+    return file_name.decode('ascii'), unpack_options(options)
+
+
+def decode_data(data, seq_width=2):
+    """:return: block_no, payload (a slice of data -- a memoryview if data is one)"""
+    header = HEADERS[seq_width]
+    return header.unpack_from(data)[1], data[header.size:]
+
+
+def decode_data_into(data, buffer, seq_width=2, offset=0):
+    """
+    Copy the payload of a DATA packet into buffer at offset
+    :return: block_no, size of the payload
+    """
+    header = HEADERS[seq_width]
+    size = len(data) - header.size
+    buffer[offset:offset + size] = memoryview(data)[header.size:]
+    return header.unpack_from(data)[1], size
+
+
+def decode_ack(data, seq_width=2):
+    """:return: block_no"""
+    return HEADERS[seq_width].unpack_from(data)[1]
+
+
+def decode_err(data):
+    """:return: err_code, err_msg (bytes)"""
+    return _ERR_HEADER.unpack_from(data)[1], bytes(data[4:]).partition(b'\x00')[0]
+
+
+def decode_oack(data):
+    """:return: options"""
+    return unpack_options(bytes(data[2:]))
+
+
+def decode_sack(data, seq_width=2):
+    """:return: block_no, selective (blocks received out of order)"""
+    header = HEADERS[seq_width]
+    block_no = header.unpack_from(data)[1]
+    return block_no, unpack_bitmap(block_no, data[header.size:])
+
+
+def decode_sigrq(data):
+    """:return: offset"""
+    return _OFFSET_HEADER.unpack_from(data)[1]
+
+
+def decode_sig(data):
+    """:return: offset, payload"""
+    return _OFFSET_HEADER.unpack_from(data)[1], data[_OFFSET_HEADER.size:]
+
+
+def decode_parity(data, seq_width=2):
+    """:return: first, count, length, payload"""
+    header = PARITY_HEADERS[seq_width]
+    _, first, count, length = header.unpack_from(data)
+    return first, count, length, data[header.size:]
+
+
+def decode_nak_session(data):
+    """:return: the session id of a NAK (the width of its Block #s depends on it). None if it is too short"""
+    return _NAK_HEADER.unpack_from(data)[1] if len(data) >= _NAK_HEADER.size else None
+
+
+def decode_nak(data, seq_width=2):
+    """:return: session, blocks (list of the Block #s reported missing)"""
+    count = (len(data) - _NAK_HEADER.size) // seq_width
+    blocks = struct.unpack_from('>{}{}'.format(count, _BLOCK_NUMBERS[seq_width]), data, _NAK_HEADER.size)
+    return _NAK_HEADER.unpack_from(data)[1], list(blocks)
+
+
+_DECODERS = {
+    INITRQ: lambda data, seq_width: decode_initrq(data),
+    DATA: decode_data,
+    ACK: decode_ack,
+    ERR: lambda data, seq_width: decode_err(data),
+    OACK: lambda data, seq_width: decode_oack(data),
+    SACK: decode_sack,
+    SIGRQ: lambda data, seq_width: decode_sigrq(data),
+    SIG: lambda data, seq_width: decode_sig(data),
+    PARITY: decode_parity,
+    NAK: decode_nak,
+}
+
+
+def decode(data, seq_width=2):
+    """
+    Decode any packet.
+    :return: op_code, content -- as returned by the decode_* function for its type. (0, None) for unknown packets
+    """
+    code = op_code(data)
+    decoder = _DECODERS.get(code)
+    if decoder is None:
+        return 0, None
+    return code, decoder(data, seq_width)
+
+
+def is_valid(code, data, blksize=DATA_SIZE, seq_width=2):
+    """Length checks for a packet of type code. False for unknown types"""
+    size = len(data)
+    if code == DATA:
+        return 2 + seq_width <= size <= blksize + 2 + seq_width
+    elif code == ACK:
+        return size == 2 + seq_width
+    elif code == SACK:
+        return 2 + seq_width <= size <= 2 + seq_width + MAX_WINDOW_SIZE // 8
+    elif code == INITRQ:
+        return MIN_PACKET_SIZE <= size <= MAX_PACKET_SIZE
+    elif code == OACK:
+        return 2 <= size <= MAX_PACKET_SIZE
+    elif code == ERR:
+        return 5 <= size <= MAX_PACKET_SIZE
+    elif code == SIGRQ:
+        return size == _OFFSET_HEADER.size
+    elif code == SIG:
+        return _OFFSET_HEADER.size <= size <= blksize + _OFFSET_HEADER.size
+    elif code == PARITY:
+        return PARITY_HEADERS[seq_width].size <= size <= blksize + PARITY_HEADERS[seq_width].size
+    elif code == NAK:
+        if size < _NAK_HEADER.size:
+            return False
+        blocks, extra = divmod(size - _NAK_HEADER.size, seq_width)
+        return 1 <= blocks <= MAX_NAK_BLOCKS and not extra
+    return False
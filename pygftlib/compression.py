@@ -0,0 +1,260 @@
+"""
+Compressed transfers. The Sender asks for option compress=<method> (see CODECS); a Receiver that knows the method
+accepts it, and the DATA of the transfer is then a compressed stream instead of the file itself.
+
+The stream is cut into frames of up to FRAME_SIZE bytes of the file -- far larger than a DATA block, so the ratio is
+that of compressing the file, not of compressing 508 bytes at a time:
+
+    magic b'PGZ1', then per frame: kind (1 byte) | size of the data (4 bytes) | size of the payload (4 bytes) | payload
+
+    b'Z'  the payload is the data, compressed
+    b'R'  the payload is the data as is (pass-through)
+
+- Compressors keep their state from one compressed frame to the next where the method allows it (zlib: a sync flush
+  per frame, its 32 KB window carries over). A raw frame resets the state on both sides.
+- Whether a frame is worth compressing is decided from a sample of it, compressed with the cheapest zlib level.
+  Incompressible data (already compressed files, media, random data) goes through as is, and the Sender backs off
+  from sampling while it keeps finding such data. A frame that comes out no smaller is sent raw as well.
+- Frames are read and compressed in the threadpool of the hub -- one frame ahead of the one being sent -- so that
+  the event loop (and ACK handling) is not held up by it. zlib and lzma release the GIL while they work.
+- The Receiver decodes the stream as the blocks come in (Decoder, see FileWriter) and writes what they decode to.
+
+Other methods can be added with register().
+"""
+import lzma
+import struct
+import zlib
+
+from pygftlib.exceptions import MalformedPacketException
+
+import logging
+logger = logging.getLogger(__name__)
+
+MAGIC = b'PGZ1'
+FRAME_SIZE = 256 * 1024  # bytes of the file per frame
+MAX_FRAME_SIZE = 16 * 1024 * 1024  # largest frame a Decoder accepts. Room for methods registered with larger frames
+SAMPLE_SIZE = 16 * 1024  # bytes of each frame compressed to tell whether it is worth compressing
+SAMPLE_RATIO = 0.9  # ... it is, if the sample shrinks below this fraction of its size
+MAX_BACKOFF = 16  # most frames sent as is without sampling, while the data keeps proving incompressible
+_FRAME = struct.Struct('!cII')
+
+
+class ZlibCompressor(object):
+    """One zlib stream across frames. Each frame ends with a sync flush, so it can be decoded once it has arrived"""
+
+    def __init__(self, level=6):
+        self.level = level
+        self.reset()
+
+    def reset(self):
+        self._compressor = zlib.compressobj(self.level)
+
+    def compress(self, data):
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+class ZlibDecompressor(object):
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._decompressor = zlib.decompressobj()
+
+    def decompress(self, payload, size):
+        try:
+            data = self._decompressor.decompress(payload, size + 1)
+        except zlib.error as err:
+            raise MalformedPacketException('Invalid zlib frame: {}'.format(err))
+        if len(data) != size or self._decompressor.unconsumed_tail:
+            raise MalformedPacketException('zlib frame does not decode to {} bytes'.format(size))
+        return data
+
+
+_LZMA_FILTERS = [{'id': lzma.FILTER_LZMA2, 'preset': 2}]
+
+
+class LzmaCompressor(object):
+    """Frames are compressed independently (lzma streams cannot be flushed half way). Raw LZMA2, no container"""
+
+    def reset(self):
+        pass
+
+    def compress(self, data):
+        return lzma.compress(data, format=lzma.FORMAT_RAW, filters=_LZMA_FILTERS)
+
+
+class LzmaDecompressor(object):
+
+    def reset(self):
+        pass
+
+    def decompress(self, payload, size):
+        decompressor = lzma.LZMADecompressor(format=lzma.FORMAT_RAW, filters=_LZMA_FILTERS)
+        try:
+            data = decompressor.decompress(payload, size + 1)
+        except lzma.LZMAError as err:
+            raise MalformedPacketException('Invalid lzma frame: {}'.format(err))
+        if len(data) != size:
+            raise MalformedPacketException('lzma frame does not decode to {} bytes'.format(size))
+        return data
+
+
+# value of option compress -> (name, compressor class, decompressor class)
+CODECS = {
+    1: ('zlib', ZlibCompressor, ZlibDecompressor),
+    2: ('lzma', LzmaCompressor, LzmaDecompressor),
+}
+
+
+def register(method, name, compressor, decompressor):
+    """
+    Add a compression method. Both peers need it, under the same number.
+    :param method: value of option compress that asks for it
+    :param compressor: class whose instances have compress(data) and reset()
+    :param decompressor: class whose instances have decompress(payload, size) and reset(). Raises
+                         MalformedPacketException unless the payload decodes to exactly size bytes
+    """
+    if method in CODECS:
+        raise ValueError('Compression method {} is taken by {}'.format(method, CODECS[method][0]))
+    CODECS[method] = (name, compressor, decompressor)
+
+
+def method_for(name):
+    """:return: the value of option compress for a method name"""
+    for method, (codec_name, _, _) in CODECS.items():
+        if codec_name == name:
+            return method
+    raise ValueError('Unknown compression method {}'.format(name))
+
+
+def stream_size_bound(size):
+    """The most a compressed stream of a file of size bytes can take -- every frame sent as is"""
+    return len(MAGIC) + size + (size // FRAME_SIZE + 1) * _FRAME.size
+
+
+class CompressingReader(object):
+    """
+    Produces the compressed stream of whatever another reader (FileReader, BatchReader, DeltaReader ..) reads, chunk by
+    chunk -- the FileReader interface the Sender expects.
+    """
+
+    def __init__(self, reader, method):
+        self.reader = reader
+        self.method = method
+        self.finished = False
+        self.mapped = False
+        self.raw = self.compressed = 0  # bytes read / bytes of the stream they made up
+        self.passed = 0  # frames sent as is
+        self._compressor = CODECS[method][1]()
+        self._pending = bytearray(MAGIC)
+        self._position = 0  # of _pending, that has been handed out
+        self._skip = 0  # frames still to send without sampling
+        self._backoff = 0
+        import gevent  # here, not at the top: the options (and the asyncio backend) import this module
+        self._threadpool = gevent.get_hub().threadpool
+        self._next = self._threadpool.spawn(self._frame)  # the frame being read and compressed
+
+    def read_chunk(self, size):
+        if self.finished:
+            return b''
+        while len(self._pending) - self._position < size and self._next is not None:
+            frame = self._next.get()
+            # read ahead: the next frame is compressed while this one is sent
+            self._next = self._threadpool.spawn(self._frame) if frame else None
+            if self._position:
+                del self._pending[:self._position]
+                self._position = 0
+            self._pending += frame
+        data = bytes(self._pending[self._position:self._position + size])
+        self._position += len(data)
+        if len(data) < size:
+            self.finished = True
+        return data
+
+    def _frame(self):
+        """The next frame of the stream. b'' once the reader is exhausted. Runs in a worker thread"""
+        if self.reader.finished:
+            return b''
+        data = self.reader.read_chunk(FRAME_SIZE)
+        if not data:
+            return b''
+        self.raw += len(data)
+        if self._worth_compressing(data):
+            payload = self._compressor.compress(data)
+            if len(payload) < len(data):
+                self.compressed += _FRAME.size + len(payload)
+                return _FRAME.pack(b'Z', len(data), len(payload)) + payload
+        self._compressor.reset()  # the Decoder resets on a raw frame as well
+        self.passed += 1
+        self.compressed += _FRAME.size + len(data)
+        return _FRAME.pack(b'R', len(data), len(data)) + data
+
+    def _worth_compressing(self, data):
+        if self._skip:
+            self._skip -= 1
+            return False
+        sample = data[:SAMPLE_SIZE]
+        if len(zlib.compress(sample, 1)) < len(sample) * SAMPLE_RATIO:
+            self._backoff = 0
+            return True
+        self._backoff = min(MAX_BACKOFF, max(1, 2 * self._backoff))
+        self._skip = self._backoff
+        return False
+
+
+class Decoder(object):
+    """
+    Decodes a compressed stream handed over block by block, in whatever order the blocks arrive. Blocks ahead of the
+    first missing one are held back till it shows up -- at most a window of them.
+    """
+
+    def __init__(self, method):
+        self._decompressor = CODECS[method][2]()
+        self._blocks = {}  # block_no -> data. Not decoded yet, out of order
+        self._next_block = 1
+        self._buffer = bytearray()  # the stream from where decoding has got to
+        self._started = False  # the magic has been checked
+        self.offset = 0  # bytes decoded so far
+
+    @property
+    def complete(self):
+        """Nothing held back -- the stream ended with a whole frame"""
+        return self._started and not self._buffer and not self._blocks
+
+    def feed(self, block_no, data):
+        """
+        :return: list of (offset, data) decoded from the stream now that block block_no has arrived. In order
+        :raises MalformedPacketException: the stream cannot be decoded
+        """
+        if block_no < self._next_block or block_no in self._blocks:
+            return []
+        self._blocks[block_no] = bytes(data)
+        while self._next_block in self._blocks:
+            self._buffer += self._blocks.pop(self._next_block)
+            self._next_block += 1
+        if not self._started:
+            if len(self._buffer) < len(MAGIC):
+                return []
+            if self._buffer[:len(MAGIC)] != MAGIC:
+                raise MalformedPacketException('Not a compressed stream')
+            del self._buffer[:len(MAGIC)]
+            self._started = True
+        decoded, position = [], 0
+        while len(self._buffer) - position >= _FRAME.size:
+            kind, size, length = _FRAME.unpack_from(self._buffer, position)
+            if size > MAX_FRAME_SIZE or kind not in (b'Z', b'R') or (kind == b'R' and length != size):
+                raise MalformedPacketException('Invalid frame header at {} of the compressed stream'.format(position))
+            start = position + _FRAME.size
+            if len(self._buffer) - start < length:
+                break
+            payload = bytes(self._buffer[start:start + length])
+            if kind == b'R':
+                self._decompressor.reset()
+            else:
+                payload = self._decompressor.decompress(payload, size)
+            decoded.append((self.offset, payload))
+            self.offset += size
+            position = start + length
+        del self._buffer[:position]
+        return decoded
@@ -0,0 +1,180 @@
+"""
+Congestion control and pacing for the Sender.
+
+- A congestion controller decides how many DATA packets (cwnd) may be in flight. It is told about acknowledgements,
+  losses (blocks the Receiver skipped over) and retransmission timeouts.
+- A token bucket spaces the packets out in time instead of sending a whole window in one burst. Its rate is the
+  smaller of what the controller suggests (cwnd per round trip) and a hard cap (max_rate).
+
+Controllers are pluggable: pass a name from CONTROLLERS, or an instance of a CongestionController subclass, to the
+Sender.
+"""
+import time
+
+from pygftlib import MAX_WINDOW_SIZE
+
+import logging
+logger = logging.getLogger(__name__)
+
+INITIAL_WINDOW = 10  # packets. As in rfc6928
+PACING_GAIN = 1.25  # pace a little faster than cwnd per round trip, so that pacing never limits the window
+BURST_TIME = 0.005  # a TokenBucket may send this many seconds worth of data at once (by default)
+
+
+class TokenBucket(object):
+    """
+    Classic token bucket. Tokens (bytes) accumulate at rate per second, up to burst. Sending takes tokens away; going
+    into debt is allowed, the caller then waits for the debt to be paid back. So packets larger than the bucket are
+    fine and the long term rate never exceeds rate.
+    """
+
+    def __init__(self, rate=None, burst=None):
+        """
+        :param rate: bytes per second. None -- unlimited
+        :param burst: bucket size in bytes. Defaults to BURST_TIME worth of rate
+        """
+        self.burst = burst
+        self.rate = rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    @property
+    def capacity(self):
+        if self.burst is not None:
+            return self.burst
+        return self.rate * BURST_TIME if self.rate else 0
+
+    def reserve(self, size, now=None):
+        """
+        Take size bytes worth of tokens.
+        :return: how long (seconds) the caller should wait before sending them. 0 if it may send right away
+        """
+        if not self.rate:
+            return 0
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= size
+        return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class CongestionController(object):
+    """
+    Base class for congestion controllers. The congestion window (cwnd) is counted in packets.
+    Subclasses implement increase() and may override reduce()/on_timeout().
+    """
+    name = None
+
+    def __init__(self, initial_window=INITIAL_WINDOW, max_window=MAX_WINDOW_SIZE):
+        self.cwnd = float(initial_window)
+        self.ssthresh = float('inf')  # slow start threshold
+        self.max_window = max_window
+        self._recovery_point = 0  # losses of blocks up to here belong to a window we have already reacted to
+
+    def __str__(self):
+        return '%s: cwnd = %.1f | ssthresh = %.1f' % (self.name, self.cwnd, self.ssthresh)
+
+    @property
+    def window(self):
+        """Number of packets that may be in flight"""
+        return int(max(1, min(self.cwnd, self.max_window)))
+
+    def on_ack(self, acked, rtt=None):
+        """
+        :param acked: number of blocks newly acknowledged
+        :param rtt: round trip time measured with this acknowledgement (if any)
+        """
+        self.increase(acked, rtt)
+        self.cwnd = min(self.cwnd, self.max_window)
+
+    def on_loss(self, block_no, highest_sent):
+        """
+        The Receiver reported block_no missing. Only the first loss in a window of data counts.
+        :param highest_sent: highest block number sent so far
+        """
+        if block_no <= self._recovery_point:
+            return
+        self._recovery_point = highest_sent
+        self.reduce()
+        logger.debug('Loss of block %d. %s', block_no, self)
+
+    def on_timeout(self, highest_sent):
+        """The retransmission timer expired. Start over from a window of one packet"""
+        self._recovery_point = highest_sent
+        self.ssthresh = max(self.cwnd / 2, 2)
+        self.cwnd = 1.0
+
+    def increase(self, acked, rtt):
+        raise NotImplementedError
+
+    def reduce(self):
+        """Multiplicative decrease"""
+        self.ssthresh = max(self.cwnd / 2, 2)
+        self.cwnd = self.ssthresh
+
+    def pacing_rate(self, srtt, packet_size):
+        """Bytes per second the window should be spread over. None if the round trip time is not known yet"""
+        if not srtt:
+            return None
+        return PACING_GAIN * self.cwnd * packet_size / srtt
+
+
+class RenoController(CongestionController):
+    """
+    AIMD (Reno style). Slow start doubles cwnd every round trip till ssthresh, after that cwnd grows by one packet
+    per round trip. Halved on loss.
+    """
+    name = 'reno'
+
+    def increase(self, acked, rtt):
+        if self.cwnd < self.ssthresh:
+            self.cwnd += acked
+        else:
+            self.cwnd += acked / self.cwnd
+
+
+class DelayController(CongestionController):
+    """
+    Delay based (in the spirit of LEDBAT, rfc6817). The lowest round trip time seen is taken as the base delay; anything
+    above it is time spent in queues. cwnd grows while the queuing delay is below target and shrinks once it is above.
+    So a transfer backs off as soon as it starts to build queues -- before packets get dropped -- leaving room for
+    latency sensitive traffic. Losses are still treated like Reno does.
+    """
+    name = 'delay'
+    GAIN = 1.0
+
+    def __init__(self, target=0.025, **kwargs):
+        """:param target: acceptable queuing delay (seconds)"""
+        super(DelayController, self).__init__(**kwargs)
+        self.target = target
+        self.base_delay = None
+
+    def increase(self, acked, rtt):
+        if rtt is None:
+            return
+        self.base_delay = rtt if self.base_delay is None else min(self.base_delay, rtt)
+        queuing_delay = rtt - self.base_delay
+        if self.cwnd < self.ssthresh and queuing_delay < self.target / 2:
+            self.cwnd += acked  # slow start, till the queues start to grow
+            return
+        self.ssthresh = min(self.ssthresh, self.cwnd)
+        off_target = (self.target - queuing_delay) / self.target
+        self.cwnd = max(1.0, self.cwnd + self.GAIN * off_target * acked / self.cwnd)
+
+
+CONTROLLERS = {
+    RenoController.name: RenoController,
+    DelayController.name: DelayController,
+}
+
+
+def create_controller(congestion='reno', **kwargs):
+    """
+    :param congestion: name of a controller in CONTROLLERS or a CongestionController instance
+    """
+    if isinstance(congestion, CongestionController):
+        return congestion
+    try:
+        return CONTROLLERS[congestion](**kwargs)
+    except KeyError:
+        raise ValueError('Unknown congestion controller {}. Choose from {}'.format(congestion, sorted(CONTROLLERS)))
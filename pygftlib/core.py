@@ -0,0 +1,535 @@
+"""
+Sans-IO protocol core. The state machines of a Sender and of a Receiver, without sockets, clocks, files or an event
+loop: they are handed the datagrams that arrive and the current time, and hand back the datagrams to send and what to
+do on disk. Backends do the I/O around them -- pygftlib.protocol (gevent) and pygftlib.aio (asyncio).
+
+    sender = SenderCore(file_name, file_size, window_size=32)
+    send(sender.connect(now))                                     # INITRQ
+    on datagram:  send_all(sender.datagram_received(data, now))   # retransmissions
+    then:         while sender.can_send(): send_all(sender.push(reader.read_chunk(sender.block_size), now))
+    at sender.deadline:  send_all(sender.timeout(now))
+    till sender.complete (or sender.error). send() reports every packet it puts on the wire: sender.sent(packet)
+
+    receiver = ReceiverCore()
+    on datagram:  carry out receiver.datagram_received(data, address, now) -- Send, Open, Write, Acknowledge, Close,
+                  Abort. Open and Close are answered with receiver.opened()/closed(), or failed()
+    every EXPIRY_INTERVAL:  carry out receiver.expire(now)
+
+The cores negotiate the options, run the windows, RTT estimation, congestion control and FEC, and keep the sessions.
+Options that need more machinery than that -- striping, batch, resume, delta, compress -- are the backend's: a
+SenderCore asks for whatever the backend adds to its options and tells it what was accepted (on_accept), a
+ReceiverCore accepts those the backend lists and leaves their files to it (see Open).
+"""
+import collections
+
+from pygftlib import *
+from pygftlib import codec
+from pygftlib import metrics
+from pygftlib import options as transfer_options
+from pygftlib import scheduler as scheduling
+from pygftlib.congestion import create_controller
+from pygftlib.fec import ParityEncoder, ParityDecoder, FEC_GROUP
+from pygftlib.helpers import seq_width_for
+from pygftlib.rtt import RTTEstimator
+from pygftlib.session import Session, SessionTable
+from pygftlib.window import SendWindow, ReceiveWindow
+
+import logging
+logger = logging.getLogger(__name__)
+
+SUPPORTED_OPTIONS = ('windowsize', 'blksize', 'seqwidth', 'tsize', 'fec')  # what a core handles by itself
+
+# what a ReceiverCore asks its backend to do
+Send = collections.namedtuple('Send', 'packet address')
+# open a file for session.file_name (session.file_obj, say), as session.options ask. The backend may change those --
+# they are what the OACK lists. Answer with opened(session), or failed()
+Open = collections.namedtuple('Open', 'session')
+Write = collections.namedtuple('Write', 'session block_no data')  # block_no counts from 1, blocks of block_size
+# send the client ack(session). Now, or once the batch of datagrams being handled is done -- one (S)ACK for all of them
+Acknowledge = collections.namedtuple('Acknowledge', 'session')
+Close = collections.namedtuple('Close', 'session')  # the file is complete. Answer with closed(session), or failed()
+Abort = collections.namedtuple('Abort', 'session')  # the client is gone. The file is not complete
+
+
+class SenderCore(object):
+    """
+    Sends one file of file_size bytes. The backend reads the file, sends what the core returns and calls timeout() once
+    deadline has passed. error is set (a message) if the transfer cannot go on; complete once the Receiver has it all.
+    :param options: the backend's own options to ask for, e.g. striping. The core adds windowsize, fec, blksize,
+    seqwidth and tsize
+    :param required: names of options the Receiver must accept. Without them it would get the file wrong
+    :param stream_size: bytes the DATA stream may come to, if more than file_size (e.g. delta). For seqwidth
+    :param on_accept: called with the accepted options once the Receiver accepts the INITRQ, before the first DATA.
+    The backend sets up its options there -- it may change file_size, or fail()
+    """
+
+    def __init__(self, file_name, file_size, window_size=WINDOW_SIZE, block_size=DATA_SIZE, seq_width=None,
+                 congestion='reno', fec=False, options=None, required=(), stream_size=None, on_accept=None,
+                 max_no_response_time=MAX_NO_RESPONSE_TIME):
+        self.file_name = file_name
+        self.file_size = file_size
+        # only ask for what differs from the defaults. So that the original protocol is spoken where it can be
+        self.options = dict(options or {})
+        if window_size > 1:
+            self.options['windowsize'] = window_size
+            if fec:
+                # follow groups of DATA blocks with PARITY, so the Receiver rebuilds lost blocks by itself
+                self.options['fec'] = FEC_GROUP
+        if block_size != DATA_SIZE:
+            self.options['blksize'] = block_size
+        self.requested_seq_width = seq_width  # None -- as wide as the stream needs
+        self.stream_size = file_size if stream_size is None else stream_size
+        self._request_seq_width()
+        self.required = required
+        self.on_accept = on_accept
+        self.block_size = DATA_SIZE
+        self.seq_width = 2
+        self.block_no = 0  # of the last DATA packet created
+        self.final_block = None  # block_no of the last block of the file, once it is created
+        self.accepted = None  # options the Receiver accepted, once it has answered the INITRQ
+        self.legacy_peer = False  # True if the Receiver ignored our options
+        self.window = SendWindow(1)
+        self.fec = None  # fec.ParityEncoder once the Receiver accepts option fec
+        self.rtt = RTTEstimator(initial_rto=NO_RESPONSE_TIME)
+        self.congestion = create_controller(congestion)
+        self.max_no_response_time = max_no_response_time
+        self.last_active = None
+        self.deadline = None  # of the retransmission timer
+        self.error = None
+        self.peer_error = None  # (error code, message) of the ERR the Receiver turned us down with, if it did
+        self.metrics = metrics.Metrics()  # as the gevent Sender's
+        self.init_rq = self._build_init_rq()
+        self._init_sent_at = None
+        self._final_packet = None
+        self._final_sent = False
+
+    def stats(self):
+        """Counters and histograms since the core was created (see pygftlib.metrics)"""
+        return self.metrics.stats()
+
+    @property
+    def complete(self):
+        # Receivers speaking the original protocol never acknowledge the last block. Sending it is all we can do
+        return self.accepted is not None and (self.window.complete or (self.legacy_peer and self._final_sent))
+
+    @property
+    def done(self):
+        return self.complete or self.error is not None
+
+    def request_block_size(self, block_size):
+        """Ask for blksize block_size after all -- e.g. what fits the path MTU. Before connect()"""
+        if block_size != DATA_SIZE:
+            self.options['blksize'] = block_size
+        else:
+            self.options.pop('blksize', None)
+        self._request_seq_width()
+        self.init_rq = self._build_init_rq()
+
+    def connect(self, now):
+        """:return: the INITRQ to send"""
+        self.last_active = self._init_sent_at = now
+        self._arm(now)
+        return self.init_rq
+
+    def sent(self, packet):
+        """The backend has put packet -- one the core handed out -- on the wire"""
+        self.metrics.sent(len(packet) if isinstance(packet, bytes) else len(packet[0]) + len(packet[1]))
+        if packet is self._final_packet:
+            self._final_sent = True
+
+    def datagram_received(self, data, now):
+        """:return: list of packets to send. DATA that the Receiver reports missing"""
+        self.metrics.received(len(data))
+        op_code = codec.op_code(data)
+        if self.done:
+            return []
+        if not codec.is_valid(op_code, data, seq_width=self.seq_width):
+            self.metrics.malformed += 1
+            return []
+        if op_code == codec.SACK:
+            self.last_active = now
+            return self._acknowledge(now, *codec.decode_sack(data, self.seq_width))
+        elif op_code == codec.ACK:
+            block_no = codec.decode_ack(data, self.seq_width)
+            self.last_active = now
+            if self.accepted is None and block_no == 0:
+                # the Receiver doesn't know about options. Fall back to the lockstep protocol
+                logger.info('ACK Received. Initiating Transfer')
+                self.legacy_peer = bool(self.options)
+                self._start({}, now)
+            elif self.accepted is not None and block_no >= self.window.base:
+                return self._acknowledge(now, block_no)
+            else:
+                self.metrics.duplicates += 1
+        elif op_code == codec.OACK:
+            self.last_active = now
+            if self.accepted is None:
+                accepted = codec.decode_oack(data)
+                logger.info('OACK Received. Receiver accepted options {}'.format(accepted))
+                self._start(accepted, now)
+        elif op_code == codec.ERR:
+            # e.g. the Receiver is too busy to take on another transfer. No point in trying any further
+            self.peer_error = codec.decode_err(data)
+            self.fail('The Receiver turned down the transfer of {}: {} (error {})'.format(
+                self.file_name, self.peer_error[1].decode('ascii', 'replace'), self.peer_error[0]))
+        else:
+            self.metrics.malformed += 1
+        return []
+
+    def can_send(self):
+        """True if push() may be called -- there is room in the window for another DATA packet"""
+        return self.accepted is not None and not self.done and self.window.can_send(self.congestion.window)
+
+    def push(self, chunk, now, vectored=False):
+        """
+        :param chunk: the next block_size bytes of the file. Fewer at the end of it
+        :param vectored: hand out DATA as a (header, chunk) pair -- chunk is not copied (e.g. a memoryview of a
+        memory-mapped file)
+        :return: list of packets to send. The DATA packet, and the PARITY it completes a group with
+        """
+        self.block_no += 1
+        if vectored:
+            packet = (codec.HEADERS[self.seq_width].pack(codec.DATA, self.block_no), chunk)
+        else:
+            packet = codec.encode_data(self.block_no, chunk, self.seq_width)
+        # a short block (possibly empty) marks the end of the transfer
+        final = len(chunk) != self.block_size
+        if final:
+            self.final_block = self.block_no
+            self._final_packet = packet
+        self.window.push(self.block_no, packet, final=final, sent_at=now)
+        packets = [packet]
+        if self.fec is not None:
+            parity = self.fec.add(self.block_no, chunk, final)
+            if parity is not None:
+                packets.append(codec.encode_parity(*parity, seq_width=self.seq_width))
+        if self.legacy_peer and not final:
+            # Receivers speaking the original protocol only ACK a block once they see it twice
+            packets.append(packet)
+        return packets
+
+    def timeout(self, now):
+        """:return: list of packets to send. Call once deadline has passed"""
+        if self.done:
+            return []
+        if now - self.last_active > self.max_no_response_time:
+            self.fail('No response from the Receiver for {} seconds'.format(self.max_no_response_time))
+            return []
+        self.rtt.timeout()
+        self._arm(now)
+        if self.accepted is None:
+            self._init_sent_at = None  # Karn's algorithm
+            return [self.init_rq]
+        self.congestion.on_timeout(self.window.next_block - 1)
+        packet = self.window.oldest()
+        if packet is None:
+            return []
+        logger.debug('Retransmission timer expired. %s', self.rtt)
+        self.metrics.retransmits += 1
+        return [packet]
+
+    def heard(self, now):
+        """The Receiver answered outside of datagram_received (e.g. the SIGRQs of a delta transfer)"""
+        self.last_active = now
+        self._arm(now)
+
+    def pacing_rate(self, max_rate=None):
+        """Bytes per second to pace DATA at. None -- no pacing"""
+        rates = [rate for rate in (max_rate, self.congestion.pacing_rate(self.rtt.srtt, self.block_size)) if rate]
+        return min(rates) if rates else None
+
+    def fail(self, message):
+        """The transfer cannot go on"""
+        logger.error(message)
+        self.error = message
+        self.deadline = None
+
+    def _build_init_rq(self):
+        options = dict(self.options)
+        if options:
+            # a Receiver that understands options may as well know the file size. It preallocates the file
+            options.setdefault('tsize', self.file_size)
+        return codec.encode_initrq(self.file_name, options)
+
+    def _request_seq_width(self):
+        """Ask for block numbers wide enough to number every block of the stream (unless told otherwise)"""
+        seq_width = self.requested_seq_width
+        if seq_width is None:
+            seq_width = seq_width_for(self.stream_size // self.options.get('blksize', DATA_SIZE) + 1)
+        if seq_width != 2:
+            self.options['seqwidth'] = seq_width
+        else:
+            self.options.pop('seqwidth', None)
+
+    def _start(self, accepted, now):
+        """
+        The Receiver has accepted our INITRQ. Set up the window as the options it agreed upon say
+        :param accepted: options from the OACK. Empty if the Receiver replied with a plain ACK 0
+        """
+        if self._init_sent_at is not None:
+            self.rtt.sample(now - self._init_sent_at)
+        self._arm(now)
+        missing = [name for name in self.required if name not in accepted]
+        if missing:
+            # e.g. each stripe would end up in a file of its own, a batch as a single file
+            self.fail('The Receiver does not support option(s) {} needed to send {}'.format(', '.join(missing),
+                                                                                           self.file_name))
+            return
+        negotiated = transfer_options.effective(accepted)
+        self.window = SendWindow(min(negotiated['windowsize'], self.options.get('windowsize', 1)))
+        self.congestion.max_window = self.window.size  # no point growing cwnd past what the Receiver allows
+        self.block_size = min(negotiated['blksize'], self.options.get('blksize', DATA_SIZE))
+        self.seq_width = negotiated['seqwidth']
+        if 'fec' in accepted and self.window.size > 1:
+            self.fec = ParityEncoder(int(accepted['fec']), self.block_size)
+        self.accepted = accepted
+        if self.on_accept is not None:
+            self.on_accept(accepted)
+            if self.error is not None:
+                return
+        if self.file_size // self.block_size + 1 > (1 << (8 * self.seq_width)) - 1:
+            self.fail('{} needs more blocks of {} bytes than {} byte block numbers can count'.format(
+                self.file_name, self.block_size, self.seq_width))
+
+    def _acknowledge(self, now, block_no, selective=()):
+        """Slide the window. :return: whatever the Receiver reports missing"""
+        acked = self.window.ack(block_no, selective)
+        if acked:
+            # progress! Measure the round trip and restart the retransmission timer
+            rtt = None
+            if self.window.sample is not None:
+                rtt = now - self.window.sample
+                self.rtt.sample(rtt)
+                self.metrics.rtt_seconds.observe(rtt)
+            for sent_at in self.window.first_sent:
+                self.metrics.block_latency_seconds.observe(now - sent_at)
+            self.congestion.on_ack(len(acked), rtt)
+            self._arm(now)
+            if self.fec is not None:
+                self.fec.observe(self.window.gaps)
+                self.fec.forget(self.window.base)
+        else:
+            self.metrics.duplicates += 1
+        resend = []
+        for lost_block, packet in self.window.lost(self.fec.group_end if self.fec is not None else None):
+            # missing at the Receiver. Send it again
+            self.congestion.on_loss(lost_block, self.window.next_block - 1)
+            self.metrics.retransmits += 1
+            resend.append(packet)
+        if self.window.complete:
+            self.deadline = None
+        return resend
+
+    def _arm(self, now):
+        self.deadline = now + self.rtt.rto
+
+
+class ReceiverCore(object):
+    """
+    Receives files from any number of clients, one session per address. Returns what is to be done for them as
+    Send, Open, Write, Acknowledge, Close and Abort actions, in the order they are to be carried out.
+    A session waits for the backend while its file is opened or closed: the client hears nothing meanwhile. So the OACK
+    goes out once the file is open, and the last (S)ACK once the file is complete on disk -- or an ERR, if it is not.
+    :param options: names of the options a Sender may have. The rest are turned down
+    :param scheduler: scheduling.Scheduler that admits new sessions. One with the default limits if None
+    """
+
+    def __init__(self, window_size=MAX_WINDOW_SIZE, block_size=MAX_BLOCK_SIZE, options=SUPPORTED_OPTIONS,
+                 scheduler=None):
+        self.limits = {'windowsize': window_size, 'blksize': block_size}  # upper bounds on what a Sender may negotiate
+        self.options = frozenset(options)
+        self.scheduler = scheduling.Scheduler() if scheduler is None else scheduler
+        self.client_state = SessionTable()
+        self.metrics = metrics.Metrics()
+
+    def stats(self):
+        """Counters since the Receiver was created. The same as the gevent Receiver's"""
+        stats = self.metrics.stats()
+        stats['sessions'] = self.client_state.in_progress()  # not those that linger once complete
+        return stats
+
+    def datagram_received(self, data, address, now):
+        """:return: list of actions"""
+        self.metrics.received(len(data))
+        op_code = codec.op_code(data)
+        session = self.client_state.get(address)
+        if session is None or (session.transfer_complete and op_code == codec.INITRQ):
+            return self._start_session(op_code, data, address, now)
+        if op_code == codec.DATA:
+            return self.data_received(session, data, now)
+        if op_code == codec.PARITY:
+            if session.fec is None or not codec.is_valid(op_code, data, blksize=session.block_size,
+                                                         seq_width=session.seq_width):
+                self.metrics.malformed += 1
+                return []
+            session.fec.add_parity(*codec.decode_parity(data, session.seq_width))
+            self.client_state.touch(session, now)
+            actions = self.receive_blocks(session, [])
+            if actions:
+                actions.append(Acknowledge(session))
+            return actions
+        if op_code == codec.SIGRQ:
+            if session.signature is None or not codec.is_valid(op_code, data):
+                self.metrics.malformed += 1
+                return []
+            # a piece of the signature of our copy of the file. For a delta transfer
+            offset = codec.decode_sigrq(data)
+            self.client_state.touch(session, now)
+            return [Send(codec.encode_sig(offset, session.signature[offset:offset + session.block_size]), address)]
+        if op_code == codec.INITRQ:
+            # the client has not seen our OACK/ACK yet
+            self.client_state.touch(session, now)
+            return [Acknowledge(session)]
+        self.metrics.malformed += 1
+        return []
+
+    def data_received(self, session, data, now):
+        """
+        A DATA datagram of session. Backends that queue DATA (see pygftlib.scheduler) hand it over once its turn comes
+        :return: list of actions
+        """
+        if not codec.is_valid(codec.DATA, data, blksize=session.block_size, seq_width=session.seq_width):
+            # e.g. larger than the negotiated blksize
+            self.metrics.malformed += 1
+            return []
+        block_no, content = codec.decode_data(data, session.seq_width)
+        self.client_state.touch(session, now)
+        actions = self.receive_blocks(session, [(block_no, content)])
+        # acknowledge -- even duplicates, the client must have missed our ACK
+        actions.append(Acknowledge(session))
+        return actions
+
+    def receive_blocks(self, session, blocks):
+        """
+        Take in the new ones of blocks (DATA), and whatever they allow to rebuild (FEC). Let the window sort out
+        duplicates. New blocks are written at their offset -- even out of order. A block shorter than the negotiated
+        blksize is the last one of the transfer.
+        :param blocks: list of (block_no, content)
+        :return: list of actions. Write for each new block, Close once the last one is in
+        """
+        window = session.window
+        actions = []
+        while blocks:
+            for block_no, content in blocks:
+                expected = window.cumulative + 1
+                if not window.receive(block_no, final=len(content) < session.block_size):
+                    self.metrics.duplicates += 1
+                    continue
+                if block_no != expected:
+                    self.metrics.out_of_order += 1
+                if session.fec is not None:
+                    session.fec.add_block(block_no, content)
+                actions.append(Write(session, block_no, content))
+            if session.fec is None:
+                break
+            # a block that completes a group but one lets the missing one be rebuilt from the group's parity
+            blocks = session.fec.recover(window)
+        if session.fec is not None:
+            session.fec.forget(window.cumulative)
+        if window.complete and not (session.transfer_complete or session.waiting):
+            logger.info('File Transfer Complete! Received {} from client {}'.format(session.file_name,
+                                                                                   session.address))
+            session.waiting = True
+            actions.append(Close(session))
+        return actions
+
+    def ack(self, session):
+        """
+        :return: the (S)ACK to send the client now -- the OACK while still in the handshake. None while the backend
+        opens or closes its file
+        """
+        if session.waiting:
+            return None
+        window = session.window
+        if window.cumulative == 0 and not window.selective() and session.options:
+            # still in the handshake. Let the client know which of its options we accept
+            return codec.encode_oack(session.options)
+        if window.size > 1:
+            return codec.encode_sack(window.cumulative, window.selective(), session.seq_width)
+        return codec.encode_ack(window.cumulative, session.seq_width)
+
+    def opened(self, session):
+        """The backend has opened the file of session (Open). :return: list of actions"""
+        if self.client_state.get(session.address) is not session:
+            return [Abort(session)]  # dropped while its file was being opened
+        session.waiting = False
+        return [Acknowledge(session)]
+
+    def closed(self, session):
+        """The backend has closed the file of session (Close) -- it is complete on disk. :return: list of actions"""
+        if self.client_state.get(session.address) is not session:
+            return []
+        session.waiting = False
+        session.transfer_complete = True
+        self.metrics.completed += 1
+        self.client_state.reschedule(session)
+        return [Acknowledge(session)]
+
+    def failed(self, session, err_code, message):
+        """
+        The backend could not open, write or close the file of session. The session is dropped, and the client is
+        sent an ERR -- rather than the (S)ACK it waits for. :return: list of actions
+        """
+        logger.warning('Dropping client {}: {}'.format(session.address, message))
+        if self.client_state.get(session.address) is session:
+            self.client_state.remove(session.address)
+        return [Abort(session), Send(codec.encode_err(err_code, message), session.address)]
+
+    def admit(self, address):
+        """:return: why a new session of address is turned down (see scheduling.Scheduler). None if it is not"""
+        refusal = self.scheduler.admit(self.client_state.in_progress(), self.client_state.in_progress(address[0]))
+        if refusal is not None:
+            logger.warning('Turning down client {}: {}'.format(address, refusal))
+            self.metrics.rejected += 1
+        return refusal
+
+    def expire(self, now):
+        """:return: list of actions for the sessions that have gone quiet"""
+        actions = []
+        for session in self.client_state.expire(now):
+            logger.info('Removing client {} context. Either transfer has completed or client has been inactive '
+                        'for over {} seconds'.format(session.address, CONN_TIMEOUT))
+            if not session.transfer_complete:
+                actions.append(Abort(session))
+        return actions
+
+    def close(self):
+        """Drop every session. :return: list of actions"""
+        sessions = [self.client_state.remove(address) for address in self.client_state]
+        return [Abort(session) for session in sessions if not session.transfer_complete]
+
+    def _start_session(self, op_code, data, address, now):
+        if op_code != codec.INITRQ or not codec.is_valid(op_code, data):
+            self.metrics.malformed += 1
+            logger.warning('Invalid/Malformed INITRQ packet received from client {}'.format(address))
+            return []
+        refusal = self.admit(address)
+        if refusal is not None:
+            return [Send(codec.encode_err(codec.ERR_ALLOCATION_EXCEEDED, refusal), address)]
+        logger.info('New client has connected. Connection from {}:{}'.format(address[0], address[1]))
+        file_name, requested = codec.decode_initrq(data)
+        accepted = self._negotiate(requested)
+        negotiated = transfer_options.effective(accepted)
+        session = Session(address, ReceiveWindow(negotiated['windowsize']), negotiated['blksize'],
+                          negotiated['seqwidth'], accepted, file_name=file_name)
+        if 'fec' in accepted:
+            session.fec = ParityDecoder(accepted['fec'], session.block_size)
+        session.waiting = True  # for its file
+        self.client_state.touch(session, now)
+        self.client_state.add(session)
+        return [Open(session)]
+
+    def _negotiate(self, requested):
+        """The options of an INITRQ we accept"""
+        accepted = transfer_options.negotiate({name: value for name, value in requested.items()
+                                               if name in self.options}, self.limits)
+        # some do not go together. stripes -- a stripe of a striped transfer (see pygftlib.striping)
+        if 'xfer' not in accepted or 'stripes' in accepted:
+            accepted.pop('resume', None)
+        if 'resume' in accepted or 'stripes' in accepted:
+            accepted.pop('compress', None)
+        if 'resume' in accepted or accepted.get('batch'):
+            accepted.pop('delta', None)
+        if transfer_options.effective(accepted)['windowsize'] <= 1:
+            accepted.pop('fec', None)
+        return accepted
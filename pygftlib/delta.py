@@ -0,0 +1,285 @@
+"""
+Delta transfers (much like rsync): only what changed since the copy the Receiver already has is sent.
+
+1. The Sender asks for option delta. A Receiver holding an earlier copy of the file (the latest one it received
+   under the same name -- the basis) computes its signature and accepts, telling the Sender its size (sigsize).
+2. The Sender fetches the signature: SIGRQ packets asking for the piece at an offset, answered by SIG packets.
+3. The Sender scans the new file and sends, as the DATA of the transfer, a delta stream: instructions to copy blocks
+   of the basis and the literal data in between. The Receiver rebuilds the file from the basis and the delta once
+   the stream is complete (DeltaWriter), checks it against the hash of the whole file and publishes it.
+
+Signature: magic b'PGS1' | block length (4 bytes) | basis size (8 bytes) | per full block of the basis: weak checksum
+(adler32, 4 bytes) and strong hash (blake2b, STRONG_SIZE bytes).
+
+Delta stream: magic b'PGD1', then instructions:
+    b'C' | first block (8 bytes) | number of blocks (4 bytes)     copy blocks of the basis
+    b'L' | length (4 bytes) | data                                literal data
+    b'E' | size of the file (8 bytes) | blake2b of the file (16)   end of the stream
+
+The scan probes each position with zlib.adler32 over a whole block (C speed). Only where that finds no match does it
+roll the checksum a byte at a time in Python -- across the changed data, up to the next match. So scanning costs in
+proportion to what changed, not to the size of the file. Past ROLL_LIMIT bytes without a match (a file that is
+mostly new) it stops rolling and only probes at block boundaries till it finds a match again.
+"""
+import hashlib
+import mmap
+import os
+import struct
+import zlib
+
+from pygftlib.file_io import StagedWriter, copy_range, COPY_SIZE
+from pygftlib.exceptions import MalformedPacketException
+
+import logging
+logger = logging.getLogger(__name__)
+
+MIN_BLOCK_LENGTH = 2048  # bounds on the signature block length. sqrt(size of the basis) in between
+MAX_BLOCK_LENGTH = 128 * 1024
+STRONG_SIZE = 8
+LITERAL_CHUNK = 1024 * 1024  # longest literal instruction
+ROLL_LIMIT = 1024 * 1024  # bytes rolled over without a match before the scan only probes at block boundaries
+
+_SIGNATURE_HEADER = struct.Struct('!4sIQ')
+_SIGNATURE_ENTRY = struct.Struct('!I{}s'.format(STRONG_SIZE))
+_COPY = struct.Struct('!cQI')
+_LITERAL = struct.Struct('!cI')
+_END = struct.Struct('!cQ16s')
+_MOD = 65521  # adler32
+
+
+def block_length(size):
+    """Signature block length for a basis of size bytes. A power of two near its square root"""
+    length = MIN_BLOCK_LENGTH
+    while length < MAX_BLOCK_LENGTH and length * length < size:
+        length *= 2
+    return length
+
+
+def stream_size_bound(size):
+    """The most a delta stream of a file of size bytes can take -- all of it literal"""
+    return 4 + size + (size // LITERAL_CHUNK + 1) * _LITERAL.size + _END.size
+
+
+def strong(data):
+    return hashlib.blake2b(data, digest_size=STRONG_SIZE).digest()
+
+
+def find_basis(file_name, directory='.'):
+    """The latest file received under file_name (see file_io.sanitize_file_name). None if there is none"""
+    from slugify import slugify
+    suffix = ' - ' + slugify(file_name)
+    candidates = [os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(suffix)]
+    candidates = [path for path in candidates if os.path.isfile(path)]
+    return max(candidates, key=os.path.getmtime) if candidates else None
+
+
+def signature(path):
+    """Signature of the file at path"""
+    size = os.path.getsize(path)
+    length = block_length(size)
+    parts = [_SIGNATURE_HEADER.pack(b'PGS1', length, size)]
+    buffer = bytearray(length)
+    view = memoryview(buffer)
+    with open(path, 'rb') as f:
+        while f.readinto(buffer) == length:
+            parts.append(_SIGNATURE_ENTRY.pack(zlib.adler32(view), strong(view)))
+    return b''.join(parts)
+
+
+def prepare(file_name, directory='.'):
+    """
+    The basis of a delta transfer of file_name and its signature -- (None, None) if there is no basis. Lists the
+    directory and reads the whole basis, so the Receiver calls it in a thread
+    """
+    basis = find_basis(file_name, directory)
+    return (basis, signature(basis)) if basis is not None else (None, None)
+
+
+def parse_signature(data):
+    """:return: block length, size of the basis, {weak checksum: [(block, strong hash), ..]}"""
+    if len(data) < _SIGNATURE_HEADER.size:
+        raise MalformedPacketException('Truncated signature')
+    magic, length, size = _SIGNATURE_HEADER.unpack_from(data)
+    if magic != b'PGS1' or (len(data) - _SIGNATURE_HEADER.size) % _SIGNATURE_ENTRY.size:
+        raise MalformedPacketException('Not a signature')
+    table = {}
+    for index, (weak, digest) in enumerate(_SIGNATURE_ENTRY.iter_unpack(memoryview(data)[_SIGNATURE_HEADER.size:])):
+        table.setdefault(weak, []).append((index, digest))
+    return length, size, table
+
+
+class DeltaReader(object):
+    """
+    Produces the delta stream of a file against a signature, chunk by chunk -- the FileReader interface the Sender
+    expects. The file is scanned as the stream is read.
+    """
+
+    def __init__(self, file_name, signature_data):
+        self.length, _, self.table = parse_signature(signature_data)
+        self.finished = False
+        self.mapped = False
+        self.copied = self.literal = 0  # bytes of the file sent as copy instructions / literally
+        self._f = open(file_name, 'rb')
+        size = os.fstat(self._f.fileno()).st_size
+        self._data = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self._pending = bytearray(b'PGD1')
+        self._position = 0  # of _pending, that has been handed out
+        self._instructions = self._scan()
+
+    def read_chunk(self, size):
+        if self.finished:
+            return b''
+        while len(self._pending) - self._position < size:
+            instruction = next(self._instructions, None)
+            if instruction is None:
+                break
+            if self._position:
+                del self._pending[:self._position]
+                self._position = 0
+            self._pending += instruction
+        data = bytes(self._pending[self._position:self._position + size])
+        self._position += len(data)
+        if len(data) < size:
+            self.finished = True
+            self._f.close()
+        return data
+
+    def _match(self, weak, data, position, expected):
+        """Block of the basis the block at position is a copy of. The one after the previous match if possible"""
+        candidates = self.table.get(weak)
+        if not candidates:
+            return None
+        digest = strong(data[position:position + self.length])
+        found = None
+        for index, candidate in candidates:
+            if candidate == digest:
+                if index == expected:
+                    return index
+                found = index if found is None else found
+        return found
+
+    def _scan(self):
+        """Generate the instructions of the delta stream"""
+        data, length = self._data, self.length
+        view = memoryview(data)
+        size = len(data)
+        file_hash = hashlib.blake2b(digest_size=16)
+        literal_start = 0  # of the literal data not sent yet
+        copy = None  # [first block, count] of the copy instruction not sent yet
+        position = 0
+        rolled = 0  # bytes rolled over since the last match
+        while position + length <= size:
+            weak = zlib.adler32(view[position:position + length])
+            index = self._match(weak, view, position, copy[0] + copy[1] if copy else None)
+            if index is None and rolled < ROLL_LIMIT:
+                # roll a byte at a time till a block matches
+                a, b = weak & 0xffff, weak >> 16
+                start, end = position, min(size - length, position + ROLL_LIMIT - rolled)
+                while position < end:
+                    out, into = data[position], data[position + length]
+                    a = (a - out + into) % _MOD
+                    b = (b - length * out + a - 1) % _MOD
+                    position += 1
+                    weak = (b << 16) | a
+                    if weak in self.table:
+                        index = self._match(weak, view, position, None)
+                        if index is not None:
+                            break
+                    if position - literal_start >= LITERAL_CHUNK:
+                        yield from self._flush(copy, view, literal_start, position, file_hash)
+                        copy, literal_start = None, position
+                rolled += position - start
+                if index is None and position >= size - length:
+                    break  # no block of the basis in what is left
+            if index is None:
+                # mostly new data. Probe at block boundaries only, till something matches again
+                position += length
+                if position - literal_start >= LITERAL_CHUNK:
+                    yield from self._flush(copy, view, literal_start, min(position, size), file_hash)
+                    copy, literal_start = None, min(position, size)
+                continue
+            rolled = 0
+            if literal_start < position:
+                yield from self._flush(copy, view, literal_start, position, file_hash)
+                copy = None
+            if copy is not None and index == copy[0] + copy[1]:
+                copy[1] += 1
+            else:
+                yield from self._flush(copy, view, position, position, file_hash)
+                copy = [index, 1]
+            file_hash.update(view[position:position + length])
+            self.copied += length
+            position += length
+            literal_start = position
+        yield from self._flush(copy, view, literal_start, literal_start, file_hash)
+        while literal_start < size:
+            end = min(size, literal_start + LITERAL_CHUNK)
+            yield from self._flush(None, view, literal_start, end, file_hash)
+            literal_start = end
+        yield _END.pack(b'E', size, file_hash.digest())
+
+    def _flush(self, copy, view, start, end, file_hash):
+        """The copy instruction held back (if any), then the literal data from start to end"""
+        if copy is not None:
+            yield _COPY.pack(b'C', copy[0], copy[1])
+        if start < end:
+            file_hash.update(view[start:end])
+            self.literal += end - start
+            yield _LITERAL.pack(b'L', end - start) + view[start:end]
+
+
+class DeltaWriter(StagedWriter):
+    """
+    Receives a delta stream into a .part file like any other, but publishes it by rebuilding the file from the basis
+    and the delta. The rebuilt file is checked against the hash at the end of the stream before it is published.
+    """
+
+    def __init__(self, file_name, chunk_size, basis, basis_signature=None, **kwargs):
+        self.basis = basis
+        # handed out to the Sender piece by piece (SIGRQ/SIG). Computed here unless the caller has (off the event loop)
+        self.signature = basis_signature if basis_signature is not None else signature(basis)
+        super(DeltaWriter, self).__init__(file_name, chunk_size, **kwargs)
+
+    def _preallocate(self, size):
+        pass  # size is that of the file, not of the (usually far smaller) delta stream
+
+    def _build(self, path):
+        length = _SIGNATURE_HEADER.unpack_from(self.signature)[1]
+        if os.pread(self._fd, 4, 0) != b'PGD1':
+            raise MalformedPacketException('Not a delta stream')
+        basis = os.open(self.basis, os.O_RDONLY)
+        out = os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o666)
+        try:
+            offset, written = 4, 0
+            while True:
+                kind = os.pread(self._fd, 1, offset)
+                if kind == b'C':
+                    _, block, count = _COPY.unpack(os.pread(self._fd, _COPY.size, offset))
+                    offset += _COPY.size
+                    copy_range(basis, block * length, out, written, count * length)
+                    written += count * length
+                elif kind == b'L':
+                    _, size = _LITERAL.unpack(os.pread(self._fd, _LITERAL.size, offset))
+                    offset += _LITERAL.size
+                    copy_range(self._fd, offset, out, written, size)
+                    written += size
+                    offset += size
+                elif kind == b'E':
+                    _, size, digest = _END.unpack(os.pread(self._fd, _END.size, offset))
+                    break
+                else:
+                    raise MalformedPacketException('Unknown delta instruction {!r} at {}'.format(kind, offset))
+            if written != size or self._hash(out, size) != digest:
+                raise MalformedPacketException('{} does not match the file that was sent'.format(path))
+            if self.fsync is not None:
+                os.fsync(out)
+        finally:
+            os.close(basis)
+            os.close(out)
+
+    @staticmethod
+    def _hash(fd, size):
+        file_hash = hashlib.blake2b(digest_size=16)
+        for offset in range(0, size, COPY_SIZE):
+            file_hash.update(os.pread(fd, min(COPY_SIZE, size - offset), offset))
+        return file_hash.digest()
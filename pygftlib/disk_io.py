@@ -0,0 +1,123 @@
+"""
+Disk I/O off the event loop. A slow read or write -- network storage, a busy disk, an fsync -- holds up the greenlet
+that asked for it, instead of every session the process serves.
+
+- DiskPool is a bounded pool of threads for file system calls. The Receiver has one (disk_threads); the files of all
+  of its sessions share it.
+- WriteBehind carries out the writes of one FileWriter (and the work of its close() and abort()) in the pool, in
+  order. Writes are queued and the writer carries on; once more than limit bytes are waiting to be written, whoever
+  writes more waits for them (backpressure -- the Receiver then acknowledges that client's DATA later, and its
+  Sender slows down). Queued writes are handed to the pool together, so a thread is woken once per batch of them.
+- The Sender reads ahead of the network in the threadpool of the hub (see Sender._read_ahead).
+
+The calls made in threads must not touch gevent. FileWriter's do not: os calls, the journal and logging.
+"""
+import collections
+
+import gevent.event
+import gevent.threadpool
+
+from pygftlib import DISK_THREADS, WRITE_BEHIND
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class DiskPool(gevent.threadpool.ThreadPool):
+    """Threads for file system calls. Create it in the thread (hub) that is going to use it"""
+
+    def __init__(self, threads=DISK_THREADS):
+        super(DiskPool, self).__init__(threads)
+
+    def write_behind(self, limit=WRITE_BEHIND):
+        """A WriteBehind for one more file"""
+        return WriteBehind(self, limit)
+
+
+def _carry_out(jobs):
+    """
+    Runs in a thread of the pool: the jobs, in order, till one of them fails.
+    :return: the result of the last job, the exception that stopped them (or None) and the job that raised it
+    """
+    value = None
+    for job in jobs:
+        _, function, args, _ = job
+        try:
+            value = function(*args)
+        except Exception as err:
+            return None, err, job
+    return value, None, None
+
+
+class WriteBehind(object):
+    """The file system calls of one file, carried out in order in a pool of threads. See the module docstring"""
+
+    def __init__(self, pool, limit=WRITE_BEHIND):
+        self.pool = pool
+        self.limit = limit
+        self.pending = 0  # bytes submitted and not written yet
+        self.error = None  # the first write that failed. Everything after it fails as well
+        self._jobs = collections.deque()  # (size, function, args, AsyncResult for call() -- None for submit())
+        self._worker = None  # greenlet handing the jobs to the pool, while there are any
+        self._room = gevent.event.Event()  # set while pending <= limit
+        self._room.set()
+
+    def submit(self, size, function, *args):
+        """
+        Queue function(*args), a write of size bytes. Returns at once, unless more than limit bytes are waiting to be
+        written -- then once they are not.
+        :raises: whatever an earlier write raised
+        """
+        self._check()
+        self._jobs.append((size, function, args, None))
+        self.pending += size
+        self._start()
+        while self.pending > self.limit and self.error is None:
+            self._room.clear()
+            self._room.wait()
+        self._check()
+
+    def call(self, function, *args):
+        """:return: function(*args), carried out once everything queued before it is done
+        :raises: the error of an earlier write, if one failed. function is not carried out then"""
+        result = gevent.event.AsyncResult()
+        self._jobs.append((0, function, args, result))
+        self._start()
+        return result.get()
+
+    def drain(self):
+        """Wait till everything queued so far has been carried out"""
+        self.call(int)
+
+    def _check(self):
+        if self.error is not None:
+            raise self.error
+
+    def _start(self):
+        if self._worker is None:
+            self._worker = gevent.spawn(self._run)
+
+    def _run(self):
+        while self._jobs:
+            # every write up to (and including) the next call() goes to the pool at once
+            jobs = []
+            while self._jobs and (not jobs or jobs[-1][3] is None):
+                jobs.append(self._jobs.popleft())
+            if self.error is not None:
+                value, err, failed = None, self.error, jobs[0]
+            else:
+                value, err, failed = self.pool.apply(_carry_out, (jobs,))
+            for job in jobs:
+                size, _, _, result = job
+                self.pending -= size
+                if err is not None and (failed is job or self.error is not None):
+                    if self.error is None:
+                        self.error = err
+                        logger.error('Write behind failed: {}'.format(err))
+                    if result is not None:
+                        result.set_exception(self.error)
+                elif result is not None:
+                    result.set(value)
+            if self.pending <= self.limit:
+                self._room.set()
+        self._worker = None
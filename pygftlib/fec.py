@@ -0,0 +1,157 @@
+"""
+Forward error correction. With option fec=<largest group> the Sender follows every group of up to that many DATA
+blocks with a PARITY packet: the XOR of the blocks (each padded to blksize) and of their lengths. A Receiver missing
+a single block of a group rebuilds it from the others and the parity -- without waiting a round trip (or a timeout)
+for it to be sent again.
+
+    PARITY | first Block # of the group | number of blocks (1 byte) | XOR of their lengths (2 bytes) | XOR of them
+
+- The group size adapts to the loss rate the Sender observes (blocks the Receiver reports missing, recovered or
+  not): about LOSS_TARGET losses per group, between MIN_GROUP and the negotiated largest group. The less loss, the
+  less parity is sent.
+- With FEC, a block is only sent again once DUP_THRESHOLD blocks past the end of its group have been acknowledged
+  without it -- the Receiver gets the chance to rebuild it first (see SendWindow.lost).
+- Parity packets are sent once and are not acknowledged. A group with more than one block missing is left to the
+  usual retransmissions; once one of them arrives the other can be rebuilt.
+"""
+import bisect
+
+import logging
+logger = logging.getLogger(__name__)
+
+FEC_GROUP = 32  # largest group the Sender asks for
+MIN_GROUP = 4
+MAX_GROUP = 255
+LOSS_TARGET = 0.5  # losses per group the group size is chosen for
+LOSS_SAMPLE = 256  # blocks sent between updates of the loss rate
+LOSS_WEIGHT = 0.5  # weight of the latest sample in the (smoothed) loss rate
+
+
+def xor_blocks(blocks, block_size):
+    """:return: the XOR of blocks, each padded with zeros to block_size"""
+    value = 0
+    for block in blocks:
+        value ^= int.from_bytes(block, 'big') << (8 * (block_size - len(block)))
+    return value.to_bytes(block_size, 'big')
+
+
+class ParityEncoder(object):
+    """Sender side. Groups the DATA blocks as they are sent, and decides on the size of the next group"""
+
+    def __init__(self, max_group, block_size):
+        self.max_group = max_group
+        self.block_size = block_size
+        self.group_size = max_group
+        self.loss_rate = 0.0
+        self._group = []  # blocks of the group being sent
+        self._value = 0  # XOR of the group so far
+        self._length = 0  # XOR of the lengths so far
+        self._ends = []  # last block of each group sent -- for group_end()
+        self._sent = 0  # blocks sent since the loss rate was updated
+        self._gaps = 0  # blocks reported missing, when the loss rate was last updated
+
+    def add(self, block_no, data, final=False):
+        """
+        A DATA block has been sent.
+        :return: the PARITY packet content (first, count, length, payload) if the block completes a group. Else None
+        """
+        self._value ^= int.from_bytes(data, 'big') << (8 * (self.block_size - len(data)))
+        self._length ^= len(data)
+        self._group.append(block_no)
+        self._sent += 1
+        if len(self._group) < self.group_size and not final:
+            return None
+        first, count = self._group[0], len(self._group)
+        parity = (first, count, self._length, self._value.to_bytes(self.block_size, 'big'))
+        self._ends.append(block_no)
+        self._group, self._value, self._length = [], 0, 0
+        return parity
+
+    def group_end(self, block_no):
+        """Last block of the group block_no belongs to. Groups still being sent end where they may end at most"""
+        i = bisect.bisect_left(self._ends, block_no)
+        if i < len(self._ends):
+            return self._ends[i]
+        return block_no + self.max_group
+
+    def forget(self, base):
+        """Groups that end before base are done with"""
+        del self._ends[:bisect.bisect_left(self._ends, base)]
+
+    def observe(self, gaps):
+        """
+        Update the loss rate, and the group size with it
+        :param gaps: blocks reported missing so far (see SendWindow.gaps)
+        """
+        if self._sent < LOSS_SAMPLE:
+            return
+        sample = (gaps - self._gaps) / self._sent
+        self.loss_rate += LOSS_WEIGHT * (sample - self.loss_rate)
+        self._sent, self._gaps = 0, gaps
+        size = int(LOSS_TARGET / self.loss_rate) if self.loss_rate else self.max_group
+        size = max(MIN_GROUP, min(self.max_group, size))
+        if size != self.group_size:
+            logger.debug('Loss rate {:.3f}. FEC groups of {} blocks'.format(self.loss_rate, size))
+            self.group_size = size
+
+
+class ParityDecoder(object):
+    """
+    Receiver side. Keeps the blocks that may still be needed to rebuild another, and the parity of groups that are
+    not complete yet.
+    """
+
+    def __init__(self, max_group, block_size):
+        self.max_group = max_group
+        self.block_size = block_size
+        self.recovered = 0  # blocks rebuilt so far
+        self._horizon = 0  # blocks up to here have been forgotten
+        self._blocks = {}  # block_no -> data
+        self._parity = {}  # first block -> (count, length, payload)
+
+    def add_block(self, block_no, data):
+        self._blocks[block_no] = bytes(data)
+
+    def add_parity(self, first, count, length, payload):
+        if count and first not in self._parity:
+            self._parity[first] = (count, length, bytes(payload))
+
+    def recover(self, window):
+        """
+        Rebuild what can be rebuilt
+        :param window: the ReceiveWindow of the session. Tells which blocks have arrived
+        :return: list of (block_no, data) rebuilt
+        """
+        recovered = []
+        for first, (count, length, payload) in list(self._parity.items()):
+            blocks = range(first, first + count)
+            missing = [block for block in blocks if not window.received(block)]
+            if len(missing) > 1:
+                continue  # maybe later
+            del self._parity[first]
+            if not missing:
+                continue
+            others = [self._blocks.get(block) for block in blocks if block != missing[0]]
+            if any(block is None for block in others):
+                continue  # arrived before we kept them
+            for block in others:
+                length ^= len(block)
+            if length > self.block_size:
+                logger.debug('Invalid parity for blocks {} to {}'.format(first, first + count - 1))
+                continue
+            data = xor_blocks(others + [payload], self.block_size)[:length]
+            recovered.append((missing[0], data))
+            self._blocks[missing[0]] = data
+        self.recovered += len(recovered)
+        return recovered
+
+    def forget(self, cumulative):
+        """Blocks too far behind the cumulative ACK to belong to a group that is not complete. Every so often"""
+        horizon = cumulative - self.max_group
+        if horizon - self._horizon < self.max_group:
+            return
+        self._horizon = horizon
+        for block in [block for block in self._blocks if block <= horizon]:
+            del self._blocks[block]
+        for first in [first for first, (count, _, _) in self._parity.items() if first + count - 1 <= cumulative]:
+            del self._parity[first]
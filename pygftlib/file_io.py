@@ -3,43 +3,140 @@ This module implements functionality to easy read and write to files.
 """
 
 import os
+import mmap
+import itertools
+import struct
 from datetime import datetime
-from slugify import slugify
 import sys
 
+from pygftlib.exceptions import MalformedPacketException
+
 import logging
 logger = logging.getLogger(__name__)
 
+COALESCE_SIZE = 1024 * 1024  # FileWriter merges adjacent blocks into writes of up to this many bytes
+COPY_SIZE = 1024 * 1024  # bytes copied at once by copy_range
+try:
+    IOV_MAX = os.sysconf('SC_IOV_MAX')  # most buffers a single pwritev takes
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 1024
+
 
-def sanitize_file_name(name):
+def sanitize_file_name(name, attempt=0):
     """
     Ensure that file_name is legal. Slug the filename and store it onto the server.
     This would ensure that there are no duplicates as far as writing a file is concerned.
     :param name: Name of the file
+    :param attempt: > 0 if the name is already taken (the same file received twice within a second). Numbers the name
+    """
+    from slugify import slugify  # here, not at the top: it takes longer to import than the rest of the package
+    stamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    if attempt:
+        stamp += ' ({})'.format(attempt)
+    return stamp + ' - ' + slugify(name)
+
+
+def copy_range(source, offset, destination, at, size):
+    """
+    Copy size bytes at offset of source to destination (at). Both file descriptors. In the kernel where possible
+    :raises MalformedPacketException: source ends before that
+    """
+    done = 0
+    while done < size:
+        count = min(COPY_SIZE, size - done)
+        copied = 0
+        if hasattr(os, 'copy_file_range'):
+            try:
+                copied = os.copy_file_range(source, destination, count, offset + done, at + done)
+            except OSError:
+                copied = 0  # not between these two (file systems, kernel). Through user space then
+        if not copied:
+            data = os.pread(source, count, offset + done)
+            copied = os.pwrite(destination, data, at + done) if data else 0
+        if not copied:
+            raise MalformedPacketException('Copy of {} bytes at {} runs past the end of the file'.format(size, offset))
+        done += copied
+
+
+def read_blocks(file_obj, block_size, count):
+    """
+    The next count blocks of file_obj (anything with read_chunk), read at once. Fewer once it ends -- the last one
+    short (empty if it ends on a block boundary), as read_chunk has it
     """
-    return datetime.now().strftime("%Y-%m-%d %H:%M:%S") + ' - ' + slugify(name)
+    data = file_obj.read_chunk(count * block_size)
+    blocks = [data[start:start + block_size] for start in range(0, len(data), block_size)]
+    if len(data) < count * block_size and (not blocks or len(blocks[-1]) == block_size):
+        blocks.append(b'')
+    return blocks
 
 
 class FileReader(object):
-    def __init__(self, file_name=None, chunk_size=0):
+    """
+    Reads a file chunk by chunk. With use_mmap the file is memory-mapped and read_chunk returns memoryview slices of
+    the mapping instead of freshly allocated bytes -- nothing is copied till the kernel copies it into a socket.
+    Only length bytes from offset on are read, if given (one stripe of a striped transfer).
+    """
+    def __init__(self, file_name=None, chunk_size=0, use_mmap=False, offset=0, length=None):
         self.name = file_name
         self.chunk_size = chunk_size
+        self.start = offset
+        self._remaining = length  # bytes left to read. None -- up to the end of the file
         self._f = self._open_file()
         self.finished = False
+        self._map = None
+        self._view = None  # memoryview of the mapping. Just the range to read
+        self._offset = 0
+        if use_mmap:
+            self._map_file()
 
     def _open_file(self):
         logger.debug('Opening File {}'.format(self.name))
-        return open(self.name, 'rb')
+        f = open(self.name, 'rb')
+        if self.start:
+            f.seek(self.start)
+        return f
+
+    def _map_file(self):
+        try:
+            self._map = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            # empty files, pipes and the like cannot be mapped. Read them the usual way
+            logger.debug('Cannot memory-map file {}. Falling back to read()'.format(self.name))
+            return
+        if hasattr(self._map, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+            self._map.madvise(mmap.MADV_SEQUENTIAL)  # aggressive read-ahead
+        end = None if self._remaining is None else self.start + self._remaining
+        self._view = memoryview(self._map)[self.start:end]
+
+    @property
+    def mapped(self):
+        """True if read_chunk returns zero-copy views into the memory-mapped file"""
+        return self._view is not None
+
+    def skip(self, count):
+        """Move past count bytes without reading them (e.g. what a Receiver already has)"""
+        if self._view is not None:
+            self._offset += count
+        else:
+            if self._remaining is not None:
+                count = min(count, self._remaining)
+                self._remaining -= count
+            self._f.seek(count, os.SEEK_CUR)
 
     def read_chunk(self, size=None):
         size = size or self.chunk_size
         if self.finished:
             return b''
 
-        data = self._f.read(size)
-        logger.debug('Reading {} bytes of data from file {} - Contents {}'.format(size, self.name, data))
+        if self._view is not None:
+            data = self._view[self._offset:self._offset + size]
+            self._offset += len(data)
+        else:
+            data = self._f.read(size if self._remaining is None else min(size, self._remaining))
+            if self._remaining is not None:
+                self._remaining -= len(data)
         if not data or (size > 0 and len(data) < size):
-            self._f.close()
+            self._f.close()  # a mapping stays valid after its file is closed
             self.finished = True
             logger.debug('Finished reading file {}. Closing!'.format(self.name))
         return data
@@ -47,31 +144,325 @@ class FileReader(object):
     def __del__(self):
         if self._f and not self._f.closed:
             self._f.close()
+        if self._map is not None:
+            self._view.release()
+            try:
+                self._map.close()
+            except BufferError:
+                pass  # slices of the mapping are still referenced somewhere. It is unmapped once they are gone
 
 
 class FileWriter(object):
-    def __init__(self, file_name, chunk_size):
-        self.name = sanitize_file_name(file_name)
+    """
+    Writes the blocks of a file at their offsets (block_no - 1) * chunk_size, in whatever order they arrive.
+
+    - The file is written under a temporary name (name + PART_SUFFIX) and renamed to name once complete, so a file
+      under its final name is always whole.
+    - If the size is known up front the file is preallocated (posix_fallocate). Less fragmentation, and running out of
+      disk space shows up at the start of the transfer instead of halfway through.
+    - Runs of adjacent blocks are coalesced in memory and written with a single pwritev, up to coalesce bytes at once.
+    - fsync: None -- leave it to the OS, 'end' -- fsync once before the file is published, or a number of bytes --
+      fsync every that many bytes (and at the end).
+    - Parts of the file may be written through FileRanges (see range()). Each coalesces its own blocks.
+    - With a journal (pygftlib.journal) the ranges written are checkpointed, and the .part file of an earlier attempt
+      listed in it is reopened rather than starting over. offset is then where to carry on from.
+    - With a decoder (pygftlib.compression.Decoder) the blocks are those of a compressed stream. What they decode to
+      is written instead, in order, as it comes out.
+    - With a disk (pygftlib.disk_io.WriteBehind) the writes, and the work of close() and abort(), are handed to it to
+      be carried out in order off the event loop. Without one they are done there and then.
+    """
+    PART_SUFFIX = '.part'
+    ACCESS = os.O_WRONLY
+
+    def __init__(self, file_name, chunk_size, size=None, fsync=None, coalesce=COALESCE_SIZE, journal=None,
+                 decoder=None, disk=None):
+        self.name = self.part_name = None  # decided by _open_file(). Unique
         self.chunk_size = chunk_size
-        self._f = self._open_file()
+        self.offset = 0  # of block 1
+        self.size = size
+        self.fsync = fsync
+        self.coalesce = coalesce
+        self.journal = journal
+        self.decoder = decoder
+        self.disk = disk
+        self.closed = False
+        self._run = []  # adjacent blocks not written yet
+        self._run_offset = 0
+        self._run_size = 0
+        self._end = 0  # end of the furthest block written so far
+        self._unsynced = 0  # bytes written since the last fsync
+        self._next_block = 1  # for write_chunk()
+        if journal is not None and journal.part_name:
+            self._fd = self._reopen_file(journal)
+            return
+        self._fd = self._open_file(file_name)
+        if journal is not None:
+            journal.name, journal.part_name = self.name, self.part_name
+        if size:
+            self._preallocate(size)
 
-    def _open_file(self):
-        logger.debug('Opening File {}'.format(self.name))
-        return open(self.name, 'xb')
+    def _open_file(self, file_name):
+        flags = self.ACCESS | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+        for attempt in itertools.count():
+            self.name = sanitize_file_name(file_name, attempt)
+            self.part_name = self.name + self.PART_SUFFIX
+            if os.path.exists(self.name):
+                continue
+            try:
+                logger.debug('Opening File {}'.format(self.part_name))
+                return os.open(self.part_name, flags, 0o666)
+            except FileExistsError:
+                continue  # another transfer of a file with the same name
 
-    def _flush(self):
-        if self._f:
-            self._f.flush()
+    def _reopen_file(self, journal):
+        """Carry on with the .part file of an earlier attempt"""
+        self.name, self.part_name = journal.name, journal.part_name
+        self.offset = self._end = journal.contiguous
+        logger.debug('Reopening File {} at {}'.format(self.part_name, self.offset))
+        return os.open(self.part_name, self.ACCESS | getattr(os, 'O_BINARY', 0))
+
+    def _preallocate(self, size):
+        if not hasattr(os, 'posix_fallocate'):
+            return
+        try:
+            os.posix_fallocate(self._fd, 0, size)
+        except OSError:
+            # not supported by every file system. The blocks are allocated as they are written instead
+            logger.debug('Unable to preallocate {} bytes for {}'.format(size, self.part_name), exc_info=True)
+
+    def write_block(self, block_no, data):
+        """
+        Write a block at its offset. Adjacent blocks are held back and written together
+        :raises MalformedPacketException: the block does not decode (with a decoder)
+        """
+        if self.decoder is not None:
+            for offset, decoded in self.decoder.feed(block_no, data):
+                self._add(self.offset + offset, decoded)
+        else:
+            self._add(self.offset + (block_no - 1) * self.chunk_size, data)
+        return len(data)
+
+    def _add(self, offset, data):
+        if self._run and (offset != self._run_offset + self._run_size or self._run_size + len(data) > self.coalesce):
+            self._flush()
+        if not self._run:
+            self._run_offset = offset
+        self._run.append(data)
+        self._run_size += len(data)
+        if self._run_size >= self.coalesce or len(self._run) >= IOV_MAX:
+            self._flush()
 
     def write_chunk(self, data):
-        bytes_written = self._f.write(data)
-        logger.debug('Writing {} bytes of data to file {} - Contents {}'.format(self.chunk_size, self.name, data))
+        """Append the next block. A short (or empty) chunk is the last one -- the file is published"""
+        bytes_written = self.write_block(self._next_block, data)
+        self._next_block += 1
         if not data or len(data) < self.chunk_size:
-            logger.debug('Finished writing file {}. Closing!'.format (self.name))
-            self._f.close()
-
+            self.close()
         return bytes_written
 
+    def range(self, offset, chunk_size):
+        """A FileRange writing blocks of chunk_size from offset on"""
+        return FileRange(self, offset, chunk_size)
+
+    def _flush(self):
+        if not self._run:
+            return
+        run, offset, size = self._run, self._run_offset, self._run_size
+        self._run, self._run_size = [], 0
+        if self.disk is not None:
+            self.disk.submit(size, self._write, run, offset, size)
+        else:
+            self._write(run, offset, size)
+
+    def _call(self, function):
+        """Carry out function after the writes before it"""
+        return self.disk.call(function) if self.disk is not None else function()
+
+    def _write(self, buffers, offset, size):
+        if hasattr(os, 'pwritev'):
+            written = os.pwritev(self._fd, buffers, offset)
+        else:
+            written = os.pwrite(self._fd, b''.join(buffers), offset)
+        if written != size:
+            # short writes only happen when the disk is full. Write the rest the slow way
+            os.pwrite(self._fd, b''.join(buffers)[written:], offset + written)
+        self._end = max(self._end, offset + size)
+        self._unsynced += size
+        if isinstance(self.fsync, int) and self._unsynced >= self.fsync:
+            os.fsync(self._fd)
+            self._unsynced = 0
+        if self.journal is not None:
+            self.journal.add(offset, size)
+            self.journal.checkpoint(self._fd)
+
+    def close(self):
+        """
+        All blocks have been written. Make the file durable (as configured) and publish it under its final name
+        :raises OSError: it could not be written or published. It is given up on, as by abort()
+        :raises MalformedPacketException: the compressed stream (with a decoder) is cut short, or the file cannot be
+                                          built from the stream (StagedWriter). Given up on as well
+        """
+        if self.closed:
+            return
+        if self.decoder is not None and not self.decoder.complete:
+            self.abort()
+            raise MalformedPacketException('The compressed stream of {} ends in the middle of a frame'.format(
+                self.name))
+        self.closed = True
+        try:
+            self._flush()
+            self._call(self._finish)
+        except (OSError, MalformedPacketException):
+            self._abandon()
+            raise
+
+    def _finish(self):
+        os.ftruncate(self._fd, self._end)  # preallocated for more than was actually sent
+        if self.fsync is not None:
+            os.fsync(self._fd)
+        self._publish()
+        if self.journal is not None:
+            self.journal.remove()
+        logger.debug('Finished writing file {}. Closing!'.format(self.name))
+
+    def _publish(self):
+        """Make the complete file available under its final name"""
+        self._close_fd()
+        os.rename(self.part_name, self.name)
+        if self.fsync is not None:
+            self._sync_directory()
+
+    def _sync_directory(self):
+        """The rename is only durable once the directory entry is"""
+        try:
+            fd = os.open(os.path.dirname(os.path.abspath(self.name)), os.O_RDONLY)
+        except OSError:
+            return  # directories cannot be opened on every platform
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def abort(self):
+        """
+        Give up on an incomplete file. It stays behind under its temporary name. Never raises: the file is closed
+        even if what was held back cannot be written any more (e.g. the disk is full) -- that is only logged
+        """
+        if not self.closed:
+            self.closed = True
+            self._abandon()
+
+    def _abandon(self):
+        try:
+            self._flush()
+            self._call(self._give_up)
+        except OSError as err:
+            logger.error('Unable to write out {} before giving up on it: {}'.format(self.part_name, err))
+        finally:
+            self._close_fd()
+
+    def _give_up(self):
+        if self.journal is not None and self._fd is not None:
+            self.journal.checkpoint(self._fd, force=True)  # so that the next attempt can pick up from here
+
+    def _close_fd(self):
+        fd, self._fd = self._fd, None
+        if fd is not None:
+            os.close(fd)
+
     def __del__(self):
-        if self._f and not self._f.closed:
-            self._f.close()
\ No newline at end of file
+        if not self.closed and getattr(self, '_fd', None) is not None:
+            os.close(self._fd)
+
+
+class FileRange(FileWriter):
+    """
+    Part of a FileWriter's file, from offset on: blocks are numbered from the start of the range and coalesced apart
+    from those of other ranges -- which would otherwise break up every run. close() writes out whatever is held back;
+    the file is published by its FileWriter.
+    """
+
+    def __init__(self, writer, offset, chunk_size):
+        self.writer = writer
+        self.name, self.part_name = writer.name, writer.part_name
+        self.chunk_size = chunk_size
+        self.offset = offset
+        self.coalesce = writer.coalesce
+        self.decoder = None
+        self.disk = writer.disk
+        self.closed = False
+        self._run = []
+        self._run_offset = 0
+        self._run_size = 0
+        self._end = offset  # end of the range written so far
+        self._next_block = 1
+
+    @property
+    def length(self):
+        """Bytes from offset to the end of the furthest block written"""
+        return self._end - self.offset
+
+    def _write(self, buffers, offset, size):
+        self.writer._write(buffers, offset, size)
+        self._end = max(self._end, offset + size)
+
+    def close(self):
+        self.closed = True
+        self._flush()
+        if self.disk is not None:
+            self.disk.drain()  # so that length is that of what was written
+
+    def abort(self):
+        """Write out what is held back, if the disk lets us. Errors are logged -- the file is its FileWriter's"""
+        try:
+            FileRange.close(self)
+        except OSError as err:
+            logger.error('Unable to write out a range of {}: {}'.format(self.part_name, err))
+
+    def __del__(self):
+        pass
+
+
+class StagedWriter(FileWriter):
+    """
+    Receives a stream that stands for the file, rather than being it (a batch, a delta), into a .part file like any
+    other. It is published by building the file from the stream under a staging name, and renaming that into place
+    once whole. A stream that does not build fails close() -- the client is sent an ERR, not told that it arrived.
+    """
+    ACCESS = os.O_RDWR  # the stream is read back to build the file
+    STAGING_SUFFIX = '.new'
+
+    def _build(self, path):
+        """Build the file the stream stands for at path"""
+        raise NotImplementedError
+
+    def _discard(self, path):
+        """Remove what _build left at path"""
+        if os.path.exists(path):
+            os.remove(path)
+
+    def _publish(self):
+        staging = self.name + self.PART_SUFFIX + self.STAGING_SUFFIX
+        try:
+            self._build(staging)
+        except (MalformedPacketException, ValueError, struct.error) as err:
+            logger.error('Unable to build {} from what was sent: {}'.format(self.name, err))
+            self._close_fd()
+            self._discard(staging)
+            os.remove(self.part_name)  # no use trying again from a stream that does not build
+            if self.journal is not None:
+                self.journal.remove()
+            if isinstance(err, MalformedPacketException):
+                raise
+            raise MalformedPacketException('{} cannot be built from what was sent'.format(self.name)) from err
+        except OSError:
+            self._close_fd()
+            self._discard(staging)
+            raise
+        self._close_fd()
+        os.rename(staging, self.name)
+        os.remove(self.part_name)
+        if self.fsync is not None:
+            self._sync_directory()
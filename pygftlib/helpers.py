@@ -15,4 +15,57 @@ def pack_short_int(x): return x if isinstance(x, bytes) else x.to_bytes(2, byteo
 
 
 # unpack a short int
-def unpack_short_int(x): return int.from_bytes(x,  byteorder='big')
\ No newline at end of file
+def unpack_short_int(x): return int.from_bytes(x,  byteorder='big')
+
+
+# pack an unsigned int into width (2, 4 or 8) bytes -- used for wide block numbers
+def pack_int(x, width=2): return x if isinstance(x, bytes) else x.to_bytes(width, byteorder='big')
+
+
+# unpack an unsigned int of any width
+def unpack_int(x): return int.from_bytes(x, byteorder='big')
+
+
+# number of bytes needed to number (0 ..) blocks. One of 2, 4 or 8
+def seq_width_for(blocks): return 2 if blocks <= 0xFFFF else 4 if blocks <= 0xFFFFFFFF else 8
+
+
+# pack a dict of negotiated options as rfc2347 style "name\0value\0" pairs
+def pack_options(options):
+    return b''.join(str_to_bytes(k) + b'\x00' + str_to_bytes(v) + b'\x00' for k, v in options.items())
+
+
+# unpack "name\0value\0" pairs into a dict. Option names are case insensitive
+def unpack_options(x):
+    fields = x.split(b'\x00')
+    return {fields[i].decode('ascii').lower(): fields[i + 1].decode('ascii')
+            for i in range(0, len(fields) - 1, 2) if fields[i]}
+
+
+# pack a set of block numbers > base + 1 into a bitmap. Bit i (msb first) is set if block base + 2 + i is present
+def pack_bitmap(base, blocks):
+    offsets = [b - base - 2 for b in blocks if b > base + 1]
+    if not offsets:
+        return b''
+    bitmap = bytearray(max(offsets) // 8 + 1)
+    for offset in offsets:
+        bitmap[offset // 8] |= 0x80 >> (offset % 8)
+    return bytes(bitmap)
+
+
+# unpack a bitmap created by pack_bitmap into a list of block numbers
+def unpack_bitmap(base, x):
+    return [base + 2 + i * 8 + j for i, byte in enumerate(x) for j in range(8) if byte & (0x80 >> j)]
+
+
+# parse a human friendly size/rate like 512, 64K, 10M or 1.5G (powers of 1000) into a number of bytes
+def parse_size(x):
+    x = str(x).strip().upper()
+    multiplier = {'K': 10 ** 3, 'M': 10 ** 6, 'G': 10 ** 9}.get(x[-1:], 1)
+    return int(float(x[:-1] if multiplier > 1 else x) * multiplier)
+
+
+# parse a durability policy for FileWriter: none -> None, end -> 'end', a size (see parse_size) -> bytes between fsyncs
+def fsync_policy(x):
+    x = str(x).strip().lower()
+    return {'none': None, 'end': 'end'}[x] if x in ('none', 'end') else parse_size(x)
@@ -0,0 +1,165 @@
+"""
+A network in a box, for tests and benchmarks. ImpairmentProxy sits between Senders and a Receiver on the loopback and
+does to the datagrams what a real network would: loses, duplicates, reorders, delays and jitters them, and holds them
+to a bandwidth limit with a queue in front of it (tail drop once the queue is full).
+
+- Profile describes a link. PROFILES has a few to pick from by name.
+- Impairment decides the fate of the datagrams going one way -- when each of them arrives, if at all. It does no I/O
+  and is seeded: the n-th datagram meets the same fate for the same seed, so a loss pattern can be repeated. (Only the
+  pattern. Which packet turns out to be the n-th depends on the timing of the endpoints.)
+- ImpairmentProxy forwards datagrams both ways, an Impairment per direction, and delivers them off a heap of arrival
+  times. All clients share the link, as they would a bottleneck.
+
+    proxy = ImpairmentProxy(('127.0.0.1', 12345), PROFILES['wan'], seed=7)
+    Sender(path).upload(*proxy.address)
+"""
+import collections
+import heapq
+import itertools
+import random
+import time
+
+import gevent
+import gevent.event
+from gevent import socket
+
+from pygftlib import MAX_DATAGRAM_SIZE
+
+import logging
+logger = logging.getLogger(__name__)
+
+REORDER_DELAY = 0.01  # seconds a reordered datagram is held back, on top of the delay of the link
+
+# loss, duplicate, reorder: probabilities per datagram. delay, jitter: one way, seconds -- each datagram is delayed by
+# delay plus up to jitter. rate: bytes per second (None: unlimited). queue: seconds of traffic that may wait for the
+# rate limit before datagrams are dropped
+Profile = collections.namedtuple('Profile', 'loss duplicate reorder delay jitter rate queue')
+Profile.__new__.__defaults__ = (0.0, 0.0, 0.0, 0.0, 0.0, None, 0.1)
+
+PROFILES = {
+    'clean': Profile(),
+    'lossy': Profile(loss=0.02),
+    'reorder': Profile(reorder=0.05, duplicate=0.01, delay=0.002),
+    'wan': Profile(loss=0.005, delay=0.02, jitter=0.002, rate=12.5e6),  # 100 Mbit/s, 40 ms round trip
+    'congested': Profile(loss=0.01, delay=0.01, jitter=0.005, rate=2.5e6, queue=0.05),  # 20 Mbit/s, shallow queue
+}
+
+
+class Impairment(object):
+    """The fate of the datagrams going one way over a link with the given Profile"""
+
+    def __init__(self, profile, seed=0):
+        self.profile = profile
+        self.random = random.Random(seed)
+        self._free_at = 0.0  # when the rate limit lets the next datagram go
+        self.counters = dict.fromkeys(('datagrams', 'dropped', 'overflowed', 'duplicated', 'reordered'), 0)
+
+    def schedule(self, size, now):
+        """
+        :param size: of the datagram, bytes
+        :return: list of times the datagram arrives at. Empty if it is lost, two of them if it is duplicated
+        """
+        profile = self.profile
+        # always the same number of draws, so that the fate of a datagram does not depend on that of the ones before
+        lost, duplicated, reordered, jitter = (self.random.random() for _ in range(4))
+        self.counters['datagrams'] += 1
+        if lost < profile.loss:
+            self.counters['dropped'] += 1
+            return []
+        departure = now
+        if profile.rate:
+            departure = max(now, self._free_at)
+            if departure - now > profile.queue:
+                self.counters['overflowed'] += 1
+                return []
+            departure += size / profile.rate
+            self._free_at = departure
+        arrival = departure + profile.delay + jitter * profile.jitter
+        if reordered < profile.reorder:
+            self.counters['reordered'] += 1
+            arrival += REORDER_DELAY
+        if duplicated < profile.duplicate:
+            self.counters['duplicated'] += 1
+            return [arrival, arrival]
+        return [arrival]
+
+    def stats(self):
+        return dict(self.counters)
+
+
+class ImpairmentProxy(object):
+    """
+    Forwards datagrams between clients and a server, over an impaired link. Clients send to address; the server sees
+    each of them come from a socket of the proxy's own. Runs in greenlets till close().
+    :param profile: of the link towards the server. down_profile that of the way back (default: the same)
+    """
+
+    def __init__(self, server, profile, seed=0, down_profile=None, host='127.0.0.1'):
+        self.server = server
+        self.up = Impairment(profile, seed=2 * seed)
+        self.down = Impairment(profile if down_profile is None else down_profile, seed=2 * seed + 1)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)  # the clients talk to this one
+        self.sock.bind((host, 0))
+        self._upstream = {}  # client address -> socket connected to the server on its behalf
+        self._queue = []  # heap of (arrival time, order, socket, datagram, address or None)
+        self._order = itertools.count()
+        self._wakeup = gevent.event.Event()
+        self._workers = [gevent.spawn(self._forward_up), gevent.spawn(self._deliver)]
+
+    @property
+    def address(self):
+        return self.sock.getsockname()
+
+    def stats(self):
+        """What the link did to the datagrams. Per direction: up (to the server) and down"""
+        return {'up': self.up.stats(), 'down': self.down.stats()}
+
+    def _forward_up(self):
+        while True:
+            data, client = self.sock.recvfrom(MAX_DATAGRAM_SIZE)
+            upstream = self._upstream.get(client)
+            if upstream is None:
+                upstream = self._upstream[client] = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                upstream.connect(self.server)
+                self._workers.append(gevent.spawn(self._forward_down, upstream, client))
+            self._enqueue(self.up, upstream, data, None)
+
+    def _forward_down(self, upstream, client):
+        while True:
+            try:
+                data = upstream.recv(MAX_DATAGRAM_SIZE)
+            except ConnectionRefusedError:
+                continue  # ICMP port unreachable -- nobody listening on the server's port (yet)
+            self._enqueue(self.down, self.sock, data, client)
+
+    def _enqueue(self, impairment, sock, data, address):
+        for arrival in impairment.schedule(len(data), time.monotonic()):
+            if not self._queue or arrival < self._queue[0][0]:
+                self._wakeup.set()
+            heapq.heappush(self._queue, (arrival, next(self._order), sock, data, address))
+
+    def _deliver(self):
+        """Send every datagram once its arrival time has come"""
+        while True:
+            self._wakeup.clear()
+            if not self._queue:
+                self._wakeup.wait()
+                continue
+            wait = self._queue[0][0] - time.monotonic()
+            if wait > 0:
+                self._wakeup.wait(wait)
+                continue
+            _, _, sock, data, address = heapq.heappop(self._queue)
+            try:
+                if address is None:
+                    sock.send(data)
+                else:
+                    sock.sendto(data, address)
+            except OSError as e:
+                logger.debug('Could not forward a datagram: %s', e)
+
+    def close(self):
+        gevent.killall(self._workers)
+        self.sock.close()
+        for upstream in self._upstream.values():
+            upstream.close()
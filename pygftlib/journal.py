@@ -0,0 +1,130 @@
+"""
+Resumable transfers. The Receiver keeps a journal per transfer: what is being received (transfer id, file name and
+size), where it goes (.part name and final name) and which byte ranges have been written.
+
+- The journal is a small JSON file next to the received files, replaced atomically (write, fsync, rename). It is
+  only ever rewritten after the .part file has been fsynced, so whatever it lists is on disk -- even after a crash.
+  Checkpoints are taken at most every JOURNAL_INTERVAL seconds while blocks are written, and when the session ends.
+- A Sender asking to resume sends a transfer id derived from the identity of the file (transfer_id()) along with
+  option resume. If there is a journal for that id (and it describes the same file), the Receiver reopens the .part
+  file and answers with resume=<offset>: everything before it has been received. The Sender starts from there,
+  numbering blocks from 1 at that offset. Otherwise resume=0 -- a new transfer.
+- The journal is removed once the file is complete.
+"""
+import bisect
+import hashlib
+import json
+import os
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+JOURNAL_INTERVAL = 1  # seconds between checkpoints of a transfer in progress
+SUFFIX = '.journal'
+
+
+def transfer_id(*identity):
+    """A (63 bit) transfer id for whatever identifies a file -- e.g. its path, size and modification time"""
+    digest = hashlib.blake2b('\x00'.join(str(part) for part in identity).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') >> 1
+
+
+def path_for(transfer_id, directory='.'):
+    return os.path.join(directory, '.pygftlib-{:016x}{}'.format(transfer_id, SUFFIX))
+
+
+class Journal(object):
+    """
+    Progress of one transfer. ranges is a sorted list of disjoint [start, end) byte ranges that have been written.
+    name/part_name are set by the FileWriter once it has opened the file.
+    """
+
+    def __init__(self, transfer_id, file_name, size, directory='.'):
+        self.transfer_id = transfer_id
+        self.file_name = file_name  # as sent by the Sender
+        self.size = size
+        self.path = path_for(transfer_id, directory)
+        self.name = self.part_name = None
+        self.ranges = []
+        self._starts = []  # start of every range. For bisect
+        self._saved_at = None  # when the last checkpoint was taken
+
+    @classmethod
+    def load(cls, transfer_id, file_name, size, directory='.'):
+        """
+        :return: the journal of an earlier attempt at the same transfer. None if there is none or it is of no use
+        """
+        path = path_for(transfer_id, directory)
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            logger.warning('Ignoring unreadable journal {}'.format(path), exc_info=True)
+            return None
+        if (state.get('file_name'), state.get('size')) != (file_name, size) or \
+                not os.path.exists(state.get('part_name') or ''):
+            logger.info('Journal {} is for a different file, or the file is gone. Starting over'.format(path))
+            return None
+        journal = cls(transfer_id, file_name, size, directory)
+        journal.name, journal.part_name = state['name'], state['part_name']
+        for start, end in state['ranges']:
+            journal.add(start, end - start)
+        return journal
+
+    @property
+    def contiguous(self):
+        """Bytes received from the start of the file on, without a gap"""
+        return self.ranges[0][1] if self.ranges and self.ranges[0][0] == 0 else 0
+
+    @property
+    def end(self):
+        """End of the furthest range received"""
+        return self.ranges[-1][1] if self.ranges else 0
+
+    def add(self, offset, size):
+        """size bytes have been written at offset. Merged with the ranges around them"""
+        if size <= 0:
+            return
+        start, end = offset, offset + size
+        i = bisect.bisect_right(self._starts, start)
+        if i and self.ranges[i - 1][1] >= start:
+            i -= 1  # touches (or overlaps) the range before it
+            start = min(start, self.ranges[i][0])
+        j = i
+        while j < len(self.ranges) and self.ranges[j][0] <= end:
+            end = max(end, self.ranges[j][1])
+            j += 1
+        self.ranges[i:j] = [[start, end]]
+        self._starts[i:j] = [start]
+
+    def checkpoint(self, fd, force=False):
+        """
+        Record the ranges written so far -- once they are on disk. Every JOURNAL_INTERVAL seconds (or now with force)
+        :param fd: of the .part file
+        """
+        now = time.monotonic()
+        if not force and self._saved_at is not None and now - self._saved_at < JOURNAL_INTERVAL:
+            return
+        self._saved_at = now
+        os.fsync(fd)
+        self.save()
+
+    def save(self):
+        state = {'transfer_id': self.transfer_id, 'file_name': self.file_name, 'size': self.size, 'name': self.name,
+                 'part_name': self.part_name, 'ranges': self.ranges}
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+
+    def remove(self):
+        """The transfer is complete. Nothing to resume"""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,176 @@
+"""
+Metrics of Senders and Receivers. Counters are plain attributes and histograms fixed arrays of buckets -- an addition
+or two per packet, nothing is formatted or logged on the packet path.
+
+- Metrics.stats() flattens them into a dict of plain numbers (a histogram is a list of bucket counts, plus its sum and
+  count), which can be added up across Receivers (see workers.ReceiverPool).
+- prometheus(stats) renders such a dict in the Prometheus text exposition format. serve() answers scrapes with it.
+- Summary keeps track of the counters at the previous report and makes a log line of what changed since: every
+  SUMMARY_INTERVAL seconds, instead of a log line per packet.
+"""
+import bisect
+
+import logging
+logger = logging.getLogger(__name__)
+
+SUMMARY_INTERVAL = 10  # seconds between summary log lines
+# upper bounds (seconds) of the buckets of the RTT and block latency histograms. The last bucket has no bound
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+COUNTERS = (
+    ('packets_sent', 'Datagrams sent'),
+    ('bytes_sent', 'Bytes sent'),
+    ('packets_received', 'Datagrams received'),
+    ('bytes_received', 'Bytes received'),
+    ('retransmits', 'DATA packets sent again'),
+    ('duplicates', 'DATA blocks received twice (Receiver), acknowledgements that acknowledged nothing (Sender)'),
+    ('out_of_order', 'DATA blocks received ahead of a missing one'),
+    ('malformed', 'Packets that were invalid or unexpected, and dropped'),
+    ('completed', 'Transfers completed'),
+    ('naks', 'NAKs sent (multicast Receiver) or received (multicast Sender)'),
+    ('rejected', 'Sessions turned down with an ERR (Receiver)'),
+    ('dropped', 'DATA packets dropped by the scheduler, their session was over its share (Receiver)'),
+)
+GAUGES = (
+    ('sessions', 'Sessions in progress'),
+)
+HISTOGRAMS = (
+    ('rtt_seconds', 'Round trip times measured by the Sender'),
+    ('block_latency_seconds', 'Time from the first send of a DATA block to its acknowledgement'),
+)
+
+
+class Histogram(object):
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+
+class Metrics(object):
+    """The counters and histograms of a Sender or a Receiver"""
+    __slots__ = tuple(name for name, _ in COUNTERS) + tuple(name for name, _ in HISTOGRAMS)
+
+    def __init__(self):
+        for name, _ in COUNTERS:
+            setattr(self, name, 0)
+        for name, _ in HISTOGRAMS:
+            setattr(self, name, Histogram())
+
+    def sent(self, size):
+        self.packets_sent += 1
+        self.bytes_sent += size
+
+    def received(self, size):
+        self.packets_received += 1
+        self.bytes_received += size
+
+    def stats(self):
+        stats = {name: getattr(self, name) for name, _ in COUNTERS}
+        for name, _ in HISTOGRAMS:
+            histogram = getattr(self, name)
+            stats[name] = list(histogram.counts)
+            stats[name + '_sum'] = histogram.sum
+            stats[name + '_count'] = histogram.count
+        return stats
+
+
+def merge(stats, more):
+    """Add the stats in more to those in stats. Histograms bucket by bucket"""
+    for name, value in more.items():
+        if isinstance(value, list):
+            previous = stats.get(name) or [0] * len(value)
+            stats[name] = [a + b for a, b in zip(previous, value)]
+        else:
+            stats[name] = stats.get(name, 0) + value
+    return stats
+
+
+def prometheus(stats, prefix='pygftlib_'):
+    """:return: stats (see Metrics.stats) in the Prometheus text exposition format"""
+    lines = []
+    for kind, metrics in (('counter', COUNTERS), ('gauge', GAUGES)):
+        for name, help_text in metrics:
+            if name in stats:
+                suffix = '_total' if kind == 'counter' else ''
+                lines += ['# HELP {}{}{} {}'.format(prefix, name, suffix, help_text),
+                          '# TYPE {}{}{} {}'.format(prefix, name, suffix, kind),
+                          '{}{}{} {}'.format(prefix, name, suffix, stats[name])]
+    for name, help_text in HISTOGRAMS:
+        if name not in stats:
+            continue
+        lines += ['# HELP {}{} {}'.format(prefix, name, help_text), '# TYPE {}{} histogram'.format(prefix, name)]
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), stats[name]):
+            cumulative += count
+            lines.append('{}{}_bucket{{le="{}"}} {}'.format(prefix, name, bound, cumulative))
+        lines += ['{}{}_sum {}'.format(prefix, name, stats[name + '_sum']),
+                  '{}{}_count {}'.format(prefix, name, stats[name + '_count'])]
+    for name, value in sorted(stats.items()):
+        # whatever else the owner adds (e.g. workers of a ReceiverPool)
+        if not any(name.startswith(known) for known, _ in COUNTERS + GAUGES + HISTOGRAMS):
+            lines += ['# TYPE {}{} gauge'.format(prefix, name), '{}{} {}'.format(prefix, name, value)]
+    return '\n'.join(lines) + '\n'
+
+
+def serve(address, stats):
+    """
+    Answer Prometheus scrapes (any path) on address with stats() rendered by prometheus(). gevent's WSGI server.
+    :return: the server, started. stop() it when done
+    """
+    from gevent.pywsgi import WSGIServer
+
+    def application(environ, start_response):
+        body = prometheus(stats()).encode()
+        start_response('200 OK', [('Content-Type', 'text/plain; version=0.0.4'), ('Content-Length', str(len(body)))])
+        return [body]
+
+    server = WSGIServer(address, application, log=None)
+    server.start()
+    logger.info('Serving metrics on http://{}:{}/metrics'.format(*server.address[:2]))
+    return server
+
+
+class Summary(object):
+    """
+    What changed since the last report -- a single log line. For the owner's background loop:
+        if summary.due(now): logger.info(summary.line(stats(), now))
+    """
+
+    def __init__(self, now, interval=SUMMARY_INTERVAL):
+        self.interval = interval
+        self._reported_at = now
+        self._previous = {}
+
+    def due(self, now):
+        return now - self._reported_at >= self.interval
+
+    def line(self, stats, now):
+        elapsed = max(now - self._reported_at, 1e-9)
+
+        def delta(name):
+            return stats.get(name, 0) - self._previous.get(name, 0)
+        line = 'Last {:.0f}s: sent {} packets ({:.2f} MB/s), received {} packets ({:.2f} MB/s), {} retransmits, ' \
+               '{} duplicates, {} out of order, {} malformed'.format(
+                   elapsed, delta('packets_sent'), delta('bytes_sent') / elapsed / 1e6, delta('packets_received'),
+                   delta('bytes_received') / elapsed / 1e6, delta('retransmits'), delta('duplicates'),
+                   delta('out_of_order'), delta('malformed'))
+        if 'sessions' in stats:
+            line += ', {} sessions, {} completed'.format(stats['sessions'], delta('completed'))
+        count = delta('rtt_seconds_count')
+        if count:
+            line += ', mean RTT {:.2f} ms'.format(1000 * (stats['rtt_seconds_sum'] - self._previous.get(
+                'rtt_seconds_sum', 0)) / count)
+        self._previous = {name: value for name, value in stats.items() if not isinstance(value, list)}
+        self._reported_at = now
+        return line
@@ -0,0 +1,208 @@
+"""
+Reliable multicast: one Sender, any number of Receivers that have joined a multicast group. Every DATA block goes out
+once, to the group, however many hosts receive it. Receivers ask for what they miss with NAKs; repairs go to the
+group as well. Nothing is acknowledged per block, so the Sender's traffic does not grow with the number of hosts.
+
+- The Sender announces the transfer to the group every ANNOUNCE_INTERVAL seconds: an INITRQ with the options mcast
+  (a random session id), blksize, seqwidth, tsize and sent (the highest block sent so far). Receivers that hear it
+  open the file; nobody answers. DATA heard before the announce is ignored -- the blocks are asked for later.
+- DATA is sent at a fixed rate (there is no feedback to adapt it to). Blocks are numbered from 1, the last one is
+  short, as in a unicast transfer.
+- A Receiver that sees a gap -- a block past a missing one, or an announce past its last block -- waits a random
+  while of up to NAK_BACKOFF before it NAKs the missing blocks, to the group. Every Receiver hears that NAK, and
+  holds back its own for the blocks listed in it for NAK_HOLD (suppression): one NAK per loss, not one per host.
+  Blocks still missing once NAK_HOLD is over are NAKed again.
+
+      NAK | session id (4 bytes) | Block # | Block # | ...    (up to MAX_NAK_BLOCKS of them, each seqwidth wide)
+
+- The Sender collects the blocks NAKed over REPAIR_DELAY and sends each of them once (aggregation). A block is not
+  sent again for REPAIR_HOLDOFF after a repair -- NAKs for it sent before the repair arrived would have it sent twice.
+- A Receiver that has every block publishes the file and tells the Sender with an ACK of the last block, sent to the
+  Sender's address (again for every announce it hears after that, in case it got lost). The Sender is done once as
+  many Receivers as it was told to expect have done so or -- not expecting any number -- once it has not heard a
+  NAK for linger seconds after sending the last block.
+
+The sending side is protocol.MulticastSender, the receiving side Receiver(group=...).
+"""
+import collections
+import random
+import socket
+
+from pygftlib import MULTICAST_TTL
+
+import logging
+logger = logging.getLogger(__name__)
+
+ANNOUNCE_INTERVAL = 0.5  # seconds between announces of the transfer
+NAK_BACKOFF = 0.02  # longest a Receiver waits (at random) before it NAKs blocks it found missing
+NAK_HOLD = 0.25  # how long a Receiver waits for the repair of a NAKed block, before NAKing it again
+REPAIR_DELAY = 0.005  # how long the Sender collects NAKs before sending the repairs
+REPAIR_HOLDOFF = 0.05  # NAKs for a block repaired this recently (seconds) are ignored
+LINGER = 2  # seconds without a NAK after the last block, for a Sender to call the transfer done
+TICK = 0.005  # how often (seconds) a Receiver looks for NAKs that are due
+SEQ_WIDTHS = (2, 4, 8)
+
+# a transfer, as announced by the Sender. sent -- the highest block sent so far
+Announce = collections.namedtuple('Announce', 'session block_size seq_width size sent')
+
+
+def parse_group(x):
+    """'239.1.2.3:5000' -> ('239.1.2.3', 5000). For argparse"""
+    address, _, port = str(x).rpartition(':')
+    try:
+        multicast = (socket.inet_aton(address)[0] & 0xF0) == 0xE0  # 224.0.0.0/4
+    except OSError:
+        multicast = False
+    if not multicast or not port.isdigit():
+        raise ValueError('Not a multicast group address:port -- {}'.format(x))
+    return address, int(port)
+
+
+def group_socket(sock, group, interface='0.0.0.0'):
+    """
+    Bind sock (UDP) to group and join the group on the interface with that address (0.0.0.0 -- the one the kernel
+    routes the group to). Any number of sockets of a host can do so. Multicasts from it are sent out of that interface
+    and looped back to the host's own members, so Receivers on the loopback see each other's NAKs.
+    :param group: (group address, port)
+    """
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(group)
+    membership = socket.inet_aton(group[0]) + socket.inet_aton(interface)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+    sender_socket(sock, interface)
+    return sock
+
+
+def sender_socket(sock, interface='0.0.0.0', ttl=MULTICAST_TTL):
+    """Set up sock to send to multicast groups from the interface with that address"""
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interface))
+    return sock
+
+
+def announce_options(announce):
+    """INITRQ options of an announce"""
+    return {'mcast': announce.session, 'blksize': announce.block_size, 'seqwidth': announce.seq_width,
+            'tsize': announce.size, 'sent': announce.sent}
+
+
+def parse_announce(options, limits):
+    """
+    :param options: of an INITRQ sent to the group
+    :param limits: the Receiver's limits (blksize). There is nothing to negotiate -- take the transfer or leave it
+    :return: Announce
+    :raises: ValueError if options are not those of an announce, or blocks are larger than limits allow
+    """
+    try:
+        announce = Announce(*(int(options[name]) for name in ('mcast', 'blksize', 'seqwidth', 'tsize', 'sent')))
+    except KeyError as err:
+        raise ValueError('Not an announce, option {} is missing'.format(err))
+    if announce.seq_width not in SEQ_WIDTHS or not 0 < announce.block_size <= limits.get('blksize', 2 ** 16):
+        raise ValueError('Cannot receive blocks of {} bytes, {} byte block numbers'.format(announce.block_size,
+                                                                                         announce.seq_width))
+    return announce
+
+
+def final_block(size, block_size):
+    """Number of the last (short) block of a file of size bytes"""
+    return size // block_size + 1
+
+
+class NakScheduler(object):
+    """
+    Receiver side. Decides when to NAK which missing blocks -- see the module docstring.
+    - gap(blocks, now) -- blocks found missing
+    - heard(blocks, now) -- a NAK (ours or another Receiver's) listed blocks
+    - advance(sent, received, now) -- the Sender has sent every block up to sent. Those not received are missing
+    - received(block_no) -- no longer missing
+    - due(now) -- the blocks to NAK now
+    """
+
+    def __init__(self, backoff=NAK_BACKOFF, hold=NAK_HOLD, rng=random):
+        self.backoff = backoff
+        self.hold = hold
+        self.rng = rng
+        self._timers = {}  # missing block -> when to NAK it
+        self.highest = 0  # highest block the Sender is known to have sent
+        self.suppressed = 0  # blocks we did not NAK because another Receiver did
+
+    def gap(self, blocks, now):
+        for block_no in blocks:
+            if block_no not in self._timers:
+                self._timers[block_no] = now + self.rng.uniform(0, self.backoff)
+
+    def advance(self, sent, received, now):
+        """:param received: callable(block_no), True if the block has arrived"""
+        if sent > self.highest:
+            self.gap([block_no for block_no in range(self.highest + 1, sent + 1) if not received(block_no)], now)
+            self.highest = sent
+
+    def heard(self, blocks, now):
+        for block_no in blocks:
+            due = self._timers.get(block_no)
+            if due is not None and due < now + self.hold:
+                if due > now:
+                    self.suppressed += 1
+                self._timers[block_no] = now + self.hold + self.rng.uniform(0, self.backoff)
+
+    def received(self, block_no):
+        self._timers.pop(block_no, None)
+
+    def due(self, now, limit=None):
+        """:return: up to limit blocks to NAK now, lowest first. From now on they wait for their repair"""
+        blocks = sorted(block_no for block_no, due in self._timers.items() if due <= now)[:limit]
+        for block_no in blocks:
+            self._timers[block_no] = now + self.hold
+        return blocks
+
+    def __len__(self):
+        return len(self._timers)
+
+
+class RepairQueue(object):
+    """
+    Sender side. Collects the blocks NAKed over delay seconds, each once, and hands them out for repair together
+    (aggregation). NAKs for blocks repaired less than holdoff seconds ago are ignored
+    """
+
+    def __init__(self, delay=REPAIR_DELAY, holdoff=REPAIR_HOLDOFF):
+        self.delay = delay
+        self.holdoff = holdoff
+        self._pending = set()
+        self._since = None  # when the first of the pending blocks was NAKed
+        self._repaired = {}  # block -> when it was last repaired
+
+    def nak(self, blocks, now):
+        """:return: number of blocks that were not already pending or repaired just now"""
+        count = 0
+        for block_no in blocks:
+            repaired = self._repaired.get(block_no)
+            if block_no in self._pending or (repaired is not None and now - repaired < self.holdoff):
+                continue
+            self._pending.add(block_no)
+            count += 1
+        if self._pending and self._since is None:
+            self._since = now
+        return count
+
+    @property
+    def deadline(self):
+        """When the pending repairs are due. None if there are none"""
+        return None if self._since is None else self._since + self.delay
+
+    def due(self, now):
+        """:return: blocks to repair now, lowest first. Empty till delay has passed since the first NAK for them"""
+        if self._since is None or now < self._since + self.delay:
+            return []
+        blocks = sorted(self._pending)
+        self._pending.clear()
+        self._since = None
+        for block_no in blocks:
+            self._repaired[block_no] = now
+        if len(self._repaired) > 4 * len(blocks) + 1024:
+            self._repaired = {block_no: at for block_no, at in self._repaired.items() if now - at < self.holdoff}
+        return blocks
+
+    def __len__(self):
+        return len(self._pending)
@@ -0,0 +1,102 @@
+"""
+Transfer options negotiated in the INITRQ/OACK exchange. Loosely based on rfc2347 (TFTP option extension).
+
+- The Sender appends the options it would like to use to the INITRQ packet.
+- The Receiver replies with an OACK packet listing the options (and values) it accepts. Unknown options are dropped.
+- A Receiver that knows nothing about options replies with a plain ACK 0. Both peers then fall back to the
+  original lockstep protocol.
+"""
+from pygftlib import *
+from pygftlib import compression
+from pygftlib import fec
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def _clamp(low, high):
+    """Accept an integer option, clamping the requested value to [low, high]"""
+    return lambda value, limit=None: max(low, min(int(value), high if limit is None else min(limit, high)))
+
+
+def _choice(*choices):
+    """Accept an option only if the requested value is one of choices"""
+    def negotiator(value, limit=None):
+        if int(value) not in choices or (limit is not None and int(value) > limit):
+            raise ValueError(value)
+        return int(value)
+    return negotiator
+
+
+def _within(low, high):
+    """Accept an integer option only if the requested value is in [low, high]. Nothing to haggle over"""
+    def negotiator(value, limit=None):
+        if not low <= int(value) <= (high if limit is None else min(limit, high)):
+            raise ValueError(value)
+        return int(value)
+    return negotiator
+
+
+def _known(table):
+    """Accept an option only if the requested value is a key of table. Looked up as negotiated: later additions count"""
+    def negotiator(value, limit=None):
+        if int(value) not in table:
+            raise ValueError(value)
+        return int(value)
+    return negotiator
+
+
+# option name -> callable(requested_value, receiver_limit) returning the accepted value
+NEGOTIATORS = {
+    'windowsize': _clamp(1, MAX_WINDOW_SIZE),
+    'blksize': _clamp(MIN_BLOCK_SIZE, MAX_BLOCK_SIZE),
+    'seqwidth': _choice(2, 4, 8),
+    'tsize': _clamp(0, 2 ** 64 - 1),  # size of the file (rfc2349). Informational, the Receiver echoes it back
+    # striped transfers (see pygftlib.striping): one session per stripe, all writing to the same file
+    'xfer': _within(0, 2 ** 64 - 1),  # id of the transfer the stripe belongs to
+    'stripes': _within(1, MAX_STRIPES),  # number of stripes of the transfer
+    'stripe': _within(0, MAX_STRIPES - 1),  # this one
+    'offset': _within(0, 2 ** 64 - 1),  # byte offset of the stripe in the file. Its blocks are numbered from there
+    'resume': _clamp(0, 2 ** 64 - 1),  # resume transfer xfer. The Receiver answers with the offset to carry on from
+    'delta': _choice(1),  # send a delta against the Receiver's copy of the file. See pygftlib.delta
+    'batch': _choice(1),  # the file is the stream of a batch of files (see pygftlib.batch). To be unpacked
+    'compress': _known(compression.CODECS),  # DATA is a compressed stream (see pygftlib.compression). Method number
+    'fec': _clamp(fec.MIN_GROUP, fec.MAX_GROUP),  # PARITY after every group of up to this many blocks. See pygftlib.fec
+}
+
+# what each option is worth when it is not negotiated
+DEFAULTS = {
+    'windowsize': 1,
+    'blksize': DATA_SIZE,
+    'seqwidth': 2,
+}
+
+
+def negotiate(requested, limits=None):
+    """
+    Receiver side of the negotiation.
+    :param requested: options (dict) received in the INITRQ packet
+    :param limits: per option upper bounds configured on the Receiver
+    :return: dict of accepted options -- to be sent back in the OACK. Empty if nothing was accepted.
+    """
+    limits = limits or {}
+    accepted = {}
+    for name, value in requested.items():
+        if name not in NEGOTIATORS:
+            logger.debug('Ignoring unknown option {}={}'.format(name, value))
+            continue
+        try:
+            accepted[name] = NEGOTIATORS[name](value, limits.get(name))
+        except ValueError:
+            logger.info('Ignoring option {} with invalid value {}'.format(name, value))
+    return accepted
+
+
+def effective(options):
+    """
+    Fill in defaults for everything not negotiated. Values in the returned dict are ints.
+    :param options: options accepted by the Receiver (possibly as strings, straight out of an OACK)
+    """
+    result = dict(DEFAULTS)
+    result.update((name, int(value)) for name, value in options.items() if name in DEFAULTS)
+    return result
@@ -2,8 +2,10 @@
 Define packet_metrics -- such as since when have not sent/received a packet.
 """
 from pygftlib import *   # TODO: only import what is required
-from pygftlib.packets import INITRQPacket, ERRPacket, DATAPacket, ACKPacket
+from pygftlib.packets import INITRQPacket, ERRPacket, DATAPacket, ACKPacket, OACKPacket, SACKPacket
 from pygftlib.exceptions import MalformedPacketException
+from pygftlib.helpers import str_to_bytes
+from pygftlib import codec
 
 import logging
 import sys
@@ -15,59 +17,52 @@ OP_CODES = {
     'DATA': b'\x00\x02',
     'ACK': b'\x00\x03',
     'ERR': b'\x00\x04',
+    'OACK': b'\x00\x05',
+    'SACK': b'\x00\x06',
     b'\x00\x01': 'INITRQ',
     b'\x00\x02': 'DATA',
     b'\x00\x03': 'ACK',
-    b'\x00\x04': 'ERR'
+    b'\x00\x04': 'ERR',
+    b'\x00\x05': 'OACK',
+    b'\x00\x06': 'SACK'
 }
 
 PACKET_TYPES = {
     'INITRQ': INITRQPacket,
     'DATA': DATAPacket,
     'ACK': ACKPacket,
-    'ERR': ERRPacket
+    'ERR': ERRPacket,
+    'OACK': OACKPacket,
+    'SACK': SACKPacket
 }
 
 
 class PacketFactory(object):
+    """
+    Encode/decode packets by name. A thin wrapper around codec -- which is what the protocol itself uses per packet
+    """
     def __init__(self):
         pass
 
     @classmethod
-    def from_bytes(cls, data):
+    def from_bytes(cls, data, seq_width=2):
         """
         Take in raw byte. Identify packet_type using op_code.
+        :param seq_width: negotiated width (in bytes) of the block numbers in DATA/ACK/SACK packets
         :return decoded content
         - file_name in case of INITRQ
         - block_no, data - (content) in case of DATA
         - block_no in case of ACK
         - error_code, error_msg in case of ERR
+        - options (dict) in case of OACK
+        - block_no, selective (list of block numbers received out of order) in case of SACK
         """
-        op_code = data[:2]
-        logger.debug('Received data for decoding. Raw contents: {}. Op_code : {}'.format(data, op_code))
-        if op_code not in OP_CODES:
-            logger.debug('Invalid OP_CODE')
-            raise MalformedPacketException('Unidentified Packet Type - {}'.format(op_code))
-        else:
-            packet_instance = PACKET_TYPES[OP_CODES[op_code]]()
-            if op_code == OP_CODES['INITRQ']:
-                logger.debug('Packet type is INITRQ')
-                file_name = packet_instance.parse_packet(data=data).file_name
-                return file_name
-            elif op_code == OP_CODES['DATA']:
-                logger.debug('Packet type is DATA')
-                block_no, content = int(packet_instance.parse_packet(data=data).block_number), packet_instance.\
-                    parse_packet(data=data).data
-                return block_no, content
-            elif op_code == OP_CODES['ACK']:
-                logger.debug('Packet type is ACK')
-                block_no = int(packet_instance.parse_packet(data=data).block_number)
-                return block_no
-            elif op_code == OP_CODES['ERR']:
-                logger.debug ('Packet type is ERR')
-                err_code, err_msg = packet_instance.parse_packet(data=data).err_code, packet_instance.parse_packet(
-                    data=data).err_msg
-                return err_code, err_msg
+        op_code, content = codec.decode(data, seq_width)
+        if not op_code:
+            raise MalformedPacketException('Unidentified Packet Type - {}'.format(bytes(data[:2])))
+        if op_code == codec.INITRQ:
+            return content[0]  # just the file_name. See options()
+        return content
 
     @classmethod
     def to_bytes(cls, type=None, **kwargs):
@@ -78,13 +73,34 @@ class PacketFactory(object):
         """
         if type is None:
             raise ValueError('Protocol Type cannot be none')
+        op_code = _op_code(type)
+        seq_width = kwargs.get('seq_width', 2)
+        if op_code == codec.DATA:
+            return codec.encode_data(kwargs['block_no'], str_to_bytes(kwargs['data']), seq_width)
+        elif op_code == codec.ACK:
+            return codec.encode_ack(kwargs['block_no'], seq_width)
+        elif op_code == codec.SACK:
+            return codec.encode_sack(kwargs['block_no'], kwargs.get('selective') or (), seq_width)
+        elif op_code == codec.INITRQ:
+            return codec.encode_initrq(kwargs['file_name'], kwargs.get('options'))
+        elif op_code == codec.OACK:
+            return codec.encode_oack(kwargs['options'])
         else:
-            if type.upper() in ('ACK', 'INITRQ', 'DATA'):
-                return PACKET_TYPES[type.upper()]().build_packet(**kwargs)
-            else:
-                # must be error. Error hasn't been fully implemented yet :-(
-                raise NotImplementedError('Error packet type is being encoded. '
-                                          'Err packet is currently not supported :-(')
+            # must be error. Without a message, the standard one of its code
+            err_code = kwargs.get('err_code', codec.ERR_UNDEFINED)
+            return codec.encode_err(err_code, kwargs.get('err_msg') or ERRPacket().errors.get(err_code, b''))
+
+    @classmethod
+    def options(cls, data):
+        """
+        Returns the options (dict) carried by an INITRQ or OACK packet. Empty if there are none.
+        """
+        op_code = codec.op_code(data)
+        if op_code == codec.INITRQ:
+            return codec.decode_initrq(data)[1]
+        elif op_code == codec.OACK:
+            return codec.decode_oack(data)
+        return {}
 
     @classmethod
     def check_type(cls, packet_type=None, data=None):
@@ -97,31 +113,30 @@ class PacketFactory(object):
         elif packet_type is None:
             raise ValueError('Not packet_type supplied.')
         else:
-            return packet_type.upper() == OP_CODES[data[:2]]
+            return codec.op_code(data) == _op_code(packet_type)
 
     @classmethod
-    def is_valid(cls, packet_type=None, data=None):
+    def is_valid(cls, packet_type=None, data=None, blksize=DATA_SIZE, seq_width=2):
         """
         Checks whether a given packet is valid_packet of the said packet_type.
         :param packet_type:
         :param data:
+        :param blksize: negotiated size of the DATA payload
+        :param seq_width: negotiated width of the block numbers
         """
-        op_code = data[:2]
-        if op_code not in OP_CODES:
-            raise MalformedPacketException('Unidentified Packet Type - {}'.format(op_code))
+        if codec.op_code(data) not in codec.NAMES:
+            raise MalformedPacketException('Unidentified Packet Type - {}'.format(bytes(data[:2])))
         elif packet_type is None:
             raise ValueError('Packet Type cannot be None')
-        else:
-            if packet_type.upper() == 'INITRQ':
-                return (len(data) >= MIN_PACKET_SIZE) and (len(data) <= MAX_PACKET_SIZE)
-            elif packet_type.upper() == 'DATA':
-                return (len(data) >= 2) and (len(data) <= MAX_PACKET_SIZE)
-            elif packet_type.upper() == 'ACK':
-                return len(data) == 4
-            else:
-                # must be error. Error hasn't been fully implemented yet :-(
-                raise NotImplementedError('Error packet type is being encoded. '
-                                          'Err packet is currently not supported :-(')
+        return codec.is_valid(_op_code(packet_type), data, blksize, seq_width)
+
+
+def _op_code(packet_type):
+    """op_code for a packet type name such as 'ack' or 'DATA'"""
+    op_code = codec.OP_CODES.get(packet_type)
+    if op_code is None:
+        op_code = codec.OP_CODES.get(packet_type.upper(), 0)
+    return op_code
 
 
 # for debugging:
@@ -2,6 +2,7 @@ import struct
 import sys
 
 from pygftlib.helpers import *
+from pygftlib.codec import HEADERS
 import logging
 logger = logging.getLogger(__name__)
 
@@ -33,29 +34,35 @@ class INITRQPacket(BasePacket):
     """
     Implementing the INITRQ packet. Note that this would be sent over the network by the client and parsed by the server
     ::
-               2 bytes    string    1 byte
-              ----------------------------
-    INITRQ   | 01    |  Filename  |   0  |
-              ----------------------------
+               2 bytes    string    1 byte   string   1 byte   string   1 byte
+              -------------------------------------------------------------
+    INITRQ   | 01    |  Filename  |   0  |  Opt1  |   0  |  Value1 |   0  | ...
+              -------------------------------------------------------------
+
+    Options are optional (rfc2347). A Receiver that understands them replies with an OACK, otherwise with ACK 0.
     """
 
     def __init__(self):
         super(INITRQPacket, self).__init__()
         self.op_code = 1
         self.file_name = None  # packet to contain the file_name
+        self.options = {}
 
     def __str__(self):
-        return 'INITRQ packet: filename = %s' % self.filename
+        return 'INITRQ packet: filename = %s | options = %s' % (self.file_name, self.options)
 
     def build_packet(self, **kwargs):
         # TODO: consider replacing join with bytearray
         self.file_name = kwargs['file_name']
-        return pack_short_int(self.op_code) + str_to_bytes(self.file_name) + b'\x00'
+        self.options = kwargs.get('options') or {}
+        return pack_short_int(self.op_code) + str_to_bytes(self.file_name) + b'\x00' + pack_options(self.options)
 
     def parse_packet(self, data):
         try:
-            self.file_name = data[2:-1].decode('ascii')
-        except ValueError:
+            file_name, _, options = data[2:].partition(b'\x00')
+            self.file_name = file_name.decode('ascii')
+            self.options = unpack_options(options)
+        except (ValueError, IndexError):
             logger.exception('Could not parse request: {}'.format(data))
         return self
 
@@ -66,11 +73,13 @@ class DATAPacket(BasePacket):
                 ---------------------------------
         DATA  | 02    |   Block #  |    Data    |
                 ---------------------------------
+    Block # is 4 or 8 bytes wide if a wider seqwidth has been negotiated.
     """
 
-    def __init__(self):
+    def __init__(self, seq_width=2):
         super(DATAPacket, self).__init__()
         self.op_code = 2
+        self.seq_width = seq_width  # size of the Block # field
         self.block_number = 0
         self.data = None
 
@@ -83,14 +92,22 @@ class DATAPacket(BasePacket):
     def build_packet(self, **kwargs):
         self.data = kwargs['data']
         self.block_number = kwargs['block_no']
+        self.seq_width = kwargs.get('seq_width', self.seq_width)
         # TODO: consider replacing join with bytearray
-        return pack_short_int(self.op_code) + pack_short_int(self.block_number) + str_to_bytes(self.data)
+        return (pack_short_int(self.op_code) + pack_int(self.block_number, self.seq_width)
+                + str_to_bytes(self.data))
+
+    @staticmethod
+    def build_header(block_no, seq_width=2):
+        """Just the header of a DATA packet. For senders that keep the payload in a separate buffer"""
+        return HEADERS[seq_width].pack(2, block_no)
 
     def parse_packet(self, data):
         try:
             #  self.block_number, self.data = unpack_short_int(data[2:4]), data[4:].decode('ascii')
             #  Fixme: ^^ write raw bytes to a file
-            self.block_number, self.data = unpack_short_int (data[2:4]), data[4:]
+            header = 2 + self.seq_width
+            self.block_number, self.data = unpack_int(data[2:header]), data[header:]
         except ValueError:
             logger.exception('Could not parse request: {}'.format(data))
         return self
@@ -102,10 +119,12 @@ class ACKPacket(BasePacket):
                 -------------------
         ACK   | 03    |   Block #  |
                 --------------------
+    Block # is 4 or 8 bytes wide if a wider seqwidth has been negotiated.
     """
-    def __init__(self):
+    def __init__(self, seq_width=2):
         super(ACKPacket, self).__init__()
         self.op_code = 3
+        self.seq_width = seq_width
         self.block_number = 0
 
     def __str__(self):
@@ -114,17 +133,84 @@ class ACKPacket(BasePacket):
     def build_packet(self, **kwargs):
         # TODO: consider replacing join with bytearray
         self.block_number = kwargs['block_no']
-        return pack_short_int(self.op_code) + pack_short_int(self.block_number)
+        self.seq_width = kwargs.get('seq_width', self.seq_width)
+        return pack_short_int(self.op_code) + pack_int(self.block_number, self.seq_width)
+
+    def parse_packet(self, data):
+        try:
+            self.block_number = unpack_int(data[2:])
+        except ValueError:
+            logger.exception('Could not parse request: {}'.format(data))
+        return self
+
+
+class OACKPacket(BasePacket):
+    """
+    Option acknowledgement. Sent by the Receiver in place of ACK 0 when it accepts some of the INITRQ options.
+    Only the options (and values) listed here are in effect for the transfer.
+                2 bytes   string   1 byte   string   1 byte
+                ---------------------------------------------
+        OACK  | 05    |  Opt1  |   0  |  Value1 |   0  | ...
+                ---------------------------------------------
+    """
+    def __init__(self):
+        super(OACKPacket, self).__init__()
+        self.op_code = 5
+        self.options = {}
+
+    def __str__(self):
+        return 'OACK packet: options = %s' % self.options
+
+    def build_packet(self, **kwargs):
+        self.options = kwargs['options']
+        return pack_short_int(self.op_code) + pack_options(self.options)
+
+    def parse_packet(self, data):
+        try:
+            self.options = unpack_options(data[2:])
+        except (ValueError, IndexError):
+            logger.exception('Could not parse request: {}'.format(data))
+        return self
+
+
+class SACKPacket(BasePacket):
+    """
+    Selective acknowledgement -- used when a windowsize > 1 has been negotiated.
+    Block # is the cumulative ACK (every block up to and including it has been received). Bit i of the bitmap (msb
+    first) is set when block # + 2 + i has also been received out of order.
+                2 bytes    2 bytes       n bytes
+                ---------------------------------
+        SACK  | 06    |   Block #  |   Bitmap   |
+                ---------------------------------
+    Block # is 4 or 8 bytes wide if a wider seqwidth has been negotiated.
+    """
+    def __init__(self, seq_width=2):
+        super(SACKPacket, self).__init__()
+        self.op_code = 6
+        self.seq_width = seq_width
+        self.block_number = 0
+        self.selective = []
+
+    def __str__(self):
+        return 'SACK packet: block = %d | selective = %s' % (self.block_number, self.selective)
+
+    def build_packet(self, **kwargs):
+        self.block_number = kwargs['block_no']
+        self.selective = kwargs.get('selective') or []
+        self.seq_width = kwargs.get('seq_width', self.seq_width)
+        return (pack_short_int(self.op_code) + pack_int(self.block_number, self.seq_width)
+                + pack_bitmap(self.block_number, self.selective))
 
     def parse_packet(self, data):
         try:
-            self.block_number = unpack_short_int(data[2:])
+            header = 2 + self.seq_width
+            self.block_number = unpack_int(data[2:header])
+            self.selective = unpack_bitmap(self.block_number, data[header:])
         except ValueError:
             logger.exception('Could not parse request: {}'.format(data))
         return self
 
 
-# FIXME: Do we even need this?
 class ERRPacket(BasePacket):
     """
                 2 bytes  2 bytes        string    1 byte
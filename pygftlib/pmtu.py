@@ -0,0 +1,51 @@
+"""
+Path MTU helpers. Used by the Sender to pick the largest blksize that would not get fragmented on its way to the
+Receiver. Only Linux exposes what we need (IP_MTU_DISCOVER/IP_MTU); everywhere else the probe returns None.
+"""
+
+import socket
+import sys
+import logging
+logger = logging.getLogger(__name__)
+
+# Not every python build exports these. Values are from <linux/in.h>
+IP_MTU_DISCOVER = getattr(socket, 'IP_MTU_DISCOVER', 10)
+IP_PMTUDISC_DO = getattr(socket, 'IP_PMTUDISC_DO', 2)
+IP_MTU = getattr(socket, 'IP_MTU', 14)
+
+IPV4_UDP_OVERHEAD = 20 + 8  # ip header + udp header
+
+
+def path_mtu(sock):
+    """
+    Ask the kernel for the path MTU towards the peer of a *connected* UDP socket. This is the route/interface MTU,
+    lowered by any ICMP "fragmentation needed" messages seen for the destination so far.
+    :return: MTU in bytes or None if it cannot be determined
+    """
+    if not sys.platform.startswith('linux') or sock.family != socket.AF_INET:
+        return None
+    try:
+        previous = sock.getsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER)
+        # IP_MTU is only meaningful when the DF bit is set on our datagrams
+        sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_DO)
+        try:
+            return sock.getsockopt(socket.IPPROTO_IP, IP_MTU)
+        finally:
+            sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, previous)
+    except OSError:
+        logger.debug('Unable to determine path MTU', exc_info=True)
+        return None
+
+
+def probe_block_size(sock, header_size=4):
+    """
+    Largest DATA payload that fits in a single unfragmented IP datagram on the path of a *connected* UDP socket.
+    :param header_size: size of the DATA header (op_code + block_no)
+    :return: block size in bytes or None if the path MTU is unknown
+    """
+    mtu = path_mtu(sock)
+    if mtu is None:
+        return None
+    block_size = mtu - IPV4_UDP_OVERHEAD - header_size
+    logger.info('Path MTU is {} bytes. Largest unfragmented DATA payload is {} bytes'.format(mtu, block_size))
+    return block_size
@@ -1,19 +1,43 @@
 """
 - Define and implement various functionality relating to sending and receiving different kinds of packets.
 - Sender UDP client; Receiver UDP DatagramServer
+- The gevent backend. It uses gevent's sockets, servers, queues and threadpool directly, and leaves the rest of the
+  interpreter alone: importing it does not monkey patch the standard library. Applications that block in the standard
+  library while Senders/Receivers run in other greenlets opt in with gevent.monkey.patch_all() themselves.
 """
 import gevent
+import gevent.event
 from gevent.server import DatagramServer
 from gevent import socket, queue
-import gevent.monkey; gevent.monkey.patch_all()
 import signal
+import errno
+import random
 import time
 import sys
+import os
 
 from pygftlib import *
-from pygftlib.file_io import FileReader, FileWriter
+from pygftlib.file_io import FileReader, FileWriter, read_blocks
 from pygftlib.packet_factory import PacketFactory
+from pygftlib.helpers import seq_width_for
 from pygftlib.exceptions import *
+from pygftlib.window import ReceiveWindow
+from pygftlib import options as transfer_options
+from pygftlib.pmtu import probe_block_size
+from pygftlib.congestion import TokenBucket
+from pygftlib import batch_io
+from pygftlib import codec
+from pygftlib.session import Session
+from pygftlib import striping
+from pygftlib import batch as batches
+from pygftlib.journal import Journal, transfer_id
+from pygftlib import delta as deltas
+from pygftlib import compression
+from pygftlib import metrics
+from pygftlib import disk_io
+from pygftlib import multicast
+from pygftlib import scheduler as scheduling
+from pygftlib import core
 
 import logging
 logger = logging.getLogger(__name__)
@@ -36,56 +60,155 @@ class Sender(object):
     """
     - Read fixed blk_size from a file_obj
     - Initiates connection to a Receiver by send it a INITRQ packet
-    - Waits for the server to reply with a ACK packet having block_no = 0.
-    - Convert the file_obj data to DATA packet. Writes to the socket. The block_no should be 1
-    - Waits for the server to send the ACK. If the server does not send the packet within *some_time*, resend the packet.
+    - Waits for the server to reply with a OACK packet (options accepted) or a ACK packet having block_no = 0.
+    - Convert the file_obj data to DATA packets. Writes up to window_size of them to the socket. Starting at block_no 1
+    - Waits for the server to send the (S)ACK. If the server does not send it within *some_time*, resend the oldest
+      unacknowledged packet.
         - Wait till timeout -- after which disconnect the client
-    - If ACK is received, check the block_no on the packet. Verify with the block_no_counter available.
-        - If there is no match, drop the packet and wait.
-        - If there is a match, send DATA packet 2
-    - repeat till transfer_complete. This happens when data_received from file_obj < or != blk_size
+    - If a (S)ACK is received, slide the window past the acknowledged blocks and send the next DATA packets.
+        - Blocks the Receiver has skipped over (see SACK) are considered lost and are sent again.
+    - repeat till transfer_complete. This happens when the last DATA packet (data_received from file_obj < or !=
+      blk_size) has been acknowledged
+
+    The protocol -- options, window, RTT estimation, congestion control, FEC -- is that of core.SenderCore (self.core).
+    What is left here is I/O, and the options that need it: striping, batch, resume, delta and compress.
+
+    upload() runs three greenlets for the length of the transfer. They hand work to each other through bounded queues:
+    - reader: reads the file up to read_ahead blocks ahead of the window (_chunks), several blocks at a time in the
+      threadpool of the hub. Queues the DATA packets of the blocks the window has room for as they arrive
+    - ACK processor: hands whatever the Receiver sends to the core, and queues the DATA packets it creates
+      (_send_queue) -- of the blocks already read, it never waits for the disk. It waits for packets no longer than
+      the retransmission timer, and lets the core resend once that is up
+    - transmitter: sends the queued packets, paced
     """
 
-    def __init__(self, file_name):
-        self.transfer_complete = False
-        self.error_occurred = False
+    def __init__(self, file_name, window_size=WINDOW_SIZE, block_size=DATA_SIZE, probe_mtu=False, seq_width=None,
+                 congestion='reno', max_rate=None, zero_copy=True, gso=True, stripe=None, batch=False, resume=False,
+                 delta=False, compress=None, fec=False, read_ahead=READ_AHEAD):
         self.file_name = file_name  # the file to read and send across
-        self.last_packet = None  # only maintain the last packet in  buffer -- for resending
-        self.new_packet = None
         if not self.file_name:
             logger.fatal('No filename supplied for Sender. Filename cannot be empty!')
             sys.exit(3)
-        self.file_obj = FileReader(self.file_name)
-        self.last_active = None
+        self.stripe = stripe  # send just this striping.Stripe of the file. See StripedSender
+        self.batch = batch  # file_name is a directory or a list of files, sent as one stream. See pygftlib.batch
+        # zero_copy: DATA payloads are views into the memory-mapped file, sent along with a separate header
+        if batch:
+            entries = batches.scan(self.file_name)
+            identity = [(name, st.st_size, st.st_mtime_ns) for name, _, st in entries]
+            self.file_obj = batches.BatchReader(entries)
+            self.file_name = os.path.basename(os.path.normpath(file_name)) if isinstance(file_name, str) else 'batch'
+        elif stripe is None:
+            self.file_obj = FileReader(self.file_name, use_mmap=zero_copy)
+        else:
+            self.file_obj = FileReader(self.file_name, use_mmap=zero_copy, offset=stripe.offset, length=stripe.length)
+        self._send_buffer = None  # to assemble header + payload where scatter-gather sendmsg is not available
+        self.gso = gso  # hand runs of equally sized DATA packets to the kernel at once (UDP_SEGMENT). If available
 
         self.packet_factory = PacketFactory
-        self.init_rq_packet = self.packet_factory.to_bytes(type='initrq', file_name=self.file_name)
-        self.last_packet = self.init_rq_packet
-        self.block_no = 0
-        self.terminating_block_no = None
-
-        # Initialize to current time.
-        self.max_no_response_time = MAX_NO_RESPONSE_TIME  # disconnect the client if an ACK not received
-        # within this time
-        self.no_response_time = NO_RESPONSE_TIME  # resend the "last_data_packet" if no ACK is received within this time
+        # our own options. The core asks for them along with its own
+        options = {'batch': 1} if batch else {}
+        # delta: send only what changed since the copy the Receiver has (if any). See pygftlib.delta
+        self.delta = delta and not batch and stripe is None
+        if self.delta:
+            options['delta'] = 1
+        # compress: name of the method (see pygftlib.compression) to compress DATA with. If the Receiver knows it
+        self.compress = compression.method_for(compress) if compress and not resume and stripe is None else None
+        if self.compress:
+            options['compress'] = self.compress
+        # resume: ask the Receiver to carry on where an earlier attempt at sending the same file left off
+        self.resume = resume and stripe is None
+        if self.resume:
+            if not batch:
+                st = os.stat(self.file_name)
+                identity = (os.path.abspath(self.file_name), st.st_size, st.st_mtime_ns)
+            self.transfer_id = transfer_id(self.file_name, identity)
+            options.update(xfer=self.transfer_id, resume=0)
+        if stripe is not None:
+            options.update(striping.options(stripe))
+        # bytes to send
+        if batch:
+            file_size = self.file_obj.size
+        else:
+            file_size = os.path.getsize(self.file_name) if stripe is None else stripe.length
+        # a delta or compressed stream may come out (slightly) larger than the file
+        stream_size = deltas.stream_size_bound(file_size) if self.delta else file_size
+        if self.compress:
+            stream_size = compression.stream_size_bound(stream_size)
+        # options the Receiver must accept. Without them it would get the file wrong
+        required = striping.OPTIONS if stripe is not None else ('batch',) if batch else ()
+        self.core = core.SenderCore(self.file_name, file_size, window_size, block_size, seq_width, congestion, fec=fec,
+                                    options=options, required=required, stream_size=stream_size,
+                                    on_accept=self._accepted, max_no_response_time=MAX_NO_RESPONSE_TIME)
+        self.probe_mtu = probe_mtu  # lower blksize to what fits the path MTU. Done once connected
+        self.max_rate = max_rate  # hard cap on the sending rate (bytes per second). None -- no cap
+        self.pacer = TokenBucket(max_rate)  # spaces packets out at min(max_rate, cwnd per round trip)
         self.sock = None  # setup client sock --- later
+        self.metrics = self.core.metrics  # see stats()
+        self._summary = None  # metrics.Summary. Logged every so often while the transfer goes on
         self.start = self.upload   # create alias to upload
-        self._send_queue = gevent.queue.Queue()  # Add processed packets to the send queue
+        self._send_queue = gevent.queue.Queue(SEND_QUEUE_SIZE)  # packets for the transmitter
+        # blocks of the file to read ahead of the window. 0 -- read them on the event loop, one at a time
+        self.read_ahead = read_ahead
+        self._chunks = gevent.queue.Queue(max(1, read_ahead))  # blocks of the file, read ahead by the reader
+        self._room = gevent.event.Event()  # set by _fill_window as it takes blocks off _chunks
+        self._workers = []  # the greenlets of upload()
+        self._finished = gevent.event.Event()  # set once the transfer is over, one way or another
+
+    @property
+    def transfer_complete(self):
+        return self.core.complete
+
+    @property
+    def error_occurred(self):
+        return self.core.error is not None
+
+    @property
+    def error(self):
+        """(error code, message) of the ERR the Receiver turned us down with, if it did"""
+        return self.core.peer_error
+
+    @property
+    def file_size(self):
+        """Bytes to send. Less than the file once the Receiver resumes an earlier attempt"""
+        return self.core.file_size
+
+    @property
+    def block_size(self):
+        """DATA payload size. Updated once the Receiver accepts a blksize"""
+        return self.core.block_size
+
+    @property
+    def seq_width(self):
+        """Bytes per block number. Updated once the Receiver accepts a seqwidth"""
+        return self.core.seq_width
 
     def upload(self, host, port):
         self.sock = gevent.socket.socket(type=socket.SOCK_DGRAM)
         self.sock.settimeout(1)   # set socket to non-blocking mode.. But setting to 1 yields better results
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+        self.gso = self.gso and batch_io.supports_gso(self.sock)
         conn = (host, port)
         try:
             logger.info('Attempting to connect to server at {}'.format(conn))
             self.sock.connect(conn)
+            if self.probe_mtu:
+                self._probe_block_size()
             # send the init_packet
-            self.sock.send(self.init_rq_packet)
-            self.last_active = time.time ()  # time since last we received a DATA packet from the server(Receiver)
+            now = time.monotonic()
+            init_rq = self.core.connect(now)
+            self.sock.send(init_rq)
+            self.core.sent(init_rq)
+            self._summary = metrics.Summary(now)
             logger.info('Init packet sent successfully')
-            while not (self.transfer_complete or self.error_occurred):
-                gevent.joinall([gevent.spawn(self.handle_ack), gevent.spawn(self.send_packet)])
-                # Block till all jobs are not finished
+            for worker in (self._process_acks, self._transmit):
+                self._workers.append(gevent.spawn(worker))
+                self._workers[-1].link(self._worker_done)
+            while not self._finished.wait(self._summary.interval):
+                logger.info(self._summary.line(self.stats(), time.monotonic()))
+            for worker in self._workers:
+                if worker.exception is not None:
+                    raise worker.exception
+            logger.info(self._summary.line(self.stats(), time.monotonic()))
             if self.transfer_complete:
                 logger.info('File Transfer Complete!!')
             else:
@@ -99,222 +222,969 @@ class Sender(object):
         finally:
             self.stop()
 
+    def _probe_block_size(self):
+        """Ask for the largest blksize that does not get fragmented on the path to the Receiver"""
+        # leave room for the widest DATA header -- seqwidth is only decided after blksize
+        block_size = probe_block_size(self.sock, header_size=2 + 8)
+        if block_size is None:
+            logger.info('Path MTU could not be determined. Not changing the block size')
+            return
+        self.core.request_block_size(max(MIN_BLOCK_SIZE, min(block_size, MAX_BLOCK_SIZE,
+                                                             self.core.options.get('blksize', MAX_BLOCK_SIZE))))
+
     def stop(self):
-        gevent.killall([gevent.spawn(self.handle_ack), gevent.spawn(self.send_packet)])
-        self.sock.close()
+        gevent.killall(self._workers)
+        if self.sock is not None:
+            self.sock.close()
+
+    def _worker_done(self, worker):
+        """The ACK processor and the transmitter return once the transfer is over. Any of the workers may fail"""
+        self._finished.set()
+
+    def stats(self):
+        """Counters and histograms of the transfer so far. See pygftlib.metrics"""
+        return self.metrics.stats()
 
-    def _check_time(self):
+    def _process_acks(self):
+        """The ACK processor. Runs till the transfer is over"""
+        while not self.core.done:
+            self.handle_ack()
+
+    def handle_ack(self):
         """
-        Checks whether an ack has been received in the last "max_no_response_time". If it had been done so, return True
-        else send False to disconnect the client
-        :return: None
+        Hands OACK, ACK, SACK and ERR packets to the core, and queues the packets it has for the Receiver in return.
+        Lets the core resend once the retransmission timer is up.
         """
-        if int(time.time() - self.last_active) > self.max_no_response_time:
-            logger.info('Receiver/server is not responding. Closing connection')
-            return False
-        elif (int(time.time() - self.last_active) < self.max_no_response_time) \
-                and (int(time.time() - self.last_active) > self.no_response_time):
-            # if an ACK is not received within the last no_response_time but may be still connected!
+        if self.core.done:
+            return
+        if time.monotonic() >= self.core.deadline:
+            # if an ACK is not received within the retransmission timeout but may be still connected!
             # this is supposed to handle the UDP **packet lost** scenario.
-            # resend the last packet and hope it reaches the server
-            self._add_to_send_queue(packet=self.last_packet)
-            return True
-        else:
-            # everything is jolly good! Nothing to do here. Move Along -- :-)
-            return True
+            for packet in self.core.timeout(time.monotonic()):
+                self._send_queue.put(packet)
+            return
+        try:
+            # wake up in time to retransmit
+            self.sock.settimeout(min(1, max(0.001, self.core.deadline - time.monotonic())))
+            data, address = self.sock.recvfrom(MAX_DATAGRAM_SIZE)
+        except (socket.timeout, ConnectionRefusedError):
+            # the retransmission timer is up. Or nobody is listening (ICMP port unreachable), which is as good as a
+            # lost packet
+            return
+        started = self.core.accepted is not None
+        for packet in self.core.datagram_received(data, time.monotonic()):
+            # missing at the Receiver. Send it again
+            self._send_queue.put(packet)
+        if self.core.done or self.core.accepted is None:
+            return
+        if not started:
+            # file_obj and block_size are settled. From here on the file is read ahead
+            self._workers.append(gevent.spawn(self._read_ahead))
+            self._workers[-1].link_exception(self._worker_done)
+        self.pacer.rate = self.core.pacing_rate(self.max_rate)
+        self._fill_window()
 
-    def handle_ack(self):
+    def _accepted(self, accepted):
         """
-        Handles ACK packets. A response would triggered only when a valid ACK is received.
+        The Receiver has accepted our INITRQ (the core's on_accept). Set up the options that are ours: resume, delta and
+        compress
         """
-        if self._check_time() and (not self.transfer_complete):
-            try:
-                logger.info ('Waiting to receive an ACK from Server')
-                data, address = self.sock.recvfrom(MIN_PACKET_SIZE)
-                # check if the data has valid op_code and is of correct length
-                if not self.packet_factory.is_valid(packet_type='ack', data=data):
-                    logger.info('Invalid/Malformed ACK Received from Receiver {}'.format(address))
-                else:
-                    # correct length and right op_code. Great! now parse the packet to get the block_no
-                    block_no = self.packet_factory.from_bytes(data)
-                    # update the last_active time to indicate that an ack has been received in **recent times**
-                    self.last_active = time.time()
-                    if block_no == self.block_no:
-                        logger.debug('ACK Matches! Received ACK with correct block_no')
-                        if self.block_no == 0:
-                            logger.info('ACK Received. Initiating Transfer')
-                        else:
-                            logger.info('ACK Received for packet no {}'.format(self.block_no))
-                        # Finally initiate transfer
-                        self.block_no += 1
-                        self._add_to_send_queue(address)
-                    else:
-                        # Better luck next time!!
-                        logger.info('Received ACK packet. But of the wrong sequence/block_no. Dropping packet')
-                        logger.debug('Contents of wrong ACK packet: {}. Block No: {}'.format(data, block_no))
-                        # Nothing to do here, send_packet worker would send the DATA again to see
-                        # if we fetch any results
-            except socket.timeout:
-                pass       # Do not print/log timeout stacktrace
-        else:
-            # Time this. If Ack not received in 10s (say) resend "last_packet"
-            # If Ack not received in 30s (say)-- disconnect
-            self.error_occurred = True
+        if self.resume and int(accepted.get('resume', 0)):
+            self._skip(int(accepted['resume']))
+            if self.error_occurred:
+                return
+        if self.delta and 'delta' in accepted:
+            self._start_delta(int(accepted.get('sigsize', 0)))
+            if self.error_occurred:
+                return
+        if self.compress and 'compress' in accepted:
+            logger.info('Compressing DATA with {}'.format(compression.CODECS[self.compress][0]))
+            self.file_obj = compression.CompressingReader(self.file_obj, self.compress)
+            self.core.file_size = compression.stream_size_bound(self.core.file_size)
+
+    def _read_ahead(self):
+        """The reader. Keeps up to read_ahead blocks of the file ready, and fills the window with them as they come"""
+        # slicing a memory-mapped file costs less than handing it to a thread. Compressed streams are read in the
+        # threadpool anyway (see CompressingReader)
+        threadpool = None
+        if self.read_ahead and not self.file_obj.mapped and \
+                not isinstance(self.file_obj, compression.CompressingReader):
+            threadpool = gevent.get_hub().threadpool
+        while True:
+            # once half the blocks read ahead are gone, as many as there is room for. In a single read
+            while self._chunks.maxsize - self._chunks.qsize() < (self._chunks.maxsize + 1) // 2:
+                self._room.clear()
+                self._room.wait()
+            count = self._chunks.maxsize - self._chunks.qsize()
+            if threadpool is not None:
+                chunks = threadpool.apply(read_blocks, (self.file_obj, self.block_size, count))
+            else:
+                chunks = read_blocks(self.file_obj, self.block_size, count)
+                if not self.file_obj.mapped:
+                    gevent.sleep(0)  # read on the event loop. Let the transmitter send what there is meanwhile
+            for chunk in chunks:
+                self._chunks.put(chunk)  # there is room: nothing else queues chunks
+            self._fill_window()
+            if len(chunks[-1]) != self.block_size:
+                return
+
+    def _start_delta(self, size):
+        """Fetch the signature of the Receiver's copy. From then on, send the delta stream instead of the file"""
+        signature = self._fetch_signature(size)
+        if signature is None:
+            self.core.fail('Could not fetch the signature of the Receiver\'s copy of {}'.format(self.file_name))
+            return
+        try:
+            self.file_obj = deltas.DeltaReader(self.file_name, signature)
+        except MalformedPacketException:
+            logger.exception('Invalid signature received for {}'.format(self.file_name))
+            self.core.fail('Invalid signature received for {}'.format(self.file_name))
+            return
+        self.core.file_size = deltas.stream_size_bound(self.core.file_size)
+        self.core.heard(time.monotonic())
+        logger.info('Sending the delta of {} against the Receiver\'s copy ({} byte signature)'.format(self.file_name,
+                                                                                                   size))
+
+    def _fetch_signature(self, size):
+        """
+        Ask for the signature piece by piece (SIGRQ), up to a window of requests at a time. Requests that go
+        unanswered for a retransmission timeout are sent again.
+        :return: the signature. None if the Receiver stopped answering
+        """
+        pieces = {}
+        offsets = list(range(0, size, self.block_size)) or [0]
+        last_heard = time.monotonic()
+        while len(pieces) < len(offsets):
+            missing = [offset for offset in offsets if offset not in pieces][:self.core.window.size]
+            for offset in missing:
+                packet = codec.encode_sigrq(offset)
+                self.sock.send(packet)
+                self.metrics.sent(len(packet))
+            deadline = time.monotonic() + self.core.rtt.rto
+            while any(offset not in pieces for offset in missing) and time.monotonic() < deadline:
+                self.sock.settimeout(max(0.001, deadline - time.monotonic()))
+                try:
+                    data = self.sock.recv(MAX_DATAGRAM_SIZE)
+                except socket.timeout:
+                    break
+                self.metrics.received(len(data))
+                if codec.op_code(data) == codec.SIG and codec.is_valid(codec.SIG, data, blksize=self.block_size):
+                    offset, payload = codec.decode_sig(data)
+                    pieces[offset] = payload
+                    last_heard = time.monotonic()
+            if time.monotonic() - last_heard > self.core.max_no_response_time:
+                return None
+        return b''.join(pieces[offset] for offset in offsets)[:size]
+
+    def _skip(self, offset):
+        """The Receiver already has everything before offset. Block 1 starts there"""
+        if offset > self.file_size:
+            self.core.fail('The Receiver claims to have {} bytes of {}, which only has {}'.format(
+                offset, self.file_name, self.file_size))
+            return
+        logger.info('Resuming transfer of {} at byte {} of {}'.format(self.file_name, offset, self.file_size))
+        self.file_obj.skip(offset)
+        self.core.file_size -= offset
+
+    def _fill_window(self):
+        """
+        Create and queue new DATA packets while the window has room for them -- of the blocks read so far. Never waits
+        for the reader: it calls this again as it reads more
+        """
+        while self.core.can_send() and self._chunks.qsize():
+            # zero-copy for a mapped file. The header is the only thing allocated
+            for packet in self.core.push(self._chunks.get_nowait(), time.monotonic(), vectored=self.file_obj.mapped):
+                self._send_queue.put(packet)
+            self._room.set()
+
+    def _transmit(self):
+        """The transmitter. Runs till the transfer is over"""
+        while not self.core.done:
+            self.send_packet()
 
     def send_packet(self):
         """
-        The actual worker that would send a packet to the remote server
+        Send the next packet in the queue (with GSO, a run of them) -- waits for one to be queued. DATA packets are
+        queued by _fill_window, retransmissions by handle_ack
         :return: None
         """
-        # Check to see if there is any packet in the queue that is to be sent
-        # If is is, send that packet. Otherwise if the queue is empty, send the last packet.
-        if self._send_queue.qsize() > 0:
-            packet = self._send_queue.get()
-        else:
-            packet = self.last_packet
-        if len(packet) < MAX_PACKET_SIZE and (self.packet_factory.check_type('data', data=packet)):
+        packets = self._next_packets()
+        size = sum(batch_io.packet_size(packet) for packet in packets)
+        delay = self.pacer.reserve(size)
+        if delay:
+            gevent.sleep(delay)
+        try:
+            if len(packets) > 1:
+                self._send_segments(packets)
+            elif isinstance(packets[0], bytes):
+                self.sock.send(packets[0])
+            else:
+                self._send_vectored(packets[0])
+        except ConnectionRefusedError:
+            pass  # nobody listening (yet). As good as lost -- the retransmission timer sees to it
+        for packet in packets:
+            self.core.sent(packet)
+
+    def _next_packets(self):
+        """
+        Take the next packet off the send queue. With GSO, along with as many of the following ones as can go in a
+        single send: all the same size, bar the last one which may be shorter
+        """
+        packets = [self._send_queue.get()]
+        if not self.gso:
+            return packets
+        size = batch_io.packet_size(packets[0])
+        while self._send_queue.qsize() > 0 and len(packets) < batch_io.MAX_SEGMENTS and \
+                (len(packets) + 1) * size <= batch_io.MAX_GSO_SIZE:
+            next_size = batch_io.packet_size(self._send_queue.peek())
+            if next_size > size:
+                break
+            packets.append(self._send_queue.get())
+            if next_size < size:
+                break
+        return packets
+
+    def _send_segments(self, packets):
+        """Send a run of packets with one sendmsg. Fall back to one send per packet if the kernel refuses"""
+        try:
+            batch_io.send_segments(self.sock, packets)
+        except OSError as err:
+            if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS):
+                raise
+            logger.info('UDP_SEGMENT failed ({}). Sending one DATA packet at a time'.format(err))
+            self.gso = False
+            for packet in packets:
+                if isinstance(packet, bytes):
+                    self.sock.send(packet)
+                else:
+                    self._send_vectored(packet)
+
+    def _send_vectored(self, packet):
+        """Send a (header, payload) packet without joining the two"""
+        if hasattr(self.sock, 'sendmsg'):
+            self.sock.sendmsg(packet)
+            return
+        # no scatter-gather. Assemble the packet in a buffer that is reused for every packet
+        header, payload = packet
+        size = len(header) + len(payload)
+        if self._send_buffer is None or len(self._send_buffer) < size:
+            self._send_buffer = bytearray(max(size, self.block_size + 10))
+        self._send_buffer[:len(header)] = header
+        self._send_buffer[len(header):size] = payload
+        self.sock.send(memoryview(self._send_buffer)[:size])
+
+
+class StripedSender(object):
+    """
+    Sends a file as a number of stripes (byte ranges) at once, each by a Sender of its own: its own socket (source
+    port), window, congestion controller and Receiver session. See pygftlib.striping.
+    Takes the same keyword arguments as Sender -- they apply to every stripe.
+    """
+
+    def __init__(self, file_name, streams=STREAMS, **sender_kwargs):
+        self.file_name = file_name
+        self.stripes = striping.split(os.path.getsize(file_name), streams, sender_kwargs.get('block_size', DATA_SIZE))
+        self.senders = [Sender(file_name, stripe=stripe, **sender_kwargs) for stripe in self.stripes]
+        self.start = self.upload
+
+    @property
+    def transfer_complete(self):
+        return all(sender.transfer_complete for sender in self.senders)
+
+    def upload(self, host, port):
+        logger.info('Sending {} as {} stripes'.format(self.file_name, len(self.stripes)))
+        uploads = [gevent.spawn(sender.upload, host, port) for sender in self.senders]
+        try:
+            gevent.joinall(uploads)
+        finally:
+            gevent.killall(uploads)
+        if not self.transfer_complete:
+            logger.info('{} of {} stripes could not be transferred'.format(
+                sum(not sender.transfer_complete for sender in self.senders), len(self.senders)))
+
+    def stop(self):
+        for sender in self.senders:
+            if sender.sock is not None:
+                sender.stop()
+
+
+class MulticastSender(object):
+    """
+    Sends a file to every Receiver that has joined a multicast group: each DATA block once, to the group, and again
+    only when a Receiver NAKs it (see pygftlib.multicast). Two greenlets for the length of the transfer:
+    - transmitter: announces the transfer, sends the blocks in order at max_rate, and the repairs that are due
+    - listener: collects the NAKs of the Receivers into repairs, and their ACKs once they have the file
+    :param receivers: number of Receivers to wait for. None -- done once nobody has NAKed anything for linger seconds
+    :param interface: address of the interface to multicast from. 0.0.0.0 -- the one the kernel routes the group to
+    """
+
+    def __init__(self, file_name, block_size=DATA_SIZE, max_rate=MULTICAST_RATE, receivers=None,
+                 linger=multicast.LINGER, interface='0.0.0.0', ttl=MULTICAST_TTL):
+        self.transfer_complete = False
+        self.error_occurred = False
+        self.file_name = file_name
+        self.file_size = os.path.getsize(file_name)
+        self.block_size = block_size
+        self.final_block = multicast.final_block(self.file_size, block_size)
+        self.seq_width = seq_width_for(self.final_block)
+        self.session = random.getrandbits(32)  # tells this transfer's NAKs from those of others to the same group
+        self.receivers = receivers
+        self.completed = set()  # addresses of the Receivers that have the whole file
+        self.linger = linger
+        self.interface = interface
+        self.ttl = ttl
+        self.max_no_response_time = MAX_NO_RESPONSE_TIME  # give up on Receivers that are not heard from
+        self.pacer = TokenBucket(max_rate)  # nothing tells a multicast Sender how fast it may go
+        self.repairs = multicast.RepairQueue()
+        self.next_block = 1  # first block not sent yet
+        self.last_heard = None  # when a Receiver was last heard from. Or the last block sent, whichever is later
+        self.group = None
+        self.sock = None
+        self.metrics = metrics.Metrics()  # see stats()
+        self._fd = None
+        self._wakeup = gevent.event.Event()  # set when there is something for the transmitter to do
+        self._workers = []
+        self._finished = gevent.event.Event()
+        self.start = self.upload
+
+    def upload(self, group):
+        """:param group: (address, port) of the multicast group to send to"""
+        self.group = group
+        self.sock = gevent.socket.socket(gevent.socket.AF_INET, gevent.socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+        multicast.sender_socket(self.sock, self.interface, self.ttl)
+        self.sock.bind((self.interface, 0))
+        self._fd = os.open(self.file_name, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        summary = metrics.Summary(time.monotonic())
+        try:
+            logger.info('Multicasting {} ({} blocks) to {}:{}'.format(self.file_name, self.final_block, *group))
+            for worker in (self._transmit, self._listen):
+                self._workers.append(gevent.spawn(worker))
+                self._workers[-1].link(self._worker_done)
+            while not self._finished.wait(summary.interval):
+                logger.info(summary.line(self.stats(), time.monotonic()))
+            for worker in self._workers:
+                if worker.exception is not None:
+                    raise worker.exception
+            logger.info(summary.line(self.stats(), time.monotonic()))
+            if self.transfer_complete:
+                logger.info('File Transfer Complete!! {} Receiver(s) have the file'.format(len(self.completed)))
+            else:
+                logger.info('File Could not be Transferred ! {} of {} Receiver(s) have the file'.format(
+                    len(self.completed), self.receivers))
+        except socket.error:
+            logger.exception('Socket Error! Cannot multicast to {}:{}'.format(*group))
+        finally:
+            self.stop()
+
+    def stop(self):
+        gevent.killall(self._workers)
+        if self.sock is not None:
+            self.sock.close()
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _worker_done(self, worker):
+        self._finished.set()
+
+    def stats(self):
+        """Counters of the transfer so far. See pygftlib.metrics"""
+        return self.metrics.stats()
+
+    def _transmit(self):
+        """The transmitter. Runs till the transfer is over"""
+        announce_at = time.monotonic()
+        while True:
+            now = time.monotonic()
+            if now >= announce_at:
+                self._announce()
+                announce_at = now + multicast.ANNOUNCE_INTERVAL
+            for block_no in self.repairs.due(now):
+                self.metrics.retransmits += 1
+                self._send_block(block_no)
+            if self.next_block <= self.final_block:
+                self._send_block(self.next_block)
+                self.next_block += 1
+                if self.next_block > self.final_block:
+                    # the Receivers that lost the last blocks find out from the announce
+                    self.last_heard = time.monotonic()
+                    announce_at = self.last_heard
+                continue
+            if self._done(now):
+                return
+            # everything has been sent once. Wait for NAKs
+            self._wakeup.clear()
+            deadline = min(announce_at, self.repairs.deadline or announce_at)
+            self._wakeup.wait(max(0.001, deadline - time.monotonic()))
+
+    def _done(self, now):
+        """True once the transfer is over, one way or another"""
+        if self.receivers is not None and len(self.completed) >= self.receivers:
             self.transfer_complete = True
-        self.sock.send(packet)
-
-    def _add_to_send_queue(self, address=None, packet=None):
-        """Add a packet to be sent to the receiver"""
-        if address is None:
-            address = self.sock.getpeername()
-        if packet is None:
-            self.new_packet = self.packet_factory.to_bytes(type='data', block_no=self.block_no,
-                                                           data=self.file_obj.read_chunk(DATA_SIZE))
-            self.last_packet = self.new_packet
-            logger.info('Sending packet to remote host: {}'.format(address))
-            if self.packet_factory.is_valid(packet_type='data', data=self.new_packet) and \
-                    self.packet_factory.check_type(packet_type='data', data=self.new_packet):
-                if len(self.last_packet) != MAX_PACKET_SIZE:
-                    self.terminating_block_no = self.block_no
-                self._send_queue.put(self.new_packet)
-        else:
-            logger.info('Sending last packet again since no ACK was received')
-            logger.debug('Resent packet contents: {}'.format(packet))
-            self._send_queue.put(packet)
+        elif self.receivers is None and now - self.last_heard >= self.linger:
+            self.transfer_complete = True  # as far as anyone has told us
+        elif now - self.last_heard > self.max_no_response_time:
+            logger.info('Receivers are not responding. Closing connection')
+            self.error_occurred = True
+        return self.transfer_complete or self.error_occurred
+
+    def _announce(self):
+        options = multicast.announce_options(multicast.Announce(self.session, self.block_size, self.seq_width,
+                                                                self.file_size, self.next_block - 1))
+        self._send(codec.encode_initrq(self.file_name, options))
+
+    def _send_block(self, block_no):
+        payload = os.pread(self._fd, self.block_size, (block_no - 1) * self.block_size)
+        self._send(codec.encode_data(block_no, payload, self.seq_width))
+
+    def _send(self, packet):
+        delay = self.pacer.reserve(len(packet))
+        if delay:
+            gevent.sleep(delay)
+        try:
+            self.sock.sendto(packet, self.group)
+        except OSError as err:
+            if err.errno != errno.ENOBUFS:
+                raise
+            return  # dropped before it left the host. Receivers NAK it like any other lost packet
+        self.metrics.sent(len(packet))
+
+    def _listen(self):
+        """The listener. NAKs and ACKs come straight to our socket"""
+        while True:
+            data, address = self.sock.recvfrom(MAX_DATAGRAM_SIZE)
+            self.metrics.received(len(data))
+            op_code = codec.op_code(data)
+            if op_code == codec.NAK and codec.is_valid(op_code, data, seq_width=self.seq_width):
+                session, blocks = codec.decode_nak(data, self.seq_width)
+                if session != self.session:
+                    self.metrics.malformed += 1
+                    continue
+                self.metrics.naks += 1
+                self.last_heard = time.monotonic()
+                if self.repairs.nak([block_no for block_no in blocks if block_no < self.next_block], self.last_heard):
+                    self._wakeup.set()
+            elif op_code == codec.ACK and codec.is_valid(op_code, data, seq_width=self.seq_width) and \
+                    codec.decode_ack(data, self.seq_width) == self.final_block:
+                if address not in self.completed:
+                    logger.info('Receiver {} has the file'.format(address))
+                    self.completed.add(address)
+                self.last_heard = time.monotonic()
+                self._wakeup.set()
+            else:
+                self.metrics.malformed += 1
+
+
+class LargeDatagramServer(DatagramServer):
+    """DatagramServer reads at most 8k of each datagram. DATA packets may be as large as the negotiated blksize"""
+
+    def do_read(self):
+        try:
+            data, address = self._socket.recvfrom(MAX_DATAGRAM_SIZE)
+        except socket.error as err:
+            if err.args[0] == errno.EWOULDBLOCK:
+                return
+            raise
+        return data, address
+
+
+class BatchDatagramServer(LargeDatagramServer):
+    """
+    Drains every datagram waiting on the socket per wakeup (batch_io.DatagramReader, coalesced with UDP_GRO where the
+    kernel supports it) and hands them to the handler together: handle(datagrams) with a list of (data, address)
+    """
+
+    def init_socket(self):
+        super(BatchDatagramServer, self).init_socket()
+        self.reader = batch_io.DatagramReader(self._socket)
+
+    def do_read(self):
+        datagrams = self.reader.read()
+        if datagrams:
+            return (datagrams,)
 
 
 class Receiver(object):
     """
     - Start the UDP server on a host and port. Check for permissions to write on the CWD
     - Accept an incoming connection. Check if the packet is INITRQ type else discard the packet.
-    - Send the ACK with block_no 0. Wait to receive DATA packet
+    - Send the OACK (if we accept any of the options in the INITRQ) or the ACK with block_no 0. Wait to receive DATA
     - Verify DATA has block_no == ACK block_no + 1
-        - If yes, write to file. Else discard packet with appropriate error code  <No error codes at the moment>
-        - Send ACK with block_no += 1
+        - If yes, write to file. Along with any blocks buffered after it
+        - If it is further ahead (but within the window) buffer it till the gap before it is filled
+        - Send ACK (lockstep) or SACK (windowed) with the highest in-order block_no
     - repeat till transfer_complete. size(DATA) < or != blk_size. Close File pointers
+
+    With group, the Receiver also joins a multicast group, and receives the files a MulticastSender sends to it. Those
+    sessions are kept by the address of their Sender, next to the unicast ones (see pygftlib.multicast).
+
+    New sessions are admitted -- or turned down with an ERR -- by a scheduling.Scheduler, which also limits the rate of
+    each client (and subnet) and shares the Receiver fairly between sessions when asked to (see pygftlib.scheduler).
+    DATA it queues is handled by a greenlet of its own (_dispatch).
+
+    The protocol -- sessions, options, windows, FEC, admission -- is that of core.ReceiverCore (self.core). What is left
+    here is I/O: sockets, files, the disk, timers. And multicast, whose sessions share the core's table.
     """
 
-    def __init__(self, timeout=None):
-        self.client_state = {}  # a data structure to store block_number etc per respective socket.
-        # TODO: check whether appending/insertion to a dictionary would be more efficient for any other DS?
+    def __init__(self, timeout=None, window_size=MAX_WINDOW_SIZE, block_size=MAX_BLOCK_SIZE, batched=True,
+                 fsync=None, reuse_port=False, striping=True, resumable=True, delta=True,
+                 compression=True, metrics_port=None, disk_threads=DISK_THREADS, write_behind=WRITE_BEHIND,
+                 group=None, max_sessions=MAX_SESSIONS, max_client_sessions=MAX_CLIENT_SESSIONS, client_rate=None,
+                 subnet_rate=None, subnet_prefix=scheduling.SUBNET_PREFIX, priorities=None, fair_share=False):
+        # admission, rate limits and fair share. client_rate/subnet_rate in bytes per second, priorities maps
+        # networks (e.g. '10.0.0.0/8') to the weight of their sessions
+        self.scheduler = scheduling.Scheduler(max_sessions, max_client_sessions, client_rate=client_rate,
+                                              subnet_rate=subnet_rate, subnet_prefix=subnet_prefix,
+                                              priorities=priorities, fair_share=fair_share)
+        refused = set()  # options that are switched off
+        if not striping:
+            refused.update(('xfer', 'stripes', 'stripe', 'offset'))  # xfer identifies resumable transfers as well
+        if not resumable:
+            refused.add('resume')
+        if not delta:
+            refused.add('delta')
+        if not compression:
+            refused.add('compress')
+        self.core = core.ReceiverCore(window_size, block_size, options=set(transfer_options.NEGOTIATORS) - refused,
+                                      scheduler=self.scheduler)
+        self.client_state = self.core.client_state  # address -> Session. Expired by a timer (_expire_sessions)
         self.packet_factory = PacketFactory
         self.listener = None
         self.timeout = timeout
+        self.limits = self.core.limits  # upper bounds on what a Sender may negotiate
+        self.batched = batched  # read datagrams in batches (batch_io). Falls back to one at a time if unsupported
+        self._deferred_acks = None  # while handling a batch: clients to acknowledge once the batch is done
+        self.fsync = fsync  # durability of received files. None, 'end' or every so many bytes -- see FileWriter
+        self._expiry = None  # greenlet expiring inactive sessions
+        self.reuse_port = reuse_port  # share the port with other Receivers (SO_REUSEPORT). See workers.ReceiverPool
+        self.striping = striping  # accept striped transfers (see pygftlib.striping)
+        self.transfers = {}  # (client host, transfer id) -> striping.Manifest of striped transfers in progress
+        self.resumable = resumable  # keep a journal for Senders that ask to resume (see pygftlib.journal)
+        self._journaled = {}  # transfer id -> Session of the resumable transfers in progress
+        self.delta = delta  # accept delta transfers against files received earlier (see pygftlib.delta)
+        self.compression = compression  # accept compressed transfers (see pygftlib.compression)
+        self.metrics = self.core.metrics  # see stats()
+        self.metrics_port = metrics_port  # serve stats() to Prometheus on this port (of the host start() binds to)
+        self._metrics_server = None
+        # files are written by this many threads, up to write_behind bytes of each behind the network. 0 threads --
+        # on the event loop (see pygftlib.disk_io)
+        self.disk_threads = disk_threads
+        self.write_behind = write_behind
+        self.disk = None  # disk_io.DiskPool. Created by start()
+        self.group = group  # (address, port) of a multicast group to join, on the interface start() binds to
+        self._group_server = None  # reads the group
+        self._groups = {}  # multicast session id -> Session
+        self._nak_timer = None  # greenlet sending the NAKs that are due
+        self._dispatcher = None  # greenlet handling the DATA the scheduler queues
+        self._queued = gevent.event.Event()  # set when DATA is queued
+
+    def stats(self):
+        """
+        Counters and histograms since the Receiver was created (see pygftlib.metrics), and the sessions in progress.
+        Plain numbers -- they can be summed across Receivers
+        """
+        return self.core.stats()
+
+    def handle_batch(self, datagrams):
+        """Handle a batch of datagrams. Each client is sent a single (S)ACK at the end -- covering all of its packets"""
+        # another batch may be handled while this one waits for the disk. Whichever is current collects the ACKs
+        deferred = self._deferred_acks = {}
+        try:
+            for data, address in datagrams:
+                self.handle(data, address)
+        finally:
+            if self._deferred_acks is deferred:
+                self._deferred_acks = None
+            for session in deferred:
+                if self.client_state.get(session.address) is session:
+                    self._send_ack(session)
 
     def handle(self, data, address):
-        self._clean_up()   # clean-up
-        if address not in self.client_state.keys():
-            logger.info('New client has connected. Connection from {}:{}'.format(address[0], address[1]))
-            # check data is valid INITRQ. If not, no point in continuing!
-            if self.packet_factory.check_type('initrq', data) and self.packet_factory.is_valid('initrq', data):
-                self.client_state[address] = {
-                    'transfer_complete': False,
-                    'block_number': 0,
-                    'file_obj': None,
-                    'file_name': None,
-                    'last_active': None,
-                    'inactive': (lambda: int(time.time() - self.client_state[address]['last_active']))
-                }
-                # build_up context - update the last_activity period
-                self.client_state[address]['last_active'] = time.time()
-                # parse the initrq packet
-                # get the filename of the file - store it!
-                self.client_state[address]['file_name'] = self.packet_factory.from_bytes(data)
-                logger.info('Creating new file with name: {} for client {}'.format(
-                    self.client_state[address]['file_name'], address
-                ))
-                # next create a file_obj to that file.
-                self.client_state[address]['file_obj'] = FileWriter(
-                    self.client_state[address]['file_name'], DATA_SIZE
-                )
-                # send ack_packet
-                self.send_ack(address)
+        if self.scheduler.shaping and codec.op_code(data) == codec.DATA:
+            session = self.client_state.get(address)
+            if session is not None:
+                self.metrics.received(len(data))
+                if self.scheduler.enqueue(session, address, data):
+                    self._queued.set()  # handled in its turn
+                else:
+                    self.metrics.dropped += 1  # the session is over its share. The client sends it again
+                return
+        self._carry_out(self.core.datagram_received(data, address, time.monotonic()))
+
+    def _carry_out(self, actions):
+        """
+        Do what the core asks for (see pygftlib.core), in order. A session whose file cannot be opened, written or
+        closed is dropped -- the rest of its actions with it -- and its client sent an ERR. Not the (S)ACK: it must not
+        take a file that is not on disk for one that is
+        """
+        failed = set()
+        for action in actions:
+            if isinstance(action, core.Send):
+                self.listener.socket.sendto(action.packet, action.address)
+                self.metrics.sent(len(action.packet))
+                continue
+            session = action.session
+            if session in failed:
+                continue
+            if isinstance(action, core.Acknowledge):
+                self.send_ack(session)
+                continue
+            try:
+                if isinstance(action, core.Write):
+                    session.file_obj.write_block(action.block_no, action.data)
+                elif isinstance(action, core.Open):
+                    self._open(session)
+                elif isinstance(action, core.Close):
+                    self._close(session)
+                elif isinstance(action, core.Abort):
+                    self._close_session(session)
+            except (MalformedPacketException, OSError) as err:
+                failed.add(session)
+                self._carry_out(self._failed(session, err))
+
+    def _failed(self, session, err):
+        """core.failed() for a session whose file raised err. :return: list of actions"""
+        if isinstance(err, MalformedPacketException):
+            # e.g. a compressed stream that does not decode. No point in carrying on
+            logger.warning('Client {} sent a file that cannot be decoded: {}'.format(session.address, err))
+            return self.core.failed(session, codec.ERR_ILLEGAL_OPERATION, str(err))
+        # e.g. the disk is full
+        logger.error('Unable to write {} for client {}: {}'.format(session.file_name, session.address, err))
+        return self.core.failed(session, codec.ERR_ALLOCATION_EXCEEDED, err.strerror or str(err))
+
+    def _dispatch(self):
+        """
+        Background. Handles the DATA the scheduler has queued, in the order it sets, DISPATCH_ROUND packets at a time.
+        Each client is sent a single (S)ACK per round -- as for a batch
+        """
+        while True:
+            self._queued.clear()
+            deferred = self._deferred_acks = {}
+            wait = 0
+            try:
+                for _ in range(scheduling.DISPATCH_ROUND):
+                    session, data = self.scheduler.next(time.monotonic())
+                    if session is None:
+                        wait = data  # till a session over its rate may go on. None -- nothing is queued
+                        break
+                    if self.client_state.get(session.address) is session:
+                        self._carry_out(self.core.data_received(session, data, time.monotonic()))
+            finally:
+                if self._deferred_acks is deferred:
+                    self._deferred_acks = None
+                for session in deferred:
+                    if self.client_state.get(session.address) is session:
+                        self._send_ack(session)
+            if wait == 0:
+                gevent.sleep(0)  # let more datagrams in before the next round
             else:
-                logger.warning('Invalid/Malformed INITRQ packet received from client {}'.format(address))
-        else:
-            # we have already received some data from this client before!
-            # determine type of packet
-            if self.packet_factory.check_type('initrq', data):
-                # May be client hasn't received an ACK.
-                # send the ack again
-                self.send_ack(address)
-            elif self.packet_factory.check_type('data', data):
-                # The packet is DATAPacket. Nice! Parse the contents of the packet
-                block_no, content = self.packet_factory.from_bytes(data)
-                block_no = int(block_no)  # covert block no to int if it is a str
-                # check the block_no on the file. Only write when the block_no on the packet +1 than block_number in
-                # client's state
-                if self.client_state[address]['block_number'] == (block_no - 1):
-                    # Write to file
-                    self.client_state[address]['file_obj'].write_chunk(content)
-                    # increment block_no
-                    self.client_state[address]['block_number'] += 1
-                    # client is active
-                    self.client_state[address]['last_active'] = time.time ()
-                elif self.client_state[address]['block_number'] == block_no:
-                    # client must have sent the duplicate DATA packet because it received no ack
-                    self.send_ack(address)
-                    # Ignore all other cases! -- # FIXME: see if there are corner cases remaining
-                # check to see if the size of packet is < MAX_SIZE
-                # If it is, gracefully disconnect the client. Close the file etc.
-                if len(data) < MAX_PACKET_SIZE:
-                    logger.info('File Transfer Complete! Wrote {} to disk'.format(
-                        self.client_state[address]['file_obj'].name
-                    ))
-                    self.disconnect_client(address)
+                self._queued.wait(wait)
+
+    def handle_group(self, data, address):
+        """A datagram sent to the multicast group: a Sender's announce or DATA, or a NAK of another Receiver"""
+        self.metrics.received(len(data))
+        op_code = codec.op_code(data)
+        session = self.client_state.get(address)
+        if op_code == codec.NAK:
+            # someone (possibly us) asked for these blocks already. Hold back our NAKs for them. NAKs of transfers we
+            # do not receive are none of our business
+            session = self._groups.get(codec.decode_nak_session(data))
+            if session is not None and codec.is_valid(op_code, data, seq_width=session.seq_width):
+                session.naks.heard(codec.decode_nak(data, session.seq_width)[1], time.monotonic())
+        elif op_code == codec.INITRQ:
+            if not codec.is_valid(op_code, data):
+                self.metrics.malformed += 1
+                return
+            file_name, options = codec.decode_initrq(data)
+            try:
+                announce = multicast.parse_announce(options, self.limits)
+            except ValueError:
+                logger.warning('Cannot receive the multicast transfer of {} from {}'.format(file_name, address),
+                               exc_info=True)
+                self.metrics.malformed += 1
+                return
+            if session is not None and session.options.get('mcast') != announce.session:
+                # the Sender's port has been reused for another transfer
+                self._close_session(self.client_state.remove(address))
+                session = None
+            if session is None:
+                session = self._join_transfer(file_name, announce, address)
+                if session is None:
+                    return
+            self.client_state.touch(session)
+            if session.transfer_complete:
+                self._send_completion(session)  # in case the last one got lost
             else:
-                logger.info('Received data from client. But Not of a valid packet type')
+                session.naks.advance(announce.sent, session.window.received, time.monotonic())
+        elif op_code == codec.DATA:
+            if session is None or session.naks is None:
+                return  # a transfer we have not heard announced yet. Its blocks are NAKed once it is
+            if not codec.is_valid(op_code, data, blksize=session.block_size, seq_width=session.seq_width):
+                self.metrics.malformed += 1
+                return
+            self.client_state.touch(session)
+            if session.transfer_complete:
+                return
+            block_no, content = codec.decode_data(data, session.seq_width)
+            actions = self.core.receive_blocks(session, [(block_no, content)])
+            session.naks.received(block_no)
+            session.naks.advance(block_no, session.window.received, time.monotonic())
+            self._carry_out(actions)  # once the file is complete, the Sender is told (see _send_ack)
+        else:
+            self.metrics.malformed += 1
 
-    def send_ack(self, address):
-        # client is active
-        self.client_state[address]['last_active'] = time.time()
-        temp_block_no = self.client_state[address]['block_number']
-        # create a awk packet. send that packet
-        temp_packet = self.packet_factory.to_bytes(type='ack', block_no=temp_block_no)
-        self.listener.socket.sendto(temp_packet, address)
+    def _join_transfer(self, file_name, announce, address):
+        """A new Session for a multicast transfer. Blocks are NAKed from the first one on. None if there is no room"""
+        if self.core.admit(address) is not None:
+            logger.warning('Not joining the multicast transfer of {} from {}'.format(file_name, address))
+            return None
+        logger.info('Creating new file with name: {} for a multicast transfer from {}'.format(file_name, address))
+        window = ReceiveWindow(multicast.final_block(announce.size, announce.block_size))
+        session = Session(address, window, announce.block_size, announce.seq_width,
+                          {'mcast': announce.session, 'tsize': announce.size}, file_name=file_name)
+        session.naks = multicast.NakScheduler()
+        session.file_obj = FileWriter(file_name, session.block_size, size=announce.size, fsync=self.fsync,
+                                      disk=self._disk())
+        self.client_state.add(session)
+        self._groups[announce.session] = session
+        return session
 
-    def disconnect_client(self, address):
+    def _send_completion(self, session):
         """
-        Strictly speaking there is no defined way of gracefully closing a UDP connection.
-        We just set the transfer_complete so that buffer is removed by clean_up function
-        :return:
+        Tell the Sender of a multicast transfer that we have every block. From our own port -- all members of the group
+        on a host send from the same (group) port
         """
-        self.client_state[address]['transfer_complete'] = True
+        packet = codec.encode_ack(session.window.final_block, session.seq_width)
+        self.listener.socket.sendto(packet, session.address)
+        self.metrics.sent(len(packet))
 
-    def _clean_up(self, purge=False):
+    def _send_naks(self):
+        """Background timer. NAKs the missing blocks of multicast transfers once they are due"""
+        while True:
+            gevent.sleep(multicast.TICK)
+            now = time.monotonic()
+            for session in list(self._groups.values()):
+                if session.transfer_complete:
+                    continue
+                blocks = session.naks.due(now, MAX_NAK_BLOCKS)
+                if not blocks:
+                    continue
+                # to the group, so the other Receivers hold back theirs, and to the Sender
+                packet = codec.encode_nak(session.options['mcast'], blocks, session.seq_width)
+                for destination in (self.group, session.address):
+                    self._group_server.socket.sendto(packet, destination)
+                    self.metrics.sent(len(packet))
+                self.metrics.naks += 1
+
+    def _disk(self):
+        """Where a new file's writes go. None -- straight to the file"""
+        return self.disk.write_behind(self.write_behind) if self.disk is not None else None
+
+    @staticmethod
+    def _decoder(accepted):
+        """Decoder of the compressed stream the client sends. None if it sends the file as is"""
+        return compression.Decoder(accepted['compress']) if 'compress' in accepted else None
+
+    def _journal(self, session):
+        """The journal of a resumable transfer. That of an earlier attempt, if there is one"""
+        options = session.options
+        previous = self._journaled.get(options['xfer'])
+        if previous is not None and self.client_state.get(previous.address) is previous:
+            # the Sender is back (from a new port) before its old session expired. The new one takes over the file
+            logger.info('Client {} resumes the transfer of client {}'.format(session.address, previous.address))
+            self.client_state.remove(previous.address)
+            self._close_session(previous)
+        self._journaled[options['xfer']] = session
+        return Journal.load(options['xfer'], session.file_name, options.get('tsize')) or \
+            Journal(options['xfer'], session.file_name, options.get('tsize'))
+
+    def _open_stripe(self, session):
+        """The file object for a stripe of a striped transfer. None if the stripe does not fit the transfer"""
+        options = session.options
+        if not all(name in options for name in striping.OPTIONS):
+            logger.warning('Stripe from client {} without its manifest {}'.format(session.address, options))
+            return None
+        key = (session.address[0], options['xfer'])
+        manifest = self.transfers.get(key)
+        if manifest is None:
+            logger.info('Creating new file with name: {} for a striped transfer of {} stripes from {}'.format(
+                session.file_name, options['stripes'], session.address[0]))
+            manifest = striping.Manifest(session.file_name, options['tsize'], options['stripes'], fsync=self.fsync,
+                                         on_close=lambda: self.transfers.pop(key, None), disk=self._disk())
+            self.transfers[key] = manifest
+        elif not manifest.matches(session.file_name, options['tsize'], options['stripes']):
+            logger.warning('Stripe from client {} does not match transfer {}'.format(session.address, key[1]))
+            return None
+        file_obj = manifest.open(options['stripe'], options['offset'], session.block_size)
+        if file_obj is None:
+            logger.warning('Stripe {} of transfer {} from client {} is invalid or already being received'.format(
+                options['stripe'], key[1], session.address))
+        return file_obj
+
+    def _open(self, session, delta=None):
         """
-        Cleanup our buffer --> client_state. Remove the entries if the client is not longer active
+        The file of a new session (core.Open). The client is sent the OACK once it is open
+        :param delta: (basis, its signature) for a session asking for a delta transfer. See _open_delta
         """
-        for client in list(self.client_state):
-            if purge is False:
-                if self.client_state[client]['inactive']() > CONN_TIMEOUT \
-                        or self.client_state[client]['transfer_complete']:
-                    _ = self.client_state.pop(client, None)
-                    logger.info('Removing client {} context. Either transfer has completed or client has been inactive '
-                                'for over {} seconds'.format(client, CONN_TIMEOUT))
+        accepted = session.options
+        file_name = session.file_name
+        if striping.requested(accepted):
+            session.file_obj = self._open_stripe(session)
+            if session.file_obj is None:
+                self._carry_out(self.core.failed(session, codec.ERR_ILLEGAL_OPERATION, 'Invalid stripe'))
+                return
+        else:
+            if delta is None and accepted.pop('delta', None):
+                gevent.spawn(self._open_delta, session)
+                return
+            basis, basis_signature = delta or (None, None)
+            journal = self._journal(session) if 'resume' in accepted else None
+            if basis is not None:
+                logger.info('Creating new file with name: {} for client {}, from a delta against {}'.format(
+                    file_name, session.address, basis))
+                session.file_obj = deltas.DeltaWriter(file_name, session.block_size, basis, basis_signature,
+                                                      fsync=self.fsync, decoder=self._decoder(accepted),
+                                                      disk=self._disk())
+                session.signature = session.file_obj.signature
+                accepted.update(delta=1, sigsize=len(session.signature))
+                writer = None
+            elif accepted.get('batch'):
+                logger.info('Creating new directory with name: {} for a batch from client {}'.format(
+                    file_name, session.address))
+                writer = batches.BatchWriter
             else:
-                _ = self.client_state.pop(client, None)
-                logger.info('Forcefully purging client {}'.format(client))
+                logger.info('Creating new file with name: {} for client {}'.format(file_name, session.address))
+                writer = FileWriter
+            # next create a file_obj to that file.
+            if writer is not None:
+                session.file_obj = writer(file_name, session.block_size, size=accepted.get('tsize'),
+                                          fsync=self.fsync, journal=journal, decoder=self._decoder(accepted),
+                                          disk=self._disk())
+            if journal is not None:
+                # the Sender starts from here. Block 1 is at this offset
+                accepted['resume'] = session.file_obj.offset
+                if session.file_obj.offset:
+                    logger.info('Resuming transfer of {} at byte {}'.format(file_name, session.file_obj.offset))
+        self._carry_out(self.core.opened(session))
+
+    def _open_delta(self, session):
+        """
+        _open() for a session asking for a delta transfer, in a greenlet of its own: finding the basis lists the
+        directory, and its signature takes reading all of it. Both in the disk pool (or the threadpool of the hub).
+        The OACK waits for them
+        """
+        pool = self.disk if self.disk is not None else gevent.get_hub().threadpool
+        try:
+            delta = pool.apply(deltas.prepare, (session.file_name,))
+        except OSError as err:
+            logger.warning('Unable to read the basis of {}: {}. Receiving it whole'.format(session.file_name, err))
+            delta = (None, None)
+        if self.client_state.get(session.address) is not session:
+            return  # dropped meanwhile
+        try:
+            self._open(session, delta)
+        except OSError as err:
+            self._carry_out(self._failed(session, err))
+
+    def _close(self, session):
+        """Publish the complete file of a session under its final name (core.Close). Then it is acknowledged"""
+        session.file_obj.close()
+        logger.info('File Transfer Complete! Wrote {} to disk'.format(session.file_obj.name))
+        self._forget(session)
+        self._carry_out(self.core.closed(session))
+
+    def send_ack(self, session):
+        if self._deferred_acks is not None:
+            self._deferred_acks[session] = True
+        else:
+            self._send_ack(session)
+
+    def _send_ack(self, session):
+        if session.naks is not None:
+            # a multicast transfer is only acknowledged once it is complete
+            self._send_completion(session)
+            return
+        temp_packet = self.core.ack(session)
+        if temp_packet is not None:
+            self.listener.socket.sendto(temp_packet, session.address)
+            self.metrics.sent(len(temp_packet))
+
+    def _clean_up(self, purge=False):
+        """
+        Cleanup our buffer --> client_state. Remove the sessions that have expired (or all of them with purge)
+        """
+        if purge is False:
+            self._carry_out(self.core.expire(time.monotonic()))
+            for manifest in list(self.transfers.values()):
+                if manifest.expired():
+                    # stripes that never showed up
+                    manifest.expire()
+        else:
+            logger.info('Forcefully purging {} client(s)'.format(len(self.client_state)))
+            self._carry_out(self.core.close())
+            for manifest in list(self.transfers.values()):
+                manifest.expire()
+
+    def _close_session(self, session):
+        """An incomplete file is left behind under its temporary name"""
+        try:
+            if session.file_obj is not None:
+                session.file_obj.abort()
+        except Exception:
+            # one session going wrong must not take the rest (or the expiry timer) with it
+            logger.exception('Unable to close the file of client {}'.format(session.address))
+        self._forget(session)
+
+    def _forget(self, session):
+        xfer = session.options.get('xfer')
+        if xfer is not None and self._journaled.get(xfer) is session:
+            del self._journaled[xfer]
+        if session.naks is not None and self._groups.get(session.options['mcast']) is session:
+            del self._groups[session.options['mcast']]
+        self.scheduler.forget(session)
+
+    def _expire_sessions(self):
+        """Background timer. Sessions are expired here -- not on the packet path. So is the summary logged"""
+        summary = metrics.Summary(time.monotonic())
+        while True:
+            gevent.sleep(EXPIRY_INTERVAL)
+            try:
+                self._clean_up()
+            except Exception:
+                logger.exception('Unable to expire sessions')
+            if summary.due(time.monotonic()) and self.metrics.packets_received:
+                logger.info(summary.line(self.stats(), time.monotonic()))
 
     def start(self, host, port):
         conn = (host, port)
         sock = gevent.socket.socket(gevent.socket.AF_INET, gevent.socket.SOCK_DGRAM)
         sock.settimeout(self.timeout)
+        # a whole window of (large) DATA packets may arrive in one burst. The kernel caps this at net.core.rmem_max
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+        if self.reuse_port:
+            # the kernel spreads clients across every socket bound to the port, by a hash of their address
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         sock.bind(conn)
-        self.listener = DatagramServer(sock, self.handle)
+        if self.batched and batch_io.supports_batched_recv(sock):
+            self.listener = BatchDatagramServer(sock, self.handle_batch)
+        else:
+            self.listener = LargeDatagramServer(sock, self.handle)
+        if self.disk_threads:
+            self.disk = disk_io.DiskPool(self.disk_threads)
+        if self.group is not None:
+            group_sock = gevent.socket.socket(gevent.socket.AF_INET, gevent.socket.SOCK_DGRAM)
+            group_sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+            multicast.group_socket(group_sock, self.group, host or '0.0.0.0')
+            logger.info('Joined multicast group {}:{}'.format(*self.group))
+            self._group_server = LargeDatagramServer(group_sock, self.handle_group)
+            self._group_server.start()
+            self._nak_timer = gevent.spawn(self._send_naks)
+        self._expiry = gevent.spawn(self._expire_sessions)
+        if self.scheduler.shaping:
+            self._dispatcher = gevent.spawn(self._dispatch)
+        if self.metrics_port is not None:
+            self._metrics_server = metrics.serve((host, self.metrics_port), self.stats)
         try:
             self.listener.serve_forever()
         except PYGFTError:
@@ -332,5 +1202,17 @@ class Receiver(object):
         """Clean up."""
         # Delete files if transfer not complete?
         # Do anything else?
+        if self._expiry is not None:
+            self._expiry.kill()
+        if self._nak_timer is not None:
+            self._nak_timer.kill()
+        if self._dispatcher is not None:
+            self._dispatcher.kill()
+        if self._group_server is not None:
+            self._group_server.close()
+        if self._metrics_server is not None:
+            self._metrics_server.stop()
         self._clean_up(purge=True)
         self.listener.close()
+        if self.disk is not None:
+            self.disk.kill()
@@ -0,0 +1,55 @@
+"""
+Round trip time estimation and retransmission timeout (RTO) for the Sender. Follows rfc6298:
+- SRTT and RTTVAR are smoothed with alpha=1/8, beta=1/4. RTO = SRTT + max(G, 4 * RTTVAR)
+- Every timeout doubles the RTO (exponential backoff) till a new measurement comes in
+- Only packets that were sent once are measured (Karn's algorithm) -- that is up to the caller
+
+All the times are in seconds, measured with time.monotonic()
+"""
+import time
+
+from pygftlib import NO_RESPONSE_TIME, MIN_RTO, MAX_RTO
+
+ALPHA = 1 / 8
+BETA = 1 / 4
+K = 4
+CLOCK_GRANULARITY = time.get_clock_info('monotonic').resolution
+
+
+class RTTEstimator(object):
+    def __init__(self, initial_rto=NO_RESPONSE_TIME, min_rto=MIN_RTO, max_rto=MAX_RTO):
+        self.srtt = None  # smoothed round trip time
+        self.rttvar = None  # round trip time variation
+        self.latest = None  # most recent measurement
+        self.samples = 0
+        self.backoff = 0  # number of timeouts since the last measurement
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self._rto = initial_rto
+
+    def __str__(self):
+        if self.srtt is None:
+            return 'RTT: no samples | RTO = %.3fs' % self.rto
+        return 'RTT: srtt = %.6fs | rttvar = %.6fs | RTO = %.3fs' % (self.srtt, self.rttvar, self.rto)
+
+    def sample(self, rtt):
+        """Update the estimate with a new round trip time measurement"""
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - BETA) * self.rttvar + BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - ALPHA) * self.srtt + ALPHA * rtt
+        self._rto = self.srtt + max(CLOCK_GRANULARITY, K * self.rttvar)
+        self.latest = rtt
+        self.samples += 1
+        self.backoff = 0
+
+    def timeout(self):
+        """The retransmission timer expired. Back off"""
+        self.backoff += 1
+
+    @property
+    def rto(self):
+        """Current retransmission timeout (with backoff applied)"""
+        return min(self.max_rto, max(self.min_rto, self._rto) * 2 ** self.backoff)
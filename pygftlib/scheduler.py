@@ -0,0 +1,197 @@
+"""
+Admission control and fair scheduling for the Receiver. Without it, DATA is handled in the order it arrives: a Sender
+that sends faster than the others gets more of the Receiver's CPU and disk, and every INITRQ opens a file.
+
+- Admission: a new session is turned down -- with an ERR, before a file is opened for it -- once max_sessions are in
+  progress, once its host has max_client_sessions of them, or while more than OVERLOAD of the queued DATA (below) is
+  waiting.
+- Rate limits: token buckets per client host (client_rate) and per subnet (subnet_rate, subnets of subnet_prefix
+  bits), in bytes per second. DATA over the limit waits in its session's queue; the Receiver acknowledges it once it
+  is handled, so the Sender slows down to the rate (its window fills up). DATA that does not fit in the queue
+  (queue_size packets) is dropped and sent again by the Sender.
+- Fair share: the queues are served by deficit round robin, weight * QUANTUM bytes per session per round. A session's
+  weight is that of the most specific network of priorities its host is in (1 if none).
+- With none of rate limits, priorities or fair_share set, DATA is not queued at all (shaping is False): it is handled
+  straight away, as it arrives. Admission applies either way.
+"""
+import collections
+import ipaddress
+
+from pygftlib import MAX_SESSIONS, MAX_CLIENT_SESSIONS, SCHEDULER_QUEUE
+from pygftlib.congestion import TokenBucket
+
+import logging
+logger = logging.getLogger(__name__)
+
+QUANTUM = 16 * 1024  # bytes a session of weight 1 may have handled per round
+OVERLOAD = 0.5  # share of the queues (all sessions together) that may fill up before new sessions are turned down
+SUBNET_PREFIX = 24  # bits of the address that make a subnet, for subnet_rate
+RATE_BURST = 0.05  # seconds worth of its rate a client (or subnet) may send at once
+DISPATCH_ROUND = 64  # queued packets the Receiver handles before it acknowledges them and reads more
+
+
+def parse_priority(x):
+    """'10.0.0.0/8=4' -> ('10.0.0.0/8', 4). For argparse"""
+    network, _, weight = str(x).rpartition('=')
+    try:
+        ipaddress.ip_network(network, strict=False)
+        weight = int(weight)
+    except ValueError:
+        raise ValueError('Not a network=weight -- {}'.format(x))
+    if weight < 1:
+        raise ValueError('Weights are 1 or more -- {}'.format(x))
+    return network, weight
+
+
+class Flow(object):
+    """The queue of DATA of one session"""
+    __slots__ = ('key', 'packets', 'weight', 'deficit', 'limits', 'buckets', 'ready_at')
+
+    def __init__(self, key, weight, limits, buckets):
+        self.key = key
+        self.packets = collections.deque()
+        self.weight = weight
+        self.deficit = 0  # bytes it may have handled before its turn is over
+        self.limits = limits  # what its DATA is charged to: ('client', host) and ('subnet', subnet)
+        self.buckets = buckets  # their token buckets
+        self.ready_at = 0  # (monotonic) time before which it is over its rate
+
+
+class Scheduler(object):
+    """See the module docstring. Sessions are identified by key (any hashable), their clients by address"""
+
+    def __init__(self, max_sessions=MAX_SESSIONS, max_client_sessions=MAX_CLIENT_SESSIONS, client_rate=None,
+                 subnet_rate=None, subnet_prefix=SUBNET_PREFIX, priorities=None, fair_share=False,
+                 queue_size=SCHEDULER_QUEUE):
+        self.max_sessions = max_sessions
+        self.max_client_sessions = max_client_sessions
+        self.client_rate = client_rate
+        self.subnet_rate = subnet_rate
+        self.subnet_prefix = subnet_prefix
+        # (network, weight), most specific first
+        self.priorities = sorted(((ipaddress.ip_network(network, strict=False), weight)
+                                  for network, weight in (priorities or {}).items()),
+                                 key=lambda priority: -priority[0].prefixlen)
+        self.queue_size = queue_size
+        self.shaping = bool(client_rate or subnet_rate or self.priorities or fair_share)
+        self.queued = 0  # packets waiting, all sessions together
+        self._flows = {}  # key -> Flow
+        self._active = collections.deque()  # Flows with packets waiting. The one at the front has its turn
+        self._topped_up = False  # True once the front Flow has been given its quantum for this turn
+        self._buckets = {}  # ('client', host) or ('subnet', subnet) -> TokenBucket
+        self._users = collections.Counter()  # the same -> number of Flows charged to it
+        self._capacity = 0  # queue_size per session
+
+    def admit(self, sessions, client_sessions):
+        """
+        :param sessions: sessions in progress
+        :param client_sessions: of them, those of the host asking for another one
+        :return: None if a new session may start. Otherwise why not
+        """
+        if sessions >= self.max_sessions:
+            return 'Too many transfers in progress'
+        if self.max_client_sessions is not None and client_sessions >= self.max_client_sessions:
+            return 'Too many transfers in progress from this host'
+        if self.shaping and self.queued > OVERLOAD * max(self._capacity, self.queue_size):
+            return 'Server overloaded'
+        return None
+
+    def weight(self, address):
+        """Weight of the sessions of a client. That of the most specific network in priorities it is in"""
+        if self.priorities:
+            host = ipaddress.ip_address(address[0])
+            for network, weight in self.priorities:
+                if host.version == network.version and host in network:
+                    return weight
+        return 1
+
+    def enqueue(self, key, address, packet):
+        """:return: False if the packet was dropped -- the session's queue is full"""
+        flow = self._flows.get(key)
+        if flow is None:
+            limits = self._limits(address)
+            buckets = [self._bucket(*limit) for limit in limits]
+            flow = self._flows[key] = Flow(key, self.weight(address), limits, buckets)
+            self._capacity += self.queue_size
+        if len(flow.packets) >= self.queue_size:
+            return False
+        if not flow.packets:
+            self._active.append(flow)
+        flow.packets.append(packet)
+        self.queued += 1
+        return True
+
+    def next(self, now):
+        """
+        The next packet to handle, in deficit round robin order. Sessions over their rate are passed over.
+        :return: (key, packet), or (None, seconds till one of the sessions may go on). (None, None) if nothing is queued
+        """
+        wait = None
+        passed_over = 0
+        while self._active and passed_over <= len(self._active):
+            flow = self._active[0]
+            if flow.ready_at > now:
+                wait = flow.ready_at - now if wait is None else min(wait, flow.ready_at - now)
+                self._next_turn()
+                passed_over += 1
+                continue
+            size = len(flow.packets[0])
+            if flow.deficit < size and not self._topped_up:
+                flow.deficit += QUANTUM * flow.weight
+                self._topped_up = True
+            if flow.deficit < size:
+                self._next_turn()
+                continue
+            flow.deficit -= size
+            packet = flow.packets.popleft()
+            self.queued -= 1
+            delay = max(bucket.reserve(size, now) for bucket in flow.buckets) if flow.buckets else 0
+            if delay:
+                flow.ready_at = now + delay
+            if not flow.packets:
+                flow.deficit = 0
+                self._active.popleft()
+                self._topped_up = False
+            return flow.key, packet
+        return None, wait
+
+    def forget(self, key):
+        """The session is over. :return: its packets that were still waiting"""
+        flow = self._flows.pop(key, None)
+        if flow is None:
+            return []
+        self._capacity -= self.queue_size
+        for limit in flow.limits:
+            self._users[limit] -= 1
+            if not self._users[limit]:
+                # nothing of it left to limit. A client that comes back starts afresh
+                del self._users[limit], self._buckets[limit]
+        if flow.packets:
+            if self._active[0] is flow:
+                self._topped_up = False
+            self._active.remove(flow)
+            self.queued -= len(flow.packets)
+        return list(flow.packets)
+
+    def _next_turn(self):
+        self._active.rotate(-1)
+        self._topped_up = False
+
+    def _limits(self, address):
+        """What a client's DATA is charged to"""
+        limits = []
+        if self.client_rate:
+            limits.append(('client', address[0]))
+        if self.subnet_rate:
+            subnet = ipaddress.ip_network('{}/{}'.format(address[0], self.subnet_prefix), strict=False)
+            limits.append(('subnet', subnet))
+        return limits
+
+    def _bucket(self, kind, what):
+        limit = (kind, what)
+        bucket = self._buckets.get(limit)
+        if bucket is None:
+            rate = self.client_rate if kind == 'client' else self.subnet_rate
+            bucket = self._buckets[limit] = TokenBucket(rate, rate * RATE_BURST)
+        self._users[limit] += 1
+        return bucket
@@ -0,0 +1,137 @@
+"""
+Per client state of the Receiver, and expiry of clients that have gone quiet.
+
+Expiry runs off a heap of deadlines, checked by a background timer -- not on the packet path. A packet only updates
+the last_active timestamp of its session. When a deadline comes up, the session's real deadline is recomputed from
+last_active; sessions that have been active since are pushed back onto the heap instead of being expired. So a
+session has one heap entry (two for a while after reschedule()), and the per packet cost does not depend on the
+number of sessions.
+"""
+import collections
+import heapq
+import itertools
+import time
+
+from pygftlib import CONN_TIMEOUT, MAX_NO_RESPONSE_TIME
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class Session(object):
+    """A client of the Receiver. One per (host, port)"""
+    __slots__ = ('address', 'transfer_complete', 'window', 'block_size', 'seq_width', 'options', 'file_obj',
+                 'file_name', 'last_active', 'fec', 'naks', 'waiting', 'signature')
+
+    def __init__(self, address, window, block_size, seq_width, options, file_name=None, file_obj=None):
+        self.address = address
+        self.transfer_complete = False
+        self.window = window
+        self.block_size = block_size
+        self.seq_width = seq_width
+        self.options = options  # options accepted in the OACK
+        self.file_name = file_name
+        self.file_obj = file_obj
+        self.last_active = time.monotonic()
+        self.fec = None  # fec.ParityDecoder, if the client sends PARITY packets
+        self.naks = None  # multicast.NakScheduler, if the client multicasts the file to a group we joined
+        self.waiting = False  # True while its file is being opened or closed. The client is not answered meanwhile
+        self.signature = None  # of our copy of the file, for a delta transfer (see pygftlib.delta)
+
+    def __str__(self):
+        return 'Session {}: {} | complete = {}'.format(self.address, self.file_name, self.transfer_complete)
+
+    def inactive(self, now=None):
+        """Seconds since the client was last heard from"""
+        return (time.monotonic() if now is None else now) - self.last_active
+
+    @property
+    def deadline(self):
+        """When the session expires, unless the client is heard from before that"""
+        # a completed session only lingers to acknowledge retransmissions of the last block
+        return self.last_active + (MAX_NO_RESPONSE_TIME if self.transfer_complete else CONN_TIMEOUT)
+
+
+class SessionTable(object):
+    """
+    Sessions by address (a dict) plus a heap of expiry deadlines.
+    - add(session) / get(address) / [address] / remove(address) / in / len / iteration over addresses -- like a dict
+    - touch(session) -- the client is active. O(1), the heap is left alone
+    - reschedule(session) -- its deadline moved closer (e.g. transfer complete). Pushes an extra heap entry
+    - expire(now) -- remove and return the sessions that have expired
+    - in_progress(host) -- sessions whose transfer is not complete yet. Of all hosts, or of one
+    """
+
+    def __init__(self):
+        self._sessions = {}
+        self._heap = []  # (deadline, tie-breaker, session)
+        self._counter = itertools.count()
+        self._in_progress = set()  # addresses of the sessions whose transfer is not complete
+        self._hosts = collections.Counter()  # host -> number of them
+
+    def add(self, session):
+        self._uncount(session.address)  # the session it replaces
+        self._sessions[session.address] = session
+        if not session.transfer_complete:
+            self._in_progress.add(session.address)
+            self._hosts[session.address[0]] += 1
+        self._push(session)
+
+    def get(self, address):
+        return self._sessions.get(address)
+
+    def __getitem__(self, address):
+        return self._sessions[address]
+
+    def remove(self, address):
+        self._uncount(address)
+        return self._sessions.pop(address, None)
+
+    def touch(self, session, now=None):
+        session.last_active = time.monotonic() if now is None else now
+
+    def reschedule(self, session):
+        if session.transfer_complete and self._sessions.get(session.address) is session:
+            self._uncount(session.address)
+        self._push(session)
+
+    def in_progress(self, host=None):
+        return len(self._in_progress) if host is None else self._hosts[host]
+
+    def _uncount(self, address):
+        if address in self._in_progress:
+            self._in_progress.remove(address)
+            self._hosts[address[0]] -= 1
+            if not self._hosts[address[0]]:
+                del self._hosts[address[0]]
+
+    def _push(self, session):
+        heapq.heappush(self._heap, (session.deadline, next(self._counter), session))
+
+    def expire(self, now=None):
+        """
+        :return: list of sessions that have expired (they are removed from the table)
+        """
+        now = time.monotonic() if now is None else now
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            _, _, session = heapq.heappop(self._heap)
+            if self._sessions.get(session.address) is not session:
+                continue  # already removed or replaced by a new session from the same address
+            deadline = session.deadline
+            if deadline <= now:
+                self._uncount(session.address)
+                del self._sessions[session.address]
+                expired.append(session)
+            else:
+                heapq.heappush(self._heap, (deadline, next(self._counter), session))
+        return expired
+
+    def __contains__(self, address):
+        return address in self._sessions
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __iter__(self):
+        return iter(list(self._sessions))
@@ -0,0 +1,159 @@
+"""
+Striped transfers: a large file is split into byte ranges (stripes) that are sent at the same time, each by its own
+Sender over its own socket. To the Receiver every stripe is a session of its own; they only share the file.
+
+- Each stripe's INITRQ carries the manifest of the transfer as options: xfer (a random transfer id), stripes (how
+  many there are), stripe (which one this is), offset (where it starts in the file) and tsize (size of the file).
+- DATA blocks of a stripe are numbered from 1 at its offset. A stripe ends with a short block, like any transfer.
+- The Receiver keeps a Manifest per (client host, xfer). Once every stripe is complete -- and together they cover
+  the whole file -- the file is published. Until then it stays under its .part name.
+- A Receiver that does not know about stripes drops the options. The Sender of the stripe then gives up rather than
+  have the stripes end up in separate files.
+
+The sending side is protocol.StripedSender.
+"""
+import collections
+import random
+import time
+
+from pygftlib import STREAMS, DATA_SIZE, CONN_TIMEOUT
+from pygftlib.file_io import FileWriter, FileRange
+
+import logging
+logger = logging.getLogger(__name__)
+
+# one stripe of a transfer. size is the size of the whole file
+Stripe = collections.namedtuple('Stripe', 'transfer_id index count offset length size')
+
+OPTIONS = ('xfer', 'stripes', 'stripe', 'offset', 'tsize')  # options every stripe's INITRQ carries
+
+
+def split(size, streams=STREAMS, block_size=DATA_SIZE, transfer_id=None):
+    """
+    Split a file of size bytes into up to streams stripes of (about) the same length. Stripes start at a multiple of
+    block_size, so only the last block of the file is a short one.
+    :return: list of Stripe
+    """
+    transfer_id = random.getrandbits(63) if transfer_id is None else transfer_id
+    blocks = -(-size // block_size)
+    count = max(1, min(streams, blocks))
+    bounds = [(blocks * i // count) * block_size for i in range(count)] + [size]
+    return [Stripe(transfer_id, i, count, bounds[i], bounds[i + 1] - bounds[i], size) for i in range(count)]
+
+
+def options(stripe):
+    """INITRQ options describing a stripe"""
+    return {'xfer': stripe.transfer_id, 'stripes': stripe.count, 'stripe': stripe.index, 'offset': stripe.offset,
+            'tsize': stripe.size}
+
+
+def requested(accepted):
+    """True if the options accepted for an INITRQ make it a stripe of a striped transfer"""
+    return 'stripes' in accepted
+
+
+class StripeWriter(FileRange):
+    """Where the blocks of one stripe go. Reports back to its Manifest once the stripe is complete (or given up on)"""
+
+    def __init__(self, manifest, index, offset, chunk_size):
+        super(StripeWriter, self).__init__(manifest.writer, offset, chunk_size)
+        self.manifest = manifest
+        self.index = index
+
+    def close(self):
+        if not self.closed:
+            try:
+                super(StripeWriter, self).close()
+            except OSError:
+                self.manifest.abort(self)
+                raise
+            self.manifest.finish(self)
+
+    def abort(self):
+        if not self.closed:
+            super(StripeWriter, self).abort()
+            self.manifest.abort(self)
+
+
+class Manifest(object):
+    """
+    Receiver side of a striped transfer: the file being assembled and what has been received of it.
+    on_close() is called once the file has been published or given up on.
+    """
+
+    def __init__(self, file_name, size, stripes, fsync=None, on_close=None, disk=None):
+        self.file_name = file_name
+        self.size = size
+        self.stripes = stripes
+        self.writer = FileWriter(file_name, DATA_SIZE, size=size, fsync=fsync, disk=disk)
+        self.on_close = on_close
+        self.active = set()  # stripes being received
+        self.received = {}  # stripe -> (offset, length) of the stripes that are complete
+        self.last_active = time.monotonic()
+
+    def matches(self, file_name, size, stripes):
+        """True if a stripe's INITRQ describes this same transfer"""
+        return (file_name, size, stripes) == (self.file_name, self.size, self.stripes)
+
+    def open(self, index, offset, chunk_size):
+        """
+        :return: a StripeWriter for the stripe. None if the stripe is already being (or has been) received or does
+                 not fit in the file
+        """
+        if index >= self.stripes or index in self.active or index in self.received or offset > self.size:
+            return None
+        self.active.add(index)
+        self.last_active = time.monotonic()
+        return StripeWriter(self, index, offset, chunk_size)
+
+    @property
+    def complete(self):
+        """Every stripe has been received, and together they cover the whole file"""
+        if len(self.received) != self.stripes:
+            return False
+        end = 0
+        for offset, length in sorted(self.received.values()):
+            if offset > end:
+                return False
+            end = max(end, offset + length)
+        return end == self.size
+
+    def finish(self, stripe):
+        self.active.discard(stripe.index)
+        self.received[stripe.index] = (stripe.offset, stripe.length)
+        self.last_active = time.monotonic()
+        logger.info('Stripe {} of {} complete ({} of {})'.format(stripe.index + 1, self.stripes, len(self.received),
+                                                                 self.stripes))
+        if len(self.received) == self.stripes:
+            try:
+                if self.complete:
+                    self.writer.close()
+                    logger.info('Striped transfer complete! Wrote {} to disk'.format(self.writer.name))
+                else:
+                    logger.warning('The stripes of {} do not cover the whole file. Leaving it as {}'.format(
+                        self.file_name, self.writer.part_name))
+                    self.writer.abort()
+            finally:
+                self._closed()
+
+    def abort(self, stripe):
+        """A stripe was given up on. The file cannot be completed any more, once the other stripes are done with it"""
+        self.active.discard(stripe.index)
+        if not self.active:
+            self.expire()
+
+    def expired(self, now=None):
+        """True if no stripe has been active for CONN_TIMEOUT -- the ones missing are not going to show up"""
+        return not self.active and (time.monotonic() if now is None else now) - self.last_active > CONN_TIMEOUT
+
+    def expire(self):
+        """Give up on the file. It is left behind under its temporary name"""
+        if not self.writer.closed:
+            logger.info('Giving up on striped transfer of {}. {} of {} stripes received'.format(
+                self.file_name, len(self.received), self.stripes))
+            self.writer.abort()
+            self._closed()
+
+    def _closed(self):
+        if self.on_close is not None:
+            self.on_close()
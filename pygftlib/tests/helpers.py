@@ -0,0 +1,25 @@
+from pygftlib.protocol import Receiver
+from pygftlib.packet_factory import PacketFactory
+
+
+class LossyReceiver(Receiver):
+    """
+    Drops the first copy of the given DATA blocks. Keeps count of them (dropped) and of the copies sent again (resent)
+    """
+
+    def __init__(self, drop, **kwargs):
+        super(LossyReceiver, self).__init__(**kwargs)
+        self.drop = set(drop)
+        self.dropped = set()
+        self.resent = []
+
+    def handle(self, data, address):
+        if PacketFactory.check_type('data', data):
+            block_no = PacketFactory.from_bytes(data)[0]
+            if block_no in self.drop:
+                self.drop.discard(block_no)
+                self.dropped.add(block_no)
+                return
+            if block_no in self.dropped:
+                self.resent.append(block_no)
+        super(LossyReceiver, self).handle(data, address)
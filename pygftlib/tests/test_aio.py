@@ -0,0 +1,156 @@
+import unittest
+from pygftlib import aio
+from pygftlib.exceptions import ProtocolException
+from pygftlib.file_io import FileReader, FileWriter
+from unittest import mock
+import asyncio
+import errno
+import threading
+import multiprocessing
+import os
+import sys
+import shutil
+import tempfile
+import filecmp
+import time
+from slugify import slugify
+
+# the gevent side runs in processes of its own, so that the test does not depend on the two event loops sharing a
+# thread. Started with 'spawn', as the ReceiverPool workers of other tests are
+spawn = multiprocessing.get_context('spawn')
+
+
+def receive(port, directory):
+    from pygftlib.protocol import Receiver
+    os.chdir(directory)
+    Receiver().start('127.0.0.1', port)
+
+
+def send(path, port, block_size):
+    from pygftlib.protocol import Sender
+    sender = Sender(path, block_size=block_size)
+    sender.upload('127.0.0.1', port)
+    sys.exit(0 if sender.transfer_complete else 1)
+
+
+def imports_gevent():
+    import pygftlib.aio  # noqa: F401
+    sys.exit(any(name.startswith('gevent') for name in sys.modules))
+
+
+class TestAsyncio(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'aio-test.bin')
+        with open(self.path, 'wb') as f:
+            f.write(os.urandom(200000))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        for name in os.listdir('.'):
+            if slugify('aio-test') in name:
+                os.remove(name)
+
+    def assertReceived(self, directory='.', count=1):
+        received = [name for name in os.listdir(directory) if name.endswith(slugify(self.path))]
+        self.assertEqual(len(received), count)
+        for name in received:
+            self.assertTrue(filecmp.cmp(os.path.join(directory, name), self.path, shallow=False))
+
+    def start(self, target, *args):
+        process = spawn.Process(target=target, args=args, daemon=True)
+        process.start()
+        return process
+
+    def test_transfer(self):
+        async def main():
+            transport, receiver = await aio.serve('127.0.0.1', 12404)
+            try:
+                sent = await asyncio.gather(aio.send_file(self.path, '127.0.0.1', 12404, block_size=1400),
+                                            aio.send_file(self.path, '127.0.0.1', 12404))  # the original protocol
+            finally:
+                transport.close()
+            return sent, receiver.stats()
+        sent, stats = asyncio.run(main())
+        self.assertEqual(sent, [200000, 200000])
+        self.assertEqual(stats['completed'], 2)
+        self.assertReceived(count=2)
+
+    def test_no_receiver(self):
+        default, aio.MAX_NO_RESPONSE_TIME = aio.MAX_NO_RESPONSE_TIME, 1
+        try:
+            self.assertRaises(ProtocolException, asyncio.run, aio.send_file(self.path, '127.0.0.1', 12405))
+        finally:
+            aio.MAX_NO_RESPONSE_TIME = default
+
+    def test_off_the_loop(self):
+        # the files are written and read in the executor, not on the event loop
+        threads = []
+        pwritev, read_chunk = os.pwritev, FileReader.read_chunk
+
+        def write(*args):
+            threads.append(('write', threading.get_ident()))
+            return pwritev(*args)
+
+        def read(*args):
+            threads.append(('read', threading.get_ident()))
+            return read_chunk(*args)
+
+        async def main():
+            transport, receiver = await aio.serve('127.0.0.1', 12408)
+            try:
+                with mock.patch('os.pwritev', write), mock.patch.object(FileReader, 'read_chunk', read):
+                    return await aio.send_file(self.path, '127.0.0.1', 12408, block_size=1400)
+            finally:
+                transport.close()
+        self.assertEqual(asyncio.run(main()), 200000)
+        self.assertEqual({kind for kind, _ in threads}, {'read', 'write'})
+        self.assertNotIn(threading.get_ident(), [thread for _, thread in threads])
+        self.assertReceived()
+
+    def test_disk_full(self):
+        # a Receiver unable to finish the file answers with an ERR, not the final ACK
+        async def main():
+            transport, receiver = await aio.serve('127.0.0.1', 12409)
+            try:
+                with mock.patch.object(FileWriter, '_finish', side_effect=OSError(errno.ENOSPC, 'No space left')):
+                    with self.assertRaises(ProtocolException):
+                        await aio.send_file(self.path, '127.0.0.1', 12409, block_size=1400)
+            finally:
+                transport.close()
+            return receiver.stats()
+        self.assertEqual(asyncio.run(main())['completed'], 0)
+
+    def test_gevent_receiver(self):
+        receiver = self.start(receive, 12406, self.root)
+        try:
+            time.sleep(1)
+            self.assertEqual(asyncio.run(aio.send_file(self.path, '127.0.0.1', 12406, block_size=1000)), 200000)
+        finally:
+            receiver.terminate()
+            receiver.join()
+        self.assertReceived(self.root)
+
+    def test_gevent_sender(self):
+        async def main():
+            transport, receiver = await aio.serve('127.0.0.1', 12407)
+            try:
+                sender = self.start(send, self.path, 12407, 1000)
+                while sender.exitcode is None:
+                    await asyncio.sleep(0.05)
+            finally:
+                transport.close()
+            return sender.exitcode
+        self.assertEqual(asyncio.run(main()), 0)
+        self.assertReceived()
+
+    def test_without_gevent(self):
+        # importing the asyncio backend leaves the process alone
+        process = self.start(imports_gevent)
+        process.join()
+        self.assertEqual(process.exitcode, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import unittest
+from pygftlib.protocol import Sender, Receiver
+from pygftlib import batch
+from pygftlib.exceptions import MalformedPacketException
+import os
+import stat
+import shutil
+import tempfile
+import filecmp
+import gevent
+from slugify import slugify
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.tree = os.path.join(self.root, 'batch-test')
+        os.makedirs(os.path.join(self.tree, 'src', 'pkg'))
+        os.makedirs(os.path.join(self.tree, 'empty'))
+        for i in range(50):
+            with open(os.path.join(self.tree, 'src', 'pkg', 'module{}.py'.format(i)), 'wb') as f:
+                f.write(os.urandom(i * 7))  # small files. Many of them share a DATA block
+        with open(os.path.join(self.tree, 'big.bin'), 'wb') as f:
+            f.write(os.urandom(5000))
+        with open(os.path.join(self.tree, 'run.sh'), 'wb') as f:
+            f.write(b'#!/bin/sh\n')
+        os.chmod(os.path.join(self.tree, 'run.sh'), 0o755)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        for name in os.listdir('.'):
+            if slugify('batch-test') in name:
+                if os.path.isdir(name):
+                    shutil.rmtree(name)
+                else:
+                    os.remove(name)
+
+    def assertSameTree(self, left, right):
+        comparison = filecmp.dircmp(left, right)
+        self.assertEqual((comparison.left_only, comparison.right_only, comparison.diff_files), ([], [], []))
+        _, mismatch, errors = filecmp.cmpfiles(left, right, comparison.common_files, shallow=False)
+        self.assertEqual((mismatch, errors), ([], []))
+        for name in comparison.common_files:
+            self.assertEqual(stat.S_IMODE(os.stat(os.path.join(left, name)).st_mode),
+                             stat.S_IMODE(os.stat(os.path.join(right, name)).st_mode))
+        for name in comparison.common_dirs:
+            self.assertSameTree(os.path.join(left, name), os.path.join(right, name))
+
+    def test_stream(self):
+        entries = batch.scan(self.tree)
+        names = [name for name, _, _ in entries]
+        self.assertIn('src/pkg/module3.py', names)
+        self.assertIn('empty', names)
+        reader = batch.BatchReader(entries)
+        stream = b''.join(iter(lambda: reader.read_chunk(100), b''))
+        self.assertEqual(len(stream), reader.size)
+        header = batch.pack_manifest(entries)
+        self.assertTrue(stream.startswith(header))
+        self.assertEqual([(name, mode) for name, _, mode in batch.unpack_manifest(header[8:])],
+                         [(name, st.st_mode) for name, _, st in entries])
+
+    def test_safe_path(self):
+        self.assertEqual(batch.safe_path('root', 'a/b'), os.path.join('root', 'a', 'b'))
+        for name in ('../etc/passwd', '/etc/passwd', 'a/../../b', 'a//b', ''):
+            self.assertRaises(MalformedPacketException, batch.safe_path, 'root', name)
+
+    def test_directory(self):
+        receiver = Receiver()
+        worker = gevent.spawn(receiver.start, '127.0.0.1', 12397)
+        sender = Sender(self.tree, batch=True)
+        gevent.spawn(sender.upload, '127.0.0.1', 12397).join(timeout=10)
+        receiver.stop()
+        worker.kill()
+        self.assertTrue(sender.transfer_complete)
+        self.assertEqual(receiver.stats()['completed'], 1)  # a single session
+        received = [name for name in os.listdir('.') if name.endswith(slugify('batch-test'))]
+        self.assertEqual(len(received), 1)
+        self.assertSameTree(self.tree, received[0])
+
+    def test_files(self):
+        receiver = Receiver()
+        worker = gevent.spawn(receiver.start, '127.0.0.1', 12398)
+        files = [os.path.join(self.tree, 'big.bin'), os.path.join(self.tree, 'run.sh')]
+        sender = Sender(files, batch=True, block_size=1000)
+        gevent.spawn(sender.upload, '127.0.0.1', 12398).join(timeout=10)
+        receiver.stop()
+        worker.kill()
+        self.assertTrue(sender.transfer_complete)
+        received = [name for name in os.listdir('.') if name.endswith(' - batch')]
+        self.assertEqual(len(received), 1)
+        self.assertEqual(sorted(os.listdir(received[0])), ['big.bin', 'run.sh'])
+        for path in files:
+            self.assertTrue(filecmp.cmp(path, os.path.join(received[0], os.path.basename(path)), shallow=False))
+        shutil.rmtree(received[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+from pygftlib.protocol import Sender, Receiver, BatchDatagramServer, LargeDatagramServer
+from pygftlib import batch_io
+import os
+import sys
+import socket
+import filecmp
+import gevent
+from slugify import slugify
+
+current_dir = os.path.abspath(os.path.dirname(__file__))
+path = os.path.join(current_dir, "data.txt")
+
+LINUX = sys.platform.startswith('linux')
+
+
+def udp_pair():
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(('127.0.0.1', 0))
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender.connect(receiver.getsockname())
+    return sender, receiver
+
+
+class TestBatchIO(unittest.TestCase):
+
+    @unittest.skipUnless(LINUX, 'UDP_SEGMENT is linux only')
+    def test_segments(self):
+        packets = [b'a' * 100, (b'bb', b'b' * 98), b'c' * 10]
+        for gro in (True, False):
+            sender, receiver = udp_pair()
+            reader = batch_io.DatagramReader(receiver, gro=gro)
+            if not batch_io.supports_gso(sender):
+                self.skipTest('UDP_SEGMENT is not available')
+            batch_io.send_segments(sender, packets)
+            receiver.settimeout(1)
+            receiver.recvmsg_into([bytearray(0)], 0, socket.MSG_PEEK)  # wait for it
+            receiver.setblocking(False)
+            # split up into the original datagrams. Whether or not the kernel coalesced them
+            self.assertEqual([data for data, _ in reader.read()], [b'a' * 100, b'b' * 100, b'c' * 10])
+            self.assertEqual(reader.read(), [])
+            sender.close()
+            receiver.close()
+
+    def test_next_packets(self):
+        sender = Sender(path)
+        sender.gso = True
+        for packet in [b'a' * 10, (b'b' * 4, b'b' * 6), b'c' * 10, b'd' * 5, b'e' * 10, b'f' * 20]:
+            sender._send_queue.put(packet)
+        self.assertEqual(len(sender._next_packets()), 4)  # the short one ends the run
+        self.assertEqual(sender._next_packets(), [b'e' * 10])  # f is larger
+        sender.gso = False
+        self.assertEqual(sender._next_packets(), [b'f' * 20])
+
+    def transfer(self, sender, receiver, port):
+        worker = gevent.spawn(receiver.start, '127.0.0.1', port)
+        gevent.spawn(sender.upload, '127.0.0.1', port).join(timeout=5)
+        listener = receiver.listener
+        receiver.stop()
+        worker.kill()
+
+        self.assertTrue(sender.transfer_complete)
+        received = [name for name in os.listdir('.') if name.endswith(slugify(path))]
+        self.assertTrue(filecmp.cmp(received[0], path, shallow=False))
+        os.remove(received[0])
+        return listener
+
+    def test_batched_transfer(self):
+        sender = Sender(path, block_size=64, window_size=64)
+        listener = self.transfer(sender, Receiver(), 12375)
+        self.assertIsInstance(listener, BatchDatagramServer)
+        self.assertEqual(sender.gso, batch_io.supports_gso(socket.socket(socket.AF_INET, socket.SOCK_DGRAM)))
+
+    def test_fallback_transfer(self):
+        sender = Sender(path, block_size=64, window_size=64, gso=False)
+        listener = self.transfer(sender, Receiver(batched=False), 12376)
+        self.assertNotIsInstance(listener, BatchDatagramServer)
+        self.assertIsInstance(listener, LargeDatagramServer)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+from pygftlib.protocol import Sender, Receiver
+from pygftlib.packet_factory import PacketFactory
+from pygftlib.pmtu import probe_block_size
+from pygftlib import MAX_BLOCK_SIZE
+import os
+import filecmp
+import socket
+import tempfile
+import gevent
+from slugify import slugify
+
+
+def transfer(port, size, **kwargs):
+    """Send size random bytes over loopback. Returns the Sender, the source and the received file names"""
+    with tempfile.NamedTemporaryFile(suffix='.bin', delete=False) as f:
+        f.write(os.urandom(size))
+    receiver = Receiver()
+    sender = Sender(f.name, **kwargs)
+    worker = gevent.spawn(receiver.start, '127.0.0.1', port)
+    gevent.spawn(sender.upload, '127.0.0.1', port).join(timeout=10)
+    receiver.stop()
+    worker.kill()
+    received = [name for name in os.listdir('.') if name.endswith(slugify(f.name))]
+    return sender, f.name, received[0]
+
+
+class TestBlockSize(unittest.TestCase):
+
+    def assertTransferred(self, sender, source, received):
+        self.assertTrue(sender.transfer_complete)
+        self.assertTrue(filecmp.cmp(received, source, shallow=False))
+        os.remove(source)
+        os.remove(received)
+
+    def test_large_blocks(self):
+        sender, source, received = transfer(12350, 1000 * 1000, block_size=32768)
+        self.assertEqual(sender.block_size, 32768)
+        self.assertEqual(sender.core.block_no, 31)
+        self.assertTransferred(sender, source, received)
+
+    def test_exact_multiple_of_block_size(self):
+        # the file ends on a block boundary. An empty DATA packet marks the end of the transfer
+        sender, source, received = transfer(12351, 4 * 1024, block_size=1024)
+        self.assertEqual(sender.core.final_block, 5)
+        self.assertTransferred(sender, source, received)
+
+    def test_probe_mtu(self):
+        sender, source, received = transfer(12352, 200 * 1000, probe_mtu=True)
+        self.assertEqual(sender.block_size, MAX_BLOCK_SIZE)  # loopback MTU is 64k
+        self.assertTransferred(sender, source, received)
+
+    def test_is_valid_follows_block_size(self):
+        packet = PacketFactory.to_bytes(type='data', block_no=1, data=b'x' * 1024)
+        self.assertFalse(PacketFactory.is_valid('data', packet))
+        self.assertTrue(PacketFactory.is_valid('data', packet, blksize=1024))
+
+    def test_probe_block_size(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.connect(('127.0.0.1', 9))
+        block_size = probe_block_size(sock)
+        sock.close()
+        self.assertTrue(block_size is None or block_size > 1400)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+from pygftlib import codec
+from pygftlib.packet_factory import PacketFactory
+from pygftlib.packets import DATAPacket, ACKPacket, SACKPacket, INITRQPacket, ERRPacket
+
+
+class TestCodec(unittest.TestCase):
+
+    def test_same_bytes_as_packets(self):
+        # the codec and the packet classes agree on the wire format
+        for width in (2, 4, 8):
+            self.assertEqual(codec.encode_data(7, b'abc', width),
+                             DATAPacket().build_packet(block_no=7, data=b'abc', seq_width=width))
+            self.assertEqual(codec.encode_ack(7, width), ACKPacket().build_packet(block_no=7, seq_width=width))
+            self.assertEqual(codec.encode_sack(7, [9, 12], width),
+                             SACKPacket().build_packet(block_no=7, selective=[9, 12], seq_width=width))
+        self.assertEqual(codec.encode_initrq('a.txt', {'blksize': 1024}),
+                         INITRQPacket().build_packet(file_name='a.txt', options={'blksize': 1024}))
+        self.assertEqual(codec.encode_err(3, b'Disk full or allocation exceeded.'),
+                         ERRPacket().build_packet(err_code=3))
+
+    def test_decode(self):
+        self.assertEqual(codec.decode(codec.encode_data(70000, b'xyz', 4), 4), (codec.DATA, (70000, b'xyz')))
+        self.assertEqual(codec.decode(codec.encode_ack(5)), (codec.ACK, 5))
+        self.assertEqual(codec.decode(codec.encode_sack(5, [7, 20], 8), 8), (codec.SACK, (5, [7, 20])))
+        self.assertEqual(codec.decode(codec.encode_oack({'windowsize': 8})), (codec.OACK, {'windowsize': '8'}))
+        self.assertEqual(codec.decode(codec.encode_initrq('a.txt')), (codec.INITRQ, ('a.txt', {})))
+        self.assertEqual(codec.decode(codec.encode_err(1, b'File Not Found')), (codec.ERR, (1, b'File Not Found')))
+        self.assertEqual(codec.decode(b'\x00\x7fjunk'), (0, None))
+        self.assertEqual(codec.op_code(b'\x00'), 0)
+
+    def test_buffers(self):
+        buffer = bytearray(64)
+        size = codec.encode_data_into(buffer, 3, b'hello', offset=10)
+        self.assertEqual(bytes(buffer[10:10 + size]), codec.encode_data(3, b'hello'))
+        self.assertEqual(codec.encode_ack_into(buffer, 4, seq_width=8), 10)
+        self.assertEqual(codec.decode_ack(buffer[:10], 8), 4)
+        payload = bytearray(8)
+        self.assertEqual(codec.decode_data_into(codec.encode_data(9, b'abc'), payload, offset=2), (9, 3))
+        self.assertEqual(bytes(payload[2:5]), b'abc')
+
+    def test_validation(self):
+        self.assertTrue(codec.is_valid(codec.DATA, codec.encode_data(1, b'x' * 508)))
+        self.assertFalse(codec.is_valid(codec.DATA, codec.encode_data(1, b'x' * 509)))
+        self.assertFalse(codec.is_valid(codec.DATA, b'\x00\x02\x00'))  # truncated header
+        self.assertFalse(codec.is_valid(codec.ACK, codec.encode_ack(1, 4)))
+        self.assertFalse(codec.is_valid(0, b'\x00\x09'))
+
+    def test_factory_wrapper(self):
+        self.assertTrue(PacketFactory.check_type('data', codec.encode_data(1, b'')))
+        self.assertTrue(PacketFactory.check_type('SACK', codec.encode_sack(1)))
+        self.assertFalse(PacketFactory.check_type('ack', b'\x00\x09'))
+        self.assertEqual(PacketFactory.from_bytes(codec.encode_initrq('a.txt', {'blksize': 8})), 'a.txt')
+        self.assertEqual(PacketFactory.options(codec.encode_initrq('a.txt', {'blksize': 8})), {'blksize': '8'})
+        self.assertEqual(PacketFactory.from_bytes(codec.encode_data(2, b'ab')), (2, b'ab'))
+        self.assertEqual(PacketFactory.to_bytes('err', err_code=1), b'\x00\x04\x00\x01File Not Found\x00')
+        packet = PacketFactory.to_bytes('err', err_code=codec.ERR_ALLOCATION_EXCEEDED, err_msg='Server overloaded')
+        self.assertEqual(PacketFactory.from_bytes(packet), (3, b'Server overloaded'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import unittest
+from pygftlib.protocol import Sender, Receiver
+from pygftlib import compression
+from pygftlib.file_io import FileReader
+from pygftlib.exceptions import MalformedPacketException
+import os
+import random
+import shutil
+import tempfile
+import filecmp
+import gevent
+from slugify import slugify
+
+
+class TestCompression(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'compression-test.csv')
+        rows = ['{},{},{:.3f},sensor-{}\n'.format(i, i * 7 % 13, i / 3, i % 5) for i in range(40000)]
+        self.text = ''.join(rows).encode('ascii')
+        self.write(self.path, self.text)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        for name in os.listdir('.'):
+            if slugify('compression-test') in name:
+                os.remove(name)
+
+    def write(self, path, data):
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def stream(self, reader, block_size=1000):
+        blocks = []
+        while not blocks or len(blocks[-1]) == block_size:
+            blocks.append(reader.read_chunk(block_size))
+        return blocks
+
+    def decode(self, blocks, method):
+        decoder = compression.Decoder(method)
+        order = list(enumerate(blocks, 1))
+        random.Random(1).shuffle(order)  # as if they arrived out of order
+        pieces = []
+        for block_no, block in order:
+            pieces.extend(decoder.feed(block_no, block))
+        self.assertTrue(decoder.complete)
+        return b''.join(data for _, data in sorted(pieces))
+
+    def test_round_trip(self):
+        for method in compression.CODECS:
+            reader = compression.CompressingReader(FileReader(self.path), method)
+            blocks = self.stream(reader)
+            self.assertLess(reader.compressed * 4, len(self.text))
+            self.assertEqual(reader.passed, 0)
+            self.assertEqual(self.decode(blocks, method), self.text)
+
+    def test_incompressible(self):
+        data = os.urandom(3 * compression.FRAME_SIZE) + self.text
+        self.write(self.path, data)
+        reader = compression.CompressingReader(FileReader(self.path), 1)
+        blocks = self.stream(reader, 5000)
+        self.assertLessEqual(sum(len(block) for block in blocks), compression.stream_size_bound(len(data)))
+        self.assertGreaterEqual(reader.passed, 3)
+        self.assertEqual(self.decode(blocks, 1), data)
+
+    def test_corrupt(self):
+        blocks = self.stream(compression.CompressingReader(FileReader(self.path), 1))
+        decoder = compression.Decoder(1)
+        self.assertRaises(MalformedPacketException, decoder.feed, 1, blocks[0][:4] + b'X' + blocks[0][5:])
+        decoder = compression.Decoder(1)
+        with self.assertRaises(MalformedPacketException):
+            for block_no, block in enumerate(blocks, 1):
+                decoder.feed(block_no, block[:20] + bytes(len(block) - 20) if block_no == 1 else block)
+
+    def test_transfer(self):
+        receiver = Receiver()
+        worker = gevent.spawn(receiver.start, '127.0.0.1', 12401)
+        for name in ('zlib', 'lzma'):
+            sender = Sender(self.path, block_size=1400, compress=name)
+            gevent.spawn(sender.upload, '127.0.0.1', 12401).join(timeout=10)
+            self.assertTrue(sender.transfer_complete)
+            self.assertIsInstance(sender.file_obj, compression.CompressingReader)
+            self.assertLess(sender.file_obj.compressed * 4, len(self.text))
+        receiver.stop()
+        worker.kill()
+        received = [name for name in os.listdir('.') if name.endswith(slugify(self.path))]
+        self.assertEqual(len(received), 2)
+        for name in received:
+            self.assertTrue(filecmp.cmp(name, self.path, shallow=False))
+
+    def test_not_accepted(self):
+        receiver = Receiver(compression=False)
+        worker = gevent.spawn(receiver.start, '127.0.0.1', 12402)
+        sender = Sender(self.path, compress='zlib')
+        gevent.spawn(sender.upload, '127.0.0.1', 12402).join(timeout=10)
+        receiver.stop()
+        worker.kill()
+        self.assertTrue(sender.transfer_complete)
+        self.assertIsInstance(sender.file_obj, FileReader)  # sent as is
+
+
+if __name__ == '__main__':
+    unittest.main()
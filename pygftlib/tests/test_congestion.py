@@ -0,0 +1,70 @@
+import unittest
+from pygftlib.protocol import Sender, Receiver
+from pygftlib.congestion import TokenBucket, RenoController, DelayController, create_controller
+from pygftlib.helpers import parse_size
+import os
+import time
+import filecmp
+import tempfile
+import gevent
+from slugify import slugify
+
+
+class TestCongestion(unittest.TestCase):
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=1000, burst=100)
+        self.assertEqual(bucket.reserve(100, now=bucket.updated), 0)
+        self.assertAlmostEqual(bucket.reserve(500, now=bucket.updated), 0.5)  # in debt. Wait for it to be paid back
+        self.assertAlmostEqual(bucket.reserve(100, now=bucket.updated + 0.5), 0.1)
+        self.assertEqual(TokenBucket().reserve(10 ** 9), 0)  # unlimited
+
+    def test_reno(self):
+        reno = RenoController(initial_window=2)
+        reno.on_ack(2)
+        self.assertEqual(reno.window, 4)  # slow start
+        reno.on_loss(5, highest_sent=8)
+        self.assertEqual(reno.window, 2)
+        reno.on_loss(7, highest_sent=8)  # same window of data. No further reduction
+        self.assertEqual(reno.window, 2)
+        reno.on_ack(2)
+        self.assertEqual(reno.cwnd, 3)  # congestion avoidance: + acked / cwnd
+        reno.on_timeout(highest_sent=10)
+        self.assertEqual(reno.window, 1)
+
+    def test_delay(self):
+        delay = DelayController(target=0.01, initial_window=10)
+        for _ in range(5):
+            delay.on_ack(1, rtt=0.001)
+        self.assertEqual(delay.window, 15)  # no queuing delay. Grow
+        for _ in range(20):
+            delay.on_ack(1, rtt=0.05)
+        self.assertLess(delay.window, 15)  # 49ms queuing delay, well over the 10ms target. Back off
+        self.assertIs(create_controller(delay), delay)
+        self.assertRaises(ValueError, create_controller, 'cubic')
+
+    def test_parse_size(self):
+        self.assertEqual([parse_size(x) for x in ('512', '64K', '10M', '1.5g')], [512, 64000, 10 ** 7, 15 * 10 ** 8])
+
+    def test_max_rate(self):
+        with tempfile.NamedTemporaryFile(suffix='.bin', delete=False) as f:
+            f.write(os.urandom(200 * 1000))
+        receiver = Receiver()
+        sender = Sender(f.name, max_rate=10 ** 6, congestion='delay')
+        worker = gevent.spawn(receiver.start, '127.0.0.1', 12365)
+        started = time.monotonic()
+        gevent.spawn(sender.upload, '127.0.0.1', 12365).join(timeout=5)
+        elapsed = time.monotonic() - started
+        receiver.stop()
+        worker.kill()
+
+        self.assertTrue(sender.transfer_complete)
+        self.assertGreater(elapsed, 0.18)  # 200k at 1MB/s. Less the initial burst
+        received = [name for name in os.listdir('.') if name.endswith(slugify(f.name))]
+        self.assertTrue(filecmp.cmp(received[0], f.name, shallow=False))
+        os.remove(received[0])
+        os.remove(f.name)
+
+
+if __name__ == '__main__':
+    unittest.main()
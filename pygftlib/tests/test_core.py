@@ -0,0 +1,135 @@
+import unittest
+from pygftlib import core, codec, CONN_TIMEOUT, DATA_SIZE
+import io
+import os
+
+ADDRESS = ('127.0.0.1', 40000)
+
+
+class TestCore(unittest.TestCase):
+    """The sans-IO core on its own: packets handed from one state machine to the other, time made up"""
+
+    def transfer(self, data, drop=(), **sender_kwargs):
+        """
+        :param drop: block numbers whose first DATA packet is lost
+        :return: SenderCore, ReceiverCore, the file as written by the Receiver's actions, the actions
+        """
+        sender = core.SenderCore('file.bin', len(data), **sender_kwargs)
+        receiver = core.ReceiverCore()
+        reader = io.BytesIO(data)
+        written, actions, dropped = {}, [], set()
+        now = 0.0
+        to_receiver = [sender.connect(now)]
+        while not sender.done and now < 60:
+            now += 0.01
+            to_sender = []
+            for packet in to_receiver:
+                sender.sent(packet)
+                if codec.op_code(packet) == codec.DATA:
+                    block_no, _ = codec.decode_data(packet, sender.seq_width)
+                    if block_no in drop and block_no not in dropped:
+                        dropped.add(block_no)
+                        continue
+                pending = receiver.datagram_received(packet, ADDRESS, now)
+                while pending:
+                    action = pending.pop(0)
+                    actions.append(action)
+                    if isinstance(action, core.Send):
+                        to_sender.append(action.packet)
+                    elif isinstance(action, core.Acknowledge):
+                        to_sender += [packet for packet in [receiver.ack(action.session)] if packet is not None]
+                    elif isinstance(action, core.Write):
+                        written[action.block_no] = action.data
+                    elif isinstance(action, core.Open):
+                        pending[:0] = receiver.opened(action.session)
+                    elif isinstance(action, core.Close):
+                        pending[:0] = receiver.closed(action.session)
+            to_receiver = []
+            for packet in to_sender:
+                to_receiver += sender.datagram_received(packet, now)
+            while sender.can_send():
+                to_receiver += sender.push(reader.read(sender.block_size), now)
+            if not to_receiver and sender.deadline is not None and now >= sender.deadline:
+                to_receiver = sender.timeout(now)
+        self.assertEqual(dropped, set(drop))
+        return sender, receiver, b''.join(written[block] for block in sorted(written)), actions
+
+    def test_windowed(self):
+        data = os.urandom(100000)
+        sender, receiver, received, actions = self.transfer(data, drop=[3, 40, 41], window_size=64, block_size=1000)
+        self.assertTrue(sender.complete)
+        self.assertEqual(received, data)
+        self.assertEqual(sender.block_size, 1000)
+        session = actions[0].session
+        self.assertIsInstance(actions[0], core.Open)
+        self.assertEqual((session.file_name, session.block_size, session.options['tsize']),
+                         ('file.bin', 1000, len(data)))
+        self.assertEqual(actions[-2:], [core.Close(session), core.Acknowledge(session)])
+        self.assertEqual(receiver.stats()['completed'], 1)
+        # the session lingers till it expires, in case the client missed the last ACK. It is not in progress
+        self.assertIs(receiver.client_state.get(ADDRESS), session)
+        self.assertEqual(receiver.stats()['sessions'], 0)
+
+    def test_fec(self):
+        # the Receiver rebuilds a lost block from its group's parity. The Sender never sends it again
+        data = os.urandom(100000)
+        sender, receiver, received, _ = self.transfer(data, drop=[5], window_size=64, block_size=1000, fec=True)
+        self.assertTrue(sender.complete)
+        self.assertEqual(received, data)
+        self.assertIn('fec', sender.accepted)
+        self.assertEqual(sender.stats()['retransmits'], 0)
+
+    def test_lockstep(self):
+        # the original protocol. No options, one block at a time
+        data = os.urandom(5000)
+        sender, receiver, received, actions = self.transfer(data, drop=[2], window_size=1)
+        self.assertTrue(sender.complete)
+        self.assertEqual(sender.options, {})
+        self.assertEqual(received, data)
+
+    def test_empty_file(self):
+        sender, _, received, _ = self.transfer(b'', window_size=1)
+        self.assertTrue(sender.complete)
+        self.assertEqual(received, b'')
+
+    def test_legacy_receiver(self):
+        # a Receiver that ignores our options. The transfer falls back to the original protocol
+        sender = core.SenderCore('file.bin', 1000, window_size=8)
+        sender.connect(0)
+        self.assertEqual(sender.datagram_received(codec.encode_ack(0), 0.1), [])
+        self.assertTrue(sender.legacy_peer)
+        self.assertEqual((sender.window.size, sender.block_size), (1, DATA_SIZE))
+        packets = sender.push(b'x' * DATA_SIZE, 0.1)
+        self.assertEqual(packets, [packets[0], packets[0]])  # it only ACKs a block once it sees it twice
+        self.assertFalse(sender.can_send())
+        sender.datagram_received(codec.encode_ack(1), 0.2)
+        packets = sender.push(b'x' * (1000 - DATA_SIZE), 0.2)
+        self.assertEqual(len(packets), 1)
+        self.assertFalse(sender.complete)
+        sender.sent(packets[0])
+        self.assertTrue(sender.complete)  # the last block is never acknowledged
+
+    def test_no_response(self):
+        sender = core.SenderCore('file.bin', 1000, max_no_response_time=5)
+        initrq = sender.connect(0)
+        self.assertEqual(sender.timeout(sender.deadline), [initrq])  # sent again
+        self.assertEqual(sender.timeout(6), [])
+        self.assertIsNotNone(sender.error)
+        self.assertIsNone(sender.deadline)
+
+    def test_expire(self):
+        receiver = core.ReceiverCore()
+        sender = core.SenderCore('file.bin', 1000, window_size=8)
+        actions = receiver.datagram_received(sender.connect(0), ADDRESS, 0)
+        self.assertEqual([type(action) for action in actions], [core.Open])
+        session = actions[0].session
+        self.assertIsNone(receiver.ack(session))  # no OACK till the file is open
+        self.assertEqual(receiver.opened(session), [core.Acknowledge(session)])
+        self.assertEqual(codec.op_code(receiver.ack(session)), codec.OACK)
+        self.assertEqual(receiver.expire(CONN_TIMEOUT - 1), [])
+        self.assertEqual(receiver.expire(CONN_TIMEOUT + 1), [core.Abort(session)])
+        self.assertEqual(receiver.stats()['sessions'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
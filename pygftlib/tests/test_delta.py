@@ -0,0 +1,110 @@
+import unittest
+from pygftlib.protocol import Sender, Receiver
+from pygftlib import delta
+from pygftlib.file_io import FileReader
+from pygftlib.exceptions import MalformedPacketException
+from unittest import mock
+import os
+import threading
+import shutil
+import tempfile
+import filecmp
+import gevent
+from slugify import slugify
+
+
+class TestDelta(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'delta-test.bin')
+        self.old = os.urandom(300000)
+        # an insert, a change and a delete
+        self.new = self.old[:1000] + os.urandom(100) + self.old[1000:150000] + b'changed' + self.old[150007:250000] + \
+            self.old[260000:]
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        for name in os.listdir('.'):
+            if slugify('delta-test') in name:
+                os.remove(name)
+
+    def write(self, path, data):
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def read_stream(self, reader):
+        return b''.join(iter(lambda: reader.read_chunk(1000), b''))
+
+    def test_rebuild(self):
+        basis = os.path.join(self.root, 'basis')
+        self.write(basis, self.old)
+        self.write(self.path, self.new)
+        reader = delta.DeltaReader(self.path, delta.signature(basis))
+        stream = self.read_stream(reader)
+        self.assertLessEqual(len(stream), delta.stream_size_bound(len(self.new)))
+        self.assertLess(reader.literal, 4 * delta.block_length(len(self.old)))  # only around the edits
+        self.assertEqual(reader.copied + reader.literal, len(self.new))
+
+        writer = delta.DeltaWriter('delta-test', 1000, basis)
+        for block_no, start in enumerate(range(0, len(stream) + 1, 1000), 1):
+            writer.write_block(block_no, stream[start:start + 1000])
+        writer.close()
+        with open(writer.name, 'rb') as f:
+            self.assertEqual(f.read(), self.new)
+
+    def test_bad_stream(self):
+        # a stream that does not rebuild the file fails close(). Nothing is published, nothing left behind
+        basis = os.path.join(self.root, 'basis')
+        self.write(basis, self.old)
+        self.write(self.path, self.new)
+        stream = bytearray(self.read_stream(delta.DeltaReader(self.path, delta.signature(basis))))
+        stream[-1] ^= 0xff  # the hash of the file
+        writer = delta.DeltaWriter('delta-test', 1000, basis)
+        for block_no, start in enumerate(range(0, len(stream) + 1, 1000), 1):
+            writer.write_block(block_no, bytes(stream[start:start + 1000]))
+        self.assertRaises(MalformedPacketException, writer.close)
+        self.assertIsNone(writer._fd)
+        self.assertEqual([name for name in os.listdir('.') if slugify('delta-test') in name], [])
+
+    def test_new_file(self):
+        # nothing in common with the basis. All literal
+        basis = os.path.join(self.root, 'basis')
+        self.write(basis, self.old)
+        self.write(self.path, os.urandom(len(self.old)))
+        reader = delta.DeltaReader(self.path, delta.signature(basis))
+        self.assertLessEqual(len(self.read_stream(reader)), delta.stream_size_bound(len(self.old)))
+        self.assertEqual(reader.copied, 0)
+
+    def test_transfer(self):
+        receiver = Receiver()
+        worker = gevent.spawn(receiver.start, '127.0.0.1', 12400)
+        self.write(self.path, self.old)
+        sender = Sender(self.path, delta=True)
+        gevent.spawn(sender.upload, '127.0.0.1', 12400).join(timeout=10)
+        self.assertTrue(sender.transfer_complete)
+        self.assertIsInstance(sender.file_obj, FileReader)  # nothing to send a delta against
+
+        self.write(self.path, self.new)
+        sender = Sender(self.path, delta=True)
+        threads = []
+        signature = delta.signature
+
+        def sign(path):
+            threads.append(threading.get_ident())
+            return signature(path)
+        with mock.patch('pygftlib.delta.signature', sign):
+            gevent.spawn(sender.upload, '127.0.0.1', 12400).join(timeout=10)
+        receiver.stop()
+        self.assertEqual(len(threads), 1)
+        self.assertNotEqual(threads[0], threading.get_ident())  # not on the event loop
+        worker.kill()
+        self.assertTrue(sender.transfer_complete)
+        self.assertIsInstance(sender.file_obj, delta.DeltaReader)
+        self.assertLess(sender.file_obj.literal, len(self.new) // 10)
+        latest = delta.find_basis(sender.file_name)
+        self.assertTrue(filecmp.cmp(latest, self.path, shallow=False))
+
+
+if __name__ == '__main__':
+    unittest.main()
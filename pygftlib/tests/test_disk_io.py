@@ -0,0 +1,140 @@
+import unittest
+from pygftlib.protocol import Sender, Receiver
+from pygftlib.file_io import FileWriter
+from pygftlib import disk_io
+from pygftlib import codec
+from unittest import mock
+import os
+import errno
+import filecmp
+import tempfile
+import threading
+import time
+import gevent
+from slugify import slugify
+
+
+def slow(function, delay):
+    """function, taking delay seconds longer. The thread sleeps -- like one waiting for a slow disk"""
+    def call(*args):
+        time.sleep(delay)
+        return function(*args)
+    return call
+
+
+class TestDiskIO(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = disk_io.DiskPool(2)
+
+    def tearDown(self):
+        self.pool.kill()
+        for name in os.listdir('.'):
+            if slugify('disk-test') in name:
+                os.remove(name)
+
+    def test_write_behind(self):
+        writer = FileWriter('disk-test', 4, size=10, coalesce=4, disk=self.pool.write_behind())
+        threads = []
+        pwritev = os.pwritev
+
+        def write(*args):
+            threads.append(threading.get_ident())
+            return pwritev(*args)
+        with mock.patch('os.pwritev', write):
+            writer.write_block(3, b'ij')
+            writer.write_block(1, b'abcd')
+            writer.write_block(2, b'efgh')
+            writer.close()
+        self.assertEqual(len(threads), 3)
+        self.assertNotIn(threading.get_ident(), threads)  # none of them on the event loop
+        with open(writer.name, 'rb') as f:
+            self.assertEqual(f.read(), b'abcdefghij')
+
+    def test_backpressure(self):
+        # writes take 20 ms. Up to 8 bytes may wait, in runs of 4
+        writer = FileWriter('disk-test', 4, coalesce=4, disk=self.pool.write_behind(8))
+        ticks = []
+        ticker = gevent.spawn(lambda: [ticks.append(gevent.sleep(0.005)) for _ in range(100)])
+        pending = []
+        with mock.patch('os.pwritev', slow(os.pwritev, 0.02)):
+            started = time.monotonic()
+            for block_no in range(1, 11):
+                writer.write_block(block_no, b'x' * 4)
+                pending.append(writer.disk.pending)
+            writer.close()
+            elapsed = time.monotonic() - started
+        ticker.kill()
+        self.assertLessEqual(max(pending), 8)
+        self.assertGreaterEqual(elapsed, 0.2)  # waited for the disk...
+        self.assertGreater(len(ticks), 10)  # ... while the event loop went on
+        self.assertEqual(os.path.getsize(writer.name), 40)
+
+    def test_error(self):
+        writer = FileWriter('disk-test', 4, coalesce=4, disk=self.pool.write_behind())
+        with mock.patch('os.pwritev', side_effect=OSError(errno.ENOSPC, 'No space left on device')):
+            writer.write_block(1, b'abcd')  # queued. The error shows up later
+            self.assertRaises(OSError, writer.close)
+        self.assertIsInstance(writer.disk.error, OSError)
+        self.assertFalse(os.path.exists(writer.name))  # not published
+        self.assertIsNone(writer._fd)  # closed all the same
+
+    def test_abort_after_error(self):
+        # the write error is logged and dropped. The file is closed all the same
+        writer = FileWriter('disk-test', 4, coalesce=4, disk=self.pool.write_behind())
+        with mock.patch('os.pwritev', side_effect=OSError(errno.ENOSPC, 'No space left on device')):
+            writer.write_block(1, b'abcd')
+            self.assertRaises(OSError, writer.disk.drain)  # the write has failed by now
+            fd = writer._fd
+            writer.abort()
+        self.assertIsNone(writer._fd)
+        self.assertRaises(OSError, os.fstat, fd)
+        writer.abort()  # and again, harmlessly
+
+    def test_disk_full(self):
+        # a Receiver unable to finish the file answers with an ERR, not the final ACK
+        path = os.path.join(tempfile.mkdtemp(), 'disk-test.bin')
+        with open(path, 'wb') as f:
+            f.write(os.urandom(30000))
+        receiver = Receiver()
+        worker = gevent.spawn(receiver.start, '127.0.0.1', 12414)
+        sender = Sender(path, block_size=1000)
+        try:
+            with mock.patch.object(FileWriter, '_finish', side_effect=OSError(errno.ENOSPC, 'No space left on device')):
+                gevent.spawn(sender.upload, '127.0.0.1', 12414).join(timeout=10)
+            self.assertFalse(sender.transfer_complete)
+            self.assertTrue(sender.error_occurred)
+            self.assertEqual(sender.error, (codec.ERR_ALLOCATION_EXCEEDED, b'No space left on device'))
+            self.assertEqual(receiver.stats()['completed'], 0)
+            self.assertEqual(receiver.client_state.in_progress(), 0)
+        finally:
+            receiver.stop()
+            worker.kill()
+            os.remove(path)
+            os.rmdir(os.path.dirname(path))
+
+    def test_transfer(self):
+        # a slow disk on both ends, read ahead / written behind
+        path = os.path.join(tempfile.mkdtemp(), 'disk-test.bin')
+        with open(path, 'wb') as f:
+            f.write(os.urandom(300000))
+        receiver = Receiver(write_behind=64 * 1024)
+        worker = gevent.spawn(receiver.start, '127.0.0.1', 12413)
+        sender = Sender(path, block_size=1000, zero_copy=False, read_ahead=16)
+        with mock.patch('os.pwritev', slow(os.pwritev, 0.001)):
+            gevent.spawn(sender.upload, '127.0.0.1', 12413).join(timeout=20)
+        receiver.stop()
+        worker.kill()
+        try:
+            self.assertTrue(sender.transfer_complete)
+            received = [name for name in os.listdir('.') if name.endswith(slugify(path))]
+            self.assertEqual(len(received), 1)
+            self.assertTrue(filecmp.cmp(received[0], path, shallow=False))
+            os.remove(received[0])
+        finally:
+            os.remove(path)
+            os.rmdir(os.path.dirname(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
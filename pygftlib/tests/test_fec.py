@@ -0,0 +1,99 @@
+import unittest
+from pygftlib.protocol import Sender
+from pygftlib.tests.helpers import LossyReceiver
+from pygftlib.fec import ParityEncoder, ParityDecoder, LOSS_SAMPLE, MIN_GROUP
+from pygftlib.window import SendWindow, ReceiveWindow
+import os
+import shutil
+import tempfile
+import filecmp
+import gevent
+from slugify import slugify
+
+
+class TestFEC(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'fec-test.bin')
+        with open(self.path, 'wb') as f:
+            f.write(os.urandom(100 * 1000 + 123))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        for name in os.listdir('.'):
+            if slugify('fec-test') in name:
+                os.remove(name)
+
+    def test_recover(self):
+        blocks = [os.urandom(100) for _ in range(9)] + [b'short']
+        encoder = ParityEncoder(8, 100)
+        parities = [parity for parity in (encoder.add(block_no, block, final=block_no == 10)
+                                          for block_no, block in enumerate(blocks, 1)) if parity]
+        self.assertEqual([(first, count) for first, count, _, _ in parities], [(1, 8), (9, 2)])
+        self.assertEqual(encoder.group_end(3), 8)
+        self.assertEqual(encoder.group_end(10), 10)
+
+        def receive(missing):
+            window, decoder = ReceiveWindow(16), ParityDecoder(8, 100)
+            for block_no, block in enumerate(blocks, 1):
+                if block_no not in missing:
+                    window.receive(block_no)
+                    decoder.add_block(block_no, block)
+            for parity in parities:
+                decoder.add_parity(*parity)
+            return window, decoder
+
+        window, decoder = receive({10})  # the last (short) block
+        self.assertEqual(decoder.recover(window), [(10, b'short')])
+        window, decoder = receive({3, 6})  # two of the same group. Rebuilt once one of them shows up
+        self.assertEqual(decoder.recover(window), [])
+        window.receive(3)
+        decoder.add_block(3, blocks[2])
+        self.assertEqual(decoder.recover(window), [(6, blocks[5])])
+
+    def test_adapt(self):
+        encoder = ParityEncoder(32, 100)
+        for block_no in range(1, LOSS_SAMPLE + 1):
+            encoder.add(block_no, b'x')
+        encoder.observe(gaps=0)
+        self.assertEqual(encoder.group_size, 32)
+        for block_no in range(1, LOSS_SAMPLE + 1):
+            encoder.add(block_no, b'x')
+        encoder.observe(gaps=LOSS_SAMPLE // 5)  # 20% loss. Far more parity
+        self.assertEqual(encoder.group_size, 5)
+        for _ in range(3):
+            for block_no in range(1, LOSS_SAMPLE + 1):
+                encoder.add(block_no, b'x')
+            encoder.observe(gaps=LOSS_SAMPLE)
+        self.assertEqual(encoder.group_size, MIN_GROUP)
+
+    def test_lost_after_group(self):
+        window = SendWindow(32)
+        for block in range(1, 21):
+            window.push(block, b'')
+        window.ack(2, selective=range(4, 12))
+        self.assertEqual([block for block, _ in window.lost(group_end=lambda block: 10)], [])
+        self.assertEqual(window.gaps, 1)
+        window.ack(2, selective=range(4, 14))
+        self.assertEqual([block for block, _ in window.lost(group_end=lambda block: 10)], [3])
+        self.assertEqual(window.gaps, 1)
+
+    def test_transfer(self):
+        receiver = LossyReceiver(drop=[5, 40, 77])
+        worker = gevent.spawn(receiver.start, '127.0.0.1', 12403)
+        sender = Sender(self.path, block_size=1000, fec=True)
+        gevent.spawn(sender.upload, '127.0.0.1', 12403).join(timeout=10)
+        receiver.stop()
+        worker.kill()
+        self.assertTrue(sender.transfer_complete)
+        self.assertIsNotNone(sender.core.fec)
+        self.assertEqual(receiver.dropped, {5, 40, 77})
+        self.assertEqual(receiver.resent, [])  # rebuilt from the parity. Never sent again
+        received = [name for name in os.listdir('.') if name.endswith(slugify(self.path))]
+        self.assertEqual(len(received), 1)
+        self.assertTrue(filecmp.cmp(received[0], self.path, shallow=False))
+
+
+if __name__ == '__main__':
+    unittest.main()
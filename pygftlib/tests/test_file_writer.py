@@ -0,0 +1,90 @@
+import unittest
+from pygftlib.protocol import Sender, Receiver
+from pygftlib.file_io import FileWriter
+from pygftlib.window import ReceiveWindow
+from pygftlib import options
+from unittest import mock
+import os
+import filecmp
+import gevent
+from slugify import slugify
+
+current_dir = os.path.abspath(os.path.dirname(__file__))
+path = os.path.join(current_dir, "data.txt")
+
+
+class TestFileWriter(unittest.TestCase):
+
+    def tearDown(self):
+        for name in os.listdir('.'):
+            if name.endswith(slugify('writer-test')) or name.endswith(slugify('writer-test') + FileWriter.PART_SUFFIX):
+                os.remove(name)
+
+    def test_out_of_order_blocks(self):
+        writer = FileWriter('writer-test', 4, size=10, coalesce=8)
+        with mock.patch('os.pwritev', wraps=os.pwritev) as pwritev:
+            writer.write_block(3, b'ij')
+            writer.write_block(1, b'abcd')
+            writer.write_block(2, b'efgh')  # adjacent to block 1. Written together
+            self.assertFalse(os.path.exists(writer.name))  # published only once complete
+            self.assertEqual(os.path.getsize(writer.part_name), 10)  # preallocated
+            writer.close()
+        self.assertEqual([call[0][1:] for call in pwritev.call_args_list], [([b'ij'], 8), ([b'abcd', b'efgh'], 0)])
+        self.assertFalse(os.path.exists(writer.part_name))
+        with open(writer.name, 'rb') as f:
+            self.assertEqual(f.read(), b'abcdefghij')
+
+    def test_fsync_policy(self):
+        for policy, syncs in ((None, 0), ('end', 1), (8, 3)):
+            writer = FileWriter('writer-test', 4, fsync=policy, coalesce=4)
+            with mock.patch('os.fsync') as fsync:
+                for block in range(1, 5):
+                    writer.write_chunk(b'abcd')
+                writer.write_chunk(b'')
+            # every other block, once at the end and once for the rename
+            self.assertEqual(fsync.call_count, syncs + (policy is not None))
+            self.assertEqual(os.path.getsize(writer.name), 16)
+            os.remove(writer.name)
+
+    def test_abort(self):
+        writer = FileWriter('writer-test', 4, size=100)
+        writer.write_block(1, b'abcd')
+        writer.abort()
+        self.assertFalse(os.path.exists(writer.name))
+        with open(writer.part_name, 'rb') as f:
+            self.assertEqual(f.read(4), b'abcd')
+
+    def test_receive_window(self):
+        window = ReceiveWindow(4)
+        self.assertTrue(window.receive(2))
+        self.assertFalse(window.receive(2))
+        self.assertFalse(window.receive(6))  # outside the window
+        self.assertTrue(window.receive(1))
+        self.assertEqual(window.cumulative, 2)
+        self.assertTrue(window.receive(3, final=True))
+        self.assertTrue(window.complete)
+
+    def test_tsize(self):
+        sender = Sender(path)
+        self.assertEqual(options.negotiate(sender.packet_factory.options(sender.core.init_rq))['tsize'],
+                         os.path.getsize(path))
+        self.assertNotIn(b'tsize', Sender(path, window_size=1).core.init_rq)  # plain INITRQ for old receivers
+
+    def test_preallocated_transfer(self):
+        receiver = Receiver(fsync='end')
+        sender = Sender(path, block_size=100)
+        worker = gevent.spawn(receiver.start, '127.0.0.1', 12380)
+        with mock.patch('os.posix_fallocate', wraps=os.posix_fallocate) as fallocate:
+            gevent.spawn(sender.upload, '127.0.0.1', 12380).join(timeout=5)
+        receiver.stop()
+        worker.kill()
+
+        self.assertTrue(sender.transfer_complete)
+        self.assertEqual(fallocate.call_args[0][1:], (0, os.path.getsize(path)))
+        received = [name for name in os.listdir('.') if name.endswith(slugify(path))]
+        self.assertTrue(filecmp.cmp(received[0], path, shallow=False))
+        os.remove(received[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
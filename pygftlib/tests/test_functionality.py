@@ -8,6 +8,12 @@ current_dir = os.path.abspath(os.path.dirname(__file__))
 path = os.path.join(current_dir, "data.txt")
 
 
+def received_file(suffix='data-txt'):
+    """The most recent file written by a Receiver (in the CWD) for a given slugified name"""
+    files = [f for f in os.listdir('.') if os.path.isfile(f) and f.endswith(suffix)]
+    return max(files, key=os.path.getmtime)
+
+
 class TestFunctionality(unittest.TestCase):
 
     def test_lib_functionality(self):
@@ -19,11 +25,54 @@ class TestFunctionality(unittest.TestCase):
         # Tweak this if unit tests fail
         gevent.joinall([worker_1, worker_2], timeout=2)
 
-        files = [f for f in os.listdir('.') if os.path.isfile(f)]
-        file = [file for file in files if '2018-' in file]
-        self.assertTrue(filecmp.cmp(str(file[0]), path))
+        file = received_file()
+        self.assertTrue(filecmp.cmp(str(file), path))
         mock_service.stop()
+        os.remove(file)
+
+    def test_lockstep_functionality(self):
+        # window_size=1 speaks the original lockstep protocol. No options are sent.
+        mock_service = Receiver()
+        mock_client_service = Sender(path, window_size=1)
+        worker_1 = gevent.spawn(mock_service.start, '127.0.0.1', 12346)
+        worker_2 = gevent.spawn(mock_client_service.upload, '127.0.0.1', 12346)
+
+        gevent.joinall([worker_1, worker_2], timeout=2)
+
+        self.assertTrue(mock_client_service.transfer_complete)
+        file = received_file()
+        self.assertTrue(filecmp.cmp(str(file), path))
+        mock_service.stop()
+        os.remove(file)
+
+    def test_pipeline(self):
+        # a reader, an ACK processor and a transmitter for the whole transfer. Nothing is sent that is not needed
+        receiver = Receiver()
+        sender = Sender(path, window_size=1)
+        worker = gevent.spawn(receiver.start, '127.0.0.1', 12411)
+        gevent.spawn(sender.upload, '127.0.0.1', 12411).join(timeout=2)
+        receiver.stop()
+        worker.kill()
+
+        self.assertTrue(sender.transfer_complete)
+        self.assertEqual(len(sender._workers), 3)
+        self.assertTrue(all(greenlet.dead for greenlet in sender._workers))
+        blocks = os.path.getsize(path) // sender.block_size + 1
+        self.assertEqual(sender.stats()['packets_sent'], blocks + 1)  # and the INITRQ
+        self.assertEqual(sender.stats()['retransmits'], 0)
+        os.remove(received_file())
+
+    def test_stop(self):
+        # nobody is listening. stop() ends the upload there and then
+        sender = Sender(path)
+        upload = gevent.spawn(sender.upload, '127.0.0.1', 12412)
+        gevent.sleep(0.2)
+        self.assertFalse(upload.dead)
+        sender.stop()
+        upload.join(timeout=1)
+        self.assertTrue(upload.dead)
+        self.assertFalse(sender.transfer_complete)
 
 
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+from pygftlib.protocol import Sender, Receiver
+from pygftlib.impairment import Impairment, ImpairmentProxy, Profile, REORDER_DELAY
+import os
+import filecmp
+import tempfile
+import gevent
+from slugify import slugify
+
+
+class TestImpairment(unittest.TestCase):
+
+    def test_seeded(self):
+        profile = Profile(loss=0.1, duplicate=0.05, reorder=0.05, delay=0.01, jitter=0.005)
+        fates = []
+        for _ in range(2):
+            impairment = Impairment(profile, seed=42)
+            fates.append([impairment.schedule(100, i * 0.001) for i in range(1000)])
+        self.assertEqual(fates[0], fates[1])
+        other = Impairment(profile, seed=43)
+        self.assertNotEqual(fates[0], [other.schedule(100, i * 0.001) for i in range(1000)])
+        self.assertTrue(80 < sum(1 for fate in fates[0] if not fate) < 120)
+
+    def test_delay(self):
+        impairment = Impairment(Profile(delay=0.02, jitter=0.01, reorder=1, duplicate=1))
+        arrivals = impairment.schedule(100, 5)
+        self.assertEqual(len(arrivals), 2)
+        self.assertEqual(arrivals[0], arrivals[1])
+        self.assertTrue(5.02 + REORDER_DELAY <= arrivals[0] <= 5.03 + REORDER_DELAY)
+        self.assertEqual(impairment.stats()['duplicated'], 1)
+
+    def test_rate(self):
+        # 1000 bytes per millisecond, with room for 5 ms of traffic in the queue
+        impairment = Impairment(Profile(rate=1e6, queue=0.005))
+        arrivals = [impairment.schedule(1000, 0) for _ in range(10)]
+        self.assertEqual([round(fate[0], 6) for fate in arrivals if fate], [0.001, 0.002, 0.003, 0.004, 0.005, 0.006])
+        self.assertEqual(impairment.stats()['overflowed'], 4)
+        self.assertEqual(impairment.schedule(1000, 1), [1.001])  # the queue has drained
+
+    def test_transfer(self):
+        path = os.path.join(tempfile.mkdtemp(), 'impairment-test.bin')
+        with open(path, 'wb') as f:
+            f.write(os.urandom(300000))
+        receiver = Receiver()
+        worker = gevent.spawn(receiver.start, '127.0.0.1', 12410)
+        profile = Profile(loss=0.03, duplicate=0.02, reorder=0.05, delay=0.002, jitter=0.002)
+        proxy = ImpairmentProxy(('127.0.0.1', 12410), profile, seed=3)
+        sender = Sender(path, block_size=1400)
+        gevent.spawn(sender.upload, *proxy.address).join(timeout=30)
+        proxy.close()
+        receiver.stop()
+        worker.kill()
+        try:
+            self.assertTrue(sender.transfer_complete)
+            stats = proxy.stats()
+            for counter in ('dropped', 'duplicated', 'reordered'):
+                self.assertGreater(stats['up'][counter], 0)
+            self.assertGreater(sender.stats()['retransmits'], 0)
+            received = [name for name in os.listdir('.') if name.endswith(slugify(path))]
+            self.assertEqual(len(received), 1)
+            self.assertTrue(filecmp.cmp(received[0], path, shallow=False))
+        finally:
+            os.remove(path)
+            os.rmdir(os.path.dirname(path))
+            for name in os.listdir('.'):
+                if name.endswith(slugify(path)):
+                    os.remove(name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+import os
+import subprocess
+import sys
+
+package_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir))
+
+# modules that tooling imports on its own. None of them should pull in an event loop library or slugify
+LIGHT_MODULES = ('pygftlib.codec', 'pygftlib.options', 'pygftlib.file_io', 'pygftlib.core', 'pygftlib.aio')
+HEAVY_PACKAGES = ('gevent', 'slugify')
+
+
+def import_times(statement):
+    """
+    Run statement in a fresh interpreter with -X importtime.
+    :return: module name -> cumulative import time (microseconds), for every module it imported
+    """
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement], cwd=package_dir,
+                            stderr=subprocess.PIPE, check=True).stderr.decode()
+    times = {}
+    for line in output.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            _, cumulative, name = line[len('import time:'):].split('|')
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative)
+    return times
+
+
+class TestImports(unittest.TestCase):
+
+    def test_light_modules(self):
+        for module in LIGHT_MODULES:
+            imported = import_times('import ' + module)
+            self.assertIn(module, imported)
+            heavy = [name for name in imported if name.split('.')[0] in HEAVY_PACKAGES]
+            self.assertEqual(heavy, [], '{} imports {}'.format(module, heavy))
+
+    def test_codec_is_cheap(self):
+        # far cheaper than the gevent backend. Relative, so that a slow machine does not fail it
+        codec = import_times('import pygftlib.codec')['pygftlib.codec']
+        protocol = import_times('import pygftlib.protocol')['pygftlib.protocol']
+        self.assertLess(codec * 10, protocol)
+
+    def test_no_monkey_patching(self):
+        # importing the gevent backend leaves the standard library alone
+        check = 'import pygftlib.protocol, gevent.monkey; raise SystemExit(gevent.monkey.is_module_patched("socket"))'
+        self.assertEqual(subprocess.call([sys.executable, '-c', check], cwd=package_dir), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+from pygftlib.protocol import Sender, Receiver
+from pygftlib.journal import Journal, transfer_id, path_for
+from pygftlib.file_io import FileWriter
+import os
+import shutil
+import tempfile
+import filecmp
+import gevent
+from slugify import slugify
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, 'journal-test.bin')
+        with open(self.path, 'wb') as f:
+            f.write(os.urandom(300000))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        for name in os.listdir('.'):
+            if slugify('journal-test') in name or name.endswith('.journal'):
+                os.remove(name)
+
+    def test_ranges(self):
+        journal = Journal(1, 'journal-test', 100)
+        for offset, size in ((10, 10), (40, 10), (0, 5), (20, 5), (5, 5), (60, 10), (45, 20)):
+            journal.add(offset, size)
+        self.assertEqual(journal.ranges, [[0, 25], [40, 70]])
+        self.assertEqual(journal.contiguous, 25)
+        self.assertEqual(journal.end, 70)
+
+    def test_transfer_id(self):
+        self.assertEqual(transfer_id('a', 1, 2), transfer_id('a', 1, 2))
+        self.assertNotEqual(transfer_id('a', 1, 2), transfer_id('a', 1, 3))
+        self.assertLess(transfer_id('a', 1, 2), 2 ** 63)
+
+    def test_reopen(self):
+        journal = Journal(2, 'journal-test', 12)
+        writer = FileWriter('journal-test', 4, size=12, journal=journal)
+        writer.write_block(1, b'abcd')
+        writer.write_block(3, b'ijkl')  # after a gap. Not something to resume from
+        writer.abort()
+        self.assertTrue(os.path.exists(path_for(2)))
+
+        journal = Journal.load(2, 'journal-test', 12)
+        self.assertEqual(journal.ranges, [[0, 4], [8, 12]])
+        self.assertIsNone(Journal.load(2, 'journal-test', 13))  # a different file
+        writer = FileWriter('journal-test', 4, size=12, journal=journal)
+        self.assertEqual(writer.offset, 4)
+        writer.write_block(1, b'efgh')
+        writer.write_block(2, b'ijkl')
+        writer.close()
+        self.assertFalse(os.path.exists(path_for(2)))
+        with open(writer.name, 'rb') as f:
+            self.assertEqual(f.read(), b'abcdefghijkl')
+
+    def test_resume(self):
+        # the Sender gives up half way, and the Receiver is restarted
+        receiver = Receiver()
+        worker = gevent.spawn(receiver.start, '127.0.0.1', 12399)
+        sender = Sender(self.path, block_size=1000, max_rate=300000, resume=True)
+        gevent.spawn(sender.upload, '127.0.0.1', 12399).join(timeout=0.5)
+        self.assertFalse(sender.transfer_complete)
+        sender.stop()
+        receiver.stop()
+        worker.kill()
+        parts = [name for name in os.listdir('.') if name.endswith(FileWriter.PART_SUFFIX)
+                 and slugify('journal-test') in name]
+        self.assertEqual(len(parts), 1)
+
+        receiver = Receiver()
+        worker = gevent.spawn(receiver.start, '127.0.0.1', 12399)
+        sender = Sender(self.path, block_size=1000, resume=True)
+        gevent.spawn(sender.upload, '127.0.0.1', 12399).join(timeout=10)
+        receiver.stop()
+        worker.kill()
+        self.assertTrue(sender.transfer_complete)
+        self.assertGreater(300000 - sender.file_size, 0)  # only what was missing was sent
+        received = [name for name in os.listdir('.') if name.endswith(slugify('journal-test.bin'))]
+        self.assertEqual(received, [parts[0][:-len(FileWriter.PART_SUFFIX)]])
+        self.assertTrue(filecmp.cmp(received[0], self.path, shallow=False))
+        self.assertFalse([name for name in os.listdir('.') if name.endswith('.journal')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import unittest
+from pygftlib.protocol import Sender, Receiver
+from pygftlib import metrics
+import os
+import tempfile
+import urllib.request
+import gevent
+from slugify import slugify
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.file_name = os.path.join(tempfile.mkdtemp(), 'metrics-test.bin')
+        with open(self.file_name, 'wb') as f:
+            f.write(os.urandom(200000))
+
+    def tearDown(self):
+        os.remove(self.file_name)
+        os.rmdir(os.path.dirname(self.file_name))
+        for name in os.listdir('.'):
+            if slugify(self.file_name) in name:
+                os.remove(name)
+
+    def test_histogram(self):
+        histogram = metrics.Histogram((1, 2, 5))
+        for value in (0.5, 1, 1.5, 3, 7, 100):
+            histogram.observe(value)
+        self.assertEqual(histogram.counts, [2, 1, 1, 2])
+        self.assertEqual(histogram.count, 6)
+        self.assertEqual(histogram.sum, 113)
+
+    def test_merge(self):
+        one, other = metrics.Metrics(), metrics.Metrics()
+        one.received(100)
+        other.received(50)
+        one.rtt_seconds.observe(0.01)
+        other.rtt_seconds.observe(20)
+        merged = metrics.merge(metrics.merge({}, one.stats()), other.stats())
+        self.assertEqual((merged['packets_received'], merged['bytes_received']), (2, 150))
+        self.assertEqual(merged['rtt_seconds_count'], 2)
+        self.assertEqual(merged['rtt_seconds'][0], 0)
+        self.assertEqual(sum(merged['rtt_seconds']), 2)
+        self.assertEqual(merged['rtt_seconds'][-1], 1)
+
+    def test_prometheus(self):
+        stats = metrics.Metrics()
+        stats.sent(10)
+        stats.block_latency_seconds.observe(0.003)
+        stats.block_latency_seconds.observe(30)
+        text = metrics.prometheus(dict(stats.stats(), sessions=2, workers=3))
+        lines = text.splitlines()
+        self.assertIn('# TYPE pygftlib_packets_sent_total counter', lines)
+        self.assertIn('pygftlib_bytes_sent_total 10', lines)
+        self.assertIn('pygftlib_sessions 2', lines)
+        self.assertIn('pygftlib_workers 3', lines)
+        # buckets are cumulative
+        self.assertIn('pygftlib_block_latency_seconds_bucket{le="0.0025"} 0', lines)
+        self.assertIn('pygftlib_block_latency_seconds_bucket{le="0.005"} 1', lines)
+        self.assertIn('pygftlib_block_latency_seconds_bucket{le="+Inf"} 2', lines)
+        self.assertIn('pygftlib_block_latency_seconds_count 2', lines)
+
+    def test_summary(self):
+        summary = metrics.Summary(0, interval=10)
+        self.assertFalse(summary.due(5))
+        self.assertTrue(summary.due(10))
+        line = summary.line({'packets_sent': 100, 'bytes_sent': 20000000, 'retransmits': 3}, 10)
+        self.assertIn('sent 100 packets (2.00 MB/s)', line)
+        self.assertIn('3 retransmits', line)
+        line = summary.line({'packets_sent': 150, 'bytes_sent': 20000000, 'retransmits': 3}, 20)
+        self.assertIn('sent 50 packets (0.00 MB/s)', line)  # what changed since the last line
+        self.assertIn('0 retransmits', line)
+
+    def test_transfer(self):
+        receiver = Receiver(metrics_port=12409)
+        worker = gevent.spawn(receiver.start, '127.0.0.1', 12408)
+        sender = Sender(self.file_name, block_size=1000, window_size=32)
+        gevent.spawn(sender.upload, '127.0.0.1', 12408).join(timeout=10)
+        self.assertTrue(sender.transfer_complete)
+        # urllib blocks. Off to a thread, so that the Receiver's greenlets can answer
+        response = gevent.get_hub().threadpool.apply(urllib.request.urlopen, ('http://127.0.0.1:12409/metrics',))
+        text = response.read().decode()
+        receiver.stop()
+        worker.kill()
+
+        sent, received = sender.stats(), receiver.stats()
+        self.assertEqual(received['completed'], 1)
+        self.assertGreaterEqual(sent['packets_sent'], 202)  # INITRQ, 200 DATA packets and an empty one to end on
+        self.assertEqual(sent['packets_sent'], received['packets_received'])  # loopback loses nothing
+        self.assertEqual(sent['bytes_sent'], received['bytes_received'])
+        self.assertEqual(received['packets_sent'], sent['packets_received'])
+        self.assertEqual(sent['block_latency_seconds_count'], 201)
+        self.assertGreater(sent['rtt_seconds_count'], 0)
+        self.assertIn('pygftlib_completed_total 1', text.splitlines())
+        self.assertIn('pygftlib_packets_received_total {}'.format(received['packets_received']), text.splitlines())
+
+
+if __name__ == '__main__':
+    unittest.main()
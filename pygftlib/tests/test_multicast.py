@@ -0,0 +1,134 @@
+import unittest
+from pygftlib.protocol import Receiver, MulticastSender
+from pygftlib import multicast
+from pygftlib import codec
+import os
+import random
+import filecmp
+import tempfile
+import gevent
+from slugify import slugify
+
+GROUP = ('239.255.41.7', 12414)
+
+
+def lossy(receiver, loss, seed):
+    """Have receiver miss a share of the DATA sent to the group"""
+    rng = random.Random(seed)
+    handle = receiver.handle_group
+
+    def handle_group(data, address):
+        if codec.op_code(data) == codec.DATA and rng.random() < loss:
+            return
+        handle(data, address)
+    receiver.handle_group = handle_group
+
+
+class TestMulticast(unittest.TestCase):
+
+    def test_parse_group(self):
+        self.assertEqual(multicast.parse_group('239.1.2.3:5000'), ('239.1.2.3', 5000))
+        for bad in ('10.1.2.3:5000', '239.1.2.3', 'group:5000'):
+            self.assertRaises(ValueError, multicast.parse_group, bad)
+
+    def test_nak_codec(self):
+        packet = codec.encode_nak(0xdeadbeef, [3, 70000, 9], seq_width=4)
+        self.assertTrue(codec.is_valid(codec.NAK, packet, seq_width=4))
+        self.assertFalse(codec.is_valid(codec.NAK, packet, seq_width=8))
+        self.assertEqual(codec.decode_nak_session(packet), 0xdeadbeef)
+        self.assertEqual(codec.decode_nak(packet, 4), (0xdeadbeef, [3, 70000, 9]))
+        self.assertIsNone(codec.decode_nak_session(packet[:3]))
+
+    def test_suppression(self):
+        naks = multicast.NakScheduler(backoff=0.1, hold=1, rng=random.Random(1))
+        naks.advance(5, lambda block_no: block_no in (1, 2, 4), 0)
+        self.assertEqual(len(naks), 2)  # 3 and 5
+        self.assertEqual(naks.due(0), [])  # backing off
+        naks.heard([3], 0.01)  # another Receiver NAKed 3 first
+        self.assertEqual(naks.suppressed, 1)
+        self.assertEqual(naks.due(0.2), [5])
+        naks.received(5)
+        self.assertEqual(naks.due(0.5), [])
+        self.assertEqual(naks.due(1.2), [3])  # never repaired. Asked for again
+
+    def test_aggregation(self):
+        repairs = multicast.RepairQueue(delay=0.01, holdoff=0.05)
+        self.assertEqual(repairs.nak([7, 3], 0), 2)
+        self.assertEqual(repairs.nak([3, 4], 0.005), 1)  # NAKed twice, repaired once
+        self.assertEqual(repairs.due(0.005), [])
+        self.assertEqual(repairs.due(0.01), [3, 4, 7])
+        self.assertEqual(repairs.nak([3], 0.02), 0)  # crossed the repair
+        self.assertEqual(repairs.nak([3], 0.1), 1)
+        self.assertEqual(repairs.due(0.2), [3])
+
+    def test_aggregation_late(self):
+        # as late in the life of the process as time.monotonic() gets. A block NAKed for the first time is repaired
+        now = 8802.713616604
+        repairs = multicast.RepairQueue(delay=0.01, holdoff=0.05)
+        self.assertEqual(repairs.nak([5], now), 1)
+        self.assertEqual(repairs.due(now + 0.01), [5])
+        self.assertEqual(repairs.nak([5], now + 0.02), 0)
+        self.assertEqual(repairs.nak([5], now + 0.1), 1)
+
+    def test_transfer(self):
+        # three Receivers on the loopback, each missing its own 5% of the DATA
+        path = os.path.join(tempfile.mkdtemp(), 'multicast-test.bin')
+        with open(path, 'wb') as f:
+            f.write(os.urandom(500000))
+        receivers, workers = [], []
+        try:
+            for i in range(3):
+                receivers.append(Receiver(group=GROUP))
+                lossy(receivers[-1], 0.05, seed=i)
+                workers.append(gevent.spawn(receivers[-1].start, '127.0.0.1', 12415 + i))
+            gevent.sleep(0.1)
+            if not all(receiver.listener and receiver.listener.started for receiver in receivers):
+                self.skipTest('Cannot join multicast group {}:{} on the loopback'.format(*GROUP))
+            sender = MulticastSender(path, block_size=1000, receivers=3, interface='127.0.0.1', max_rate=10e6)
+            gevent.spawn(sender.upload, GROUP).join(timeout=20)
+            self.assertTrue(sender.transfer_complete)
+            self.assertEqual(len(sender.completed), 3)
+            received = [name for name in os.listdir('.') if name.endswith(slugify(path))]
+            self.assertEqual(len(received), 3)
+            for name in received:
+                self.assertTrue(filecmp.cmp(name, path, shallow=False))
+            stats = sender.stats()
+            self.assertGreater(stats['retransmits'], 0)
+            # every block went out once, plus the repairs -- far fewer than a transfer per Receiver
+            self.assertLess(stats['packets_sent'], 1.5 * sender.final_block)
+        finally:
+            for receiver, worker in zip(receivers, workers):
+                if receiver.listener is not None:
+                    receiver.stop()
+                worker.kill()
+            os.remove(path)
+            os.rmdir(os.path.dirname(path))
+            for name in os.listdir('.'):
+                if slugify(path) in name:
+                    os.remove(name)
+
+    def test_linger(self):
+        # not told how many Receivers to expect: done once they have gone quiet
+        path = os.path.join(tempfile.mkdtemp(), 'multicast-test.bin')
+        with open(path, 'wb') as f:
+            f.write(os.urandom(50000))
+        receiver = Receiver(group=GROUP)
+        worker = gevent.spawn(receiver.start, '127.0.0.1', 12418)
+        try:
+            gevent.sleep(0.1)
+            sender = MulticastSender(path, block_size=1000, linger=0.3, interface='127.0.0.1')
+            gevent.spawn(sender.upload, GROUP).join(timeout=10)
+            self.assertTrue(sender.transfer_complete)
+            self.assertEqual(receiver.stats()['completed'], 1)
+        finally:
+            receiver.stop()
+            worker.kill()
+            os.remove(path)
+            os.rmdir(os.path.dirname(path))
+            for name in os.listdir('.'):
+                if slugify(path) in name:
+                    os.remove(name)
+
+
+if __name__ == '__main__':
+    unittest.main()
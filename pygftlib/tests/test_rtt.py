@@ -0,0 +1,79 @@
+import unittest
+from pygftlib.protocol import Sender
+from pygftlib.tests.helpers import LossyReceiver
+from pygftlib.rtt import RTTEstimator
+from pygftlib.window import SendWindow
+from pygftlib import MIN_RTO, MAX_RTO
+import os
+import time
+import filecmp
+import gevent
+from slugify import slugify
+
+current_dir = os.path.abspath(os.path.dirname(__file__))
+path = os.path.join(current_dir, "data.txt")
+
+
+class TestRTT(unittest.TestCase):
+
+    def test_estimator(self):
+        rtt = RTTEstimator(initial_rto=1)
+        self.assertEqual(rtt.rto, 1)
+        rtt.sample(0.1)
+        self.assertAlmostEqual(rtt.srtt, 0.1)
+        self.assertAlmostEqual(rtt.rttvar, 0.05)
+        self.assertAlmostEqual(rtt.rto, 0.3)
+        rtt.sample(0.2)
+        self.assertAlmostEqual(rtt.srtt, 0.1125)
+        self.assertAlmostEqual(rtt.rttvar, 0.0625)
+        rtt.timeout()
+        rtt.timeout()
+        self.assertAlmostEqual(rtt.rto, 4 * (0.1125 + 4 * 0.0625))
+        for _ in range(20):
+            rtt.timeout()
+        self.assertEqual(rtt.rto, MAX_RTO)
+        rtt.sample(0.0001)  # a fresh measurement resets the backoff
+        self.assertEqual(rtt.backoff, 0)
+        for _ in range(100):
+            rtt.sample(0.0001)
+        self.assertEqual(rtt.rto, MIN_RTO)
+
+    def test_karn(self):
+        window = SendWindow(4)
+        for block in range(1, 5):
+            window.push(block, b'', sent_at=float(block))
+        window.ack(1)
+        self.assertEqual(window.sample, 1.0)
+        window.oldest()  # block 2 is sent again
+        window.ack(2)
+        self.assertIsNone(window.sample)
+        window.ack(2, [4])
+        self.assertEqual(window.sample, 4.0)
+
+    def assertQuickTransfer(self, sender, receiver, port):
+        worker = gevent.spawn(receiver.start, '127.0.0.1', port)
+        started = time.monotonic()
+        gevent.spawn(sender.upload, '127.0.0.1', port).join(timeout=5)
+        elapsed = time.monotonic() - started
+        receiver.stop()
+        worker.kill()
+
+        self.assertTrue(sender.transfer_complete)
+        # the lost block is resent after a RTO derived from the loopback round trip. Not after a whole second
+        self.assertLess(elapsed, 0.5)
+        self.assertGreater(sender.core.rtt.samples, 0)
+        self.assertLess(sender.core.rtt.srtt, 0.05)
+        received = [name for name in os.listdir('.') if name.endswith(slugify(path))]
+        self.assertTrue(filecmp.cmp(received[0], path, shallow=False))
+        os.remove(received[0])
+
+    def test_lockstep_loss(self):
+        self.assertQuickTransfer(Sender(path, window_size=1), LossyReceiver([2]), 12360)
+
+    def test_tail_loss(self):
+        # nothing is sent after the last block. Only the retransmission timer can recover it
+        self.assertQuickTransfer(Sender(path, block_size=128), LossyReceiver([10]), 12361)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+import unittest
+from pygftlib.protocol import Sender, Receiver
+from pygftlib import scheduler
+from pygftlib import codec
+import os
+import time
+import tempfile
+import gevent
+import gevent.socket
+from slugify import slugify
+
+PACKET = b'x' * 1000
+
+
+def drain(sched, now, limit=1000):
+    """Keys of the packets sched hands out at now, in order"""
+    keys = []
+    for _ in range(limit):
+        key, packet = sched.next(now)
+        if key is None:
+            break
+        keys.append(key)
+    return keys
+
+
+class TestScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.file_name = os.path.join(tempfile.mkdtemp(), 'scheduler-test.bin')
+        with open(self.file_name, 'wb') as f:
+            f.write(os.urandom(200000))
+
+    def tearDown(self):
+        os.remove(self.file_name)
+        os.rmdir(os.path.dirname(self.file_name))
+        for name in os.listdir('.'):
+            if slugify(self.file_name) in name:
+                os.remove(name)
+
+    def test_parse_priority(self):
+        self.assertEqual(scheduler.parse_priority('10.0.0.0/8=4'), ('10.0.0.0/8', 4))
+        for bad in ('10.0.0.0/8', 'host=2', '10.0.0.0/8=0'):
+            self.assertRaises(ValueError, scheduler.parse_priority, bad)
+
+    def test_shaping(self):
+        self.assertFalse(scheduler.Scheduler().shaping)
+        self.assertTrue(scheduler.Scheduler(fair_share=True).shaping)
+        self.assertTrue(scheduler.Scheduler(client_rate=10 ** 6).shaping)
+
+    def test_fair_share(self):
+        # a session of weight 3 gets three times the share of one of weight 1, however many packets the other queues
+        sched = scheduler.Scheduler(priorities={'10.0.0.0/8': 3, '10.1.0.0/16': 2})
+        self.assertEqual([sched.weight((host, 1)) for host in ('10.2.0.1', '10.1.0.1', '192.168.0.1')], [3, 2, 1])
+        for _ in range(300):
+            sched.enqueue('heavy', ('10.2.0.1', 1), PACKET)
+            sched.enqueue('light', ('192.168.0.1', 1), PACKET)
+        keys = drain(sched, time.monotonic(), limit=260)
+        self.assertAlmostEqual(keys.count('heavy') / keys.count('light'), 3, delta=0.2)
+        self.assertEqual(sched.queued, 600 - 260)
+
+    def test_queue_size(self):
+        sched = scheduler.Scheduler(fair_share=True, queue_size=2)
+        self.assertTrue(sched.enqueue('a', ('h', 1), PACKET))
+        self.assertTrue(sched.enqueue('a', ('h', 1), PACKET))
+        self.assertFalse(sched.enqueue('a', ('h', 1), PACKET))
+        self.assertTrue(sched.enqueue('b', ('h', 2), PACKET))
+        self.assertEqual(sched.forget('a'), [PACKET, PACKET])
+        self.assertEqual(drain(sched, time.monotonic()), ['b'])
+        self.assertEqual(sched.next(time.monotonic()), (None, None))
+
+    def test_rate_limit(self):
+        # a client over its rate waits. Others go on
+        sched = scheduler.Scheduler(client_rate=100000)  # a burst of 5000 bytes
+        for _ in range(20):
+            sched.enqueue('limited', ('10.0.0.1', 1), PACKET)
+        now = time.monotonic()
+        self.assertEqual(len(drain(sched, now)), 6)  # the burst, and one more into debt
+        key, wait = sched.next(now)
+        self.assertIsNone(key)
+        self.assertAlmostEqual(wait, 0.01, places=3)
+        sched.enqueue('other', ('10.0.0.2', 1), PACKET)
+        self.assertEqual(drain(sched, now), ['other'])
+        self.assertEqual(drain(sched, now + wait), ['limited'])
+
+    def test_subnet_rate(self):
+        sched = scheduler.Scheduler(subnet_rate=100000, subnet_prefix=24)
+        for host in ('10.0.0.1', '10.0.0.2', '10.0.1.1'):
+            for _ in range(5):
+                sched.enqueue(host, (host, 1), PACKET)
+        now = time.monotonic()
+        keys = drain(sched, now)
+        # the first two share their subnet's burst, the third has one of its own
+        self.assertEqual(keys.count('10.0.0.1') + keys.count('10.0.0.2'), 6)
+        self.assertEqual(keys.count('10.0.1.1'), 5)
+
+    def test_admit(self):
+        sched = scheduler.Scheduler(max_sessions=3, max_client_sessions=2, fair_share=True, queue_size=10)
+        self.assertIsNone(sched.admit(2, 1))
+        self.assertEqual(sched.admit(3, 0), 'Too many transfers in progress')
+        self.assertEqual(sched.admit(1, 2), 'Too many transfers in progress from this host')
+        for _ in range(6):
+            sched.enqueue('a', ('h', 1), PACKET)
+        self.assertEqual(sched.admit(1, 1), 'Server overloaded')
+        drain(sched, time.monotonic())
+        self.assertIsNone(sched.admit(1, 1))
+
+    def test_rejected(self):
+        # a Receiver taking one transfer at a time turns down a second Sender with an ERR
+        receiver = Receiver(max_sessions=1)
+        worker = gevent.spawn(receiver.start, '127.0.0.1', 12420)
+        try:
+            gevent.sleep(0.1)
+            busy = gevent.socket.socket(gevent.socket.AF_INET, gevent.socket.SOCK_DGRAM)
+            busy.sendto(codec.encode_initrq('scheduler-test-idle.bin'), ('127.0.0.1', 12420))  # and nothing more
+            gevent.sleep(0.1)
+            self.assertEqual(receiver.client_state.in_progress(), 1)
+            sender = Sender(self.file_name)
+            gevent.spawn(sender.upload, '127.0.0.1', 12420).join(timeout=10)
+            self.assertFalse(sender.transfer_complete)
+            self.assertTrue(sender.error_occurred)
+            self.assertEqual(sender.error, (codec.ERR_ALLOCATION_EXCEEDED, b'Too many transfers in progress'))
+            self.assertEqual(receiver.stats()['rejected'], 1)
+            busy.close()
+        finally:
+            receiver.stop()
+            worker.kill()
+            for name in os.listdir('.'):
+                if slugify('scheduler-test-idle.bin') in name:
+                    os.remove(name)
+
+    def test_rate_limited_transfer(self):
+        receiver = Receiver(client_rate=500000)
+        worker = gevent.spawn(receiver.start, '127.0.0.1', 12421)
+        try:
+            gevent.sleep(0.1)
+            sender = Sender(self.file_name, block_size=1000)
+            started = time.monotonic()
+            gevent.spawn(sender.upload, '127.0.0.1', 12421).join(timeout=10)
+            elapsed = time.monotonic() - started
+            self.assertTrue(sender.transfer_complete)
+            self.assertGreater(elapsed, 0.9 * (200000 - 500000 * scheduler.RATE_BURST) / 500000)
+            received = [name for name in os.listdir('.') if name.endswith(slugify(self.file_name))]
+            with open(received[0], 'rb') as copy, open(self.file_name, 'rb') as original:
+                self.assertEqual(copy.read(), original.read())
+        finally:
+            receiver.stop()
+            worker.kill()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import unittest
+from pygftlib.protocol import Receiver
+from pygftlib.session import Session, SessionTable
+from pygftlib.window import ReceiveWindow
+from pygftlib import codec, CONN_TIMEOUT, MAX_NO_RESPONSE_TIME, DATA_SIZE
+import os
+import time
+from slugify import slugify
+
+
+class NullSocket(object):
+    def sendto(self, data, address):
+        pass
+
+
+class NullListener(object):
+    socket = NullSocket()
+
+
+def session(address, now=0):
+    s = Session(address, ReceiveWindow(1), DATA_SIZE, 2, {})
+    s.last_active = now
+    return s
+
+
+class TestSession(unittest.TestCase):
+
+    def test_slots(self):
+        self.assertRaises(AttributeError, setattr, session(('h', 1)), 'anything', 1)
+
+    def test_expiry(self):
+        table = SessionTable()
+        idle, busy, done = session(('h', 1)), session(('h', 2)), session(('h', 3))
+        for s in (idle, busy, done):
+            table.add(s)
+        table.touch(busy, now=CONN_TIMEOUT - 1)
+        done.transfer_complete = True
+        table.reschedule(done)
+        self.assertEqual(table.expire(now=MAX_NO_RESPONSE_TIME - 1), [])
+        self.assertEqual(table.expire(now=MAX_NO_RESPONSE_TIME + 1), [done])
+        self.assertEqual(table.expire(now=CONN_TIMEOUT + 1), [idle])  # busy was heard from since
+        self.assertEqual(list(table), [('h', 2)])
+        self.assertEqual(table.expire(now=2 * CONN_TIMEOUT), [busy])
+        self.assertEqual(len(table), 0)
+
+    def test_replaced_session(self):
+        table = SessionTable()
+        old = session(('h', 1))
+        table.add(old)
+        new = session(('h', 1), now=CONN_TIMEOUT)
+        table.add(new)  # e.g. a new INITRQ from the same address
+        self.assertEqual(table.expire(now=CONN_TIMEOUT + 1), [])
+        self.assertIs(table[('h', 1)], new)
+
+    def test_in_progress(self):
+        table = SessionTable()
+        for address in (('h', 1), ('h', 2), ('g', 1)):
+            table.add(session(address))
+        self.assertEqual((table.in_progress(), table.in_progress('h'), table.in_progress('x')), (3, 2, 0))
+        done = table[('h', 1)]
+        done.transfer_complete = True
+        table.reschedule(done)  # complete sessions linger, but no longer count
+        self.assertEqual((table.in_progress(), table.in_progress('h')), (2, 1))
+        table.add(session(('h', 1)))  # replaces it
+        table.add(session(('h', 2)))  # replaces one in progress
+        self.assertEqual((table.in_progress(), table.in_progress('h')), (3, 2))
+        table.remove(('g', 1))
+        table.expire(now=2 * CONN_TIMEOUT)
+        self.assertEqual((table.in_progress(), table.in_progress('h'), len(table)), (0, 0, 0))
+
+    def per_packet_time(self, sessions, run, packets=2000):
+        """Seconds per DATA packet handled by a Receiver with that many (idle) sessions besides the active one"""
+        receiver = Receiver(max_sessions=sessions + 1)
+        receiver.listener = NullListener()
+        now = time.monotonic()
+        for i in range(sessions):
+            receiver.client_state.add(session(('10.0.{}.{}'.format(i // 250, i % 250), 1000 + i), now=now))
+        address = ('127.0.0.1', 5000)
+        receiver.handle(codec.encode_initrq('scaling-test-{}-{}'.format(sessions, run)), address)
+        payload = b'x' * DATA_SIZE
+        packets = [codec.encode_data(block, payload) for block in range(1, packets + 1)]
+        started = time.perf_counter()
+        for packet in packets:
+            receiver.handle(packet, address)
+        elapsed = time.perf_counter() - started
+        self.assertEqual(receiver.client_state[address].window.cumulative, len(packets))
+        receiver._clean_up(purge=True)
+        for name in os.listdir('.'):
+            if slugify('scaling-test') in name:
+                os.remove(name)
+        return elapsed / len(packets)
+
+    def test_scaling(self):
+        # handling a packet must not touch every session. 10k sessions cost (about) the same as 10
+        few = min(self.per_packet_time(10, run) for run in range(3))
+        many = min(self.per_packet_time(10000, run) for run in range(3))
+        self.assertLess(many, 3 * few)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+from pygftlib.protocol import Sender, StripedSender, Receiver
+from pygftlib.file_io import FileReader
+from pygftlib import striping, DATA_SIZE
+import os
+import filecmp
+import gevent
+from slugify import slugify
+
+current_dir = os.path.abspath(os.path.dirname(__file__))
+path = os.path.join(current_dir, "data.txt")
+
+
+class TestStriping(unittest.TestCase):
+
+    def tearDown(self):
+        for name in os.listdir('.'):
+            if slugify(path) in name or slugify('stripe-test') in name:
+                os.remove(name)
+
+    def test_split(self):
+        stripes = striping.split(1050, 4, block_size=100, transfer_id=7)
+        self.assertEqual([(s.offset, s.length) for s in stripes], [(0, 200), (200, 300), (500, 300), (800, 250)])
+        self.assertTrue(all(s.count == 4 and s.size == 1050 and s.transfer_id == 7 for s in stripes))
+        self.assertEqual(len(striping.split(150, 4, block_size=100)), 2)  # no empty stripes
+        self.assertEqual([(s.offset, s.length) for s in striping.split(0, 4)], [(0, 0)])
+
+    def test_ranged_reader(self):
+        with open(path, 'rb') as f:
+            content = f.read()
+        for use_mmap in (True, False):
+            reader = FileReader(path, use_mmap=use_mmap, offset=100, length=250)
+            chunks = [bytes(reader.read_chunk(100)) for _ in range(3)]
+            self.assertTrue(reader.finished)
+            self.assertEqual(b''.join(chunks), content[100:350])
+
+    def test_manifest(self):
+        closed = []
+        manifest = striping.Manifest('stripe-test', 10, 2, on_close=lambda: closed.append(True))
+        second, first = manifest.open(1, 6, 2), manifest.open(0, 0, 4)
+        self.assertIsNone(manifest.open(1, 6, 2))  # already being received
+        second.write_block(1, b'gh')
+        second.write_block(2, b'ij')
+        second.close()
+        self.assertFalse(manifest.complete)
+        first.write_block(2, b'ef')  # runs of the two stripes are coalesced separately
+        first.write_block(1, b'abcd')
+        first.close()
+        self.assertTrue(manifest.complete)
+        self.assertEqual(closed, [True])
+        with open(manifest.writer.name, 'rb') as f:
+            self.assertEqual(f.read(), b'abcdefghij')
+
+    def test_striped_transfer(self):
+        receiver = Receiver()
+        worker = gevent.spawn(receiver.start, '127.0.0.1', 12395)
+        sender = StripedSender(path, streams=3, block_size=100)
+        gevent.spawn(sender.upload, '127.0.0.1', 12395).join(timeout=10)
+        receiver.stop()
+        worker.kill()
+        self.assertTrue(sender.transfer_complete)
+        self.assertEqual(receiver.stats()['completed'], 3)  # a session per stripe
+        self.assertEqual(receiver.transfers, {})
+        received = [name for name in os.listdir('.') if name.endswith(slugify(path))]
+        self.assertEqual(len(received), 1)
+        self.assertTrue(filecmp.cmp(received[0], path, shallow=False))
+
+    def test_unsupported(self):
+        # e.g. a ReceiverPool worker. The stripes would end up in files of their own
+        receiver = Receiver(striping=False)
+        worker = gevent.spawn(receiver.start, '127.0.0.1', 12396)
+        sender = Sender(path, stripe=striping.split(os.path.getsize(path), 2, DATA_SIZE)[0])
+        gevent.spawn(sender.upload, '127.0.0.1', 12396).join(timeout=5)
+        receiver.stop()
+        worker.kill()
+        self.assertTrue(sender.error_occurred)
+        self.assertFalse(sender.transfer_complete)
+
+
+if __name__ == '__main__':
+    unittest.main()
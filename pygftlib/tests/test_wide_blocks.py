@@ -0,0 +1,90 @@
+import unittest
+from pygftlib.protocol import Sender, Receiver
+from pygftlib.packet_factory import PacketFactory
+from pygftlib.helpers import seq_width_for
+from pygftlib import MAX_BLOCK_SIZE
+import os
+import hashlib
+import filecmp
+import tempfile
+import gevent
+from slugify import slugify
+
+current_dir = os.path.abspath(os.path.dirname(__file__))
+path = os.path.join(current_dir, "data.txt")
+
+# streaming a multi-GB file takes a while. Opt in with PYGFTLIB_SLOW_TESTS=1
+SLOW_TESTS = bool(os.environ.get('PYGFTLIB_SLOW_TESTS'))
+SPARSE_FILE_SIZE = int(os.environ.get('PYGFTLIB_SPARSE_FILE_SIZE', 5 * 1024 ** 3))
+
+
+def digest(name):
+    sha = hashlib.sha256()
+    with open(name, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class TestWideBlocks(unittest.TestCase):
+
+    def test_wide_packets(self):
+        for width in (4, 8):
+            packet = PacketFactory.to_bytes(type='data', block_no=70000, data=b'abc', seq_width=width)
+            self.assertTrue(PacketFactory.is_valid('data', packet, seq_width=width))
+            self.assertEqual(PacketFactory.from_bytes(packet, seq_width=width), (70000, b'abc'))
+            packet = PacketFactory.to_bytes(type='ack', block_no=2 ** 32 - 1, seq_width=width)
+            self.assertTrue(PacketFactory.is_valid('ack', packet, seq_width=width))
+            self.assertEqual(PacketFactory.from_bytes(packet, seq_width=width), 2 ** 32 - 1)
+            packet = PacketFactory.to_bytes(type='sack', block_no=65535, selective=[65537, 65540], seq_width=width)
+            self.assertEqual(PacketFactory.from_bytes(packet, seq_width=width), (65535, [65537, 65540]))
+        self.assertEqual([seq_width_for(n) for n in (65535, 65536, 2 ** 32, 2 ** 40)], [2, 4, 8, 8])
+
+    def test_sender_asks_for_wide_blocks(self):
+        with tempfile.NamedTemporaryFile() as f:
+            f.truncate(40 * 1024 * 1024)  # 82k blocks of 508 bytes
+            self.assertEqual(Sender(f.name).core.options.get('seqwidth'), 4)
+            self.assertNotIn('seqwidth', Sender(f.name, block_size=MAX_BLOCK_SIZE).core.options)
+
+    def test_wide_transfer(self):
+        receiver = Receiver()
+        sender = Sender(path, seq_width=8)
+        worker = gevent.spawn(receiver.start, '127.0.0.1', 12355)
+        gevent.spawn(sender.upload, '127.0.0.1', 12355).join(timeout=5)
+        receiver.stop()
+        worker.kill()
+
+        self.assertTrue(sender.transfer_complete)
+        self.assertEqual(sender.seq_width, 8)
+        received = [name for name in os.listdir('.') if name.endswith(slugify(path))]
+        self.assertTrue(filecmp.cmp(received[0], path, shallow=False))
+        os.remove(received[0])
+
+    @unittest.skipUnless(SLOW_TESTS, 'set PYGFTLIB_SLOW_TESTS=1 to stream a multi-GB file')
+    def test_sparse_multi_gb_file(self):
+        # more than 65535 blocks even with the largest blksize. Most of the file is a hole, but all of it is sent
+        with tempfile.NamedTemporaryFile(suffix='.sparse', delete=False) as f:
+            f.write(b'head')
+            f.seek(SPARSE_FILE_SIZE - 4)
+            f.write(b'tail')
+        receiver = Receiver()
+        sender = Sender(f.name, block_size=MAX_BLOCK_SIZE, window_size=64)
+        self.assertGreater(os.path.getsize(f.name) // MAX_BLOCK_SIZE, 0xFFFF)
+        worker = gevent.spawn(receiver.start, '127.0.0.1', 12356)
+        gevent.spawn(sender.upload, '127.0.0.1', 12356).join()
+        receiver.stop()
+        worker.kill()
+
+        self.assertTrue(sender.transfer_complete)
+        self.assertEqual(sender.seq_width, 4)
+        received = [name for name in os.listdir('.') if name.endswith(slugify(f.name))]
+        try:
+            self.assertEqual(os.path.getsize(received[0]), SPARSE_FILE_SIZE)
+            self.assertEqual(digest(received[0]), digest(f.name))
+        finally:
+            os.remove(received[0])
+            os.remove(f.name)
+
+
+if __name__ == '__main__':
+    unittest.main()
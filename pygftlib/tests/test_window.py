@@ -0,0 +1,74 @@
+import unittest
+from pygftlib.protocol import Sender, Receiver
+from pygftlib.packet_factory import PacketFactory
+from pygftlib.window import SendWindow, ReceiveWindow
+from pygftlib import options
+import os
+import filecmp
+import tempfile
+import gevent
+from slugify import slugify
+
+
+class TestWindow(unittest.TestCase):
+
+    def test_receive_window_reorders(self):
+        window = ReceiveWindow(4)
+        self.assertEqual(window.accept(2, b'b'), [])
+        self.assertEqual(window.accept(4, b'd', final=True), [])
+        self.assertEqual(window.selective(), [2, 4])
+        self.assertEqual(window.accept(1, b'a'), [(1, b'a'), (2, b'b')])
+        self.assertEqual(window.accept(2, b'b'), [])  # duplicate
+        self.assertEqual(window.accept(7, b'g'), [])  # outside the window
+        self.assertFalse(window.complete)
+        self.assertEqual(window.accept(3, b'c'), [(3, b'c'), (4, b'd')])
+        self.assertTrue(window.complete)
+
+    def test_send_window_selective_ack(self):
+        window = SendWindow(8)
+        for block in range(1, 9):
+            self.assertTrue(window.can_send())
+            window.push(block, 'packet %d' % block)
+        self.assertFalse(window.can_send())
+        # block 2 got lost on its way. The receiver reports 1 and 3..6
+        self.assertEqual(window.ack(1, [3, 4, 5, 6]), [1, 3, 4, 5, 6])
+        self.assertEqual(window.lost(), [(2, 'packet 2')])
+        self.assertEqual(window.lost(), [])  # only reported once
+        self.assertTrue(window.can_send())
+        window.ack(8)
+        self.assertEqual(window.base, 9)
+        self.assertEqual(len(window), 0)
+
+    def test_sack_packet(self):
+        packet = PacketFactory.to_bytes(type='sack', block_no=10, selective=[12, 13, 25])
+        self.assertTrue(PacketFactory.is_valid('sack', packet))
+        self.assertEqual(PacketFactory.from_bytes(packet), (10, [12, 13, 25]))
+
+    def test_options_negotiation(self):
+        packet = PacketFactory.to_bytes(type='initrq', file_name='data.txt', options={'WindowSize': 10000, 'foo': 1})
+        self.assertEqual(PacketFactory.from_bytes(packet), 'data.txt')
+        accepted = options.negotiate(PacketFactory.options(packet), {'windowsize': 64})
+        self.assertEqual(accepted, {'windowsize': 64})
+        self.assertEqual(options.effective({})['windowsize'], 1)
+
+    def test_windowed_transfer(self):
+        with tempfile.NamedTemporaryFile(suffix='.bin', delete=False) as f:
+            f.write(os.urandom(300 * 1024))
+        receiver = Receiver()
+        sender = Sender(f.name, window_size=64)
+        worker_1 = gevent.spawn(receiver.start, '127.0.0.1', 12347)
+        worker_2 = gevent.spawn(sender.upload, '127.0.0.1', 12347)
+        worker_2.join(timeout=10)
+
+        self.assertTrue(sender.transfer_complete)
+        self.assertEqual(sender.core.window.size, 64)
+        received = [name for name in os.listdir('.') if name.endswith(slugify(f.name))]
+        self.assertTrue(filecmp.cmp(received[0], f.name, shallow=False))
+        receiver.stop()
+        worker_1.kill()
+        os.remove(received[0])
+        os.remove(f.name)
+
+
+if __name__ == '__main__':
+    unittest.main()
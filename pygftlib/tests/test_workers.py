@@ -0,0 +1,53 @@
+import unittest
+from pygftlib.protocol import Sender
+from pygftlib.workers import ReceiverPool, supported
+from pygftlib.file_io import FileWriter
+import os
+import time
+import filecmp
+import gevent
+from slugify import slugify
+
+current_dir = os.path.abspath(os.path.dirname(__file__))
+path = os.path.join(current_dir, "data.txt")
+
+
+class TestWorkers(unittest.TestCase):
+
+    def test_unique_names(self):
+        first, second = FileWriter('same-name', 8), FileWriter('same-name', 8)
+        self.assertNotEqual(first.part_name, second.part_name)
+        for writer in (first, second):
+            writer.close()
+            os.remove(writer.name)
+
+    @unittest.skipUnless(supported(), 'SO_REUSEPORT is not available')
+    def test_pool(self):
+        pool = ReceiverPool(2)
+        supervisor = gevent.spawn(pool.start, '127.0.0.1', 12390)
+        started = time.monotonic()
+        while not pool.ready and time.monotonic() - started < 20:
+            gevent.sleep(0.05)
+        self.assertTrue(pool.ready)
+
+        # every client sticks to one worker. Otherwise its DATA would reach a worker without its session
+        senders = [Sender(path, block_size=100) for _ in range(6)]
+        gevent.joinall([gevent.spawn(sender.upload, '127.0.0.1', 12390) for sender in senders], timeout=10)
+        pool.stop()
+        supervisor.join(timeout=10)
+
+        self.assertTrue(all(sender.transfer_complete for sender in senders))
+        self.assertEqual(pool.exit_codes, [0, 0])  # shut down cleanly
+        stats = pool.stats()
+        self.assertEqual(stats['workers'], 2)
+        self.assertEqual(stats['completed'], 6)
+        self.assertEqual(stats['sessions'], 0)  # purged on the way out
+        received = [name for name in os.listdir('.') if name.endswith(slugify(path))]
+        self.assertEqual(len(received), 6)
+        for name in received:
+            self.assertTrue(filecmp.cmp(name, path, shallow=False))
+            os.remove(name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+from pygftlib.protocol import Sender, Receiver
+from pygftlib.file_io import FileReader
+from pygftlib.packets import DATAPacket
+from pygftlib.packet_factory import PacketFactory
+import os
+import filecmp
+import gevent
+from slugify import slugify
+
+current_dir = os.path.abspath(os.path.dirname(__file__))
+path = os.path.join(current_dir, "data.txt")
+
+
+class PlainSocket(object):
+    """Only send(). Like sockets on platforms without scatter-gather I/O"""
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, data):
+        self.sent.append(bytes(data))
+
+
+class TestZeroCopy(unittest.TestCase):
+
+    def test_mapped_reader(self):
+        reader = FileReader(path, use_mmap=True)
+        self.assertTrue(reader.mapped)
+        with open(path, 'rb') as f:
+            content = f.read()
+        chunks = []
+        for chunk in iter(lambda: reader.read_chunk(100), b''):
+            self.assertIsInstance(chunk, memoryview)
+            chunks.append(bytes(chunk))
+            if len(chunk) < 100:
+                break
+        self.assertEqual(b''.join(chunks), content)
+
+    def test_header(self):
+        for width in (2, 4, 8):
+            packet = DATAPacket.build_header(70000 if width > 2 else 7, width) + b'abc'
+            self.assertEqual(packet, PacketFactory.to_bytes(type='data', block_no=70000 if width > 2 else 7,
+                                                            data=b'abc', seq_width=width))
+
+    def transfer(self, sender, port):
+        receiver = Receiver()
+        worker = gevent.spawn(receiver.start, '127.0.0.1', port)
+        gevent.spawn(sender.upload, '127.0.0.1', port).join(timeout=5)
+        receiver.stop()
+        worker.kill()
+
+        self.assertTrue(sender.transfer_complete)
+        received = [name for name in os.listdir('.') if name.endswith(slugify(path))]
+        self.assertTrue(filecmp.cmp(received[0], path, shallow=False))
+        os.remove(received[0])
+
+    def test_zero_copy_transfer(self):
+        sender = Sender(path, block_size=128)
+        self.assertTrue(sender.file_obj.mapped)
+        self.transfer(sender, 12370)
+
+    def test_copying_transfer(self):
+        sender = Sender(path, block_size=128, zero_copy=False)
+        self.assertFalse(sender.file_obj.mapped)
+        self.transfer(sender, 12371)
+
+    def test_without_sendmsg(self):
+        sender = Sender(path, block_size=128)
+        sender.sock = PlainSocket()
+        header = DATAPacket.build_header(1)
+        sender._send_vectored((header, memoryview(b'x' * 128)))
+        buffer = sender._send_buffer
+        sender._send_vectored((header, memoryview(b'abc')))
+        self.assertEqual(sender.sock.sent, [header + b'x' * 128, header + b'abc'])
+        self.assertIs(sender._send_buffer, buffer)  # allocated once, reused
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,187 @@
+"""
+Sliding window bookkeeping for Sender and Receiver. Nothing in here touches sockets -- protocol.py does the I/O.
+
+With a window of 1 this degrades to the original lockstep (stop-and-wait) behaviour.
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+DUP_THRESHOLD = 3  # a block is considered lost once this many later blocks have been acknowledged
+
+
+class SendWindow(object):
+    """
+    Keeps track of DATA packets that have been sent but not yet acknowledged.
+    - base: oldest unacknowledged block number
+    - next_block: block number of the next DATA packet to be sent
+    """
+
+    def __init__(self, size=1):
+        self.size = size
+        self.base = 1
+        self.next_block = 1
+        self.final_block = None  # block number of the last (short) DATA packet -- once it has been read
+        self._unacked = {}  # block_no -> packet
+        self._sacked = set()  # blocks above base that the receiver has selectively acknowledged
+        self._retransmitted = set()  # blocks already fast-retransmitted since they were last sent by a timeout
+        self._resent = set()  # blocks that were sent more than once. Useless for measuring the round trip time
+        self._sent_at = {}  # block_no -> time the block was first sent
+        self.sample = None  # after ack(): first-send time of the latest block it acknowledged (if sent only once)
+        self.first_sent = []  # after ack(): first-send times of the blocks it acknowledged. Sent once or not
+        self._missing = set()  # blocks above base that the receiver has reported missing
+        self.gaps = 0  # blocks reported missing so far. Whether they turned out lost or not
+
+    def can_send(self, limit=None):
+        """
+        True if there is room for another DATA packet in the window
+        :param limit: at most this many packets may be in flight (congestion window)
+        """
+        return self.final_block is None and self.next_block < self.base + self.size and \
+            (limit is None or len(self) < limit)
+
+    def push(self, block_no, packet, final=False, sent_at=None):
+        """Register a freshly sent DATA packet"""
+        self._unacked[block_no] = packet
+        self._sent_at[block_no] = sent_at
+        self.next_block = block_no + 1
+        if final:
+            self.final_block = block_no
+
+    def ack(self, block_no, selective=()):
+        """
+        Process a (selective) acknowledgement.
+        :param block_no: cumulative ACK. All the blocks up to and including this one have been received
+        :param selective: blocks above block_no that have been received out of order
+        :return: list of block numbers that were newly acknowledged
+        """
+        acked = []
+        self.sample = None
+        self.first_sent = []
+        for block in range(self.base, min(block_no, self.next_block - 1) + 1):
+            if self._unacked.pop(block, None) is not None and block not in self._sacked:
+                acked.append(block)
+                self._measure(block)
+            self._sacked.discard(block)
+            self._retransmitted.discard(block)
+            self._resent.discard(block)
+            self._missing.discard(block)
+            self._sent_at.pop(block, None)
+        self.base = max(self.base, min(block_no, self.next_block - 1) + 1)
+        for block in selective:
+            if block in self._unacked and block not in self._sacked:
+                self._sacked.add(block)
+                acked.append(block)
+                self._measure(block)
+        return acked
+
+    def _measure(self, block_no):
+        """
+        Karn's algorithm -- only blocks that were sent once tell us something about the round trip time. Every block
+        tells how long it took to get through (first_sent)
+        """
+        sent_at = self._sent_at.get(block_no)
+        if sent_at is None:
+            return
+        self.first_sent.append(sent_at)
+        if block_no not in self._resent:
+            self.sample = max(self.sample or sent_at, sent_at)
+
+    def lost(self, group_end=None):
+        """
+        Blocks that can be assumed lost -- DUP_THRESHOLD later blocks have been acknowledged already.
+        Each block is only reported once, until it is retransmitted again on a timeout.
+        :param group_end: with FEC (see pygftlib.fec), the last block of the group a block belongs to. Its block is
+                          only lost once DUP_THRESHOLD blocks past the end of the group have been acknowledged
+        :return: list of (block_no, packet)
+        """
+        if not self._sacked:
+            return []
+        highest = max(self._sacked)
+        lost = []
+        for block in range(self.base, highest - DUP_THRESHOLD + 1):
+            if block in self._unacked and block not in self._sacked and block not in self._retransmitted:
+                if block not in self._missing:
+                    self._missing.add(block)
+                    self.gaps += 1
+                if group_end is not None and group_end(block) > highest - DUP_THRESHOLD:
+                    continue  # the receiver may yet rebuild it from the parity of its group
+                self._retransmitted.add(block)
+                self._resent.add(block)
+                lost.append((block, self._unacked[block]))
+        return lost
+
+    def oldest(self):
+        """The oldest unacknowledged packet. Resent when the Receiver stays silent for too long"""
+        self._retransmitted.clear()
+        if self.base in self._unacked:
+            self._resent.add(self.base)
+        return self._unacked.get(self.base)
+
+    def __len__(self):
+        return len(self._unacked) - len(self._sacked)
+
+    @property
+    def complete(self):
+        return self.final_block is not None and self.base > self.final_block
+
+
+class ReceiveWindow(object):
+    """
+    Re-orders DATA packets for a Receiver. Blocks arriving out of order are buffered (if they fall in the window) and
+    handed over in sequence once the gap before them has been filled.
+    """
+
+    def __init__(self, size=1):
+        self.size = size
+        self.cumulative = 0  # every block up to and including this one has been received
+        self.final_block = None
+        self._pending = {}  # block_no -> data. Received out of order
+
+    def accept(self, block_no, data, final=False):
+        """
+        :param final: True if this is the last block of the transfer
+        :return: list of (block_no, data) that are now ready -- in order. Empty for duplicates or blocks that do not
+        fit in the window.
+        """
+        if not self._admit(block_no, final):
+            return []
+        self._pending[block_no] = data
+        ready = []
+        while self.cumulative + 1 in self._pending:
+            self.cumulative += 1
+            ready.append((self.cumulative, self._pending.pop(self.cumulative)))
+        return ready
+
+    def receive(self, block_no, final=False):
+        """
+        Like accept(), but only keeps track of which blocks have arrived. For writers that put each block straight at
+        its offset in the file -- nothing needs to be buffered.
+        :return: True if the block is new and falls in the window
+        """
+        if not self._admit(block_no, final):
+            return False
+        self._pending[block_no] = None
+        while self.cumulative + 1 in self._pending:
+            self.cumulative += 1
+            del self._pending[self.cumulative]
+        return True
+
+    def _admit(self, block_no, final):
+        if block_no <= self.cumulative or block_no > self.cumulative + self.size or block_no in self._pending:
+            return False
+        if final:
+            self.final_block = block_no
+        return True
+
+    def received(self, block_no):
+        """True if block_no has arrived"""
+        return block_no <= self.cumulative or block_no in self._pending
+
+    def selective(self):
+        """Blocks received out of order -- waiting for the gap before them to be filled"""
+        return sorted(self._pending)
+
+    @property
+    def complete(self):
+        return self.final_block is not None and self.cumulative >= self.final_block
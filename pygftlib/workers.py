@@ -0,0 +1,159 @@
+"""
+Multi-process Receiver. A supervisor (ReceiverPool) starts a number of worker processes, each running its own Receiver
+on the same host:port with SO_REUSEPORT.
+
+- Sharding: the kernel picks the socket (worker) for a datagram by hashing the source and destination address, so all
+  packets of a client reach the same worker and its session state never has to be shared. This holds as long as the
+  set of workers does not change -- a worker that dies takes its sessions with it and its clients are re-hashed
+  onto the others. For the same reason workers turn down striped transfers (pygftlib.striping): the stripes of a
+  file come from different ports.
+- Stats: every worker sends Receiver.stats() to the supervisor over a pipe every STATS_INTERVAL seconds, and once more
+  on its way out. ReceiverPool.stats() adds them up. The supervisor (not the workers) serves them to Prometheus.
+- Shutdown: workers ignore SIGINT. The supervisor sends them SIGTERM, upon which they stop their Receiver (purging
+  sessions, closing files) and exit. Stragglers are killed after a grace period.
+
+Workers are started with the 'spawn' method: forking a process with a running gevent hub would clone its greenlets.
+"""
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+import gevent
+import gevent.select
+
+from pygftlib import metrics
+from pygftlib.protocol import Receiver
+
+import logging
+logger = logging.getLogger(__name__)
+
+STATS_INTERVAL = 1  # seconds between stats reports of a worker
+SHUTDOWN_TIMEOUT = 5  # seconds workers get to exit after SIGTERM
+
+
+def supported():
+    """True if several sockets can be bound to the same UDP port (and the kernel spreads datagrams across them)"""
+    return hasattr(socket, 'SO_REUSEPORT')
+
+
+def _run_worker(index, host, port, receiver_kwargs, conn):
+    """Entry point of a worker process"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the supervisor decides when to stop
+    # the stripes of a striped transfer come from different ports. They would be spread over workers that each only
+    # see part of the file
+    receiver = Receiver(reuse_port=True, **dict(receiver_kwargs, striping=False))
+    gevent.signal_handler(signal.SIGTERM, receiver.stop)
+
+    def report():
+        # first report as soon as the socket is bound -- the supervisor takes it as a sign the worker is ready
+        while True:
+            conn.send(receiver.stats())
+            gevent.sleep(STATS_INTERVAL)
+
+    reporter = gevent.spawn(report)
+    try:
+        logger.info('Worker {} (pid {}) receiving on {}:{}'.format(index, os.getpid(), host, port))
+        receiver.start(host, port)
+    finally:
+        reporter.kill()
+        conn.send(receiver.stats())
+        conn.close()
+
+
+class ReceiverPool(object):
+    """
+    Runs workers (processes) Receivers on the same port. Takes the same keyword arguments as Receiver. metrics_port
+    serves the stats of all of them at once.
+    """
+
+    def __init__(self, workers=None, metrics_port=None, **receiver_kwargs):
+        self.workers = workers or os.cpu_count() or 1
+        self.metrics_port = metrics_port
+        self.receiver_kwargs = receiver_kwargs
+        self._processes = []  # (process, connection to read its stats from)
+        self._stats = {}  # worker index -> latest stats it reported
+        self._stop_deadline = None  # set by stop()
+
+    def start(self, host, port):
+        """Start the workers and supervise them till they have all exited (see stop())"""
+        if not supported():
+            raise NotImplementedError('SO_REUSEPORT is not available on this platform. Use a single Receiver')
+        context = multiprocessing.get_context('spawn')
+        for index in range(self.workers):
+            reader, writer = context.Pipe(duplex=False)
+            process = context.Process(target=_run_worker, args=(index, host, port, self.receiver_kwargs, writer),
+                                      name='pygftlib-receiver-{}'.format(index), daemon=True)
+            process.start()
+            writer.close()
+            self._processes.append((process, reader))
+        server = None
+        if self.metrics_port is not None:
+            server = metrics.serve((host, self.metrics_port), self.stats)
+        try:
+            self._supervise()
+        except KeyboardInterrupt:
+            logger.info('Received Keyboard Interrupt. Stopping {} workers'.format(self.workers))
+        finally:
+            if server is not None:
+                server.stop()
+            self._shutdown()
+
+    def _supervise(self):
+        """Collect stats till every worker has exited -- or the grace period after stop() is over"""
+        connections = {reader: index for index, (_, reader) in enumerate(self._processes)}
+        while connections:
+            if self._stop_deadline is not None and time.monotonic() > self._stop_deadline:
+                break
+            # gevent's select: other greenlets of the supervisor's process keep running meanwhile
+            for reader in gevent.select.select(list(connections), [], [], STATS_INTERVAL)[0]:
+                index = connections[reader]
+                try:
+                    self._stats[index] = reader.recv()
+                except (EOFError, OSError):
+                    del connections[reader]
+                    if self._stop_deadline is None:
+                        logger.warning('Worker {} exited unexpectedly (exit code {})'.format(
+                            index, self._processes[index][0].exitcode))
+
+    def stop(self):
+        """Ask every worker to finish (SIGTERM). start() returns once they have"""
+        if self._stop_deadline is None:
+            self._stop_deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+        for process, _ in self._processes:
+            if process.is_alive():
+                process.terminate()
+
+    def _shutdown(self):
+        self.stop()
+        for index, (process, reader) in enumerate(self._processes):
+            process.join(max(0, self._stop_deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning('Worker {} did not exit in time. Killing it'.format(process.name))
+                process.kill()
+                process.join()
+            # whatever the worker reported on its way out
+            try:
+                while reader.poll():
+                    self._stats[index] = reader.recv()
+            except (EOFError, OSError):
+                pass
+            reader.close()
+
+    @property
+    def ready(self):
+        """True once every worker is bound to the port"""
+        return len(self._stats) == self.workers
+
+    @property
+    def exit_codes(self):
+        return [process.exitcode for process, _ in self._processes]
+
+    def stats(self):
+        """Stats of all workers added up. Along with the number of workers that have reported"""
+        merged = {}
+        for stats in self._stats.values():
+            metrics.merge(merged, stats)
+        merged['workers'] = len(self._stats)
+        return merged